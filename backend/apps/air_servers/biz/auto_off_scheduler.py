@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+中央空调无人自动关闭调度
+
+所有待关闭的空调保存在 redis(device_data) 的一个有序集合中:
+    air_auto_off_schedule: 成员为 '{中央空调 id}:{空调设备 username}'，分值为关闭时间戳
+分组无人时 ZADD 写入关闭时间(重复写入即重新计时)，分组有人时 ZREM 取消，均不写数据库。
+celery beat 中只有一条固定的 air_auto_off_dispatch 任务，每 AIR_AUTO_OFF_DISPATCH_INTERVAL 秒领取到期成员并
+下发 air_auto_off_task(air_id, device_username)，beat 负载与空调数量无关。
+"""
+import json
+import time
+
+import environ
+from django.conf import settings
+from django_celery_beat.models import PeriodicTask
+from django_redis import get_redis_connection
+
+logger = settings.LOGGER
+
+env = environ.Env()
+# 是否使用 redis 调度无人自动关闭(否则每台空调一条 django_celery_beat 定时任务)
+# isw_adapter 与 celery worker 都须使用 category_overrides 中的 PersonnelSensorManage，确认后再开启
+AIR_AUTO_OFF_SCHEDULER_ENABLED = env.bool('AIR_AUTO_OFF_SCHEDULER_ENABLED', default=False)
+# 到期检查间隔(秒)
+AIR_AUTO_OFF_DISPATCH_INTERVAL = env.int('AIR_AUTO_OFF_DISPATCH_INTERVAL', default=10)
+
+AUTO_OFF_SCHEDULE_KEY = 'air_auto_off_schedule'
+# 未设置延时分钟数时的默认延时
+DEFAULT_OFF_DELAY_MINUTES = 1
+# 旧版每台空调一条定时任务的名称
+LEGACY_BEAT_TASK_NAME = 'air_auto_off_task_{}'
+# 每次领取的到期成员上限
+DISPATCH_BATCH_SIZE = 500
+
+
+def get_redis_conn():
+    return get_redis_connection('device_data')
+
+
+def schedule_member(air_id, device_username):
+    return f'{air_id}:{device_username}'
+
+
+def parse_member(member):
+    if isinstance(member, bytes):
+        member = member.decode()
+    air_id, device_username = member.split(':', 1)
+    return int(air_id), device_username
+
+
+def get_auto_off_entries(air_conditioner_qs):
+    """
+    :param air_conditioner_qs: CentralAirConditioner 查询集
+    :return: [(air_id, device_username, off_delay_minutes)]
+    """
+    return list(air_conditioner_qs.values_list('id', 'air_cond__device__username', 'off_delay_minutes'))
+
+
+def schedule_auto_off(air_conditioner_qs, now=None, redis_conn=None):
+    """
+    按各空调的延时分钟数写入关闭时间，已在调度中的空调重新计时
+    :return: 写入的空调数量
+    """
+    entries = get_auto_off_entries(air_conditioner_qs)
+    if not entries:
+        return 0
+    now = time.time() if now is None else now
+    redis_conn = redis_conn or get_redis_conn()
+    redis_conn.zadd(AUTO_OFF_SCHEDULE_KEY, {
+        schedule_member(air_id, username): now + (delay or DEFAULT_OFF_DELAY_MINUTES) * 60
+        for air_id, username, delay in entries
+    })
+    return len(entries)
+
+
+def cancel_auto_off(air_conditioner_qs, redis_conn=None):
+    """
+    取消空调的自动关闭
+    :return: 取消的空调数量
+    """
+    entries = get_auto_off_entries(air_conditioner_qs)
+    if not entries:
+        return 0
+    redis_conn = redis_conn or get_redis_conn()
+    return redis_conn.zrem(AUTO_OFF_SCHEDULE_KEY, *[
+        schedule_member(air_id, username) for air_id, username, _ in entries
+    ])
+
+
+def pop_due_auto_off(now=None, limit=DISPATCH_BATCH_SIZE, redis_conn=None):
+    """
+    领取到期的自动关闭，ZREM 成功的成员才算领取，多个调度进程同时执行时不会重复下发
+    :return: [(air_id, device_username)]
+    """
+    now = time.time() if now is None else now
+    redis_conn = redis_conn or get_redis_conn()
+    members = redis_conn.zrangebyscore(AUTO_OFF_SCHEDULE_KEY, '-inf', now, start=0, num=limit)
+    if not members:
+        return []
+    pipe = redis_conn.pipeline(transaction=False)
+    for member in members:
+        pipe.zrem(AUTO_OFF_SCHEDULE_KEY, member)
+    return [parse_member(member) for member, removed in zip(members, pipe.execute()) if removed]
+
+
+def dispatch_due_auto_off(task, now=None, redis_conn=None):
+    """
+    下发所有到期的自动关闭任务
+    :param task: air_auto_off_task
+    :return: 下发数量
+    """
+    redis_conn = redis_conn or get_redis_conn()
+    count = 0
+    while True:
+        due = pop_due_auto_off(now=now, redis_conn=redis_conn)
+        for air_id, device_username in due:
+            task.delay(air_id, device_username)
+        count += len(due)
+        if len(due) < DISPATCH_BATCH_SIZE:
+            return count
+
+
+def migrate_legacy_beat_tasks(redis_conn=None):
+    """
+    将旧版每台空调一条的 django_celery_beat 定时任务迁入 redis 调度，并删除这些定时任务
+    关闭时间按定时任务最后修改时间加间隔计算，已过期的在下一次检查时下发
+    :return: 迁移数量
+    """
+    legacy_tasks = list(PeriodicTask.objects.filter(
+        task='air_auto_off_task', name__startswith=LEGACY_BEAT_TASK_NAME.format(''), enabled=True
+    ).select_related('interval'))
+    mapping, migrated_ids = {}, []
+    for periodic_task in legacy_tasks:
+        try:
+            air_id, device_username = json.loads(periodic_task.args)
+        except (TypeError, ValueError):
+            logger.error(f'无法迁移自动关闭定时任务: {periodic_task.name}, args: {periodic_task.args}')
+            continue
+        interval = periodic_task.interval.schedule.run_every.total_seconds() if periodic_task.interval else 0
+        mapping[schedule_member(air_id, device_username)] = periodic_task.date_changed.timestamp() + interval
+        migrated_ids.append(periodic_task.id)
+    if not mapping:
+        return 0
+    redis_conn = redis_conn or get_redis_conn()
+    redis_conn.zadd(AUTO_OFF_SCHEDULE_KEY, mapping)
+    PeriodicTask.objects.filter(id__in=migrated_ids).delete()
+    return len(mapping)
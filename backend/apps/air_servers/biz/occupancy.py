@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+中央空调分组人员占用计数
+
+每个分组在 redis(device_data) 中维护两个集合，成员为人体存在传感器的设备 id:
+    air_group_sensors_{group_id}: 分组内的全部传感器
+    air_group_occupied_{group_id}: 分组内状态为有人的传感器
+传感器状态变化时通过一次 MULTI 完成 SADD/SREM 与前后计数，分组是否有人由占用计数直接得出，无需查询分组内所有传感器。
+集合操作是幂等的，重复上报不会造成计数漂移; 分组的传感器变更后删除集合，下次使用时从数据库重建。
+"""
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from backend.apps.air_servers.models import AirPersonnelSensor
+
+logger = settings.LOGGER
+
+GROUP_SENSORS_KEY = 'air_group_sensors_{}'
+GROUP_OCCUPIED_KEY = 'air_group_occupied_{}'
+# 人员状态: 有人
+STATUS_OCCUPIED = '1'
+
+
+def get_redis_conn():
+    return get_redis_connection('device_data')
+
+
+def rebuild_group_occupancy(group_id, redis_conn=None):
+    """
+    从数据库重建分组占用计数
+    :return: (occupied, total)
+    """
+    redis_conn = redis_conn or get_redis_conn()
+    sensors = list(AirPersonnelSensor.objects.filter(group_id=group_id).values_list(
+        'personnel_sensor__device_id', 'personnel_sensor__status'
+    ))
+    occupied = [device_id for device_id, status in sensors if status == STATUS_OCCUPIED]
+    sensors_key, occupied_key = GROUP_SENSORS_KEY.format(group_id), GROUP_OCCUPIED_KEY.format(group_id)
+    pipe = redis_conn.pipeline()
+    pipe.delete(sensors_key, occupied_key)
+    if sensors:
+        pipe.sadd(sensors_key, *[device_id for device_id, _ in sensors])
+    if occupied:
+        pipe.sadd(occupied_key, *occupied)
+    pipe.execute()
+    return len(occupied), len(sensors)
+
+
+def update_sensor_occupancy(group_id, device_id, status, redis_conn=None):
+    """
+    传感器状态变化后更新分组占用计数
+    :param group_id: 传感器所在分组
+    :param device_id: 传感器设备 id
+    :param status: 传感器状态
+    :return: (更新前是否有人, 更新后是否有人) 计数需要重建时更新前状态为 None
+    """
+    redis_conn = redis_conn or get_redis_conn()
+    sensors_key, occupied_key = GROUP_SENSORS_KEY.format(group_id), GROUP_OCCUPIED_KEY.format(group_id)
+    pipe = redis_conn.pipeline()
+    pipe.sismember(sensors_key, device_id)
+    pipe.scard(occupied_key)
+    if str(status) == STATUS_OCCUPIED:
+        pipe.sadd(occupied_key, device_id)
+    else:
+        pipe.srem(occupied_key, device_id)
+    pipe.scard(occupied_key)
+    is_member, before, _, after = pipe.execute()
+    if not is_member:
+        # 计数不存在或分组传感器已变更
+        occupied, _ = rebuild_group_occupancy(group_id, redis_conn=redis_conn)
+        return None, occupied > 0
+    return before > 0, after > 0
+
+
+def get_many_group_occupancy(group_ids, redis_conn=None):
+    """
+    批量获取分组占用计数，一次 redis 往返，计数不存在的分组从数据库重建
+    :return: {group_id: (occupied, total)}
+    """
+    group_ids = list(group_ids)
+    redis_conn = redis_conn or get_redis_conn()
+    pipe = redis_conn.pipeline(transaction=False)
+    for group_id in group_ids:
+        pipe.exists(GROUP_SENSORS_KEY.format(group_id))
+        pipe.scard(GROUP_OCCUPIED_KEY.format(group_id))
+        pipe.scard(GROUP_SENSORS_KEY.format(group_id))
+    values = pipe.execute()
+    result = {}
+    for i, group_id in enumerate(group_ids):
+        exists, occupied, total = values[i * 3:i * 3 + 3]
+        result[group_id] = (occupied, total) if exists else rebuild_group_occupancy(group_id, redis_conn=redis_conn)
+    return result
+
+
+def del_many_group_occupancy(group_ids, redis_conn=None):
+    """
+    删除分组占用计数，下次使用时重建
+    """
+    group_ids = [group_id for group_id in group_ids if group_id is not None]
+    if not group_ids:
+        return
+    redis_conn = redis_conn or get_redis_conn()
+    keys = [key.format(group_id) for group_id in group_ids for key in (GROUP_SENSORS_KEY, GROUP_OCCUPIED_KEY)]
+    redis_conn.delete(*keys)
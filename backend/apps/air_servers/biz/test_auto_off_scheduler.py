@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+中央空调无人自动关闭调度 测试
+"""
+import json
+from datetime import timedelta
+from unittest import mock
+
+import fakeredis
+from django.test import TestCase
+from django.utils import timezone
+from django_celery_beat.models import IntervalSchedule, PeriodicTask
+
+from backend.apps.air_servers.biz import auto_off_scheduler as scheduler
+from backend.apps.air_servers.models import CentralAirConditioner
+from backend.apps.device_models.models import AirConditioner
+from backend.apps.equipments.models import Device, DeviceCategory, EZtProjects
+from backend.apps.projects.models import Projects
+
+
+class AutoOffSchedulerTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        project = Projects.objects.create(name='auto_off')
+        category = DeviceCategory.objects.create(
+            key='auto_off_air', project=project, ezt_project=EZtProjects.objects.create(project_key='PR_auto_off'),
+            category_id='auto_off_air', category_name='air_conditioner',
+        )
+        cls.air_ids = []
+        for index, delay in enumerate([5, None]):
+            device = Device.objects.create(username=f'air_{index}', project=project, category=category)
+            air_cond = AirConditioner.objects.create(device=device)
+            cls.air_ids.append(CentralAirConditioner.objects.create(
+                air_cond=air_cond, is_auto_off=True, off_delay_minutes=delay
+            ).id)
+
+    def setUp(self):
+        # 不读写 device_data redis 中正在使用的调度集合
+        self.redis_conn = fakeredis.FakeRedis()
+        patcher = mock.patch.object(scheduler, 'get_redis_conn', return_value=self.redis_conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.air_qs = CentralAirConditioner.objects.filter(id__in=self.air_ids)
+
+    def scores(self):
+        return {
+            scheduler.parse_member(member): score
+            for member, score in self.redis_conn.zrange(scheduler.AUTO_OFF_SCHEDULE_KEY, 0, -1, withscores=True)
+        }
+
+    def test_schedule_uses_off_delay(self):
+        self.assertEqual(scheduler.schedule_auto_off(self.air_qs, now=1000), 2)
+        self.assertEqual(self.scores(), {
+            (self.air_ids[0], 'air_0'): 1000 + 5 * 60,
+            (self.air_ids[1], 'air_1'): 1000 + scheduler.DEFAULT_OFF_DELAY_MINUTES * 60,
+        })
+
+    def test_schedule_again_restarts_timer(self):
+        scheduler.schedule_auto_off(self.air_qs, now=1000)
+        scheduler.schedule_auto_off(self.air_qs, now=2000)
+        self.assertEqual(self.scores()[(self.air_ids[0], 'air_0')], 2000 + 5 * 60)
+
+    def test_cancel(self):
+        scheduler.schedule_auto_off(self.air_qs, now=1000)
+        self.assertEqual(scheduler.cancel_auto_off(self.air_qs.filter(id=self.air_ids[0])), 1)
+        self.assertEqual(list(self.scores()), [(self.air_ids[1], 'air_1')])
+        self.assertEqual(scheduler.cancel_auto_off(CentralAirConditioner.objects.none()), 0)
+
+    def test_pop_due_only_once(self):
+        scheduler.schedule_auto_off(self.air_qs, now=1000)
+        self.assertEqual(scheduler.pop_due_auto_off(now=1000 + 60), [(self.air_ids[1], 'air_1')])
+        self.assertEqual(scheduler.pop_due_auto_off(now=1000 + 60), [])
+        self.assertEqual(list(self.scores()), [(self.air_ids[0], 'air_0')])
+
+    def test_dispatch_due(self):
+        scheduler.schedule_auto_off(self.air_qs, now=1000)
+        task = mock.Mock()
+        self.assertEqual(scheduler.dispatch_due_auto_off(task, now=1000 + 5 * 60), 2)
+        self.assertCountEqual(
+            [call.args for call in task.delay.call_args_list],
+            [(self.air_ids[0], 'air_0'), (self.air_ids[1], 'air_1')],
+        )
+        self.assertEqual(self.scores(), {})
+
+    def test_migrate_legacy_beat_tasks(self):
+        interval = IntervalSchedule.objects.create(every=10, period=IntervalSchedule.MINUTES)
+        periodic_task = PeriodicTask.objects.create(
+            name=scheduler.LEGACY_BEAT_TASK_NAME.format(self.air_ids[0]), task='air_auto_off_task',
+            interval=interval, args=json.dumps([self.air_ids[0], 'air_0']),
+        )
+        changed = timezone.now() - timedelta(minutes=3)
+        PeriodicTask.objects.filter(id=periodic_task.id).update(date_changed=changed)
+
+        self.assertEqual(scheduler.migrate_legacy_beat_tasks(), 1)
+        self.assertFalse(PeriodicTask.objects.filter(id=periodic_task.id).exists())
+        self.assertAlmostEqual(
+            self.scores()[(self.air_ids[0], 'air_0')], changed.timestamp() + 10 * 60, places=3
+        )
+        self.assertEqual(scheduler.migrate_legacy_beat_tasks(), 0)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+中央空调分组人员占用计数 测试
+"""
+from unittest import mock
+
+import fakeredis
+from django.test import TestCase
+
+from backend.apps.air_servers.biz import occupancy
+from backend.apps.air_servers.models import AirCondGroup, AirPersonnelSensor
+from backend.apps.device_models.models import PersonnelSensor
+from backend.apps.equipments.models import Device, DeviceCategory, EZtProjects
+from backend.apps.projects.models import Projects
+
+
+class GroupOccupancyTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        project = Projects.objects.create(name='occupancy')
+        category = DeviceCategory.objects.create(
+            key='occupancy_pir', project=project, ezt_project=EZtProjects.objects.create(project_key='PR_occupancy'),
+            category_id='occupancy_pir', category_name='personnel_sensor',
+        )
+        cls.group = AirCondGroup.objects.create(name='g1')
+        cls.device_ids = []
+        for index, status in enumerate(['1', '0']):
+            device = Device.objects.create(username=f'pir_{index}', project=project, category=category)
+            sensor = PersonnelSensor.objects.create(device=device, status=status)
+            AirPersonnelSensor.objects.create(personnel_sensor=sensor, group=cls.group)
+            cls.device_ids.append(device.id)
+
+    def setUp(self):
+        # 测试库的分组 id 与线上分组重叠，不读写 device_data redis
+        self.redis_conn = fakeredis.FakeRedis()
+        patcher = mock.patch.object(occupancy, 'get_redis_conn', return_value=self.redis_conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rebuild_from_database(self):
+        self.assertEqual(occupancy.get_many_group_occupancy([self.group.id]), {self.group.id: (1, 2)})
+
+    def test_update_rebuilds_missing_counter(self):
+        # 计数不存在时从数据库重建，更新前状态未知
+        self.assertEqual(occupancy.update_sensor_occupancy(self.group.id, self.device_ids[1], '1'), (None, True))
+
+    def test_update_transitions(self):
+        occupancy.rebuild_group_occupancy(self.group.id)
+        first, second = self.device_ids
+        self.assertEqual(occupancy.update_sensor_occupancy(self.group.id, second, '1'), (True, True))
+        self.assertEqual(occupancy.update_sensor_occupancy(self.group.id, first, '0'), (True, True))
+        self.assertEqual(occupancy.update_sensor_occupancy(self.group.id, second, '0'), (True, False))
+        self.assertEqual(occupancy.update_sensor_occupancy(self.group.id, first, 1), (False, True))
+        self.assertEqual(occupancy.get_many_group_occupancy([self.group.id]), {self.group.id: (1, 2)})
+
+    def test_repeated_reports_do_not_drift(self):
+        occupancy.rebuild_group_occupancy(self.group.id)
+        for _ in range(3):
+            self.assertEqual(occupancy.update_sensor_occupancy(self.group.id, self.device_ids[0], '1'), (True, True))
+        self.assertEqual(occupancy.get_many_group_occupancy([self.group.id]), {self.group.id: (1, 2)})
+
+    def test_sensor_change_invalidates_counter(self):
+        occupancy.rebuild_group_occupancy(self.group.id)
+        sensor = AirPersonnelSensor.objects.get(personnel_sensor__device_id=self.device_ids[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            sensor.delete()
+        self.assertFalse(self.redis_conn.exists(occupancy.GROUP_SENSORS_KEY.format(self.group.id)))
+        self.assertEqual(occupancy.get_many_group_occupancy([self.group.id]), {self.group.id: (1, 1)})
@@ -185,4 +185,8 @@ class AirSpaceTightSensor(models.Model):
 
     class Meta:
         verbose_name = '中央空调_门窗传感器'
-        verbose_name_plural = verbose_name
\ No newline at end of file
+        verbose_name_plural = verbose_name
+
+
+# 注册分组占用计数失效通知
+from backend.apps.air_servers import signals  # noqa: E402,F401
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+中央空调分组的人体存在传感器变更后删除分组占用计数
+"""
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from backend.apps.air_servers.biz.occupancy import del_many_group_occupancy
+
+
+def personnel_sensor_pre_save(sender, instance, **kwargs):
+    # 记录变更前的分组，传感器移到其它分组时两个分组的计数都需要重建
+    instance._occupancy_old_group_id = None
+    if instance.pk is not None:
+        instance._occupancy_old_group_id = sender.objects.filter(pk=instance.pk).values_list(
+            'group_id', flat=True
+        ).first()
+
+
+def personnel_sensor_changed(sender, instance, **kwargs):
+    group_ids = {instance.group_id, getattr(instance, '_occupancy_old_group_id', None)}
+    transaction.on_commit(lambda: del_many_group_occupancy(group_ids))
+
+
+pre_save.connect(personnel_sensor_pre_save, sender='air_servers.AirPersonnelSensor',
+                 dispatch_uid='air_group_occupancy_pre_save')
+for signal_name, signal in (('post_save', post_save), ('post_delete', post_delete)):
+    signal.connect(personnel_sensor_changed, sender='air_servers.AirPersonnelSensor',
+                   dispatch_uid=f'air_group_occupancy_{signal_name}')
@@ -0,0 +1,33 @@
+# -*-coding:utf-8-*-
+import traceback
+
+from django.conf import settings
+
+from backend.apps.air_servers.biz.auto_off_scheduler import dispatch_due_auto_off, migrate_legacy_beat_tasks
+from backend.apps.celery_tasks.air_servers_tasks.tasks import air_auto_off_task
+from backend.apps.celery_tasks.main import celery_app
+
+logger = settings.CELERY_LOGGER
+
+# 旧版定时任务每个进程只迁移一次
+_legacy_migrated = False
+
+
+@celery_app.task(name='air_auto_off_dispatch')
+def air_auto_off_dispatch():
+    """
+    下发到期的中央空调无人自动关闭任务
+    """
+    global _legacy_migrated
+    try:
+        if not _legacy_migrated:
+            migrated = migrate_legacy_beat_tasks()
+            _legacy_migrated = True
+            if migrated:
+                logger.info(f'air_auto_off_dispatch 迁移旧版自动关闭定时任务: {migrated}')
+        count = dispatch_due_auto_off(air_auto_off_task)
+        if count:
+            logger.info(f'air_auto_off_dispatch 下发自动关闭任务: {count}')
+    except Exception as err:
+        logger.error(f'air_auto_off_dispatch failed: {err}')
+        logger.error(traceback.format_exc())
@@ -0,0 +1,23 @@
+# -*-coding:utf-8-*-
+import traceback
+
+from django.conf import settings
+
+from backend.apps.celery_tasks.main import celery_app
+from backend.apps.el_prepayment_servers.biz.billing import settle_due_windows
+
+logger = settings.CELERY_LOGGER
+
+
+@celery_app.task(name='el_prepaid_settle_windows')
+def el_prepaid_settle_windows():
+    """
+    批量结算超过窗口时长的预付费电表
+    """
+    try:
+        count = settle_due_windows()
+        if count:
+            logger.info(f'el_prepaid_settle_windows 结算电表数量: {count}')
+    except Exception as err:
+        logger.error(f'el_prepaid_settle_windows failed: {err}')
+        logger.error(traceback.format_exc())
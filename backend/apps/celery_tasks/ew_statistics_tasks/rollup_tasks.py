@@ -0,0 +1,49 @@
+# -*-coding:utf-8-*-
+import traceback
+
+from django.conf import settings
+
+from backend.apps.celery_tasks.main import celery_app
+from backend.apps.energy_statistics.biz.tsdb_rollup import apply_rollup_retention, check_rollup_lags, run_rollups
+
+logger = settings.CELERY_LOGGER
+
+
+@celery_app.task(name='tsdb_rollup_run')
+def tsdb_rollup_run():
+    """
+    增量计算时序数据库汇总
+    """
+    try:
+        count = run_rollups()
+        if count:
+            logger.info(f'tsdb_rollup_run 写入汇总数据点: {count}')
+    except Exception as err:
+        logger.error(f'tsdb_rollup_run failed: {err}')
+        logger.error(traceback.format_exc())
+
+
+@celery_app.task(name='tsdb_rollup_lag_check')
+def tsdb_rollup_lag_check():
+    """
+    检查汇总数据滞后
+    """
+    try:
+        lagging = check_rollup_lags()
+        if lagging:
+            logger.warning(f'tsdb_rollup_lag_check 滞后的汇总数量: {len(lagging)}')
+    except Exception as err:
+        logger.error(f'tsdb_rollup_lag_check failed: {err}')
+        logger.error(traceback.format_exc())
+
+
+@celery_app.task(name='tsdb_rollup_retention')
+def tsdb_rollup_retention():
+    """
+    删除超过保留天数的汇总数据
+    """
+    try:
+        apply_rollup_retention()
+    except Exception as err:
+        logger.error(f'tsdb_rollup_retention failed: {err}')
+        logger.error(traceback.format_exc())
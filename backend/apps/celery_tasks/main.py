@@ -31,6 +31,69 @@ celery_app.autodiscover_tasks([
     'backend.apps.celery_tasks.ew_statistics_tasks',
     'backend.apps.celery_tasks.el_prepayment_tasks',
 ])
+celery_app.autodiscover_tasks(['backend.apps.celery_tasks.air_servers_tasks'], related_name='auto_off_tasks')
+celery_app.autodiscover_tasks(['backend.apps.celery_tasks.el_prepayment_tasks'], related_name='billing_tasks')
+
+# 中央空调无人自动关闭: 固定一条到期检查任务，不再为每台空调创建定时任务
+from backend.apps.air_servers.biz.auto_off_scheduler import AIR_AUTO_OFF_SCHEDULER_ENABLED, \
+    AIR_AUTO_OFF_DISPATCH_INTERVAL  # noqa: E402
+
+if AIR_AUTO_OFF_SCHEDULER_ENABLED:
+    celery_app.conf.beat_schedule = {
+        **celery_app.conf.beat_schedule,
+        'air_auto_off_dispatch': {
+            'task': 'air_auto_off_dispatch',
+            'schedule': AIR_AUTO_OFF_DISPATCH_INTERVAL,
+            'options': {'expires': AIR_AUTO_OFF_DISPATCH_INTERVAL},
+        },
+    }
+
+# 预付费电表窗口批量结算
+from backend.apps.el_prepayment_servers.biz.billing import PREPAID_BILLING_WINDOW  # noqa: E402
+
+if PREPAID_BILLING_WINDOW:
+    celery_app.conf.beat_schedule = {
+        **celery_app.conf.beat_schedule,
+        'el_prepaid_settle_windows': {
+            'task': 'el_prepaid_settle_windows',
+            'schedule': PREPAID_BILLING_WINDOW,
+            'options': {'expires': PREPAID_BILLING_WINDOW},
+        },
+    }
+
+# 时序数据库汇总: celery 计算(native 模式下只计算数据库不能原生维护的汇总)、滞后检查、过期清理
+from backend.m_common.tsdb.rollup import ROLLUPS, TSDB_ROLLUP_ENABLED, TSDB_ROLLUP_INTERVAL, \
+    TSDB_ROLLUP_LAG_CHECK_INTERVAL  # noqa: E402
+
+celery_app.autodiscover_tasks(['backend.apps.celery_tasks.ew_statistics_tasks'], related_name='rollup_tasks')
+
+if TSDB_ROLLUP_ENABLED:
+    celery_app.conf.beat_schedule = {
+        **celery_app.conf.beat_schedule,
+        'tsdb_rollup_run': {
+            'task': 'tsdb_rollup_run',
+            'schedule': TSDB_ROLLUP_INTERVAL,
+            'options': {'expires': TSDB_ROLLUP_INTERVAL},
+        },
+        'tsdb_rollup_lag_check': {
+            'task': 'tsdb_rollup_lag_check',
+            'schedule': TSDB_ROLLUP_LAG_CHECK_INTERVAL,
+            'options': {'expires': TSDB_ROLLUP_LAG_CHECK_INTERVAL},
+        },
+    }
+    if any(rollup.retention is not None for rollup in ROLLUPS):
+        celery_app.conf.beat_schedule = {
+            **celery_app.conf.beat_schedule,
+            'tsdb_rollup_retention': {
+                'task': 'tsdb_rollup_retention',
+                'schedule': 24 * 3600,
+                'options': {'expires': 3600},
+            },
+        }
+
+# isw_adapter_parse_msg 在 worker 中按 CATEGORY_CLASS_MAP 解析上报，worker 启动时导入处理类扩展，
+# 与 isw_adapter 进程使用相同的处理类(category_cfg 间接导入本模块，不能在此直接导入)
+celery_app.conf.imports = [*celery_app.conf.imports, 'backend.isw_adapter.category_overrides']
 
 # 开启celery的命令
 #  celery -A 应用路径（.包路径） worker -l info
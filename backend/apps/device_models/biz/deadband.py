@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+设备模型上报数据死区/变化检测
+"""
+import copy
+
+
+class DeadbandModelMixin(object):
+    """
+    设备模型数据变化检测
+
+    从数据库加载的对象调用 save() 时，只更新变化超过死区的字段，没有字段变化时不写库。
+    死区在模型 ATTR_MAP 旁通过 DEADBAND_MAP 声明，未声明的字段值不同即视为变化:
+        DEADBAND_MAP = {
+            'ua': {'abs': 0.5},             # 绝对死区: |新值 - 旧值| > 0.5
+            'ia': {'pct': 1},               # 百分比死区: |新值 - 旧值| > |旧值| * 1%
+            'p': {'abs': 0.01, 'pct': 1},   # 同时声明时取两者中较大的阈值
+        }
+    旧值始终为数据库中的值，被死区抑制的小幅变化不会累积漂移。
+    """
+    DEADBAND_MAP = {}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._deadband_snapshot = {
+            name: copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+            for name, value in zip(field_names, values)
+        }
+        return instance
+
+    @classmethod
+    def exceeds_deadband(cls, name, old, new):
+        """
+        字段值变化是否超过死区
+        :param name: 字段名
+        :param old: 数据库中的值
+        :param new: 待写入的值
+        :return: bool
+        """
+        if old == new:
+            return False
+        band = cls.DEADBAND_MAP.get(name)
+        if band is None or old is None or new is None:
+            return True
+        try:
+            old, new = float(old), float(new)
+        except (TypeError, ValueError):
+            return True
+        threshold = max(band.get('abs', 0), abs(old) * band.get('pct', 0) / 100)
+        return abs(new - old) > threshold
+
+    def get_deadband_changed_fields(self):
+        """
+        变化超过死区的字段
+        :return: [field_name, ...]
+        """
+        snapshot = self._deadband_snapshot
+        changed = []
+        for field in self._meta.concrete_fields:
+            if field.primary_key or getattr(field, 'auto_now', False) or field.attname not in snapshot:
+                continue
+            if self.exceeds_deadband(field.name, snapshot[field.attname], getattr(self, field.attname)):
+                changed.append(field)
+        return changed
+
+    def save(self, *args, **kwargs):
+        snapshot = getattr(self, '_deadband_snapshot', None)
+        if snapshot is None or self._state.adding or args or set(kwargs) - {'using'}:
+            return super().save(*args, **kwargs)
+        changed = self.get_deadband_changed_fields()
+        if not changed:
+            return
+        update_fields = [field.name for field in changed]
+        update_fields += [field.name for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)]
+        super().save(update_fields=update_fields, **kwargs)
+        for field in changed:
+            value = getattr(self, field.attname)
+            snapshot[field.attname] = copy.deepcopy(value) if isinstance(value, (dict, list)) else value
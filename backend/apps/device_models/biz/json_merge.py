@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+JSON 字段部分更新
+
+上报数据只包含部分属性时，通过 jsonb 的 || 运算在数据库中合并:
+    UPDATE ... SET up_attr_data = COALESCE(up_attr_data, '{}') || '{"temp": 21.5}'
+无需先读出整个 JSON 再整体写回，只传输本次上报的属性，行锁只在一条 UPDATE 内持有。
+"""
+from django.db import connection
+from django.db.models import F, Func, JSONField, Value
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+
+class JSONBMerge(Func):
+    """
+    jsonb 合并表达式 COALESCE(field, '{}') || data，data 中的属性覆盖原值
+    """
+    template = '%(expressions)s'
+    arg_joiner = ' || '
+    output_field = JSONField()
+
+    def __init__(self, field_name, data, **extra):
+        super().__init__(
+            Coalesce(F(field_name), Cast(Value({}, output_field=JSONField()), JSONField())),
+            Cast(Value(data, output_field=JSONField()), JSONField()),
+            **extra
+        )
+
+
+def supports_jsonb_merge():
+    return connection.vendor == 'postgresql'
+
+
+def merge_json_field(queryset, field_name, data):
+    """
+    将 data 合并到查询集中各对象的 JSON 字段
+    :param queryset: 待更新对象(BaseModel 子类)的查询集
+    :param field_name: JSON 字段名
+    :param data: {key: value}
+    :return: 更新的行数
+    """
+    if not data:
+        return 0
+    # update() 不会触发 auto_now
+    return queryset.update(**{field_name: JSONBMerge(field_name, data), 'updated_time': timezone.now()})
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+多回路设备回路状态位
+
+开关监控(state1…state16 字段)及照明设备(light_data 中的 state1…state16)额外保存一个整数状态位 state_bits:
+    第 n-1 位为 1 表示回路 n 状态为 1(闭合/亮灯)
+状态位在对象 save() 时由各回路状态重新计算，上报数据写库(整体 save)时即同步更新。
+统计接口通过 BitCount(state_bits) 在数据库中汇总组织下的开启回路数，不再依赖逐个回路的字段。
+"""
+import functools
+import operator
+
+from django.db.models import ExpressionWrapper, F, IntegerField, Sum, Value
+from django.db.models.functions import Coalesce
+
+# 回路数
+CHANNEL_COUNT = 16
+# 回路开启状态值
+STATE_ON = 1
+
+
+def pack_states(states):
+    """
+    回路状态打包为状态位
+    :param states: {回路序号(1 开始): 状态}
+    :return: int 没有任何回路状态时为 None
+    """
+    bits, has_state = 0, False
+    for index, value in states.items():
+        if value is None or not 1 <= index <= CHANNEL_COUNT:
+            continue
+        has_state = True
+        if value in (STATE_ON, str(STATE_ON)):
+            bits |= 1 << (index - 1)
+    return bits if has_state else None
+
+
+def unpack_states(bits):
+    """
+    状态位解包为开启的回路序号
+    :return: [回路序号, ...]
+    """
+    if not bits:
+        return []
+    return [index for index in range(1, CHANNEL_COUNT + 1) if bits >> (index - 1) & 1]
+
+
+class StateBitsModelMixin(object):
+    """
+    回路状态位维护
+    子类实现 get_channel_states() 返回 {回路序号: 状态}
+    """
+    STATE_BITS_FIELD = 'state_bits'
+
+    def get_channel_states(self):
+        raise NotImplementedError
+
+    def save(self, *args, **kwargs):
+        setattr(self, self.STATE_BITS_FIELD, pack_states(self.get_channel_states()))
+        update_fields = kwargs.get('update_fields')
+        if update_fields and self.STATE_BITS_FIELD not in update_fields:
+            kwargs['update_fields'] = [*update_fields, self.STATE_BITS_FIELD]
+        return super().save(*args, **kwargs)
+
+
+class BitCount(ExpressionWrapper):
+    """
+    状态位中为 1 的位数: 逐位 (state_bits >> i) & 1 相加，不依赖 PostgreSQL 14+ 的 bit_count
+    """
+
+    def __init__(self, expression, bits=CHANNEL_COUNT):
+        if isinstance(expression, str):
+            expression = F(expression)
+        total = functools.reduce(operator.add, [expression.bitrightshift(i).bitand(1) for i in range(bits)])
+        super().__init__(total, output_field=IntegerField())
+
+
+def sum_on_channels(state_bits_field, count_field):
+    """
+    汇总开启的回路数，尚未计算状态位的对象使用原有的开启回路数字段
+    :param state_bits_field: 状态位字段(查询路径)
+    :param count_field: 开启回路数字段(查询路径)
+    """
+    return Coalesce(
+        Sum(Coalesce(BitCount(state_bits_field), count_field, output_field=IntegerField())), Value(0)
+    )
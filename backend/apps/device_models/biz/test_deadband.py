@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+设备模型上报数据死区 测试
+"""
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from backend.apps.device_models.models import Transformer
+from backend.apps.equipments.models import Device, DeviceCategory, EZtProjects
+from backend.apps.projects.models import Projects
+
+
+class ExceedsDeadbandTestCase(SimpleTestCase):
+
+    def test_absolute(self):
+        self.assertFalse(Transformer.exceeds_deadband('ua', 220.0, 220.5))
+        self.assertTrue(Transformer.exceeds_deadband('ua', 220.0, 220.6))
+
+    def test_percent_or_absolute_whichever_larger(self):
+        # 阈值 max(0.05, 100 * 1%) = 1
+        self.assertFalse(Transformer.exceeds_deadband('ia', 100.0, 101.0))
+        self.assertTrue(Transformer.exceeds_deadband('ia', 100.0, 101.5))
+        # 阈值 max(0.05, 1 * 1%) = 0.05
+        self.assertTrue(Transformer.exceeds_deadband('ia', 1.0, 1.06))
+
+    def test_undeclared_and_missing_values(self):
+        self.assertTrue(Transformer.exceeds_deadband('name', 'a', 'b'))
+        self.assertTrue(Transformer.exceeds_deadband('ua', None, 220.0))
+        self.assertTrue(Transformer.exceeds_deadband('ua', 220.0, 'x'))
+        self.assertFalse(Transformer.exceeds_deadband('ua', None, None))
+
+
+class DeadbandSaveTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        project = Projects.objects.create(name='deadband')
+        category = DeviceCategory.objects.create(
+            key='deadband_transformer', project=project,
+            ezt_project=EZtProjects.objects.create(project_key='PR_deadband'),
+            category_id='deadband_transformer', category_name='transformer',
+        )
+        device = Device.objects.create(username='transformer_0', project=project, category=category)
+        cls.transformer_id = Transformer.objects.create(device=device, ua=220.0, ia=100.0).id
+
+    def save(self, **fields):
+        transformer = Transformer.objects.get(id=self.transformer_id)
+        for name, value in fields.items():
+            setattr(transformer, name, value)
+        with CaptureQueriesContext(connection) as queries:
+            transformer.save()
+        return transformer, queries
+
+    def test_small_change_not_written(self):
+        _, queries = self.save(ua=220.3, ia=100.5)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(Transformer.objects.get(id=self.transformer_id).ua, 220.0)
+
+    def test_only_changed_fields_written(self):
+        _, queries = self.save(ua=221.0, ia=100.5)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"ua"', queries[0]['sql'])
+        self.assertNotIn('"ia"', queries[0]['sql'])
+        self.assertEqual(Transformer.objects.values_list('ua', 'ia').get(id=self.transformer_id), (221.0, 100.0))
+
+    def test_drift_compared_with_database_value(self):
+        transformer, _ = self.save(ua=220.4)
+        transformer.ua = 220.8
+        transformer.save()
+        self.assertEqual(Transformer.objects.get(id=self.transformer_id).ua, 220.8)
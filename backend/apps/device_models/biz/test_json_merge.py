@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+JSON 字段部分更新 测试
+"""
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+
+from backend.apps.device_models.biz.json_merge import merge_json_field
+from backend.apps.device_models.models import EnvironmentMonitor
+from backend.apps.equipments.models import Device, DeviceCategory, EZtProjects
+from backend.apps.projects.models import Projects
+
+
+class MergeJsonFieldTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        project = Projects.objects.create(name='json_merge')
+        category = DeviceCategory.objects.create(
+            key='json_merge_env', project=project, ezt_project=EZtProjects.objects.create(project_key='PR_json_merge'),
+            category_id='json_merge_env', category_name='environment_monitor',
+        )
+        device = Device.objects.create(username='env_0', project=project, category=category)
+        cls.monitor = EnvironmentMonitor.objects.create(device=device, up_attr_data={'temp': 20, 'hum': 50})
+
+    def test_empty_data(self):
+        self.assertEqual(merge_json_field(EnvironmentMonitor.objects.all(), 'up_attr_data', {}), 0)
+
+    @skipUnless(connection.vendor == 'postgresql', 'jsonb 合并只支持 PostgreSQL')
+    def test_merge(self):
+        queryset = EnvironmentMonitor.objects.filter(id=self.monitor.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(merge_json_field(queryset, 'up_attr_data', {'temp': 21.5, 'pm25': 8}), 1)
+        self.assertEqual(queryset.get().up_attr_data, {'temp': 21.5, 'hum': 50, 'pm25': 8})
+
+    @skipUnless(connection.vendor == 'postgresql', 'jsonb 合并只支持 PostgreSQL')
+    def test_merge_null(self):
+        queryset = EnvironmentMonitor.objects.filter(id=self.monitor.id)
+        queryset.update(up_attr_data=None)
+        merge_json_field(queryset, 'up_attr_data', {'temp': 21.5})
+        self.assertEqual(queryset.get().up_attr_data, {'temp': 21.5})
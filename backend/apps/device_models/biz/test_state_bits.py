@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+多回路设备回路状态位 测试
+"""
+from django.test import SimpleTestCase, TestCase
+
+from backend.apps.device_models.biz.state_bits import BitCount, pack_states, sum_on_channels, unpack_states
+from backend.apps.device_models.models import SwitchMonitor
+from backend.apps.equipments.models import Device, DeviceCategory, EZtProjects
+from backend.apps.projects.models import Projects
+
+
+class PackStatesTestCase(SimpleTestCase):
+
+    def test_pack(self):
+        self.assertEqual(pack_states({1: 1, 2: 0, 3: '1', 16: 1, 17: 1}), 0b1000000000000101)
+        self.assertEqual(pack_states({1: 0}), 0)
+        self.assertIsNone(pack_states({1: None}))
+
+    def test_unpack(self):
+        self.assertEqual(unpack_states(0b1000000000000101), [1, 3, 16])
+        self.assertEqual(unpack_states(None), [])
+
+
+class BitCountTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        project = Projects.objects.create(name='state_bits')
+        category = DeviceCategory.objects.create(
+            key='state_bits_switch', project=project, ezt_project=EZtProjects.objects.create(project_key='PR_bits'),
+            category_id='state_bits_switch', category_name='switch_monitor',
+        )
+        states = [{'state1': 1, 'state2': 1, 'state16': 1}, {'state3': 0}, {}]
+        for index, fields in enumerate(states):
+            device = Device.objects.create(username=f'switch_{index}', project=project, category=category)
+            SwitchMonitor.objects.create(device=device, on_count=5, **fields)
+
+    def test_state_bits_saved(self):
+        self.assertEqual(list(SwitchMonitor.objects.order_by('device__username').values_list('state_bits', flat=True)),
+                         [0b1000000000000011, 0, None])
+
+    def test_bit_count(self):
+        counts = SwitchMonitor.objects.order_by('device__username').annotate(
+            bit_count=BitCount('state_bits')
+        ).values_list('bit_count', flat=True)
+        self.assertEqual(list(counts), [3, 0, None])
+
+    def test_sum_on_channels(self):
+        # 尚未计算状态位的对象使用原有的开启回路数
+        result = Device.objects.filter(username__startswith='switch_').aggregate(
+            on_count=sum_on_channels('switch_monitor__state_bits', 'switch_monitor__on_count')
+        )
+        self.assertEqual(result['on_count'], 3 + 0 + 5)
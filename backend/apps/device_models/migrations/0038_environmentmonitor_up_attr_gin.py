@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 10:00
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('device_models', '0037_prepaidelectricmeter_deep_valley_epi_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='environmentmonitor',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['up_attr_data'], name='env_monitor_up_attr_gin', opclasses=['jsonb_path_ops']),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.20 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+CHANNEL_COUNT = 16
+
+
+def pack_states(states):
+    bits, has_state = 0, False
+    for index, value in enumerate(states, 1):
+        if value is None:
+            continue
+        has_state = True
+        if value in (1, '1'):
+            bits |= 1 << (index - 1)
+    return bits if has_state else None
+
+
+def fill_state_bits(apps, schema_editor):
+    SwitchMonitor = apps.get_model('device_models', 'SwitchMonitor')
+    LightMonitor = apps.get_model('device_models', 'LightMonitor')
+    state_fields = [f'state{i}' for i in range(1, CHANNEL_COUNT + 1)]
+    switch_monitors = []
+    for obj in SwitchMonitor.objects.only('id', *state_fields).iterator():
+        obj.state_bits = pack_states([getattr(obj, field) for field in state_fields])
+        switch_monitors.append(obj)
+    SwitchMonitor.objects.bulk_update(switch_monitors, ['state_bits'], batch_size=500)
+    light_monitors = []
+    for obj in LightMonitor.objects.only('id', 'light_data').iterator():
+        light_data = obj.light_data if isinstance(obj.light_data, dict) else {}
+        obj.state_bits = pack_states([light_data.get(field) for field in state_fields])
+        light_monitors.append(obj)
+    LightMonitor.objects.bulk_update(light_monitors, ['state_bits'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('device_models', '0038_environmentmonitor_up_attr_gin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lightmonitor',
+            name='state_bits',
+            field=models.IntegerField(blank=True, help_text='回路状态位: 第 n-1 位为回路 n 状态', null=True, verbose_name='回路状态位: 第 n-1 位为回路 n 状态'),
+        ),
+        migrations.AddField(
+            model_name='switchmonitor',
+            name='state_bits',
+            field=models.IntegerField(blank=True, help_text='回路状态位: 第 n-1 位为回路 n 状态', null=True, verbose_name='回路状态位: 第 n-1 位为回路 n 状态'),
+        ),
+        migrations.RunPython(fill_state_bits, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,8 @@
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from backend.apps.custom_perm.models import BaseModel
+from backend.apps.device_models.biz.deadband import DeadbandModelMixin
+from backend.apps.device_models.biz.state_bits import StateBitsModelMixin, CHANNEL_COUNT
 
 
 class AirConditioner(BaseModel):
@@ -346,7 +349,7 @@ class ElectricMeter(BaseModel):
         return self.device.name
 
 
-class IotBreaker(BaseModel):
+class IotBreaker(DeadbandModelMixin, BaseModel):
     """
     ‌物联网断路器
     """
@@ -604,6 +607,36 @@ class IotBreaker(BaseModel):
         }
     }
 
+    # 上报数据死区，见 DeadbandModelMixin；未声明的字段(状态、告警、电能等)值不同即更新
+    DEADBAND_MAP = {
+        'hz': {'abs': 0.02},
+        'ma': {'abs': 1},
+        'ua': {'abs': 0.5},
+        'ub': {'abs': 0.5},
+        'uc': {'abs': 0.5},
+        'ia': {'abs': 0.05, 'pct': 1},
+        'ib': {'abs': 0.05, 'pct': 1},
+        'ic': {'abs': 0.05, 'pct': 1},
+        'p': {'abs': 0.01, 'pct': 1},
+        'pa': {'abs': 0.01, 'pct': 1},
+        'pb': {'abs': 0.01, 'pct': 1},
+        'pc': {'abs': 0.01, 'pct': 1},
+        'qa': {'abs': 0.01, 'pct': 1},
+        'qb': {'abs': 0.01, 'pct': 1},
+        'qc': {'abs': 0.01, 'pct': 1},
+        'pf': {'abs': 0.01},
+        'pfa': {'abs': 0.01},
+        'pfb': {'abs': 0.01},
+        'pfc': {'abs': 0.01},
+        'sa': {'abs': 0.01, 'pct': 1},
+        'sb': {'abs': 0.01, 'pct': 1},
+        'sc': {'abs': 0.01, 'pct': 1},
+        't01': {'abs': 0.2},
+        't02': {'abs': 0.2},
+        't03': {'abs': 0.2},
+        't04': {'abs': 0.2},
+    }
+
     STATE_MAP_ = (
         (1, '闭合'),
         (2, '断开'),
@@ -1074,7 +1107,7 @@ class HiddenDangerMonitor(BaseModel):
         return self.device.name
 
 
-class ElMonitorInstrument(BaseModel):
+class ElMonitorInstrument(DeadbandModelMixin, BaseModel):
     """
     三项电力仪表
     """
@@ -1226,6 +1259,35 @@ class ElMonitorInstrument(BaseModel):
         }
     }
 
+    # 上报数据死区，见 DeadbandModelMixin；未声明的字段(电能等)值不同即更新
+    DEADBAND_MAP = {
+        'u0': {'abs': 0.5},
+        'ua': {'abs': 0.5},
+        'ub': {'abs': 0.5},
+        'uc': {'abs': 0.5},
+        'ia': {'abs': 0.05, 'pct': 1},
+        'ib': {'abs': 0.05, 'pct': 1},
+        'ic': {'abs': 0.05, 'pct': 1},
+        'i0': {'abs': 0.05, 'pct': 1},
+        'hz': {'abs': 0.02},
+        'p': {'abs': 0.01, 'pct': 1},
+        'pa': {'abs': 0.01, 'pct': 1},
+        'pb': {'abs': 0.01, 'pct': 1},
+        'pc': {'abs': 0.01, 'pct': 1},
+        'q': {'abs': 0.01, 'pct': 1},
+        'qa': {'abs': 0.01, 'pct': 1},
+        'qb': {'abs': 0.01, 'pct': 1},
+        'qc': {'abs': 0.01, 'pct': 1},
+        'pf': {'abs': 0.01},
+        'pfa': {'abs': 0.01},
+        'pfb': {'abs': 0.01},
+        'pfc': {'abs': 0.01},
+        's': {'abs': 0.01, 'pct': 1},
+        'sa': {'abs': 0.01, 'pct': 1},
+        'sb': {'abs': 0.01, 'pct': 1},
+        'sc': {'abs': 0.01, 'pct': 1},
+    }
+
     device = models.OneToOneField(
         to='equipments.Device',
         related_name='el_monitor_instrument',
@@ -1416,11 +1478,54 @@ class ElMonitorInstrument(BaseModel):
         return self.device.name
 
 
-class Transformer(BaseModel):
+class Transformer(DeadbandModelMixin, BaseModel):
     """
     变压器电力监测
     """
 
+    # 上报数据死区，见 DeadbandModelMixin；未声明的字段(电能等)值不同即更新
+    DEADBAND_MAP = {
+        'ua': {'abs': 0.5},
+        'ub': {'abs': 0.5},
+        'uc': {'abs': 0.5},
+        'uab': {'abs': 0.5},
+        'ubc': {'abs': 0.5},
+        'uca': {'abs': 0.5},
+        'hz': {'abs': 0.02},
+        'ia': {'abs': 0.05, 'pct': 1},
+        'ib': {'abs': 0.05, 'pct': 1},
+        'ic': {'abs': 0.05, 'pct': 1},
+        'i0': {'abs': 0.05, 'pct': 1},
+        's': {'abs': 0.01, 'pct': 1},
+        'sa': {'abs': 0.01, 'pct': 1},
+        'sb': {'abs': 0.01, 'pct': 1},
+        'sc': {'abs': 0.01, 'pct': 1},
+        'p': {'abs': 0.01, 'pct': 1},
+        'pa': {'abs': 0.01, 'pct': 1},
+        'pb': {'abs': 0.01, 'pct': 1},
+        'pc': {'abs': 0.01, 'pct': 1},
+        'q': {'abs': 0.01, 'pct': 1},
+        'qa': {'abs': 0.01, 'pct': 1},
+        'qb': {'abs': 0.01, 'pct': 1},
+        'qc': {'abs': 0.01, 'pct': 1},
+        'pf': {'abs': 0.01},
+        'pfa': {'abs': 0.01},
+        'pfb': {'abs': 0.01},
+        'pfc': {'abs': 0.01},
+        'uunb': {'abs': 0.1},
+        'iunb': {'abs': 0.1},
+        'epi_demand': {'abs': 0.01, 'pct': 1},
+        'epe_demand': {'abs': 0.01, 'pct': 1},
+        'eql_demand': {'abs': 0.01, 'pct': 1},
+        'eqc_demand': {'abs': 0.01, 'pct': 1},
+        'thdu_ua': {'abs': 0.1},
+        'thdu_ub': {'abs': 0.1},
+        'thdu_uc': {'abs': 0.1},
+        'thdi_ia': {'abs': 0.1},
+        'thdi_ib': {'abs': 0.1},
+        'thdi_ic': {'abs': 0.1},
+    }
+
     device = models.OneToOneField(
         to='equipments.Device',
         related_name='transformer',
@@ -1733,7 +1838,7 @@ class TfTemperatureMonitor(BaseModel):
         return self.device.name
 
 
-class LightMonitor(BaseModel):
+class LightMonitor(StateBitsModelMixin, BaseModel):
     """
     设备模型-照明设备
     """
@@ -1797,6 +1902,12 @@ class LightMonitor(BaseModel):
         null=True,
         blank=True
     )
+    state_bits = models.IntegerField(
+        verbose_name='回路状态位: 第 n-1 位为回路 n 状态',
+        help_text='回路状态位: 第 n-1 位为回路 n 状态',
+        null=True,
+        blank=True,
+    )
 
     class Meta:
         verbose_name = '设备模型-照明设备'
@@ -1805,8 +1916,12 @@ class LightMonitor(BaseModel):
     def __str__(self):
         return self.device.name
 
+    def get_channel_states(self):
+        light_data = self.light_data if isinstance(self.light_data, dict) else {}
+        return {i: light_data.get(f'state{i}') for i in range(1, CHANNEL_COUNT + 1)}
+
 
-class SwitchMonitor(BaseModel):
+class SwitchMonitor(StateBitsModelMixin, BaseModel):
     """
     开关设备
     """
@@ -2022,6 +2137,12 @@ class SwitchMonitor(BaseModel):
         null=True,
         blank=True,
     )
+    state_bits = models.IntegerField(
+        verbose_name='回路状态位: 第 n-1 位为回路 n 状态',
+        help_text='回路状态位: 第 n-1 位为回路 n 状态',
+        null=True,
+        blank=True,
+    )
 
     class Meta:
         verbose_name = '设备模型-开关监控设备'
@@ -2030,6 +2151,9 @@ class SwitchMonitor(BaseModel):
     def __str__(self):
         return self.device.name
 
+    def get_channel_states(self):
+        return {i: getattr(self, f'state{i}') for i in range(1, CHANNEL_COUNT + 1)}
+
 
 class EnvironmentMonitor(BaseModel):
     """
@@ -2052,6 +2176,10 @@ class EnvironmentMonitor(BaseModel):
     class Meta:
         verbose_name = '设备模型-环境系统设备'
         verbose_name_plural = verbose_name
+        indexes = [
+            # 按属性值筛选(up_attr_data__contains)
+            GinIndex(fields=['up_attr_data'], opclasses=['jsonb_path_ops'], name='env_monitor_up_attr_gin'),
+        ]
 
     def __str__(self):
         return self.device.name
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+预付费电表窗口批量结算
+
+电表上报不再逐条锁定 PrepaidElMeter 行结算，码值变化累积在 redis(device_data) 的结算窗口中:
+    prepaid_billing_{电表 id}: hash, start_{码值字段}/end_{码值字段} 为窗口起止码值，opened 为窗口开始时间
+    prepaid_billing_windows: 有序集合，成员为电表 id，分值为窗口开始时间
+窗口超过 PREPAID_BILLING_WINDOW 秒后由定时任务批量结算: 一个事务内用 F() 表达式扣减余额，bulk_create 写入抄表记录。
+按窗口估算的余额跨过预警金额、欠费或可透支金额，以及码值回退时，立即结算该电表，预警/欠费/分闸不受窗口延迟。
+抄表记录以 (电表, 起始码值, 截止码值) 去重，同一码值区间不会重复扣费。
+"""
+import datetime
+import json
+import time
+import traceback
+from decimal import Decimal
+
+import environ
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from backend.apps.device_models.models import PrepaidElectricMeter
+from backend.apps.el_prepayment_servers.models import PrepaidElMeter, MeterReadRecord, EventRecord, TenantElMeter, \
+    BasePriceCfg
+from backend.m_common.mq_factory import NotifierMq
+
+logger = settings.LOGGER
+
+env = environ.Env()
+# 结算窗口(秒)，为 0 时每次上报立即结算
+PREPAID_BILLING_WINDOW = env.int('PREPAID_BILLING_WINDOW', default=0)
+
+BILLING_WINDOW_KEY = 'prepaid_billing_{}'
+BILLING_WINDOWS_KEY = 'prepaid_billing_windows'
+# 每个事务结算的电表数量上限
+SETTLE_BATCH_SIZE = 500
+
+# 总码值及分时码值: (码值字段, 电价字段, 抄表记录使用电能字段)
+EPI_FIELD = 'epi'
+TOU_FIELDS = (
+    ('top_epi', 'top_price', 'used_top_epi'),
+    ('on_peak_epi', 'on_peak_price', 'used_on_peak_epi'),
+    ('flat_epi', 'flat_price', 'used_flat_epi'),
+    ('valley_epi', 'valley_price', 'used_valley_epi'),
+    ('deep_valley_epi', 'deep_valley_price', 'used_deep_valley_epi'),
+)
+READING_FIELDS = (EPI_FIELD, *[field for field, _, _ in TOU_FIELDS])
+PRICE_FIELDS = [field.name for field in BasePriceCfg._meta.fields]
+
+SURPLUS_EVENTS = {
+    'warming': '预警',
+    'arrears': '欠费',
+}
+# 电表分闸状态
+TRIP_STATE = 2
+
+
+def get_redis_conn():
+    return get_redis_connection('device_data')
+
+
+def billing_window_key(el_meter_id):
+    return BILLING_WINDOW_KEY.format(el_meter_id)
+
+
+def decode_window(raw):
+    """
+    :return: {码值字段: (起始码值, 截止码值)}, 窗口开始时间
+    """
+    raw = {
+        key.decode() if isinstance(key, bytes) else key: float(value)
+        for key, value in raw.items()
+    }
+    window = {
+        field: (raw.get(f'start_{field}'), raw[f'end_{field}'])
+        for field in READING_FIELDS if f'end_{field}' in raw
+    }
+    return window, raw.get('opened')
+
+
+def to_decimal(value):
+    return Decimal(str(value))
+
+
+def window_usage(el_meter, window):
+    """
+    计算窗口内使用电量及电费
+    :param el_meter: PrepaidElMeter
+    :param window: {码值字段: (起始码值, 截止码值)}
+    :return: (使用电量, 电费, 抄表记录字段)
+    """
+    record = {}
+    start_epi, end_epi = window.get(EPI_FIELD, (None, None))
+    if start_epi is not None:
+        record.update(start_epi=start_epi, end_epi=end_epi)
+    if not el_meter.is_time_of_use:
+        if start_epi is None:
+            return Decimal(0), Decimal(0), record
+        used_el = to_decimal(end_epi) - to_decimal(start_epi)
+        return used_el, used_el * el_meter.price, record
+    used_el, amount = Decimal(0), Decimal(0)
+    for field, price_field, used_field in TOU_FIELDS:
+        start, end = window.get(field, (None, None))
+        if start is None:
+            continue
+        used = to_decimal(end) - to_decimal(start)
+        record.update({field: end, used_field: float(used)})
+        used_el += used
+        amount += used * (getattr(el_meter, price_field) or 0)
+    return used_el, amount, record
+
+
+def is_trip_required(surplus, trip_amount, state):
+    return trip_amount is not None and surplus <= -trip_amount and state != TRIP_STATE
+
+
+def extend_window(el_meter_id, start_values, end_values, now=None, redis_conn=None):
+    """
+    写入本次上报码值，窗口不存在时以上一次码值为起始码值
+    :param start_values: {码值字段: 上一次码值}
+    :param end_values: {码值字段: 本次码值}
+    :return: {码值字段: (起始码值, 截止码值)}
+    """
+    now = time.time() if now is None else now
+    key = billing_window_key(el_meter_id)
+    redis_conn = redis_conn or get_redis_conn()
+    pipe = redis_conn.pipeline()
+    for field, value in end_values.items():
+        if start_values.get(field) is not None:
+            pipe.hsetnx(key, f'start_{field}', start_values[field])
+    pipe.hset(key, mapping={f'end_{field}': value for field, value in end_values.items()})
+    pipe.hsetnx(key, 'opened', now)
+    pipe.zadd(BILLING_WINDOWS_KEY, {el_meter_id: now}, nx=True)
+    pipe.hgetall(key)
+    window, _ = decode_window(pipe.execute()[-1])
+    return window
+
+
+def claim_windows(el_meter_ids, redis_conn=None):
+    """
+    取出并删除结算窗口，与上报写入互斥: 取出后的上报从上一次码值开始新窗口
+    :return: {电表 id: ({码值字段: (起始码值, 截止码值)}, 窗口开始时间)}
+    """
+    redis_conn = redis_conn or get_redis_conn()
+    pipe = redis_conn.pipeline()
+    for el_meter_id in el_meter_ids:
+        pipe.hgetall(billing_window_key(el_meter_id))
+        pipe.delete(billing_window_key(el_meter_id))
+    pipe.zrem(BILLING_WINDOWS_KEY, *el_meter_ids)
+    values = pipe.execute()
+    windows = {}
+    for i, el_meter_id in enumerate(el_meter_ids):
+        if values[i * 2]:
+            windows[el_meter_id] = decode_window(values[i * 2])
+    return windows
+
+
+def restore_windows(windows, redis_conn=None):
+    """
+    结算失败时放回窗口，期间新开的窗口并入原窗口
+    """
+    if not windows:
+        return
+    redis_conn = redis_conn or get_redis_conn()
+    pipe = redis_conn.pipeline()
+    for el_meter_id, (window, opened) in windows.items():
+        key = billing_window_key(el_meter_id)
+        starts = {f'start_{field}': start for field, (start, _) in window.items() if start is not None}
+        if starts:
+            pipe.hset(key, mapping=starts)
+        for field, (_, end) in window.items():
+            pipe.hsetnx(key, f'end_{field}', end)
+        pipe.hset(key, 'opened', opened)
+        pipe.zadd(BILLING_WINDOWS_KEY, {el_meter_id: opened})
+    pipe.execute()
+
+
+def get_recorded_ranges(records):
+    """
+    已写入的抄表记录码值区间
+    :return: {(电表 id, 起始码值, 截止码值)}
+    """
+    conditions = [
+        Q(el_meter_id=record.el_meter_id, start_epi=record.start_epi, end_epi=record.end_epi)
+        for record in records if record.start_epi is not None
+    ]
+    if not conditions:
+        return set()
+    query = conditions.pop()
+    for condition in conditions:
+        query |= condition
+    return set(MeterReadRecord.objects.filter(query).values_list('el_meter_id', 'start_epi', 'end_epi'))
+
+
+def apply_usage(el_meters, usages):
+    """
+    在一个事务内扣减余额并写入抄表记录
+    :param el_meters: {电表 id: PrepaidElMeter}
+    :param usages: {电表 id: (使用电量, 电费, 抄表记录字段)}
+    :return: {电表 id: (结算后余额, 原余额状态, 结算后余额状态)}
+    """
+    records = {}
+    for el_meter_id, (used_el, amount, record) in usages.items():
+        el_meter = el_meters[el_meter_id]
+        records[el_meter_id] = MeterReadRecord(
+            el_meter_id=el_meter_id,
+            device_id=el_meter.prepaid_el_meter.device_id if el_meter.prepaid_el_meter else None,
+            used_el=float(used_el),
+            used_amount=amount,
+            **{field: getattr(el_meter, field) for field in PRICE_FIELDS},
+            **record
+        )
+    with transaction.atomic():
+        recorded = get_recorded_ranges(records.values())
+        for el_meter_id, record in list(records.items()):
+            if (el_meter_id, record.start_epi, record.end_epi) in recorded:
+                logger.info(f'预付费电表码值区间已结算, el_meter_id: {el_meter_id}, '
+                            f'epi: {record.start_epi} - {record.end_epi}')
+                del records[el_meter_id]
+        if not records:
+            return {}
+        for el_meter_id in records:
+            used_el, amount, _ = usages[el_meter_id]
+            PrepaidElMeter.objects.filter(id=el_meter_id).update(
+                surplus=F('surplus') - amount,
+                used_el=F('used_el') + float(used_el),
+            )
+        result = {}
+        settled = PrepaidElMeter.objects.filter(id__in=list(records)).values_list(
+            'id', 'surplus', 'surplus_state', 'waring_amount'
+        )
+        for el_meter_id, surplus, old_state, waring_amount in settled:
+            state = PrepaidElMeter.get_surplus_state(surplus, waring_amount)
+            if state != old_state:
+                PrepaidElMeter.objects.filter(id=el_meter_id).update(surplus_state=state)
+            records[el_meter_id].surplus = surplus
+            result[el_meter_id] = (surplus, old_state, state)
+        MeterReadRecord.objects.bulk_create(records.values())
+    return result
+
+
+def notify_surplus_state(el_meter, surplus_state, surplus):
+    """
+    余额预警/欠费事件记录及租户短信通知
+    """
+    event_type = SURPLUS_EVENTS.get(surplus_state)
+    if event_type is None:
+        return
+    device = el_meter.prepaid_el_meter.device if el_meter.prepaid_el_meter else None
+    EventRecord.objects.create(el_meter_id=el_meter.id, device=device, event_type=event_type)
+    mobiles = [
+        mobile for mobile in TenantElMeter.objects.filter(el_meter_id=el_meter.id).values_list('user__mobile', flat=True)
+        if mobile
+    ]
+    if not mobiles or device is None:
+        return
+    NotifierMq().put_msg(json.dumps({
+        'method': 'sms',
+        'aims': mobiles,
+        'template_key': 'el_surplus_alarm',
+        'params': [datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), str(round(float(surplus), 2))],
+        'project_id': str(device.project_id),
+    }))
+
+
+def settle_windows(el_meter_ids, device_states=None, redis_conn=None):
+    """
+    批量结算电表窗口
+    :param el_meter_ids: 电表 id 列表
+    :param device_states: {电表 id: 电表通断状态} 未指定时使用设备表中的状态
+    :return: 结算的电表数量
+    """
+    # celery_tasks.main 注册定时任务时引用本模块，任务在此处导入
+    from backend.apps.celery_tasks.device_tasks.tasks import device_down_attr
+
+    el_meter_ids = list(dict.fromkeys(el_meter_ids))
+    if not el_meter_ids:
+        return 0
+    device_states = device_states or {}
+    redis_conn = redis_conn or get_redis_conn()
+    windows = claim_windows(el_meter_ids, redis_conn=redis_conn)
+    if not windows:
+        return 0
+    try:
+        el_meters = PrepaidElMeter.objects.select_related('prepaid_el_meter__device').in_bulk(list(windows))
+        usages = {}
+        for el_meter_id, (window, _) in windows.items():
+            el_meter = el_meters.get(el_meter_id)
+            if el_meter is None or el_meter.is_deleted:
+                continue
+            usage = window_usage(el_meter, window)
+            if usage[0] > 0:
+                usages[el_meter_id] = usage
+        result = apply_usage(el_meters, usages) if usages else {}
+    except Exception:
+        restore_windows(windows, redis_conn=redis_conn)
+        raise
+    for el_meter_id, (surplus, old_state, state) in result.items():
+        el_meter = el_meters[el_meter_id]
+        try:
+            if state != old_state:
+                notify_surplus_state(el_meter, state, surplus)
+            device = el_meter.prepaid_el_meter
+            if device is None:
+                continue
+            if is_trip_required(surplus, el_meter.trip_amount, device_states.get(el_meter_id, device.state)):
+                device_down_attr([device.device.username], {'attrs': {'switch': TRIP_STATE}})
+        except Exception as err:
+            logger.error(f'预付费电表结算通知失败, el_meter_id: {el_meter_id}, err: {err}')
+            logger.error(traceback.format_exc())
+    return len(result)
+
+
+def settle_due_windows(window=PREPAID_BILLING_WINDOW, now=None, redis_conn=None):
+    """
+    结算超过窗口时长的电表
+    :return: 结算的电表数量
+    """
+    now = time.time() if now is None else now
+    redis_conn = redis_conn or get_redis_conn()
+    due = [int(el_meter_id) for el_meter_id in redis_conn.zrangebyscore(BILLING_WINDOWS_KEY, '-inf', now - window)]
+    count = 0
+    for i in range(0, len(due), SETTLE_BATCH_SIZE):
+        count += settle_windows(due[i:i + SETTLE_BATCH_SIZE], redis_conn=redis_conn)
+    return count
+
+
+def bill_report(device_meter, msg_data, redis_conn=None):
+    """
+    电表上报码值计入结算窗口，估算余额跨过阈值时立即结算
+    redis 异常及码值无法转换为数值时的 ValueError 只会在写入设备表之前抛出，此时可改为逐条结算
+    :param device_meter: 上报前的 PrepaidElectricMeter
+    :param msg_data: 上报的电表属性，码值可以是数值字符串
+    :return: 是否已处理(电表未开通预付费时返回 False)
+    """
+    el_meter = PrepaidElMeter.objects.filter(prepaid_el_meter_id=device_meter.id, is_deleted=False).first()
+    if el_meter is None:
+        return False
+    redis_conn = redis_conn or get_redis_conn()
+    readings = {field: float(msg_data[field]) for field in READING_FIELDS if msg_data.get(field) is not None}
+    previous = {field: getattr(device_meter, field) for field in readings}
+    regressed = [field for field, value in readings.items() if previous[field] is not None and value < previous[field]]
+    if regressed:
+        # 码值回退(换表或清零): 结算回退前的窗口，从新码值开始新窗口
+        settle_windows([el_meter.id], redis_conn=redis_conn)
+        previous.update({field: readings[field] for field in regressed})
+    window = extend_window(el_meter.id, previous, readings, redis_conn=redis_conn) if readings else {}
+
+    model_fields = {field.name for field in PrepaidElectricMeter._meta.concrete_fields}
+    PrepaidElectricMeter.objects.filter(id=device_meter.id).update(
+        updated_time=timezone.now(),
+        **{attr: value for attr, value in msg_data.items() if attr in model_fields}
+    )
+    if el_meter.first_epi is None and EPI_FIELD in readings:
+        PrepaidElMeter.objects.filter(id=el_meter.id, first_epi__isnull=True).update(first_epi=readings[EPI_FIELD])
+
+    used_el, amount, _ = window_usage(el_meter, window)
+    if used_el <= 0:
+        return True
+    surplus = el_meter.surplus - amount
+    state = msg_data.get('state', device_meter.state)
+    if PrepaidElMeter.get_surplus_state(surplus, el_meter.waring_amount) != el_meter.surplus_state \
+            or is_trip_required(surplus, el_meter.trip_amount, state):
+        try:
+            settle_windows([el_meter.id], device_states={el_meter.id: state}, redis_conn=redis_conn)
+        except Exception as err:
+            # 窗口已放回，由定时任务或下一次上报结算
+            logger.error(f'预付费电表立即结算失败, el_meter_id: {el_meter.id}, err: {err}')
+            logger.error(traceback.format_exc())
+    return True
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+预付费电表窗口批量结算 测试
+"""
+from decimal import Decimal
+from unittest import mock
+
+import fakeredis
+from django.test import SimpleTestCase, TestCase
+
+from backend.apps.device_models.models import PrepaidElectricMeter
+from backend.apps.el_prepayment_servers.biz import billing
+from backend.apps.el_prepayment_servers.models import EventRecord, MeterReadRecord, PrepaidElMeter
+from backend.apps.equipments.models import Device, DeviceCategory, EZtProjects
+from backend.apps.projects.models import OrgTree, Projects
+
+
+class WindowUsageTestCase(SimpleTestCase):
+
+    def test_total_epi(self):
+        el_meter = PrepaidElMeter(is_time_of_use=False, price=Decimal('1.5'))
+        used_el, amount, record = billing.window_usage(el_meter, {'epi': (100.0, 102.5)})
+        self.assertEqual((used_el, amount), (Decimal('2.5'), Decimal('3.75')))
+        self.assertEqual(record, {'start_epi': 100.0, 'end_epi': 102.5})
+
+    def test_window_without_start(self):
+        el_meter = PrepaidElMeter(is_time_of_use=False, price=Decimal('1'))
+        self.assertEqual(billing.window_usage(el_meter, {'epi': (None, 102.5)}), (0, 0, {}))
+
+    def test_time_of_use(self):
+        el_meter = PrepaidElMeter(is_time_of_use=True, top_price=Decimal('2'), valley_price=Decimal('0.5'))
+        used_el, amount, record = billing.window_usage(el_meter, {
+            'epi': (10.0, 14.0), 'top_epi': (1.0, 2.0), 'valley_epi': (5.0, 8.0), 'flat_epi': (None, 3.0),
+        })
+        self.assertEqual((used_el, amount), (Decimal('4'), Decimal('3.5')))
+        self.assertEqual(record, {
+            'start_epi': 10.0, 'end_epi': 14.0, 'top_epi': 2.0, 'used_top_epi': 1.0,
+            'valley_epi': 8.0, 'used_valley_epi': 3.0,
+        })
+
+    def test_trip_required(self):
+        self.assertTrue(billing.is_trip_required(Decimal('-2'), Decimal('2'), 1))
+        self.assertFalse(billing.is_trip_required(Decimal('-2'), Decimal('2'), billing.TRIP_STATE))
+        self.assertFalse(billing.is_trip_required(Decimal('-1'), Decimal('2'), 1))
+        self.assertFalse(billing.is_trip_required(Decimal('-100'), None, 1))
+
+
+class BillingWindowTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        project = Projects.objects.create(name='billing')
+        category = DeviceCategory.objects.create(
+            key='billing_meter', project=project, ezt_project=EZtProjects.objects.create(project_key='PR_billing'),
+            category_id='billing_meter', category_name='prepaid_electric_meter',
+        )
+        device = Device.objects.create(username='meter_0', project=project, category=category)
+        cls.device_meter = PrepaidElectricMeter.objects.create(device=device, epi=100.0, state=1)
+        cls.el_meter = PrepaidElMeter.objects.create(
+            org=OrgTree.objects.create(project=project, name='org'), prepaid_el_meter=cls.device_meter,
+            price=Decimal('1'), waring_amount=Decimal('10'), trip_amount=Decimal('2'), surplus=Decimal('15'),
+        )
+
+    def setUp(self):
+        # 不读写 device_data redis 中线上电表的结算窗口
+        self.redis_conn = fakeredis.FakeRedis()
+        patcher = mock.patch.object(billing, 'get_redis_conn', return_value=self.redis_conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(billing, 'NotifierMq')
+        self.notifier = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('backend.apps.celery_tasks.device_tasks.tasks.device_down_attr')
+        self.device_down_attr = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def report(self, **msg_data):
+        device_meter = PrepaidElectricMeter.objects.get(id=self.device_meter.id)
+        self.assertTrue(billing.bill_report(device_meter, msg_data))
+
+    def surplus(self):
+        return PrepaidElMeter.objects.get(id=self.el_meter.id).surplus
+
+    def records(self):
+        return list(MeterReadRecord.objects.order_by('id').values_list('start_epi', 'end_epi', 'used_el'))
+
+    def test_reports_accumulate_until_settled(self):
+        self.report(epi=101.0)
+        self.report(epi=102.5)
+        self.assertEqual(self.surplus(), Decimal('15'))
+        self.assertEqual(PrepaidElectricMeter.objects.get(id=self.device_meter.id).epi, 102.5)
+        self.assertEqual(billing.settle_due_windows(window=0), 1)
+        self.assertEqual(self.surplus(), Decimal('12.5'))
+        self.assertEqual(self.records(), [(100.0, 102.5, 2.5)])
+        # 结算后的上报从上一次码值开始新窗口
+        self.report(epi=103.0)
+        billing.settle_due_windows(window=0)
+        self.assertEqual(self.surplus(), Decimal('12'))
+        self.assertEqual(self.records(), [(100.0, 102.5, 2.5), (102.5, 103.0, 0.5)])
+
+    def test_string_readings(self):
+        # 电表上报的码值可以是字符串，如 "epi":"2385.17"
+        self.report(epi='101.5')
+        self.report(epi='99.0')
+        self.assertEqual(self.records(), [(100.0, 101.5, 1.5)])
+        self.report(epi='100.0')
+        billing.settle_due_windows(window=0)
+        self.assertEqual(self.records(), [(100.0, 101.5, 1.5), (99.0, 100.0, 1.0)])
+        self.assertEqual(self.surplus(), Decimal('12.5'))
+
+    def test_invalid_reading(self):
+        device_meter = PrepaidElectricMeter.objects.get(id=self.device_meter.id)
+        with self.assertRaises(ValueError):
+            billing.bill_report(device_meter, {'epi': 'n/a'})
+        self.assertFalse(self.redis_conn.exists(billing.billing_window_key(self.el_meter.id)))
+        self.assertEqual(PrepaidElectricMeter.objects.get(id=self.device_meter.id).epi, 100.0)
+
+    def test_due_windows_only(self):
+        self.report(epi=101.0)
+        self.assertEqual(billing.settle_due_windows(window=300), 0)
+        self.assertEqual(self.surplus(), Decimal('15'))
+
+    def test_warning_settles_immediately(self):
+        self.report(epi=106.0)
+        el_meter = PrepaidElMeter.objects.get(id=self.el_meter.id)
+        self.assertEqual((el_meter.surplus, el_meter.surplus_state), (Decimal('9'), 'warming'))
+        self.assertEqual(list(EventRecord.objects.values_list('event_type', flat=True)), ['预警'])
+        self.assertFalse(self.redis_conn.exists(billing.billing_window_key(self.el_meter.id)))
+
+    def test_trip_when_overdrawn(self):
+        self.report(epi=117.5)
+        self.assertEqual(self.surplus(), Decimal('-2.5'))
+        self.device_down_attr.assert_called_once_with(['meter_0'], {'attrs': {'switch': billing.TRIP_STATE}})
+
+    def test_regression_starts_new_window(self):
+        self.report(epi=101.0)
+        self.report(epi=5.0)
+        self.assertEqual(self.records(), [(100.0, 101.0, 1.0)])
+        self.report(epi=6.0)
+        billing.settle_due_windows(window=0)
+        self.assertEqual(self.records(), [(100.0, 101.0, 1.0), (5.0, 6.0, 1.0)])
+        self.assertEqual(self.surplus(), Decimal('13'))
+
+    def test_settled_range_not_charged_twice(self):
+        self.report(epi=101.0)
+        windows = billing.claim_windows([self.el_meter.id])
+        billing.restore_windows(windows)
+        self.assertEqual(billing.settle_windows([self.el_meter.id]), 1)
+        billing.restore_windows(windows)
+        self.assertEqual(billing.settle_windows([self.el_meter.id]), 0)
+        self.assertEqual(self.surplus(), Decimal('14'))
+        self.assertEqual(len(self.records()), 1)
+
+    def test_failed_settlement_restores_window(self):
+        self.report(epi=101.0)
+        with mock.patch.object(MeterReadRecord.objects, 'bulk_create', side_effect=RuntimeError('db')):
+            with self.assertRaises(RuntimeError):
+                billing.settle_windows([self.el_meter.id])
+        self.assertEqual(self.surplus(), Decimal('15'))
+        self.assertEqual(billing.settle_due_windows(window=0), 1)
+        self.assertEqual(self.surplus(), Decimal('14'))
+
+    def test_not_prepaid(self):
+        PrepaidElMeter.objects.filter(id=self.el_meter.id).update(is_deleted=True)
+        device_meter = PrepaidElectricMeter.objects.get(id=self.device_meter.id)
+        self.assertFalse(billing.bill_report(device_meter, {'epi': 101.0}))
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+时序数据库汇总维护
+
+每个 Ezt 项目(project_key)对应一个存储桶，汇总声明及计算见 backend.m_common.tsdb.rollup。
+由 celery 定时任务(rollup_tasks)与管理命令 tsdb_rollup 调用。
+"""
+import traceback
+
+from django.conf import settings
+
+from backend.apps.equipments.models import EZtProjects
+from backend.m_common.tsdb.interface import DatabaseFactory
+from backend.m_common.tsdb.rollup import RollupEngine, TSDB_ROLLUP_LAG_ALERT, get_state
+
+logger = settings.LOGGER
+
+
+def rollup_stores():
+    return list(EZtProjects.objects.values_list('project_key', flat=True))
+
+
+def get_rollup_engine(rollups=None, mode=None):
+    client = DatabaseFactory.get_client(settings.TSDB_TYPE, logger=logger)
+    kwargs = {} if mode is None else {'mode': mode}
+    return RollupEngine(client, rollups=rollups, state=get_state(), logger=logger, **kwargs)
+
+
+def run_rollups():
+    """
+    增量计算各存储桶已结束的汇总窗口
+    :return: 写入的数据点数
+    """
+    engine = get_rollup_engine()
+    count = 0
+    try:
+        for store in rollup_stores():
+            try:
+                count += engine.run(store)
+            except Exception as err:
+                logger.error(f'tsdb 汇总计算失败 store<<{store}>>: {err}')
+                logger.error(traceback.format_exc())
+    finally:
+        engine.client.close()
+    return count
+
+
+def rollup_lags(stores=None, rollups=None):
+    """
+    :return: [(store, 汇总名称, 滞后秒数或 None), ...]
+    """
+    engine = get_rollup_engine(rollups)
+    try:
+        return [
+            (store, rollup.name, engine.lag(store, rollup))
+            for store in stores or rollup_stores() for rollup in engine.rollups
+        ]
+    finally:
+        engine.client.close()
+
+
+def check_rollup_lags():
+    """
+    汇总滞后超过 TSDB_ROLLUP_LAG_ALERT 秒时告警，没有汇总数据的存储桶(新项目、未补算)同样告警
+    :return: 滞后的 [(store, 汇总名称, 滞后秒数或 None), ...]
+    """
+    lagging = [item for item in rollup_lags() if item[2] is None or item[2] > TSDB_ROLLUP_LAG_ALERT]
+    for store, name, lag in lagging:
+        if lag is None:
+            logger.warning(f'tsdb 汇总没有数据 store<<{store}>> rollup<<{name}>>')
+        else:
+            logger.warning(f'tsdb 汇总滞后 store<<{store}>> rollup<<{name}>>: {int(lag)}s')
+    return lagging
+
+
+def apply_rollup_retention():
+    engine = get_rollup_engine()
+    try:
+        for store in rollup_stores():
+            engine.apply_retention(store)
+    finally:
+        engine.client.close()
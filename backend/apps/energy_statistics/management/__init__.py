@@ -0,0 +1 @@
+# Django management commands for energy_statistics app
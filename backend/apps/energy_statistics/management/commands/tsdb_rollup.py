@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+时序数据库汇总管理
+
+    python manage.py tsdb_rollup list
+    python manage.py tsdb_rollup backfill --start 2024-01-01 [--end 2024-06-01] [--store PR_xxx] [--rollup f_epi_point_hour]
+    python manage.py tsdb_rollup lag [--store PR_xxx]
+    python manage.py tsdb_rollup install [--store PR_xxx]     # TSDB_ROLLUP_MODE=native 时创建 InfluxDB task / TDengine stream
+    python manage.py tsdb_rollup uninstall [--store PR_xxx]
+
+未指定 --store 时为全部 Ezt 项目，未指定 --rollup 时为全部汇总(按声明顺序，先计算来源汇总)。
+"""
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.apps.energy_statistics.biz.tsdb_rollup import get_rollup_engine, rollup_lags, rollup_stores
+from backend.m_common.tsdb.rollup import MODE_NATIVE, TSDB_ROLLUP_LAG_ALERT, get_rollups, to_local
+
+
+def parse_time(value):
+    try:
+        return to_local(datetime.fromisoformat(value))
+    except ValueError:
+        raise CommandError(f'时间格式错误: {value}，应为 2024-01-01 或 2024-01-01T08:00:00')
+
+
+class Command(BaseCommand):
+    help = '时序数据库汇总: 查看声明、补算、检查滞后、创建/删除原生汇总'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'backfill', 'lag', 'install', 'uninstall'])
+        parser.add_argument('--store', action='append', help='存储桶(project_key)，可重复')
+        parser.add_argument('--rollup', action='append', help='汇总名称，可重复')
+        parser.add_argument('--start', help='补算开始时间')
+        parser.add_argument('--end', help='补算结束时间，默认为已结束的窗口')
+
+    def handle(self, *args, **options):
+        try:
+            rollups = get_rollups(options['rollup'])
+        except ValueError as err:
+            raise CommandError(err)
+        action = options['action']
+        if action == 'list':
+            for rollup in rollups:
+                retention = '永久' if rollup.retention is None else f'{rollup.retention} 天'
+                self.stdout.write(f'{rollup!r} 保留 {retention}')
+            return
+        stores = options['store'] or rollup_stores()
+        if action == 'backfill':
+            self.backfill(stores, rollups, options)
+        elif action == 'lag':
+            self.lag(stores, rollups)
+        else:
+            self.native(action, stores, rollups)
+
+    def backfill(self, stores, rollups, options):
+        if not options['start']:
+            raise CommandError('backfill 需要 --start')
+        start = parse_time(options['start'])
+        end = parse_time(options['end']) if options['end'] else None
+        engine = get_rollup_engine(rollups)
+        try:
+            for store in stores:
+                counts = engine.backfill(store, start, end)
+                self.stdout.write(f'{store}: ' + ', '.join(f'{name} {count}' for name, count in counts.items()))
+        finally:
+            engine.client.close()
+
+    def lag(self, stores, rollups):
+        for store, name, lag in rollup_lags(stores, rollups):
+            if lag is None:
+                self.stdout.write(self.style.WARNING(f'{store} {name}: 没有汇总数据'))
+            elif lag > TSDB_ROLLUP_LAG_ALERT:
+                self.stdout.write(self.style.WARNING(f'{store} {name}: 滞后 {int(lag)}s'))
+            else:
+                self.stdout.write(f'{store} {name}: 滞后 {int(lag)}s')
+
+    def native(self, action, stores, rollups):
+        engine = get_rollup_engine(rollups, mode=MODE_NATIVE)
+        try:
+            for store in stores:
+                if action == 'install':
+                    names = engine.install_native(store)
+                    self.stdout.write(f'{store}: 已创建 {", ".join(names) or "无"}')
+                else:
+                    engine.uninstall_native(store)
+                    self.stdout.write(f'{store}: 已删除')
+        finally:
+            engine.client.close()
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+环境系统分布图接口，设备属性读取设备属性最新值存储
+"""
+from rest_framework.decorators import action
+
+from backend.apps.environment_monitor import views
+from backend.apps.equipments.biz.latest_value_store import LatestValueViewMixin
+
+
+class EnvDistributionViewSet(LatestValueViewMixin, views.EnvDistributionViewSet):
+    """
+    环境系统 - 分布图
+    """
+    latest_value_path = ('environment_device', 'environment_monitor')
+    latest_value_data_field = 'up_attr_data'
+
+    @action(methods=['get'], detail=True, schema=views.EnvDistributionViewSet.get_dmap_env_devices.kwargs.get('schema'))
+    def get_dmap_env_devices(self, request, *args, **kwargs):
+        """
+        获取画布设备信息
+        """
+        response = super().get_dmap_env_devices(request, *args, **kwargs)
+        self.overlay_latest_values(response.data)
+        return response
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+设备/设备类型信息两级缓存
+
+一级缓存: 进程内 LRU，命中时无需访问 redis
+二级缓存: redis(device_data)，数据格式与 device_data_manage 一致
+缓存写入/删除后通过 redis pub/sub 通知所有进程(isw_adapter、celery、uwsgi)清除一级缓存中的过期数据，
+一级缓存同时设有过期时间，兜底未经本模块写入 redis 的修改。
+"""
+import json
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from backend.apps.equipments.biz.device_data_manage import set_device_info_cache as _set_device_info_cache, \
+    set_category_info_cache as _set_category_info_cache
+
+logger = settings.LOGGER
+
+DEVICE_KEY = 'device_{}'
+CATEGORY_KEY = 'device_category_{}'
+# 一级缓存失效通知频道
+INVALIDATE_CHANNEL = 'device_cache_invalidate'
+LOCAL_CACHE_MAX_SIZE = 50000
+LOCAL_CACHE_TTL = 300
+
+
+def device_key(device_username):
+    return DEVICE_KEY.format(device_username)
+
+
+def category_key(category_id):
+    return CATEGORY_KEY.format(category_id)
+
+
+class LRUCache(object):
+    """
+    线程安全的进程内 LRU 缓存
+    """
+
+    def __init__(self, max_size=LOCAL_CACHE_MAX_SIZE, ttl=LOCAL_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expire_at = item
+            if expire_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TwoTierCache(object):
+    """
+    进程内 LRU + redis 两级缓存，值为 json
+    """
+
+    def __init__(self, redis_alias='device_data', max_size=LOCAL_CACHE_MAX_SIZE, ttl=LOCAL_CACHE_TTL,
+                 channel=INVALIDATE_CHANNEL):
+        self.redis_alias = redis_alias
+        self.channel = channel
+        self.local = LRUCache(max_size=max_size, ttl=ttl)
+        self._redis_conn = None
+        self._invalidate_callbacks = []
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+
+    @property
+    def redis_conn(self):
+        if self._redis_conn is None:
+            self._redis_conn = get_redis_connection(self.redis_alias)
+        return self._redis_conn
+
+    def add_invalidate_callback(self, callback):
+        """
+        注册失效通知回调
+        :param callback: callback(keys)，keys 为 None 时表示可能漏掉了通知，需全部失效
+        """
+        self._invalidate_callbacks.append(callback)
+
+    def _on_invalidate(self, keys):
+        for key in keys:
+            self.local.pop(key)
+        for callback in self._invalidate_callbacks:
+            callback(keys)
+
+    def ensure_listener(self):
+        """
+        启动失效通知监听线程，fork 后的子进程中重新启动
+        """
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._listener_lock:
+            if self._listener_pid == pid:
+                return
+            # 子进程继承的一级缓存无法再收到失效通知，直接清空
+            self.local.clear()
+            thread = threading.Thread(target=self._listen, name='device_cache_invalidate', daemon=True)
+            thread.start()
+            self._listener_pid = pid
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis_conn.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    self._on_invalidate(json.loads(message['data']))
+            except Exception as err:
+                logger.error(f'设备缓存失效通知监听异常: {err}')
+                logger.error(traceback.format_exc())
+                # 断线期间可能漏掉通知
+                self.local.clear()
+                for callback in self._invalidate_callbacks:
+                    callback(None)
+                time.sleep(1)
+
+    def get_many(self, keys):
+        """
+        批量获取缓存，一级缓存未命中的 key 通过一次 mget 从 redis 获取
+        :param keys: [key, ...]
+        :return: {key: value} 不存在的 key 不返回
+        """
+        self.ensure_listener()
+        result = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                result[key] = value
+        if missing:
+            for key, raw in zip(missing, self.redis_conn.mget(missing)):
+                if raw is None:
+                    continue
+                value = json.loads(raw)
+                self.local.set(key, value)
+                result[key] = value
+        return result
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set_many(self, mapping):
+        """
+        批量写入缓存
+        :param mapping: {key: value}
+        """
+        if not mapping:
+            return
+        pipe = self.redis_conn.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(key, json.dumps(value))
+        pipe.publish(self.channel, json.dumps(list(mapping)))
+        pipe.execute()
+
+    def delete_many(self, keys):
+        if not keys:
+            return
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.unlink(*keys)
+        pipe.publish(self.channel, json.dumps(list(keys)))
+        pipe.execute()
+
+    def invalidate(self, keys):
+        """
+        仅通知各进程清除一级缓存，不修改 redis 数据
+        """
+        if keys:
+            self.redis_conn.publish(self.channel, json.dumps(list(keys)))
+
+
+device_info_cache = TwoTierCache()
+
+
+def get_device_info_cache(device_username):
+    """
+    获取设备数据缓存
+    :param device_username:
+    :return: dict or None
+    """
+    return device_info_cache.get(device_key(device_username))
+
+
+def get_many_device_info_cache(device_usernames):
+    """
+    批量获取设备数据缓存
+    :param device_usernames:
+    :return: {device_username: dict} 未缓存的设备不返回
+    """
+    keys = {device_key(username): username for username in device_usernames}
+    return {keys[key]: value for key, value in device_info_cache.get_many(list(keys)).items()}
+
+
+def get_category_info_cache(category_id):
+    """
+    获取设备类型缓存
+    :param category_id: DeviceCategory.id
+    :return: dict or None
+    """
+    return device_info_cache.get(category_key(category_id))
+
+
+def get_many_category_info_cache(category_ids):
+    """
+    批量获取设备类型缓存
+    :param category_ids: DeviceCategory.id 列表
+    :return: {category_id: dict} 未缓存的设备类型不返回
+    """
+    keys = {category_key(_id): _id for _id in category_ids}
+    return {keys[key]: value for key, value in device_info_cache.get_many(list(keys)).items()}
+
+
+def set_many_device_info_cache(device_objs):
+    """
+    批量设置设备数据缓存，数据格式与 set_device_info_cache 一致
+    :param device_objs: Device 列表
+    """
+    if not device_objs:
+        return
+    pipe = device_info_cache.redis_conn.pipeline(transaction=False)
+    for device_obj in device_objs:
+        _set_device_info_cache(device_obj, redis_conn=pipe)
+    pipe.publish(INVALIDATE_CHANNEL, json.dumps([device_key(obj.username) for obj in device_objs]))
+    pipe.execute()
+
+
+def set_device_info_cache(device_obj):
+    """
+    设置设备数据缓存
+    """
+    set_many_device_info_cache([device_obj])
+
+
+def set_many_category_info_cache(category_objs):
+    """
+    批量设置设备类型缓存，数据格式与 set_category_info_cache 一致
+    :param category_objs: DeviceCategory 列表
+    """
+    if not category_objs:
+        return
+    pipe = device_info_cache.redis_conn.pipeline(transaction=False)
+    for category_obj in category_objs:
+        _set_category_info_cache(category_obj, redis_conn=pipe)
+    pipe.publish(INVALIDATE_CHANNEL, json.dumps([category_key(obj.id) for obj in category_objs]))
+    pipe.execute()
+
+
+def set_category_info_cache(category_obj):
+    """
+    设置设备类型缓存
+    """
+    set_many_category_info_cache([category_obj])
+
+
+def update_many_device_info_cache(update_data_map):
+    """
+    批量更新设备数据缓存
+    :param update_data_map: {device_username: {field: value}}
+    """
+    keys = {device_key(username): data for username, data in update_data_map.items()}
+    if not keys:
+        return
+    mapping = {}
+    for key, raw in zip(keys, device_info_cache.redis_conn.mget(list(keys))):
+        if raw is None:
+            continue
+        value = json.loads(raw)
+        value.update(keys[key])
+        mapping[key] = value
+    device_info_cache.set_many(mapping)
+
+
+def update_device_info_cache(device_username, update_data):
+    """
+    更新设备数据缓存
+    """
+    update_many_device_info_cache({device_username: update_data})
+
+
+def del_many_device_info_cache(device_usernames):
+    """
+    批量删除设备数据缓存
+    """
+    device_info_cache.delete_many([device_key(username) for username in device_usernames])
+
+
+def del_device_info_cache(device_username):
+    """
+    删除设备数据缓存
+    """
+    del_many_device_info_cache([device_username])
+
+
+def del_many_category_info_cache(category_ids):
+    """
+    批量删除设备类型缓存
+    """
+    device_info_cache.delete_many([category_key(_id) for _id in category_ids])
+
+
+def del_category_info_cache(category_id):
+    """
+    删除设备类型缓存
+    """
+    del_many_category_info_cache([category_id])
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+设备属性最新值存储
+
+每台设备一个 redis(device_data) hash: latest_value_{device_username} -> {属性: json 编码的值}
+由 isw_adapter 上行处理写入，列表类接口按页一次 pipeline 读取，读取指定属性时在 redis 端用 HMGET 投影。
+hash 中没有的属性仍以设备模型表中的值为准。
+最新值只由 isw_adapter 的微批/asyncio/分片模式写入，默认模式(celery 解析)下列表接口不读取最新值;
+hash 在 LATEST_VALUE_TTL 秒内没有写入即过期，设备模型数据通过 save() 修改时删除该设备的 hash(见 equipments.signals)，
+isw_adapter 解析上报时的 save() 不删除(见 ingest_writes)，最新值由同一批次写入。
+"""
+import contextlib
+import json
+import threading
+
+import environ
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = settings.LOGGER
+
+env = environ.Env()
+# 最新值过期时间(秒)
+LATEST_VALUE_TTL = env.int('LATEST_VALUE_TTL', default=900)
+# 列表接口是否用最新值覆盖设备模型属性: isw_adapter 以微批/asyncio/分片模式运行且写入最新值时才启用
+LATEST_VALUE_OVERLAY_ENABLED = env.bool('ISW_LATEST_VALUE_ENABLED', default=True) and (
+    env.bool('ISW_BATCH_ENABLED', default=False) or env.bool('ISW_ASYNC_ENABLED', default=False)
+    or env.int('ISW_WORKER_PROCESSES', default=0) > 0
+)
+
+LATEST_VALUE_KEY = 'latest_value_{}'
+
+_local = threading.local()
+
+
+def latest_value_key(device_username):
+    return LATEST_VALUE_KEY.format(device_username)
+
+
+def update_many_latest_values(values_map, redis_conn=None):
+    """
+    批量写入设备属性最新值
+    :param values_map: {device_username: {attr: value}}
+    :param redis_conn:
+    """
+    values_map = {username: values for username, values in values_map.items() if values}
+    if not values_map:
+        return
+    redis_conn = redis_conn or get_redis_connection('device_data')
+    pipe = redis_conn.pipeline(transaction=False)
+    for username, values in values_map.items():
+        key = latest_value_key(username)
+        pipe.hset(key, mapping={attr: json.dumps(value, ensure_ascii=False) for attr, value in values.items()})
+        pipe.expire(key, LATEST_VALUE_TTL)
+    pipe.execute()
+
+
+def get_many_latest_values(device_usernames, fields=None, redis_conn=None):
+    """
+    批量获取设备属性最新值，一次 redis 往返
+    :param device_usernames: [device_username, ...]
+    :param fields: 需要的属性列表，为 None 时获取全部属性
+    :param redis_conn:
+    :return: {device_username: {attr: value}} 没有最新值的设备不返回
+    """
+    device_usernames = list(dict.fromkeys(device_usernames))
+    if not device_usernames:
+        return {}
+    redis_conn = redis_conn or get_redis_connection('device_data')
+    pipe = redis_conn.pipeline(transaction=False)
+    for username in device_usernames:
+        if fields is None:
+            pipe.hgetall(latest_value_key(username))
+        else:
+            pipe.hmget(latest_value_key(username), fields)
+    result = {}
+    for username, raw in zip(device_usernames, pipe.execute()):
+        if fields is None:
+            items = raw.items()
+        else:
+            items = zip(fields, raw)
+        values = {
+            attr.decode() if isinstance(attr, bytes) else attr: json.loads(value)
+            for attr, value in items if value is not None
+        }
+        if values:
+            result[username] = values
+    return result
+
+
+def get_latest_values(device_username, fields=None):
+    """
+    获取设备属性最新值
+    """
+    return get_many_latest_values([device_username], fields=fields).get(device_username, {})
+
+
+def del_many_latest_values(device_usernames, redis_conn=None):
+    """
+    删除设备属性最新值
+    """
+    if not device_usernames:
+        return
+    redis_conn = redis_conn or get_redis_connection('device_data')
+    redis_conn.unlink(*[latest_value_key(username) for username in device_usernames])
+
+
+@contextlib.contextmanager
+def ingest_writes():
+    """
+    当前线程在此期间保存的设备模型数据来自上报，不删除最新值
+    """
+    previous = getattr(_local, 'ingest', False)
+    _local.ingest = True
+    try:
+        yield
+    finally:
+        _local.ingest = previous
+
+
+def is_ingest_write():
+    return getattr(_local, 'ingest', False)
+
+
+class LatestValueViewMixin(object):
+    """
+    列表接口返回前用最新值覆盖设备模型属性，每页一次 redis 往返
+
+    latest_value_path: 返回数据中设备模型数据的路径，如 ('iot_breaker',)
+    latest_value_data_field: 属性所在的 JSON 字段，为 None 时属性即设备模型字段(只覆盖已返回的字段)
+    latest_value_fields: 读取的属性，为 None 时读取全部
+    """
+    latest_value_path = ()
+    latest_value_data_field = None
+    latest_value_fields = None
+
+    @staticmethod
+    def get_page_items(data):
+        if isinstance(data, dict):
+            return data.get('results') or []
+        return data or []
+
+    def get_latest_value_target(self, item):
+        model_data = item
+        for key in self.latest_value_path:
+            if not isinstance(model_data, dict):
+                return None, None
+            model_data = model_data.get(key)
+        if not isinstance(model_data, dict) or not isinstance(model_data.get('device'), dict):
+            return None, None
+        return model_data['device'].get('username'), model_data
+
+    def overlay_latest_values(self, data):
+        """
+        :param data: 序列化后的返回数据(分页或列表)
+        :return: data
+        """
+        if not LATEST_VALUE_OVERLAY_ENABLED:
+            return data
+        targets = [self.get_latest_value_target(item) for item in self.get_page_items(data)]
+        targets = [(username, model_data) for username, model_data in targets if username]
+        if not targets:
+            return data
+        try:
+            latest = get_many_latest_values(
+                [username for username, _ in targets], fields=self.latest_value_fields
+            )
+        except Exception as err:
+            # 最新值存储不可用时返回设备模型表中的值
+            logger.error(f'获取设备属性最新值失败: {err}')
+            return data
+        for username, model_data in targets:
+            values = latest.get(username)
+            if not values:
+                continue
+            if self.latest_value_data_field is None:
+                model_data.update({attr: value for attr, value in values.items() if attr in model_data})
+            else:
+                attr_data = model_data.get(self.latest_value_data_field)
+                model_data[self.latest_value_data_field] = {**(attr_data or {}), **values}
+        return data
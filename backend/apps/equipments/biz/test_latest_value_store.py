@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+设备属性最新值存储 测试
+"""
+from unittest import mock
+
+import fakeredis
+from django.test import TestCase
+
+from backend.apps.device_models.models import IotBreaker
+from backend.apps.equipments import signals
+from backend.apps.equipments.biz import latest_value_store
+from backend.apps.equipments.models import Device, DeviceCategory, EZtProjects
+from backend.apps.projects.models import Projects
+
+
+class LatestValueStoreTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        project = Projects.objects.create(name='latest_value')
+        category = DeviceCategory.objects.create(
+            key='latest_breaker', project=project, ezt_project=EZtProjects.objects.create(project_key='PR_latest'),
+            category_id='latest_breaker', category_name='iot_breaker',
+        )
+        cls.breaker = IotBreaker.objects.create(
+            device=Device.objects.create(username='breaker_0', project=project, category=category)
+        )
+
+    def setUp(self):
+        self.redis_conn = fakeredis.FakeRedis()
+        patcher = mock.patch.object(latest_value_store, 'get_redis_connection', return_value=self.redis_conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.key = latest_value_store.latest_value_key('breaker_0')
+
+    def view(self):
+        view = latest_value_store.LatestValueViewMixin()
+        view.latest_value_path = ('iot_breaker',)
+        return view
+
+    def page(self):
+        return {'results': [{'iot_breaker': {'device': {'username': 'breaker_0'}, 'state': 0}}]}
+
+    def test_values_expire(self):
+        latest_value_store.update_many_latest_values({'breaker_0': {'state': 1}, 'breaker_1': {}})
+        self.assertEqual(latest_value_store.get_latest_values('breaker_0'), {'state': 1})
+        ttl = self.redis_conn.ttl(self.key)
+        self.assertTrue(0 < ttl <= latest_value_store.LATEST_VALUE_TTL)
+
+    def test_projection(self):
+        latest_value_store.update_many_latest_values({'breaker_0': {'state': 1, 'state_sub': 2}})
+        self.assertEqual(latest_value_store.get_many_latest_values(['breaker_0', 'breaker_1'], fields=['state']),
+                         {'breaker_0': {'state': 1}})
+
+    def test_overlay_enabled(self):
+        latest_value_store.update_many_latest_values({'breaker_0': {'state': 1, 'other': 2}})
+        with mock.patch.object(latest_value_store, 'LATEST_VALUE_OVERLAY_ENABLED', True):
+            data = self.view().overlay_latest_values(self.page())
+        self.assertEqual(data['results'][0]['iot_breaker']['state'], 1)
+        self.assertNotIn('other', data['results'][0]['iot_breaker'])
+
+    def test_overlay_disabled_in_default_mode(self):
+        latest_value_store.update_many_latest_values({'breaker_0': {'state': 1}})
+        with mock.patch.object(latest_value_store, 'LATEST_VALUE_OVERLAY_ENABLED', False):
+            data = self.view().overlay_latest_values(self.page())
+        self.assertEqual(data['results'][0]['iot_breaker']['state'], 0)
+
+    def test_model_save_invalidates(self):
+        latest_value_store.update_many_latest_values({'breaker_0': {'state': 1}})
+        with mock.patch.object(signals, 'LATEST_VALUE_OVERLAY_ENABLED', True), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.breaker.save()
+        self.assertFalse(self.redis_conn.exists(self.key))
+
+    def test_model_save_uses_cached_device(self):
+        latest_value_store.update_many_latest_values({'breaker_0': {'state': 1}})
+        breaker = IotBreaker.objects.select_related('device').get(id=self.breaker.id)
+        breaker.state = 1
+        with mock.patch.object(signals, 'LATEST_VALUE_OVERLAY_ENABLED', True), \
+                mock.patch.object(Device.objects, 'filter') as device_filter, \
+                self.captureOnCommitCallbacks(execute=True):
+            breaker.save()
+        device_filter.assert_not_called()
+        self.assertFalse(self.redis_conn.exists(self.key))
+
+    def test_ingest_save_keeps_latest_values(self):
+        latest_value_store.update_many_latest_values({'breaker_0': {'state': 1}})
+        with mock.patch.object(signals, 'LATEST_VALUE_OVERLAY_ENABLED', True), \
+                self.captureOnCommitCallbacks(execute=True) as callbacks, latest_value_store.ingest_writes():
+            self.breaker.save()
+        self.assertTrue(self.redis_conn.exists(self.key))
+        self.assertEqual(callbacks, [])
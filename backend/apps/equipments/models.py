@@ -497,3 +497,7 @@ class DeviceControlLogging(models.Model):
     class Meta:
         verbose_name = '设备操控日志'
         verbose_name_plural = verbose_name
+
+
+# 注册设备缓存失效通知
+from backend.apps.equipments import signals  # noqa: E402,F401
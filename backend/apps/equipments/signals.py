@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+设备/设备类型变更后通知各进程清除设备信息一级缓存
+列表接口读取最新值的设备模型数据变更后删除该设备的属性最新值
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from backend.apps.equipments.biz.device_cache import device_info_cache, device_key, category_key
+from backend.apps.equipments.biz.latest_value_store import LATEST_VALUE_OVERLAY_ENABLED, del_many_latest_values, \
+    is_ingest_write
+from backend.apps.equipments.models import Device
+
+# 列表接口使用最新值覆盖属性的设备模型(见各应用的 latest_views)
+LATEST_VALUE_MODELS = ('device_models.IotBreaker', 'device_models.EnvironmentMonitor', 'device_models.LightMonitor')
+
+
+def device_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: device_info_cache.invalidate([device_key(instance.username)]))
+
+
+def category_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: device_info_cache.invalidate([category_key(instance.id)]))
+
+
+def category_mode_mapping_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: device_info_cache.invalidate([category_key(instance.category_id)]))
+
+
+def device_model_changed(sender, instance, **kwargs):
+    # 上报解析时的保存不删除，最新值由同一批次写入
+    if not LATEST_VALUE_OVERLAY_ENABLED or is_ingest_write():
+        return
+    if sender.device.is_cached(instance):
+        usernames = [instance.device.username]
+    else:
+        usernames = list(Device.objects.filter(id=instance.device_id).values_list('username', flat=True))
+    transaction.on_commit(lambda: del_many_latest_values(usernames))
+
+
+for signal_name, signal in (('post_save', post_save), ('post_delete', post_delete)):
+    signal.connect(device_changed, sender='equipments.Device', dispatch_uid=f'device_cache_{signal_name}_device')
+    signal.connect(category_changed, sender='equipments.DeviceCategory',
+                   dispatch_uid=f'device_cache_{signal_name}_category')
+    signal.connect(category_mode_mapping_changed, sender='equipments.CategoryModeMapping',
+                   dispatch_uid=f'device_cache_{signal_name}_category_mode_mapping')
+    for model in LATEST_VALUE_MODELS:
+        signal.connect(device_model_changed, sender=model,
+                       dispatch_uid=f'latest_value_{signal_name}_{model.split(".")[1].lower()}')
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+物联网断路器列表接口，属性值读取设备属性最新值存储
+"""
+from rest_framework.decorators import action
+
+from backend.apps.device_models.models import IotBreaker
+from backend.apps.equipments.biz.latest_value_store import LatestValueViewMixin
+from backend.apps.iot_breakers import views
+
+
+class IotBreakerDeviceViewSet(LatestValueViewMixin, views.IotBreakerDeviceViewSet):
+    """
+    物联网断路器-断路器设备
+    """
+    latest_value_path = ('iot_breaker',)
+    latest_value_fields = list(IotBreaker.ATTR_MAP)
+
+    @action(methods=['get'], detail=False, schema=views.IotBreakerDeviceViewSet.get_list.kwargs.get('schema'))
+    def get_list(self, request, *args, **kwargs):
+        """
+        用电终端设备列表
+        """
+        response = super().get_list(request, *args, **kwargs)
+        self.overlay_latest_values(response.data)
+        return response
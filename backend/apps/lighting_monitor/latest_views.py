@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+照明设备列表接口，回路状态读取设备属性最新值存储; 组织统计按回路状态位在数据库中汇总
+"""
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from backend.apps.device_models.biz.state_bits import sum_on_channels
+from backend.apps.device_models.models import LightMonitor
+from backend.apps.equipments.biz.latest_value_store import LatestValueViewMixin
+from backend.apps.lighting_monitor import views
+
+
+class LightDeviceViewSet(LatestValueViewMixin, views.LightDeviceViewSet):
+    """
+    照明系统-照明设备
+    """
+    latest_value_path = ('light_monitor',)
+    latest_value_data_field = 'light_data'
+    latest_value_fields = list(LightMonitor.ATTR_MAP)
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        self.overlay_latest_values(response.data)
+        return response
+
+    @action(methods=['get'], detail=False, schema=views.LightDeviceViewSet.org_statistics.kwargs.get('schema'))
+    def org_statistics(self, request, *args, **kwargs):
+        """
+        获取组织下照明设备统计信息
+        """
+        data = self.filter_queryset(self.get_queryset()).aggregate(
+            total_count=Count('id'),
+            on_line_count=Count('id', filter=Q(light_monitor__device__is_online=True)),
+            on_light_count=sum_on_channels('light_monitor__state_bits', 'light_monitor__light_count'),
+            total_light_count=Coalesce(Sum('light_monitor__total_count'), Value(0)),
+        )
+        data['off_line_count'] = data['total_count'] - data['on_line_count']
+        return Response(data)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+开关监控设备接口，组织统计按回路状态位在数据库中汇总
+"""
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from backend.apps.device_models.biz.state_bits import sum_on_channels
+from backend.apps.switch_monitor import views
+
+
+class SwitchDeviceViewSet(views.SwitchDeviceViewSet):
+    """
+    开关监控-开关设备
+    """
+
+    @action(methods=['get'], detail=False, schema=views.SwitchDeviceViewSet.org_statistics.kwargs.get('schema'))
+    def org_statistics(self, request, *args, **kwargs):
+        """
+        获取组织下开关监控设备统计信息
+        """
+        data = self.filter_queryset(self.get_queryset()).aggregate(
+            total_count=Count('id'),
+            on_line_count=Count('id', filter=Q(switch_monitor__device__is_online=True)),
+            on_count=sum_on_channels('switch_monitor__state_bits', 'switch_monitor__on_count'),
+            total_switch_count=Coalesce(Sum('switch_monitor__total_count'), Value(0)),
+        )
+        data['off_count'] = data['total_switch_count'] - data['on_count']
+        data['off_line_count'] = data['total_count'] - data['on_line_count']
+        return Response(data)
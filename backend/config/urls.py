@@ -35,18 +35,21 @@ from backend.apps.energy_statistics.views import StatisticDimensionViewSet, Dime
     ElectricMeterNodeViewSet
 from backend.apps.energy_waste_statistics.views import EnergyWasteGroupViewSet, EnergyWasteDeviceViewSet, \
     EnergyWasteDailyDataViewSet
-from backend.apps.environment_monitor.views import EnvironmentMonitorNodeViewSet, EnvironmentDeviceViewSet, \
-    EnvDistributionViewSet
+from backend.apps.environment_monitor.views import EnvironmentMonitorNodeViewSet, EnvironmentDeviceViewSet
+from backend.apps.environment_monitor.latest_views import EnvDistributionViewSet
 from backend.apps.equipments.views import ISWDataView, EZtProjectsView, \
     DeviceCategoryViewSet, DeviceViewSet, CategoryModeMappingViewSet, DeviceSyncRecordViewSet, \
     DeviceAttrDataViewSet, DeviceControlLoggingViewSet
-from backend.apps.iot_breakers.views import IotBreakerTreeNodeViewSet, IotBreakerDeviceViewSet
-from backend.apps.lighting_monitor.views import LightMonitorNodeViewSet, LightDeviceViewSet
+from backend.apps.iot_breakers.views import IotBreakerTreeNodeViewSet
+from backend.apps.iot_breakers.latest_views import IotBreakerDeviceViewSet
+from backend.apps.lighting_monitor.views import LightMonitorNodeViewSet
+from backend.apps.lighting_monitor.latest_views import LightDeviceViewSet
 from backend.apps.proj_common.views import ConstDataAPI
 from backend.apps.projects.views import ProjectViewSet, OrgTreeViewSet, \
     ProjectMemberViewSet, ProjectsAppMenusViewSet, OrgAppMenusViewSet, ProjectGroupViewSet
 from backend.apps.scenes.views import SceneConfigViewSet
-from backend.apps.switch_monitor.views import SwitchMonitorNodeViewSet, SwitchDeviceViewSet
+from backend.apps.switch_monitor.views import SwitchMonitorNodeViewSet
+from backend.apps.switch_monitor.stat_views import SwitchDeviceViewSet
 from backend.apps.transformer_monitor.views import TransformerMonitorViewSet
 from backend.apps.uploader.views import UploadViewSet
 from backend.apps.users.views import ErrorTimesView, UserViewSet, ExtraLogin, \
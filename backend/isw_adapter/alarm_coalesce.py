@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+告警通知合并
+
+断路器抖动、网关掉线恢复等情况下设备会在短时间内上报大量相同的告警，每条告警都推送通知会造成短信/微信/钉钉消息风暴。
+批处理模式下告警通知按 (设备, alarm_rule_id) 在 ISW_ALARM_COALESCE_WINDOW 秒的窗口内合并:
+    告警状态变化(首条告警、告警→恢复等)立即推送并开启新窗口，窗口内相同状态的重复告警不再推送，
+    窗口结束(或状态变化、进程退出)时若有被合并的重复告警，推送一条汇总通知，内容为最后一条告警，并附加
+    alarm_count(窗口内告警次数，含首条)、first_alarm_time/last_alarm_time(首次/最后告警时间)
+告警日志 DeviceAlarmLogs 仍逐条记录，由所在批次通过一次 bulk_create 写入(见 batch_ingest)。
+窗口保存在进程内: 分片模式下同一设备的消息总在同一工作进程处理。
+"""
+import atexit
+import signal
+import sys
+import threading
+import time
+import traceback
+
+from django.conf import settings
+
+from backend.isw_adapter.ingest_config import ISW_ALARM_COALESCE_WINDOW
+from backend.isw_adapter.up_server import ParseUpMsg
+
+logger = settings.ISW_ADAPTER_LOGGER
+
+# 到期窗口检查间隔上限(秒)
+MAX_FLUSH_INTERVAL = 1
+
+
+def exit_on_sigterm():
+    """
+    收到 SIGTERM 时正常退出进程，以便退出前推送未结束窗口的合并通知(只能在主线程调用)
+    """
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+
+def send_alarm_msg(device_id, device_username, msg):
+    """
+    推送告警通知
+    """
+    handler = ParseUpMsg(f'open//{device_username}/alarm', '')
+    handler.device_username = device_username
+    handler._send_alarm_msg(device_id, msg)
+
+
+class AlarmCoalescer(object):
+    """
+    按 (设备, 告警规则) 合并告警通知
+    """
+
+    def __init__(self, window=ISW_ALARM_COALESCE_WINDOW, sender=send_alarm_msg):
+        """
+        :param window: 合并窗口(秒)
+        :param sender: 推送函数 sender(device_id, device_username, msg)
+        """
+        self.window = window
+        self.sender = sender
+        # {(device_id, alarm_rule_id): 窗口状态}
+        self._windows = {}
+        # 推送在锁内进行，保证同一告警规则的通知按状态变化顺序推送
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def add(self, device_id, device_username, msg, alarm_status, alarm_time, now=None):
+        """
+        记录一条告警，状态变化时立即推送，窗口内的重复告警合并
+        :param msg: 告警上报数据
+        :param alarm_status: 告警状态 normal/pending/alerting
+        :param alarm_time: 告警时间
+        """
+        now = time.monotonic() if now is None else now
+        key = (device_id, msg.get('alarm_rule_id'))
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and window['deadline'] > now and window['alarm_status'] == alarm_status:
+                window['alarm_count'] += 1
+                window['last_alarm_time'] = alarm_time
+                window['msg'] = msg
+                return
+            # 先推送上一窗口被合并的重复告警，再推送本次状态变化
+            if window is not None and window['alarm_count'] > 1:
+                self.send(device_id, device_username, self.build_msg(window))
+            self._windows[key] = {
+                'deadline': now + self.window,
+                'device_username': device_username,
+                'alarm_status': alarm_status,
+                'alarm_count': 1,
+                'first_alarm_time': alarm_time,
+                'last_alarm_time': alarm_time,
+                'msg': msg,
+            }
+            self.send(device_id, device_username, msg)
+        self.start()
+
+    def pop_due(self, now=None):
+        """
+        取出已到期的窗口，只返回有被合并的重复告警的窗口
+        :return: [(device_id, device_username, 合并后的告警通知)]
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            due_keys = [key for key, window in self._windows.items() if window['deadline'] <= now]
+            due = [(key[0], self._windows.pop(key)) for key in due_keys]
+        return [(device_id, window['device_username'], self.build_msg(window))
+                for device_id, window in due if window['alarm_count'] > 1]
+
+    @staticmethod
+    def build_msg(window):
+        msg = dict(window['msg'])
+        msg.update({
+            'alarm_count': window['alarm_count'],
+            'first_alarm_time': window['first_alarm_time'],
+            'last_alarm_time': window['last_alarm_time'],
+        })
+        return msg
+
+    def send(self, device_id, device_username, msg):
+        try:
+            self.sender(device_id, device_username, msg)
+        except Exception as err:
+            logger.error(f'{device_username} 告警通知推送失败: {err}')
+            logger.error(traceback.format_exc())
+
+    def flush(self, now=None):
+        """
+        推送已到期窗口的合并通知
+        :param now: 为 float('inf') 时推送所有窗口
+        :return: 推送数量
+        """
+        with self._lock:
+            due = self.pop_due(now)
+            for device_id, device_username, msg in due:
+                self.send(device_id, device_username, msg)
+        return len(due)
+
+    def run(self):
+        interval = min(self.window, MAX_FLUSH_INTERVAL)
+        while not self._stopped.wait(interval):
+            try:
+                count = self.flush()
+                if count:
+                    logger.debug(f'isw_adapter 告警合并通知推送: {count}')
+            except Exception as err:
+                logger.error(f'isw_adapter 告警合并通知失败: {err}')
+                logger.error(traceback.format_exc())
+
+    def start(self):
+        """
+        启动到期窗口检查线程，分片模式下由各工作进程在收到第一条告警时启动
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self.run, name='isw_adapter_alarm_coalescer', daemon=True)
+                self._thread.start()
+                atexit.unregister(self.stop)
+                atexit.register(self.stop)
+
+    def stop(self):
+        """
+        停止窗口检查线程，推送所有未结束窗口的合并通知(进程退出时调用)
+        """
+        self._stopped.set()
+        count = self.flush(float('inf'))
+        if count:
+            logger.info(f'isw_adapter 退出前推送告警合并通知: {count}')
+
+
+alarm_coalescer = AlarmCoalescer()
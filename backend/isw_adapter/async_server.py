@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+isw 上行数据 asyncio 处理模式
+
+MQTT 收发、批次调度及各写入目标在同一个事件循环中并发执行:
+    1. paho 客户端的 socket 读写挂到事件循环上(不再使用 loop_forever 线程)，收到的消息按设备 username 分到
+       ISW_ASYNC_LANES 个处理通道，同一设备的消息总在同一通道内按序处理
+    2. 各通道按 ISW_BATCH_SIZE/ISW_BATCH_INTERVAL_MS 聚合批次，解析(json 解码、设备模型处理类)在线程池中执行
+    3. 解析完成后设备表、告警日志、最新值存储、时序数据库四个写入目标在线程池中并发写入
+    4. 待处理消息超过 ISW_QUEUE_MAX_SIZE 时暂停读取 MQTT socket，回落到一半以下后恢复
+数据库/redis 不可用时该批次退避后从失败处继续处理(见 batch_ingest)，期间通道内的消息继续积压，由第 4 步反压。
+"""
+import asyncio
+import functools
+import time
+import traceback
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import paho.mqtt.client as mqtt
+from django.conf import settings
+from django.db import close_old_connections
+
+from backend.isw_adapter.alarm_coalesce import exit_on_sigterm
+from backend.isw_adapter.batch_ingest import UpMsgBatch, CONNECTION_ERRORS, MAX_BACKOFF
+from backend.isw_adapter.ingest_config import ISW_BATCH_SIZE, ISW_BATCH_INTERVAL_MS, ISW_BATCH_TSDB_WRITE, \
+    ISW_QUEUE_MAX_SIZE, ISW_WORKER_REPORT_INTERVAL, ISW_ASYNC_LANES, ISW_ASYNC_EXECUTOR_WORKERS
+from backend.isw_adapter.isw_adapter_config import ISW_MQTT_DATA
+from backend.isw_adapter.shard_server import get_device_username
+from backend.isw_adapter.up_server import MQTTUpServer, IswUpServe
+from backend.m_common.tsdb.interface import DatabaseFactory
+
+logger = settings.ISW_ADAPTER_LOGGER
+
+# MQTT 断线重连间隔(秒)
+RECONNECT_INTERVAL = 5
+
+
+class AsyncioHelper(object):
+    """
+    将 paho 客户端的 socket 读写挂到 asyncio 事件循环上
+    """
+
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.paused = False
+        self.misc_task = None
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+        # 客户端在初始化时已建立连接
+        sock = client.socket()
+        if sock is not None:
+            self.on_socket_open(client, None, sock)
+            if client.want_write():
+                self.on_socket_register_write(client, None, sock)
+
+    def on_socket_open(self, client, user_data, sock):
+        self.paused = False
+        self.loop.add_reader(sock, client.loop_read)
+        if self.misc_task is None:
+            self.misc_task = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, user_data, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+
+    def on_socket_register_write(self, client, user_data, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, user_data, sock):
+        self.loop.remove_writer(sock)
+
+    def pause_reading(self):
+        sock = self.client.socket()
+        if sock is not None and not self.paused:
+            self.loop.remove_reader(sock)
+            self.paused = True
+
+    def resume_reading(self):
+        sock = self.client.socket()
+        if sock is not None and self.paused:
+            self.loop.add_reader(sock, self.client.loop_read)
+            self.paused = False
+
+    async def misc_loop(self):
+        """
+        心跳及断线重连
+        """
+        while True:
+            if self.client.loop_misc() != mqtt.MQTT_ERR_SUCCESS:
+                logger.error('isw_adapter mqtt 连接断开，重连中...')
+                try:
+                    self.client.reconnect()
+                except Exception as err:
+                    logger.error(f'isw_adapter mqtt 重连失败: {err}')
+                    await asyncio.sleep(RECONNECT_INTERVAL)
+                    continue
+            await asyncio.sleep(1)
+
+
+class AsyncMQTTUpServer(MQTTUpServer):
+    """
+    接收 Isw 设备上行数据后交由 asyncio 处理通道
+    """
+
+    def __init__(self, *args, server=None, **kwargs):
+        self.server = server
+        super().__init__(*args, **kwargs)
+
+    def on_message(self, client, user_data, msg):
+        self.server.put(msg.topic, msg.payload.decode())
+
+
+class AsyncUpServer(object):
+    """
+    asyncio 上行消息处理
+    """
+
+    def __init__(self, lanes=ISW_ASYNC_LANES, executor_workers=ISW_ASYNC_EXECUTOR_WORKERS,
+                 batch_size=ISW_BATCH_SIZE, interval_ms=ISW_BATCH_INTERVAL_MS, max_pending=ISW_QUEUE_MAX_SIZE,
+                 tsdb_write=ISW_BATCH_TSDB_WRITE):
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self.max_pending = max_pending
+        self.lane_count = lanes
+        self.lanes = []
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix='isw_adapter_async')
+        self.tsdb_client = DatabaseFactory.get_client(settings.TSDB_TYPE, logger=logger) if tsdb_write else None
+        self.loop = None
+        self.helper = None
+        self.pending = 0
+        self.processed = 0
+        self._failures = 0
+
+    def put(self, topic, msg_str):
+        """
+        消息按设备分到处理通道，待处理消息过多时暂停读取 MQTT socket
+        """
+        username = get_device_username(topic) or topic
+        self.lanes[zlib.crc32(username.encode()) % self.lane_count].put_nowait((topic, msg_str))
+        self.pending += 1
+        if self.pending >= self.max_pending and self.helper is not None:
+            self.helper.pause_reading()
+
+    def done(self, count):
+        self.pending -= count
+        self.processed += count
+        if self.pending < self.max_pending // 2 and self.helper is not None:
+            self.helper.resume_reading()
+
+    async def run_sync(self, func, *args):
+        """
+        在线程池中执行阻塞调用(数据库、redis、时序数据库)
+        """
+        return await self.loop.run_in_executor(self.executor, functools.partial(self.call_in_thread, func, *args))
+
+    @staticmethod
+    def call_in_thread(func, *args):
+        close_old_connections()
+        return func(*args)
+
+    async def next_batch(self, lane):
+        messages = [await lane.get()]
+        deadline = self.loop.time() + self.interval
+        while len(messages) < self.batch_size:
+            timeout = deadline - self.loop.time()
+            if timeout <= 0:
+                break
+            try:
+                messages.append(await asyncio.wait_for(lane.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return messages
+
+    async def process_batch(self, messages):
+        batch = UpMsgBatch(messages, tsdb_client=self.tsdb_client)
+        while True:
+            try:
+                await self.run_sync(batch.parse)
+                await self.flush(batch)
+                self._failures = 0
+            except CONNECTION_ERRORS as err:
+                await self.on_connection_error(messages, err)
+                continue
+            except Exception as err:
+                logger.error(f'isw_adapter 批量处理失败: {err}')
+                logger.error(traceback.format_exc())
+            return
+
+    async def flush(self, batch):
+        """
+        各写入目标并发写入，全部结束后再抛出异常，避免重试时与未结束的写入并发
+        """
+        results = await asyncio.gather(
+            self.run_sync(batch.flush_device_data),
+            self.run_sync(batch.flush_alarm_logs),
+            self.run_sync(batch.flush_latest_values),
+            self.run_sync(batch.flush_tsdb_points),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        for err in errors:
+            if isinstance(err, CONNECTION_ERRORS):
+                raise err
+        if errors:
+            raise errors[0]
+
+    async def on_connection_error(self, messages, err):
+        """
+        数据库/redis 不可用时退避重试，之后由 process_batch 从失败处继续处理该批次
+        """
+        self._failures += 1
+        backoff = min(2 ** (self._failures - 1), MAX_BACKOFF)
+        logger.error(f'isw_adapter 连接失败, {len(messages)} 条消息的批次 {backoff}s 后继续处理: {err}')
+        await asyncio.sleep(backoff)
+
+    async def run_lane(self, lane):
+        while True:
+            messages = await self.next_batch(lane)
+            try:
+                await self.process_batch(messages)
+            finally:
+                self.done(len(messages))
+
+    async def monitor(self, interval=ISW_WORKER_REPORT_INTERVAL):
+        processed, start = self.processed, time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            rate = (self.processed - processed) / (now - start)
+            processed, start = self.processed, now
+            depths = ', '.join(f'lane-{i}={lane.qsize()}' for i, lane in enumerate(self.lanes))
+            logger.info(f'isw_adapter asyncio pending: {self.pending}, {rate:.1f} msgs/s, {depths}')
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.lanes = [asyncio.Queue() for _ in range(self.lane_count)]
+        client = AsyncMQTTUpServer(
+            client_id=f'isw_adapter_{int(time.time() * 1000)}',
+            logger=logger,
+            server=self,
+            **ISW_MQTT_DATA
+        )
+        self.helper = AsyncioHelper(self.loop, client._client)
+        tasks = [self.run_lane(lane) for lane in self.lanes]
+        await asyncio.gather(self.monitor(), *tasks)
+
+    def run(self):
+        asyncio.run(self.serve())
+
+
+class AsyncIswUpServe(IswUpServe):
+    """
+    isw网关上行数据处理(asyncio 模式)
+    """
+
+    @staticmethod
+    def start_receiver_server():
+        """
+        启动 asyncio 事件循环
+        :return:
+        """
+        exit_on_sigterm()
+        AsyncUpServer().run()
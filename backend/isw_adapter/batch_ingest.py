@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+"""
+isw 上行数据微批处理
+
+MQTT 收到的上行消息先进入批处理队列，满 ISW_BATCH_SIZE 条或超过 ISW_BATCH_INTERVAL_MS 毫秒后整批处理:
+    1. 设备/设备类型缓存通过两级缓存一次性预取，已缓存的设备无需访问 redis
+    2. 逐条解析消息(topic 及设备类型处理类均由预先生成的路由表分发)，设备上报时间等字段只在批次内累积
+    3. 批次结束时通过一次 bulk_update 更新设备表，通过一次 pipeline 写入设备属性最新值存储，
+       (可选)通过一次 write_multiple_data 写入时序数据库
+    4. (可选)告警日志在批次结束时通过一次 bulk_create 写入，告警通知按窗口合并后推送(见 alarm_coalesce)
+队列有界，队列满时的处理见 ingest_queue。
+数据库/redis 不可用时该批次退避后从失败处继续处理: 已解析的消息不再解析，已写入的目标不再写入，
+避免告警日志、预付费结算等非幂等写入重复执行，故障期间不再从队列取新消息。
+"""
+import copy
+import datetime
+import queue
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction, InterfaceError, OperationalError
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+from backend.apps.alarms.models import DeviceAlarmLogs
+from backend.apps.equipments.biz.device_cache import get_many_device_info_cache, get_many_category_info_cache
+from backend.apps.equipments.biz.latest_value_store import ingest_writes, update_many_latest_values
+from backend.apps.equipments.models import Device
+from backend.isw_adapter.alarm_coalesce import alarm_coalescer, exit_on_sigterm
+from backend.isw_adapter.ingest_config import ISW_BATCH_SIZE, ISW_BATCH_INTERVAL_MS, ISW_BATCH_TSDB_WRITE, \
+    ISW_LATEST_VALUE_ENABLED
+from backend.isw_adapter.ingest_queue import BoundedIngestQueue
+from backend.isw_adapter.isw_adapter_config import ISW_MQTT_DATA
+from backend.isw_adapter.payload_decoder import loads, get_schema, TSDB_FLOAT_FIELD, TSDB_STRING_FIELD
+from backend.isw_adapter.topic_router import TopicRouter, category_handler_registry
+from backend.isw_adapter.up_server import ParseUpMsg, MQTTUpServer, IswUpServe
+from backend.m_common.tsdb.interface import DatabaseFactory
+
+logger = settings.ISW_ADAPTER_LOGGER
+
+TSDB_MEASUREMENT = 'data'
+
+# 数据库/redis 不可用，批次需稍后从失败处继续处理
+CONNECTION_ERRORS = (OperationalError, InterfaceError, RedisConnectionError, RedisTimeoutError)
+# 连接故障后的最大退避时间(秒)
+MAX_BACKOFF = 30
+# EZt 告警状态 -> 告警日志状态
+ALARM_STATE_MAP = {'D': 'pending', 'F': 'alerting', 'H': 'normal'}
+
+
+class BatchParseUpMsg(ParseUpMsg):
+    """
+    批处理上报数据解析类
+    设备缓存由所在批次预取，设备上报时间由所在批次统一更新
+    """
+
+    def __init__(self, topic, msg_str, batch):
+        super().__init__(topic, msg_str)
+        self.batch = batch
+
+    def parse_msg(self):
+        """
+        数据解析入口函数
+        """
+        route = topic_router.route(self.topic)
+        if route is None:
+            logger.error(f'<<{self.topic}>> topic 格式错误')
+            return
+        self.project_key, self.device_username, handler = route
+        device_data = self.batch.get_device_info(self.device_username)
+        if not device_data:
+            logger.info(f'{self.device_username} 设备未录入')
+            return
+        self.device_data = device_data
+        if handler is None:
+            return
+        self.msg = self.get_msg(self.msg_str)
+        if isinstance(self.msg, str):
+            self.is_error = True
+            logger.error(f'topic <<{self.topic}>> msg <<{self.msg_str}>> msg 格式错误!')
+        category_info = self.batch.get_category_info(device_data.get('category'))
+        if not category_info:
+            logger.error(f'{self.device_username} not category_info')
+            return
+        self.device_data['category_info'] = category_info
+        if handler is BatchParseUpMsg.parse_on_line:
+            # 上下线直接写库，先落盘该设备批次内的待更新数据，保证更新顺序
+            self.batch.flush_device_data(self.device_username)
+        elif handler is BatchParseUpMsg.parse_data_report and not self.is_error:
+            self.batch.add_data_report(
+                self.project_key, self.device_username, self.msg, category_info.get('device_types', ())
+            )
+        return handler(self)
+
+    @staticmethod
+    def get_msg(msg_str):
+        return loads(msg_str)
+
+    def parse_data_report(self):
+        """
+        解析设备定时上报数据，处理类由注册表直接给出
+        """
+        self.update_device_data(timestamp=datetime.datetime.now())
+        for manage_class in category_handler_registry.get_handlers(self.device_data['category_info']):
+            manage_class(self.topic, self.msg, self.device_data, logger=logger).parse_data_report()
+
+    def update_device_data(self, **kwargs):
+        """
+        更新设备数据上报时间，批次结束时统一写库
+        """
+        self.batch.update_device_data(self.device_username, self.device_data['id'], **kwargs)
+
+    def parse_alarm_report(self):
+        """
+        解析设备告警上报，启用告警通知合并时告警日志由所在批次批量写入，通知按窗口合并后推送
+        """
+        if not alarm_coalescer.enabled:
+            return super().parse_alarm_report()
+        alarm_status = ALARM_STATE_MAP.get(self.msg.get('alarm_status'))
+        if alarm_status is None:
+            logger.info(f'alarm_status<<{self.msg.get("alarm_status")}>> ')
+            return
+        update_info = {'is_online': True}
+        device_alarm_status = ALARM_STATE_MAP.get(self.msg.get('device_alarm_status'))
+        if device_alarm_status is not None:
+            update_info['alarm_status'] = device_alarm_status
+        alarm_detail = copy.deepcopy(self.msg)
+        alarm_type = ''
+        if 'trigger_info' in alarm_detail:
+            alarm_rule = alarm_detail['trigger_info'].get('alarm_rule')
+            if alarm_rule:
+                alarm_rule.pop('ds_source', None)
+                alarm_type = (alarm_rule.get('tag_conf') or {}).get('alarm_type', '')
+        alarm_log = DeviceAlarmLogs(
+            device_id=self.device_data['id'],
+            degree=self.msg['alarm_level'],
+            alarm_status=alarm_status,
+            alarm_rule_id=self.msg.get('alarm_rule_id'),
+            alarm_rule_name=self.msg.get('alarm_rule_name'),
+            alarm_detail=alarm_detail,
+            alarm_type=alarm_type,
+            alarm_time=self.msg.get('create_time_text'),
+        )
+        self.update_device_data(**update_info)
+        self.batch.add_alarm_log(self.device_username, alarm_log, self.msg)
+
+
+topic_router = TopicRouter(BatchParseUpMsg)
+
+
+class UpMsgBatch(object):
+    """
+    一批上行消息的处理上下文
+    """
+
+    def __init__(self, messages, tsdb_client=None, latest_value_enabled=ISW_LATEST_VALUE_ENABLED):
+        """
+        :param messages: [(topic, msg_str), ...]
+        :param tsdb_client: 时序数据库客户端，为 None 时不写入时序数据库
+        :param latest_value_enabled: 是否写入设备属性最新值存储
+        """
+        self.messages = messages
+        self.tsdb_client = tsdb_client
+        self.latest_value_enabled = latest_value_enabled
+        self.device_info = {}
+        self.category_info = {}
+        # {device_username: (device_id, {field: value})}
+        self.device_updates = {}
+        # {store: [data_point, ...]}
+        self.tsdb_points = {}
+        # {device_username: {attr: value}}
+        self.latest_values = {}
+        # [(device_username, DeviceAlarmLogs, 告警上报数据), ...]
+        self.alarm_logs = []
+        # 需标记为已恢复的批次前告警 {(device_id, alarm_rule_id), ...}
+        self.alarm_restores = set()
+        # 已预取缓存; 已解析的消息数，连接故障后从此处继续解析
+        self.prefetched = False
+        self.parsed = 0
+
+    def prefetch(self):
+        """
+        一次性预取批次内所有设备及其设备类型的缓存
+        """
+        usernames = {topic.split('/')[2] for topic, _ in self.messages if topic.count('/') == 3}
+        if usernames:
+            self.device_info = get_many_device_info_cache(usernames)
+            category_ids = {info.get('category') for info in self.device_info.values()}
+            if category_ids:
+                self.category_info = get_many_category_info_cache(category_ids)
+        self.prefetched = True
+
+    def get_device_info(self, device_username):
+        info = self.device_info.get(device_username)
+        # 缓存数据为多条消息共用，每条消息使用独立的副本
+        return dict(info) if info else None
+
+    def get_category_info(self, category_id):
+        return self.category_info.get(category_id)
+
+    def update_device_data(self, device_username, device_id, **kwargs):
+        _, fields = self.device_updates.setdefault(device_username, (device_id, {}))
+        fields.update(kwargs)
+
+    @staticmethod
+    def decode_values(msg, device_types=()):
+        """
+        属性上报数据类型转换，设备模型字段按字段类型转换，其余属性保持原值
+        :return: {attr: value}
+        """
+        values = dict(msg)
+        for device_type in device_types:
+            schema = get_schema(device_type)
+            if schema is not None:
+                values.update(schema.model_values(schema.coerce(msg)))
+        return values
+
+    def add_data_report(self, store, device_username, msg, device_types=()):
+        """
+        记录属性上报数据，批次结束时写入最新值存储及时序数据库
+        """
+        if not isinstance(msg, dict) or (self.tsdb_client is None and not self.latest_value_enabled):
+            return
+        values = self.decode_values(msg, device_types)
+        if self.latest_value_enabled:
+            self.latest_values.setdefault(device_username, {}).update(values)
+        if self.tsdb_client is not None:
+            self.add_tsdb_points(store, device_username, values)
+
+    def add_tsdb_points(self, store, device_username, values):
+        """
+        将属性上报数据转换为时序数据点
+        """
+        timestamp = int(time.time() * 1000)
+        points = self.tsdb_points.setdefault(store, [])
+        for key, value in values.items():
+            if isinstance(value, (bool, int, float)):
+                fields = {TSDB_FLOAT_FIELD: float(value)}
+            elif isinstance(value, str):
+                fields = {TSDB_STRING_FIELD: value}
+            else:
+                continue
+            points.append({
+                'measurement': TSDB_MEASUREMENT,
+                'fields': fields,
+                'tags': {'device_username': device_username, 'key': key},
+                'timestamp': timestamp,
+            })
+
+    def flush_device_data(self, device_username=None):
+        """
+        批量更新设备表，写入成功后清除待更新数据
+        :param device_username: 为 None 时更新批次内所有设备
+        """
+        if device_username is None:
+            updates = self.device_updates
+        elif device_username in self.device_updates:
+            updates = {device_username: self.device_updates[device_username]}
+        else:
+            return
+        # bulk_update 要求同一批对象更新相同字段，按字段集合分组
+        groups = {}
+        for device_id, fields in updates.values():
+            groups.setdefault(tuple(sorted(fields)), []).append(Device(id=device_id, **fields))
+        for field_names, objs in groups.items():
+            Device.objects.bulk_update(objs, list(field_names), batch_size=ISW_BATCH_SIZE)
+        for username in list(updates):
+            self.device_updates.pop(username, None)
+
+    def add_alarm_log(self, device_username, alarm_log, msg):
+        """
+        记录告警日志，批次结束时批量写入
+        告警恢复时批次内该规则未恢复的告警直接标记为已恢复，批次前的告警在写入前统一更新
+        """
+        if alarm_log.alarm_status == 'normal':
+            key = (alarm_log.device_id, alarm_log.alarm_rule_id)
+            for _, log, _ in self.alarm_logs:
+                if (log.device_id, log.alarm_rule_id) == key and log.alarm_status == 'alerting':
+                    log.is_restored = True
+            self.alarm_restores.add(key)
+        self.alarm_logs.append((device_username, alarm_log, msg))
+
+    def flush_alarm_logs(self):
+        """
+        在一个事务中批量写入告警日志，提交成功后清除待写入日志，告警交由通知合并
+        """
+        alarm_logs, restores = self.alarm_logs, self.alarm_restores
+        if not alarm_logs:
+            return
+        with transaction.atomic():
+            for device_id, alarm_rule_id in restores:
+                DeviceAlarmLogs.objects.filter(
+                    device_id=device_id, alarm_rule_id=alarm_rule_id, alarm_status='alerting', is_restored=False
+                ).update(is_restored=True)
+            DeviceAlarmLogs.objects.bulk_create([log for _, log, _ in alarm_logs], batch_size=ISW_BATCH_SIZE)
+        self.alarm_logs, self.alarm_restores = [], set()
+        for device_username, log, msg in alarm_logs:
+            alarm_coalescer.add(log.device_id, device_username, msg, log.alarm_status, log.alarm_time)
+
+    def flush_latest_values(self):
+        update_many_latest_values(self.latest_values)
+        self.latest_values = {}
+
+    def flush_tsdb_points(self):
+        if self.tsdb_client is None:
+            return
+        # 逐个 store 写入，写入成功的 store 不再重复写入
+        for store in list(self.tsdb_points):
+            data_points = self.tsdb_points[store]
+            if data_points:
+                self.tsdb_client.write_multiple_data(store, data_points)
+            del self.tsdb_points[store]
+
+    def parse(self):
+        """
+        逐条解析批次内的消息，连接故障后再次调用时从未解析完成的消息继续
+        """
+        if not self.prefetched:
+            self.prefetch()
+        with ingest_writes():
+            while self.parsed < len(self.messages):
+                topic, msg_str = self.messages[self.parsed]
+                try:
+                    BatchParseUpMsg(topic, msg_str, self).parse_msg()
+                except CONNECTION_ERRORS:
+                    raise
+                except Exception as err:
+                    logger.error(f'topic <<{topic}>> msg <<{msg_str}>> 解析失败: {err}')
+                    logger.error(traceback.format_exc())
+                self.parsed += 1
+
+    def flush(self):
+        """
+        批量写入设备表、告警日志、最新值存储及时序数据库，各写入目标成功后清除待写入数据，重试时不会重复写入
+        """
+        self.flush_device_data()
+        self.flush_alarm_logs()
+        self.flush_latest_values()
+        self.flush_tsdb_points()
+
+    def execute(self):
+        """
+        处理整批消息，连接故障后可再次调用继续处理
+        """
+        self.parse()
+        self.flush()
+
+
+class UpMsgBatcher(object):
+    """
+    上行消息微批处理器，在独立线程中按条数/时间窗口聚合消息
+    """
+
+    def __init__(self, batch_size=ISW_BATCH_SIZE, interval_ms=ISW_BATCH_INTERVAL_MS,
+                 tsdb_write=ISW_BATCH_TSDB_WRITE, msg_queue=None):
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self.msg_queue = msg_queue if msg_queue is not None else queue.Queue()
+        self.tsdb_client = DatabaseFactory.get_client(settings.TSDB_TYPE, logger=logger) if tsdb_write else None
+        self._thread = None
+        self._failures = 0
+
+    def put(self, topic, msg_str):
+        self.msg_queue.put((topic, msg_str))
+
+    def next_batch(self):
+        """
+        阻塞获取下一批消息
+        """
+        messages = [self.msg_queue.get()]
+        deadline = time.monotonic() + self.interval
+        while len(messages) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                messages.append(self.msg_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return messages
+
+    def process_batch(self, messages):
+        close_old_connections()
+        start = time.monotonic()
+        batch = UpMsgBatch(messages, tsdb_client=self.tsdb_client)
+        while True:
+            try:
+                batch.execute()
+                self._failures = 0
+            except CONNECTION_ERRORS as err:
+                self.on_connection_error(messages, err)
+                continue
+            except Exception as err:
+                logger.error(f'isw_adapter 批量处理失败: {err}')
+                logger.error(traceback.format_exc())
+            break
+        logger.debug(f'isw_adapter batch size: {len(messages)}, cost: {time.monotonic() - start:.3f}s')
+
+    def on_connection_error(self, messages, err):
+        """
+        数据库/redis 不可用时退避重连，之后由 process_batch 从失败处继续处理该批次
+        """
+        self._failures += 1
+        backoff = min(2 ** (self._failures - 1), MAX_BACKOFF)
+        logger.error(f'isw_adapter 连接失败, {len(messages)} 条消息的批次 {backoff}s 后继续处理: {err}')
+        connections.close_all()
+        time.sleep(backoff)
+
+    def task_done(self, count):
+        """
+        通知有界队列消息已处理，溢出文件中的消息全部处理后才删除该文件
+        """
+        if isinstance(self.msg_queue, BoundedIngestQueue):
+            self.msg_queue.task_done(count)
+
+    def run(self):
+        while True:
+            messages = self.next_batch()
+            self.process_batch(messages)
+            self.task_done(len(messages))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='isw_adapter_batcher', daemon=True)
+        self._thread.start()
+
+
+class BatchMQTTUpServer(MQTTUpServer):
+    """
+    接收 Isw 设备上行数据后交由微批处理器处理
+    """
+
+    def __init__(self, *args, batcher=None, **kwargs):
+        self.batcher = batcher
+        super().__init__(*args, **kwargs)
+
+    def on_message(self, client, user_data, msg):
+        try:
+            self.batcher.put(msg.topic, msg.payload.decode())
+        except Exception as err:
+            logger.error(f'topic <<{msg.topic}>> 消息入队失败: {err}')
+            logger.error(traceback.format_exc())
+
+
+class BatchIswUpServe(IswUpServe):
+    """
+    isw网关上行数据处理(微批模式)
+    """
+
+    @staticmethod
+    def start_receiver_server():
+        """
+        启动批处理器及 mqtt server
+        :return:
+        """
+        exit_on_sigterm()
+        msg_queue = BoundedIngestQueue()
+        msg_queue.start_monitor()
+        batcher = UpMsgBatcher(msg_queue=msg_queue)
+        batcher.start()
+        client = BatchMQTTUpServer(
+            client_id=f'isw_adapter_{int(time.time() * 1000)}',
+            logger=logger,
+            batcher=batcher,
+            **ISW_MQTT_DATA
+        )
+        client.loop_forever()
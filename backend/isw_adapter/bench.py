@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+isw_adapter 上行处理微基准测试
+
+用法:
+    python bench.py router [-n 200000]
+    python bench.py decode [-n 200000]
+    python bench.py ingest [-n 20000] [--devices 100] [--mode legacy|batch] [--device-types iot_breaker,...]
+
+ingest 在本地 Postgres/redis 上离线运行，时序数据库使用内存实现:
+    1. 为每种设备类型创建 --devices 台测试设备并写入设备缓存
+    2. 生成 -n 条上行消息(属性上报为主，少量上下线)，逐条交给 ParseUpMsg (legacy) 或按 ISW_BATCH_SIZE 交给 UpMsgBatch (batch)，
+       与 isw_adapter 相同在自动提交模式下逐条/逐批提交，on_commit 回调(缓存失效等)照常执行
+    3. 输出 msgs/s、端到端延迟 p50/p99、每条消息的数据库查询次数及时序数据点写入速率
+    4. 删除测试项目下的数据(含上次异常退出遗留的数据)、测试设备缓存及属性最新值
+batch 模式始终写入时序数据库，延迟为消息进入批次到批次处理完成的时间，不含攒批等待时间。
+"""
+import argparse
+import itertools
+import json
+import random
+import time
+import timeit
+
+import _setup_django
+from django.db import connection
+
+from backend.apps.equipments.biz.device_cache import (
+    set_many_device_info_cache, set_many_category_info_cache, del_many_device_info_cache, del_many_category_info_cache
+)
+from backend.apps.equipments.biz.latest_value_store import del_many_latest_values
+from backend.apps.equipments.models import Device, DeviceCategory, CategoryModeMapping, EZtProjects
+from backend.apps.projects.models import Projects
+from backend.isw_adapter.batch_ingest import UpMsgBatch
+from backend.isw_adapter.category_cfg import CATEGORY_CLASS_MAP
+from backend.isw_adapter.ingest_config import ISW_BATCH_SIZE
+from backend.isw_adapter.payload_decoder import get_schema, to_int, to_bool, to_str
+from backend.isw_adapter.up_server import ParseUpMsg
+from backend.isw_adapter.topic_router import TopicRouter, CategoryHandlerRegistry
+
+BENCH_TOPICS = [
+    'open/PR_bench/meter_0001/attributes',
+    'open/PR_bench/breaker_0001/attributes',
+    'open/PR_bench/meter_0001/online',
+    'open/PR_bench/breaker_0001/event_report',
+]
+BENCH_CATEGORIES = [
+    {'id': 1, 'device_types': ['prepaid_electric_meter']},
+    {'id': 2, 'device_types': ['iot_breaker']},
+]
+
+# 现场记录的上报数据
+RECORDED_PAYLOADS = {
+    'iot_breaker': (
+        '{"state":1,"state_sub":0,"cmd_switch":0,"cmd_trip":0,"cmd_lock":0,"cmd_force_state":0,'
+        '"cmd_leakage_test":0,"cmd_clr_bat":0,"hz":50.02,"ma":3.1,"rated_u":220,"rated_i":63,'
+        '"ua":220.43,"ub":221.07,"uc":219.86,"ia":12.41,"ib":10.93,"ic":11.58,"epi":15872.36,'
+        '"p":7.92,"pa":2.71,"pb":2.38,"pc":2.53,"limit_p":40,"qa":0.31,"qb":0.27,"qc":0.29,'
+        '"pf":0.98,"pfa":0.99,"pfb":0.97,"pfc":0.98,"sa":2.74,"sb":2.41,"sc":2.55,'
+        '"t01":38.5,"t02":36.7,"t03":37.2,"t04":35.9,"t_alarm":0,"t_log":[],"gl_alarm":0,"gl_log":[],'
+        '"qy_alarm":0,"qy_log":[],"gy_alarm":0,"gy_log":[],"ld_alarm":0,"ld_log":[],"dl_alarm":0,"dl_log":[]}'
+    ),
+    'prepaid_electric_meter': (
+        '{"state":1,"epi":"2385.17","top_epi":"312.40","on_peak_epi":"804.25","flat_epi":"736.02",'
+        '"valley_epi":"450.11","deep_valley_epi":"82.39"}'
+    ),
+}
+
+BENCH_PROJECT_KEY = 'PR_bench'
+BENCH_PROJECT_NAME = 'isw_adapter bench'
+BENCH_DEVICE_TYPES = [
+    'iot_breaker', 'prepaid_electric_meter', 'personnel_sensor', 'environment_monitor', 'light_monitor',
+]
+# 上下线消息占比
+ONLINE_MSG_RATIO = 0.02
+
+
+class MemoryTSDBClient(object):
+    """
+    内存时序数据库，只记录写入的数据点
+    """
+
+    def __init__(self):
+        self.stores = {}
+
+    @property
+    def points(self):
+        return sum(len(data_points) for data_points in self.stores.values())
+
+    def write_data(self, store=None, measurement=None, fields=None, tags=None, timestamp=None):
+        self.write_multiple_data(
+            store, [{'measurement': measurement, 'fields': fields, 'tags': tags, 'timestamp': timestamp}]
+        )
+
+    def write_multiple_data(self, store, data_points):
+        self.stores.setdefault(store, []).extend(data_points)
+
+
+def jitter(value, rng, pct=2):
+    return round(value * (1 + rng.uniform(-pct, pct) / 100), 2)
+
+
+def gen_recorded(device_type):
+    """
+    在现场记录数据基础上对数值加扰动
+    """
+    recorded = json.loads(RECORDED_PAYLOADS[device_type])
+
+    def generate(rng):
+        msg = {}
+        for key, value in recorded.items():
+            if isinstance(value, float):
+                value = jitter(value, rng)
+            elif isinstance(value, str) and value.replace('.', '', 1).isdigit():
+                value = str(jitter(float(value), rng))
+            msg[key] = value
+        return msg
+
+    return generate
+
+
+def gen_personnel_sensor(rng):
+    return {'status': rng.choice(['0', '1'])}
+
+
+def gen_environment_monitor(rng):
+    return {
+        'temperature': round(rng.uniform(15, 35), 1),
+        'humidity': round(rng.uniform(20, 90), 1),
+        'pm25': rng.randint(5, 150),
+        'co2': rng.randint(400, 2000),
+    }
+
+
+def gen_light_monitor(rng):
+    msg = {}
+    for i in range(1, 17):
+        state = rng.randint(0, 1)
+        msg.update({f'state{i}': state, f'brightness{i}': rng.randint(0, 100) if state else 0})
+    return msg
+
+
+def gen_from_schema(device_type):
+    """
+    按设备模型上报数据结构随机生成
+    """
+    schema = get_schema(device_type)
+    generators = {
+        to_int: lambda rng: rng.randint(0, 1),
+        to_bool: lambda rng: rng.random() < 0.5,
+        to_str: lambda rng: str(rng.randint(0, 9)),
+        float: lambda rng: round(rng.uniform(0, 500), 2),
+    }
+    attrs = {key: generators[attr[0]] for key, attr in schema.attrs.items() if attr[0] in generators}
+
+    def generate(rng):
+        return {key: generator(rng) for key, generator in attrs.items()}
+
+    return generate
+
+
+PAYLOAD_GENERATORS = {
+    'iot_breaker': gen_recorded('iot_breaker'),
+    'prepaid_electric_meter': gen_recorded('prepaid_electric_meter'),
+    'personnel_sensor': gen_personnel_sensor,
+    'environment_monitor': gen_environment_monitor,
+    'light_monitor': gen_light_monitor,
+}
+
+
+def get_payload_generator(device_type):
+    if device_type not in PAYLOAD_GENERATORS:
+        PAYLOAD_GENERATORS[device_type] = gen_from_schema(device_type)
+    return PAYLOAD_GENERATORS[device_type]
+
+
+def create_bench_devices(device_types, devices):
+    """
+    创建测试设备及设备模型数据
+    :return: ([DeviceCategory, ...], {device_type: [Device, ...]})
+    """
+    project = Projects.objects.create(name=BENCH_PROJECT_NAME)
+    ezt_project, _ = EZtProjects.objects.get_or_create(project_key=BENCH_PROJECT_KEY)
+    categories, device_map = [], {}
+    for i, device_type in enumerate(device_types):
+        category = DeviceCategory.objects.create(
+            project=project, ezt_project=ezt_project, key=f'K_BENCH_{i}',
+            category_id=f'bench_{device_type}', category_name=device_type,
+        )
+        CategoryModeMapping.objects.create(category=category, device_type=device_type)
+        Device.objects.bulk_create([
+            Device(project=project, category=category, username=f'bench_{device_type}_{n:05d}', name=device_type)
+            for n in range(devices)
+        ])
+        device_objs = list(Device.objects.filter(category=category).select_related('category'))
+        model_class = CATEGORY_CLASS_MAP[device_type].model_class
+        model_class.objects.bulk_create([model_class(device=device_obj) for device_obj in device_objs])
+        categories.append(category)
+        device_map[device_type] = device_objs
+    return categories, device_map
+
+
+def delete_bench_devices():
+    """
+    删除测试项目、设备及上报产生的数据，清除其设备缓存及属性最新值
+    """
+    projects = Projects.objects.filter(name=BENCH_PROJECT_NAME)
+    usernames = list(Device.objects.filter(project__in=projects).values_list('username', flat=True))
+    category_ids = list(DeviceCategory.objects.filter(project__in=projects).values_list('id', flat=True))
+    Device.objects.filter(project__in=projects).delete()
+    CategoryModeMapping.objects.filter(category_id__in=category_ids).delete()
+    DeviceCategory.objects.filter(id__in=category_ids).delete()
+    projects.delete()
+    EZtProjects.objects.filter(project_key=BENCH_PROJECT_KEY).delete()
+    del_many_device_info_cache(usernames)
+    del_many_latest_values(usernames)
+    del_many_category_info_cache(category_ids)
+
+
+def generate_traffic(device_map, number, seed=0):
+    """
+    生成上行消息，设备轮流上报
+    :return: [(topic, msg_str), ...]
+    """
+    rng = random.Random(seed)
+    devices = [
+        (device_obj.username, get_payload_generator(device_type))
+        for device_objs in itertools.zip_longest(*device_map.values())
+        for device_type, device_obj in zip(device_map, device_objs) if device_obj is not None
+    ]
+    messages = []
+    for i in range(number):
+        username, generate = devices[i % len(devices)]
+        if rng.random() < ONLINE_MSG_RATIO:
+            topic, msg = f'open/{BENCH_PROJECT_KEY}/{username}/online', {'online': rng.random() < 0.5}
+        else:
+            topic, msg = f'open/{BENCH_PROJECT_KEY}/{username}/attributes', generate(rng)
+        messages.append((topic, json.dumps(msg)))
+    return messages
+
+
+class QueryCounter(object):
+    """
+    数据库查询计数
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def run_legacy(messages, tsdb_client):
+    latencies = []
+    for topic, msg_str in messages:
+        start = time.perf_counter()
+        ParseUpMsg(topic, msg_str).parse_msg()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_batch(messages, tsdb_client, batch_size=ISW_BATCH_SIZE):
+    latencies = []
+    for i in range(0, len(messages), batch_size):
+        batch = messages[i:i + batch_size]
+        start = time.perf_counter()
+        UpMsgBatch(batch, tsdb_client=tsdb_client).execute()
+        latencies.extend([time.perf_counter() - start] * len(batch))
+    return latencies
+
+
+INGEST_MODES = {
+    'legacy': run_legacy,
+    'batch': run_batch,
+}
+
+
+def bench_ingest(number, devices=100, mode='batch', device_types=None):
+    """
+    上行消息处理吞吐量
+    """
+    device_types = device_types or BENCH_DEVICE_TYPES
+    delete_bench_devices()
+    try:
+        categories, device_map = create_bench_devices(device_types, devices)
+        set_many_category_info_cache(categories)
+        set_many_device_info_cache([device_obj for device_objs in device_map.values() for device_obj in device_objs])
+        messages = generate_traffic(device_map, number)
+        tsdb_client, counter = MemoryTSDBClient(), QueryCounter()
+        # 不包在事务中: 与 isw_adapter 相同逐条/逐批提交
+        with connection.execute_wrapper(counter):
+            start = time.perf_counter()
+            latencies = INGEST_MODES[mode](messages, tsdb_client)
+            seconds = time.perf_counter() - start
+    finally:
+        delete_bench_devices()
+    latencies.sort()
+    print(f'mode: {mode}, device types: {len(device_types)}, devices: {devices * len(device_types)}, msgs: {number}')
+    print(f'{"throughput":<20} {number / seconds:>12,.0f} msgs/s')
+    print(f'{"latency p50":<20} {percentile(latencies, 50) * 1e3:>12.3f} ms')
+    print(f'{"latency p99":<20} {percentile(latencies, 99) * 1e3:>12.3f} ms')
+    print(f'{"db queries":<20} {counter.count / number:>12.2f} /msg')
+    print(f'{"tsdb points":<20} {tsdb_client.points / seconds:>12,.0f} points/s')
+
+
+def report(name, number, seconds):
+    print(f'{name:<36} {number / seconds:>14,.0f} ops/s {seconds / number * 1e9:>10.1f} ns/op')
+
+
+def bench_router(number):
+    """
+    对比 parse_topic + PARSE_FUNC + getattr + CATEGORY_CLASS_MAP 与预编译路由表的分发开销
+    """
+    router = TopicRouter(ParseUpMsg)
+    registry = CategoryHandlerRegistry(
+        loader=lambda: [(c['id'], dt) for c in BENCH_CATEGORIES for dt in c['device_types']]
+    )
+    registry.build()
+    samples = [(topic, BENCH_CATEGORIES[i % len(BENCH_CATEGORIES)]) for i, topic in enumerate(BENCH_TOPICS)]
+
+    def legacy():
+        for topic, category_info in samples:
+            obj = ParseUpMsg(topic, '')
+            getattr(obj, obj.PARSE_FUNC[obj.parse_topic()])
+            [CATEGORY_CLASS_MAP[dt] for dt in category_info['device_types'] if dt in CATEGORY_CLASS_MAP]
+
+    def routed():
+        for topic, category_info in samples:
+            router.route(topic)
+            registry.get_handlers(category_info)
+
+    total = number * len(samples)
+    report('getattr dispatch', total, timeit.timeit(legacy, number=number))
+    report('precompiled router', total, timeit.timeit(routed, number=number))
+
+
+def bench_decode(number):
+    """
+    对比 json.loads + 逐个遍历 ATTR_MAP 与按模型生成的解码器
+    """
+    for device_type, msg_str in RECORDED_PAYLOADS.items():
+        schema = get_schema(device_type)
+        attr_keys = list(schema.attrs)
+
+        def legacy():
+            msg = json.loads(msg_str)
+            return {key: msg[key] for key in attr_keys if key in msg}
+
+        def typed():
+            return schema.decode(msg_str)
+
+        report(f'{device_type} json+walk', number, timeit.timeit(legacy, number=number))
+        report(f'{device_type} typed', number, timeit.timeit(typed, number=number))
+
+
+BENCHES = {
+    'router': bench_router,
+    'decode': bench_decode,
+    'ingest': bench_ingest,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='isw_adapter 微基准测试')
+    parser.add_argument('bench', choices=sorted(BENCHES))
+    parser.add_argument('-n', '--number', type=int, default=None, help='重复次数(ingest 为消息数)')
+    parser.add_argument('--devices', type=int, default=100, help='ingest: 每种设备类型的设备数')
+    parser.add_argument('--mode', choices=sorted(INGEST_MODES), default='batch', help='ingest: 处理方式')
+    parser.add_argument('--device-types', default=','.join(BENCH_DEVICE_TYPES), help='ingest: 设备类型，逗号分隔')
+    args = parser.parse_args()
+    if args.bench == 'ingest':
+        bench_ingest(
+            args.number or 20000, devices=args.devices, mode=args.mode, device_types=args.device_types.split(',')
+        )
+    else:
+        BENCHES[args.bench](args.number or 200000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+设备模型处理类扩展
+
+替换 CATEGORY_CLASS_MAP 中的部分处理类，逐条、批处理、分片及 asyncio 模式均使用替换后的处理类
+默认的逐条模式由 celery worker(isw_adapter_parse_msg)解析上报，worker 启动时按 celery_app.conf.imports 导入本模块
+"""
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from backend.apps.air_servers.biz.auto_off_scheduler import AIR_AUTO_OFF_SCHEDULER_ENABLED, schedule_auto_off, \
+    cancel_auto_off
+from backend.apps.air_servers.biz.occupancy import update_sensor_occupancy
+from backend.apps.air_servers.models import CentralAirConditioner
+from backend.apps.device_models.biz.json_merge import supports_jsonb_merge, merge_json_field
+from backend.apps.device_models.models import EnvironmentMonitor
+from backend.apps.el_prepayment_servers.biz.billing import PREPAID_BILLING_WINDOW, bill_report
+from backend.isw_adapter.category_cfg import CATEGORY_CLASS_MAP
+from backend.isw_adapter.category_manages import PersonnelSensorManage as BasePersonnelSensorManage, \
+    PrepaidElectricMeterManage as BasePrepaidElectricMeterManage, \
+    EnvironmentMonitorManage as BaseEnvironmentMonitorManage
+
+logger = settings.ISW_ADAPTER_LOGGER
+
+
+class PersonnelSensorManage(BasePersonnelSensorManage):
+    """
+    人体存在感应传感器 数据处理类
+    分组是否有人由 redis 占用计数得出，不再查询分组内所有传感器
+    无人自动关闭由 redis 有序集合调度，不再为每台空调创建定时任务
+    """
+
+    def open_auto_off_task(self, air_conditioner_qs):
+        """
+        开启无人自动关闭
+        :param air_conditioner_qs: 分组内启用无人自动关闭的中央空调
+        :return:
+        """
+        if not AIR_AUTO_OFF_SCHEDULER_ENABLED:
+            return super().open_auto_off_task(air_conditioner_qs)
+        count = schedule_auto_off(air_conditioner_qs)
+        logger.info(f'开启无人自动关闭, 空调数量: {count}')
+
+    @staticmethod
+    def close_auto_off_task(air_conditioner_qs):
+        """
+        关闭无人自动关闭
+        :param air_conditioner_qs: 分组内启用无人自动关闭的中央空调
+        :return:
+        """
+        if not AIR_AUTO_OFF_SCHEDULER_ENABLED:
+            return BasePersonnelSensorManage.close_auto_off_task(air_conditioner_qs)
+        count = cancel_auto_off(air_conditioner_qs)
+        logger.info(f'关闭无人自动关闭, 空调数量: {count}')
+
+    def check_group_state(self, group_id, group_old_state, status):
+        """
+        检查人员状态
+        :param group_id: 传感器所在分组
+        :param group_old_state: 传感器所在分组 状态
+        :param status: 传感器 状态
+        :return:
+        """
+        try:
+            old_state, group_state = update_sensor_occupancy(group_id, self.device_id, status)
+        except RedisError as err:
+            logger.error(f'分组占用计数更新失败, 改为查询数据库: {err}')
+            return super().check_group_state(group_id, group_old_state, status)
+        if old_state is None:
+            old_state = group_old_state
+        logger.info(f'group_id: {group_id}, group_old_state: {old_state}, group_state: {group_state}, status: {status}')
+        if old_state == group_state:
+            return
+        air_conditioner_qs = CentralAirConditioner.objects.filter(group_id=group_id, is_auto_off=True)
+        if group_state:
+            self.close_auto_off_task(air_conditioner_qs)
+        else:
+            self.open_auto_off_task(air_conditioner_qs)
+
+
+class PrepaidElectricMeterManage(BasePrepaidElectricMeterManage):
+    """
+    预付费电表 数据处理类
+    码值变化计入结算窗口批量结算，不再每次上报锁定电表余额
+    """
+
+    def parse_el_meter_data(self, obj, msg_data: dict):
+        """
+        解析电表数据
+        """
+        if not PREPAID_BILLING_WINDOW:
+            return super().parse_el_meter_data(obj, msg_data)
+        try:
+            handled = bill_report(obj, msg_data)
+        except (RedisError, TypeError, ValueError) as err:
+            logger.error(f'预付费电表结算窗口写入失败, 改为逐条结算: {err}')
+            handled = False
+        if not handled:
+            return super().parse_el_meter_data(obj, msg_data)
+
+
+class EnvironmentMonitorManage(BaseEnvironmentMonitorManage):
+    """
+    环境系统设备 数据处理类
+    上报属性在数据库中合并到 up_attr_data，不再读出整个 JSON 后整体写回
+    """
+
+    def parse_data_report(self):
+        """
+        解析设备定时上报数据
+        """
+        if not isinstance(self.msg, dict) or not supports_jsonb_merge():
+            return super().parse_data_report()
+        merge_json_field(EnvironmentMonitor.objects.filter(device_id=self.device_id), 'up_attr_data', self.msg)
+
+
+CATEGORY_CLASS_MAP['personnel_sensor'] = PersonnelSensorManage
+CATEGORY_CLASS_MAP['prepaid_electric_meter'] = PrepaidElectricMeterManage
+CATEGORY_CLASS_MAP['environment_monitor'] = EnvironmentMonitorManage
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+isw_adapter 上行数据处理配置
+"""
+from backend.isw_adapter.isw_adapter_config import env, BACKEND_PATH
+
+# 上行数据微批处理: 满 ISW_BATCH_SIZE 条或距批次首条消息超过 ISW_BATCH_INTERVAL_MS 毫秒即处理一批
+ISW_BATCH_ENABLED = env.bool('ISW_BATCH_ENABLED', default=False)
+ISW_BATCH_SIZE = env.int('ISW_BATCH_SIZE', default=500)
+ISW_BATCH_INTERVAL_MS = env.int('ISW_BATCH_INTERVAL_MS', default=200)
+# 是否由 isw_adapter 将属性上报数据批量写入时序数据库
+ISW_BATCH_TSDB_WRITE = env.bool('ISW_BATCH_TSDB_WRITE', default=False)
+# 是否将属性上报数据写入设备属性最新值存储(redis hash)，供列表类接口读取
+ISW_LATEST_VALUE_ENABLED = env.bool('ISW_LATEST_VALUE_ENABLED', default=True)
+
+# 多进程分片处理: 工作进程数，为 0 时不启用; 队列深度上报间隔(秒)
+ISW_WORKER_PROCESSES = env.int('ISW_WORKER_PROCESSES', default=0)
+ISW_WORKER_REPORT_INTERVAL = env.int('ISW_WORKER_REPORT_INTERVAL', default=60)
+
+# 上行消息有界队列(微批处理模式，多进程分片模式下每个工作进程一个): 队列长度上限; 队列满时的处理策略 block/drop_oldest/spill; 溢出文件目录
+ISW_QUEUE_MAX_SIZE = env.int('ISW_QUEUE_MAX_SIZE', default=100000)
+ISW_QUEUE_OVERFLOW_POLICY = env.str('ISW_QUEUE_OVERFLOW_POLICY', default='block')
+ISW_QUEUE_SPILL_DIR = env.str('ISW_QUEUE_SPILL_DIR', default='') or BACKEND_PATH('isw_adapter/spill')
+
+# asyncio 处理模式: 是否启用; 处理通道数(按设备分通道，通道间并发); 解析及写库线程池大小
+ISW_ASYNC_ENABLED = env.bool('ISW_ASYNC_ENABLED', default=False)
+ISW_ASYNC_LANES = env.int('ISW_ASYNC_LANES', default=4)
+ISW_ASYNC_EXECUTOR_WORKERS = env.int('ISW_ASYNC_EXECUTOR_WORKERS', default=8)
+
+# 告警通知合并: 告警状态变化立即推送，同一设备同一告警规则在 ISW_ALARM_COALESCE_WINDOW 秒内的重复告警合并为一条汇总通知，为 0 时不合并
+ISW_ALARM_COALESCE_WINDOW = env.int('ISW_ALARM_COALESCE_WINDOW', default=0)
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+isw 上行消息有界队列
+
+MQTT 回调线程与解析/写库线程之间的有界队列，队列满时按 ISW_QUEUE_OVERFLOW_POLICY 处理:
+    block: 阻塞 MQTT 回调线程，由 MQTT 连接反压
+    drop_oldest: 丢弃最早的消息
+    spill: 写入本地追加文件，此后的消息也追加到溢出文件，直到溢出文件全部回放，保证消息按到达顺序处理
+溢出文件在处理线程取空内存队列时按顺序读回，处理线程只在上一批写入成功后取消息，
+数据库/redis 故障期间不会回放(故障批次由处理线程原地重试，见 batch_ingest)。
+处理线程处理完消息后调用 task_done，溢出文件中的消息全部处理后才删除该文件，
+进程在回放期间退出时，重启后重新回放整个文件(已处理的消息会重复处理)。
+进程正常退出(包括 exit_on_sigterm 处理的 SIGTERM)时，内存队列中未处理的消息写入溢出文件，重启后回放。
+"""
+import atexit
+import collections
+import glob
+import json
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+from backend.isw_adapter.ingest_config import (
+    ISW_QUEUE_MAX_SIZE, ISW_QUEUE_OVERFLOW_POLICY, ISW_QUEUE_SPILL_DIR, ISW_WORKER_REPORT_INTERVAL
+)
+
+logger = settings.ISW_ADAPTER_LOGGER
+
+POLICY_BLOCK = 'block'
+POLICY_DROP_OLDEST = 'drop_oldest'
+POLICY_SPILL = 'spill'
+OVERFLOW_POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_SPILL)
+
+SPILL_FILE_NAME = 'isw_adapter_{}.spill'
+REPLAY_SUFFIX = '.replaying'
+# 每次从溢出文件读回内存队列的消息数
+REPLAY_CHUNK_SIZE = 1000
+# 溢出文件写入缓冲的消息数，进程异常终止时最多丢失这么多条溢出消息
+SPILL_FLUSH_SIZE = 100
+
+
+class SpillFile(object):
+    """
+    溢出消息追加文件，每行一条 json: [topic, msg_str]
+    文件句柄在改名回放前保持打开，每 flush_size 条消息写入一次
+    """
+
+    def __init__(self, spill_dir=ISW_QUEUE_SPILL_DIR, flush_size=SPILL_FLUSH_SIZE):
+        self.spill_dir = spill_dir
+        self.flush_size = flush_size
+        os.makedirs(spill_dir, exist_ok=True)
+        self.path = os.path.join(spill_dir, SPILL_FILE_NAME.format(os.getpid()))
+        self._lock = threading.Lock()
+        self._stamp = 0
+        self._file = None
+        self._unflushed = 0
+        # 已交给队列回放的文件，回放完成前仍在目录中
+        self._taken = set()
+
+    @staticmethod
+    def encode(messages):
+        return ''.join(json.dumps(message, ensure_ascii=False) + '\n' for message in messages).encode()
+
+    def append(self, messages):
+        """
+        追加消息
+        :param messages: [(topic, msg_str), ...]
+        :return: 写入字节数
+        """
+        data = self.encode(messages)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'ab')
+            self._file.write(data)
+            self._unflushed += len(messages)
+            if self._unflushed >= self.flush_size:
+                self._file.flush()
+                self._unflushed = 0
+        return len(data)
+
+    def _close(self):
+        """
+        写入缓冲并关闭追加文件(需持有文件锁)
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._unflushed = 0
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def save(self, messages):
+        """
+        保存早于追加文件中消息的消息(进程退出时内存队列中的消息)，重启后先于追加文件回放
+        :param messages: [(topic, msg_str), ...]
+        """
+        with self._lock:
+            self._close()
+            path = self._new_replay_path()
+            with open(path, 'wb') as f:
+                f.write(self.encode(messages))
+            if os.path.exists(self.path):
+                # 遗留文件按修改时间回放，修改时间设为追加文件之前
+                mtime = os.stat(self.path).st_mtime_ns - 1
+                os.utime(path, ns=(mtime, mtime))
+
+    @staticmethod
+    def is_orphan(path):
+        """
+        文件所属进程已退出
+        """
+        pid = int(os.path.basename(path).split('_')[-1].split('.')[0])
+        if pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+        return False
+
+    def take_pending(self):
+        """
+        将已退出进程遗留的及本进程的溢出文件依次改名为待回放文件，此后的溢出写入新文件
+        :return: [path, ...] 未回放过的待回放文件，按写入先后排序
+        """
+        orphans = [path for path in glob.glob(os.path.join(self.spill_dir, SPILL_FILE_NAME.format('*') + '*'))
+                   if self.is_orphan(path)]
+        # 遗留文件早于本进程的溢出文件，按修改时间依次改名，时间戳递增保证回放顺序
+        for path in sorted(orphans, key=lambda path: (os.stat(path).st_mtime_ns, path)):
+            os.rename(path, self._new_replay_path())
+        with self._lock:
+            self._close()
+            if os.path.exists(self.path):
+                os.rename(self.path, self._new_replay_path())
+            # 包括 pid 相同的已退出进程遗留的待回放文件
+            pending = sorted(set(glob.glob(self.path + '.*' + REPLAY_SUFFIX)) - self._taken)
+            self._taken.update(pending)
+        return pending
+
+    def _new_replay_path(self):
+        """
+        新的待回放文件名，时间戳递增且不与已有文件重名
+        """
+        while True:
+            self._stamp = max(self._stamp + 1, int(time.time() * 1000))
+            path = f'{self.path}.{self._stamp}{REPLAY_SUFFIX}'
+            if not os.path.exists(path):
+                return path
+
+    @staticmethod
+    def read(path):
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    topic, msg_str = json.loads(line)
+                except ValueError:
+                    continue
+                yield topic, msg_str
+
+
+class BoundedIngestQueue(object):
+    """
+    有界消息队列，接口与 queue.Queue 的 put/get/qsize/task_done 一致
+    """
+
+    def __init__(self, maxsize=ISW_QUEUE_MAX_SIZE, policy=ISW_QUEUE_OVERFLOW_POLICY, spill_dir=ISW_QUEUE_SPILL_DIR,
+                 replay_chunk_size=REPLAY_CHUNK_SIZE):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'ISW_QUEUE_OVERFLOW_POLICY only can be one of {OVERFLOW_POLICIES}')
+        self.maxsize = maxsize
+        self.policy = policy
+        self.replay_chunk_size = replay_chunk_size
+        self.spill_file = SpillFile(spill_dir)
+        self._queue = collections.deque()
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._not_full = threading.Condition(self._mutex)
+        # 溢出文件中有待回放的消息，此时新消息同样写入溢出文件
+        self._spilling = False
+        self._replay_paths = collections.deque()
+        self._replay_path = None
+        self._replay_reader = None
+        self._replay_start = 0.0
+        self._replay_count = 0
+        # 消息按进入内存队列的顺序编号: 已进入、已取出、已处理(task_done 及丢弃)的消息数
+        self._appended = 0
+        self._popped = 0
+        self._done = 0
+        # 最后一条从溢出文件读回的消息编号，及已读完待删除的溢出文件 [(path, 最后一条消息编号), ...]
+        self._replayed_end = 0
+        self._finished_paths = collections.deque()
+        self._stopped = False
+        self.metrics = {
+            'put': 0,
+            'dropped': 0,
+            'spilled': 0,
+            'spill_bytes': 0,
+            'replayed': 0,
+        }
+        self._replay_rate = 0.0
+        # 历史进程遗留的溢出文件先于新消息处理
+        self._replay_paths.extend(self.spill_file.take_pending())
+        self._spilling = bool(self._replay_paths)
+        atexit.register(self.stop)
+
+    def qsize(self):
+        return len(self._queue)
+
+    def put(self, item):
+        """
+        :param item: (topic, msg_str)
+        """
+        with self._not_full:
+            if not self._spilling and len(self._queue) >= self.maxsize:
+                if self.policy == POLICY_DROP_OLDEST:
+                    self._queue.popleft()
+                    self._popped += 1
+                    self._done += 1
+                    self.metrics['dropped'] += 1
+                elif self.policy == POLICY_BLOCK:
+                    while not self._spilling and len(self._queue) >= self.maxsize:
+                        self._not_full.wait()
+                else:
+                    self._spilling = True
+            if self._spilling:
+                # 持有队列锁写文件，保证溢出的消息与回放按同一顺序
+                self._spill([item])
+            else:
+                self._queue.append(item)
+                self._appended += 1
+                self.metrics['put'] += 1
+            self._not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        with self._not_empty:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                if not self._queue and self._spilling and not self._stopped:
+                    self._replay()
+                if self._queue:
+                    break
+                if not block:
+                    raise queue.Empty
+                if deadline is None:
+                    self._not_empty.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    self._not_empty.wait(remaining)
+            item = self._queue.popleft()
+            self._popped += 1
+            self._not_full.notify()
+            return item
+
+    def task_done(self, count=1):
+        """
+        通知队列已处理取出的消息，溢出文件中的消息全部处理后删除该文件
+        :param count: 按取出顺序已处理的消息数
+        """
+        with self._mutex:
+            self._done += count
+            while self._finished_paths and self._finished_paths[0][1] <= self._done:
+                path, _ = self._finished_paths.popleft()
+                os.remove(path)
+
+    def stop(self):
+        """
+        将内存队列中未处理的消息写入溢出文件，重启后回放(进程退出时调用)
+        此后的消息直接写入溢出文件，不再回放
+        """
+        with self._mutex:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._spilling = True
+            # 内存队列前部从溢出文件读回的消息仍保存在未删除的溢出文件中
+            replayed = min(max(self._replayed_end - self._popped, 0), len(self._queue))
+            pending = list(self._queue)[replayed:]
+            self._queue.clear()
+            try:
+                if pending:
+                    self.spill_file.save(pending)
+                    logger.info(f'isw_adapter 退出前保存内存队列消息: {len(pending)}')
+                self.spill_file.close()
+            except OSError as err:
+                logger.error(f'isw_adapter 退出前保存内存队列消息失败, 消息数: {len(pending)}, err: {err}')
+
+    def _spill(self, messages):
+        """
+        写入溢出文件，等待回放(需持有队列锁)
+        :param messages: [(topic, msg_str), ...]
+        """
+        self.metrics['spill_bytes'] += self.spill_file.append(messages)
+        self.metrics['spilled'] += len(messages)
+        if self._stopped:
+            # 进程正在退出，不再等待批量写入
+            self.spill_file.close()
+
+    def _replay(self):
+        """
+        内存队列取空后从溢出文件按顺序读回下一段消息(需持有队列锁)
+        溢出文件全部回放后，新消息恢复直接进入内存队列
+        """
+        while len(self._queue) < self.replay_chunk_size:
+            if self._replay_reader is None:
+                if not self._replay_paths:
+                    self._replay_paths.extend(self.spill_file.take_pending())
+                if not self._replay_paths:
+                    self._spilling = False
+                    return
+                self._replay_path = self._replay_paths.popleft()
+                self._replay_reader = self.spill_file.read(self._replay_path)
+                self._replay_start, self._replay_count = time.monotonic(), 0
+            item = next(self._replay_reader, None)
+            if item is None:
+                # 文件中的消息全部处理后由 task_done 删除
+                self._replay_reader = None
+                self._finished_paths.append((self._replay_path, self._appended))
+                if self._appended <= self._done:
+                    self._finished_paths.pop()
+                    os.remove(self._replay_path)
+                self._replay_rate = self._replay_count / max(time.monotonic() - self._replay_start, 1e-6)
+                logger.info(f'isw_adapter 溢出文件回放完成: {self._replay_path}, 消息数: {self._replay_count}')
+                continue
+            self._queue.append(item)
+            self._appended += 1
+            self._replayed_end = self._appended
+            self._replay_count += 1
+            self.metrics['replayed'] += 1
+
+    def monitor(self, interval):
+        while True:
+            time.sleep(interval)
+            self.log_metrics()
+
+    def start_monitor(self, interval=ISW_WORKER_REPORT_INTERVAL):
+        threading.Thread(target=self.monitor, args=(interval,), name='isw_adapter_queue_monitor', daemon=True).start()
+
+    def get_metrics(self):
+        """
+        队列指标
+        :return: {'depth', 'spilling', 'put', 'dropped', 'spilled', 'spill_bytes', 'replayed', 'replay_rate'}
+        """
+        with self._mutex:
+            metrics = dict(self.metrics)
+            metrics['spilling'] = self._spilling
+        metrics['depth'] = self.qsize()
+        metrics['replay_rate'] = round(self._replay_rate, 1)
+        return metrics
+
+    def log_metrics(self):
+        logger.info('isw_adapter ingest queue: ' + json.dumps(self.get_metrics()))
@@ -1,13 +1,25 @@
 import traceback
 import _setup_django
 from backend.isw_adapter.isw_adapter_config import ISW_LOGGER
+from backend.isw_adapter import category_overrides  # noqa: F401
+from backend.isw_adapter.ingest_config import ISW_BATCH_ENABLED, ISW_WORKER_PROCESSES, ISW_ASYNC_ENABLED
 from backend.isw_adapter.up_server import IswUpServe
+from backend.isw_adapter.batch_ingest import BatchIswUpServe
+from backend.isw_adapter.shard_server import ShardIswUpServe
+from backend.isw_adapter.async_server import AsyncIswUpServe
 
 logger = ISW_LOGGER
 
 
 def main():
-    IswUpServe().run()
+    if ISW_WORKER_PROCESSES > 0:
+        ShardIswUpServe().run()
+    elif ISW_ASYNC_ENABLED:
+        AsyncIswUpServe().run()
+    elif ISW_BATCH_ENABLED:
+        BatchIswUpServe().run()
+    else:
+        IswUpServe().run()
 
 
 if __name__ == '__main__':
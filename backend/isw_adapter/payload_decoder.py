@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+按设备模型 ATTR_MAP 生成的上报数据解码器
+
+一次遍历完成 json 解码与类型转换，结果可直接用于模型字段赋值及时序数据库字段:
+    - 字段类型优先取模型字段类型，模型无对应字段时按 ATTR_MAP 的 data_type 转换
+    - 模型未定义 ATTR_MAP 时，使用处理类的 attr_keys 或模型的全部数据字段
+    - 已安装 orjson 时使用 orjson 解码，orjson 不接受的 NaN/Infinity 等由标准库 json 解码
+"""
+import json
+
+from django.db import models
+
+from backend.isw_adapter.category_cfg import CATEGORY_CLASS_MAP
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    json_loads = json.loads
+    JSONDecodeError = json.JSONDecodeError
+
+# 不属于上报属性的模型字段
+EXCLUDE_FIELDS = ('id', 'device', 'created_time', 'updated_time')
+
+# 时序数据库字段
+TSDB_FLOAT_FIELD = 'f_value'
+TSDB_STRING_FIELD = 's_value'
+
+
+def loads(msg_str):
+    """
+    json 解码，格式错误时与 ParseUpMsg.get_msg 一致返回原字符串
+    """
+    try:
+        return json_loads(msg_str)
+    except (JSONDecodeError, TypeError, ValueError):
+        if json_loads is json.loads:
+            return msg_str
+    try:
+        return json.loads(msg_str)
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return msg_str
+
+
+def to_int(value):
+    if isinstance(value, int):
+        return int(value)
+    return int(float(value))
+
+
+def to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'on')
+    return bool(value)
+
+
+def to_str(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def keep(value):
+    return value
+
+
+DATA_TYPE_COERCERS = {
+    'N': float,
+    'T': to_str,
+    'B': to_bool,
+    'O': keep,
+}
+
+
+def field_coercer(field):
+    if isinstance(field, models.BooleanField):
+        return to_bool
+    if isinstance(field, (models.IntegerField, models.SmallIntegerField, models.BigIntegerField)):
+        return to_int
+    if isinstance(field, (models.FloatField, models.DecimalField)):
+        return float
+    if isinstance(field, (models.CharField, models.TextField)):
+        return to_str
+    return keep
+
+
+def tsdb_field_name(coerce):
+    if coerce in (to_int, float, to_bool):
+        return TSDB_FLOAT_FIELD
+    if coerce is to_str:
+        return TSDB_STRING_FIELD
+    return None
+
+
+class PayloadSchema(object):
+    """
+    单个设备模型的上报数据结构
+    """
+
+    def __init__(self, model_class, attr_keys=None):
+        """
+        :param model_class: 设备模型
+        :param attr_keys: 模型未定义 ATTR_MAP 时使用的属性列表
+        """
+        self.model_class = model_class
+        model_fields = {
+            field.name: field for field in model_class._meta.concrete_fields if field.name not in EXCLUDE_FIELDS
+        }
+        attr_map = getattr(model_class, 'ATTR_MAP', None)
+        if attr_map:
+            data_types = {key: attr['data_type'] for key, attr in attr_map.items()}
+        else:
+            data_types = {key: None for key in (attr_keys or model_fields)}
+        # {key: (coerce, tsdb_field, is_model_field)}
+        self.attrs = {}
+        for key, data_type in data_types.items():
+            field = model_fields.get(key)
+            if field is not None:
+                coerce = field_coercer(field)
+            else:
+                coerce = DATA_TYPE_COERCERS.get(data_type, keep)
+            self.attrs[key] = (coerce, tsdb_field_name(coerce), field is not None)
+
+    def coerce(self, msg):
+        """
+        类型转换，忽略未定义及无法转换的属性
+        :param msg: 已解码的上报数据
+        :return: {key: value}
+        """
+        values = {}
+        attrs = self.attrs
+        for key, value in msg.items():
+            attr = attrs.get(key)
+            if attr is None:
+                continue
+            if value is None:
+                values[key] = None
+                continue
+            try:
+                values[key] = attr[0](value)
+            except (TypeError, ValueError, OverflowError):
+                continue
+        return values
+
+    def decode(self, msg_str):
+        """
+        解码并类型转换
+        :param msg_str: 上报数据 json 字符串
+        :return: {key: value} 格式错误时返回 None
+        """
+        msg = loads(msg_str)
+        if not isinstance(msg, dict):
+            return None
+        return self.coerce(msg)
+
+    def model_values(self, values):
+        """
+        可直接赋值给模型字段的数据
+        """
+        return {key: value for key, value in values.items() if self.attrs[key][2]}
+
+    def tsdb_fields(self, values):
+        """
+        时序数据库字段
+        :return: [(key, {'f_value': value}), ...]
+        """
+        result = []
+        for key, value in values.items():
+            tsdb_field = self.attrs[key][1]
+            if tsdb_field is None or value is None:
+                continue
+            if tsdb_field == TSDB_FLOAT_FIELD:
+                value = float(value)
+            result.append((key, {tsdb_field: value}))
+        return result
+
+
+_schemas = {}
+
+
+def get_schema(device_type):
+    """
+    获取设备模型的上报数据结构
+    :param device_type: CategoryModeMapping.device_type
+    :return: PayloadSchema 设备模型没有处理类时返回 None
+    """
+    if device_type not in _schemas:
+        manage_class = CATEGORY_CLASS_MAP.get(device_type)
+        if manage_class is None or manage_class.model_class is None:
+            _schemas[device_type] = None
+        else:
+            _schemas[device_type] = PayloadSchema(
+                manage_class.model_class, attr_keys=getattr(manage_class, 'attr_keys', None)
+            )
+    return _schemas[device_type]
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+isw 上行数据多进程分片处理
+
+主进程只负责接收 MQTT 消息，按设备 username 的哈希值将消息分发给 ISW_WORKER_PROCESSES 个工作进程，
+同一设备的消息总是进入同一个工作进程，保证单设备消息按序处理。
+每个工作进程的消息先进入主进程中的有界队列(队列满时的处理同微批模式，见 ingest_queue)，
+再由转发线程送入长度为 SHARD_PIPE_SIZE 的进程间队列，工作进程处理变慢时消息积压在有界队列中。
+工作进程通过 forkserver 启动，监控线程重启工作进程时不会从多线程的主进程 fork。
+工作进程异常退出时可能仍持有进程间队列的读锁，重启时为其创建新的进程间队列，旧队列中未读取的消息丢弃。
+"""
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+import zlib
+
+from django.conf import settings
+from django.db import connections
+
+from backend.isw_adapter.alarm_coalesce import alarm_coalescer, exit_on_sigterm
+from backend.isw_adapter.batch_ingest import UpMsgBatcher
+from backend.isw_adapter.ingest_config import ISW_BATCH_ENABLED, ISW_BATCH_SIZE, ISW_WORKER_PROCESSES, \
+    ISW_WORKER_REPORT_INTERVAL, ISW_QUEUE_SPILL_DIR
+from backend.isw_adapter.ingest_queue import BoundedIngestQueue
+from backend.isw_adapter.isw_adapter_config import ISW_MQTT_DATA
+from backend.isw_adapter.up_server import MQTTUpServer, IswUpServe
+
+logger = settings.ISW_ADAPTER_LOGGER
+
+# 进程间队列长度，超出的消息留在主进程的有界队列中
+SHARD_PIPE_SIZE = ISW_BATCH_SIZE * 2
+# 转发线程写入进程间队列的超时(秒)，超时后重新获取该工作进程当前的队列
+FORWARD_PUT_TIMEOUT = 1
+
+
+def get_device_username(topic):
+    """
+    解析topic open/<project_key>/<device_username>/<topic_type> 中的设备 username
+    """
+    parts = topic.split('/')
+    if len(parts) != 4:
+        return None
+    return parts[2]
+
+
+def worker_main(index, msg_queue):
+    """
+    工作进程入口
+    :param index: 工作进程序号
+    :param msg_queue: 该工作进程的消息队列
+    :return:
+    """
+    # 子进程不能复用 forkserver 进程的数据库连接
+    connections.close_all()
+    logger.info(f'isw_adapter worker-{index} 启动')
+    batcher = UpMsgBatcher(batch_size=ISW_BATCH_SIZE if ISW_BATCH_ENABLED else 1, msg_queue=msg_queue)
+    exit_on_sigterm()
+    try:
+        batcher.run()
+    finally:
+        # 工作进程退出时不执行 atexit，直接推送未结束窗口的合并通知
+        alarm_coalescer.stop()
+
+
+class ShardSupervisor(object):
+    """
+    工作进程管理: 启动、消息路由、队列深度上报及异常退出后重启
+    """
+
+    def __init__(self, processes=ISW_WORKER_PROCESSES, report_interval=ISW_WORKER_REPORT_INTERVAL,
+                 spill_dir=ISW_QUEUE_SPILL_DIR, **queue_kwargs):
+        """
+        :param spill_dir: 溢出文件目录，每个工作进程使用其中的 shard_<序号> 子目录
+        :param queue_kwargs: 有界队列参数 maxsize/policy
+        """
+        self.processes = processes
+        self.report_interval = report_interval
+        self.ctx = multiprocessing.get_context('forkserver')
+        self.buffers = [
+            BoundedIngestQueue(spill_dir=os.path.join(spill_dir, f'shard_{index}'), **queue_kwargs)
+            for index in range(processes)
+        ]
+        self.queues = [self.ctx.Queue(SHARD_PIPE_SIZE) for _ in range(processes)]
+        self.workers = [None] * processes
+
+    def shard_index(self, device_username):
+        if not device_username:
+            return 0
+        return zlib.crc32(device_username.encode()) % self.processes
+
+    def put(self, topic, msg_str):
+        self.buffers[self.shard_index(get_device_username(topic))].put((topic, msg_str))
+
+    def forward(self, index):
+        """
+        将有界队列中的消息按序转发给工作进程，进程间队列满时阻塞，工作进程重启后转发到新的队列
+        """
+        buffer = self.buffers[index]
+        while True:
+            msg = buffer.get()
+            while True:
+                try:
+                    self.queues[index].put(msg, timeout=FORWARD_PUT_TIMEOUT)
+                    buffer.task_done()
+                    break
+                except (queue.Full, ValueError):
+                    # 队列已满或已被重启的工作进程替换(关闭)
+                    continue
+
+    def start_worker(self, index):
+        worker = self.ctx.Process(
+            target=worker_main,
+            args=(index, self.queues[index]),
+            name=f'isw_adapter_worker_{index}',
+            daemon=True,
+        )
+        worker.start()
+        self.workers[index] = worker
+
+    def restart_worker(self, index):
+        """
+        以新的进程间队列重启工作进程，异常退出的进程可能仍持有旧队列的读锁
+        """
+        old_queue = self.queues[index]
+        self.queues[index] = self.ctx.Queue(SHARD_PIPE_SIZE)
+        try:
+            lost = old_queue.qsize()
+        except NotImplementedError:
+            lost = None
+        old_queue.cancel_join_thread()
+        old_queue.close()
+        if lost:
+            logger.error(f'isw_adapter worker-{index} 进程间队列中 {lost} 条消息未处理，已丢弃')
+        self.start_worker(index)
+
+    def start(self):
+        for index in range(self.processes):
+            self.start_worker(index)
+            threading.Thread(
+                target=self.forward, args=(index,), name=f'isw_adapter_forward_{index}', daemon=True
+            ).start()
+        threading.Thread(target=self.monitor, name='isw_adapter_supervisor', daemon=True).start()
+
+    def queue_depths(self):
+        """
+        各工作进程待处理的消息数(有界队列及进程间队列)
+        :return: [depth, ...]
+        """
+        return [buffer.qsize() + q.qsize() for buffer, q in zip(self.buffers, self.queues)]
+
+    def check_workers(self):
+        for index, worker in enumerate(self.workers):
+            if worker is not None and not worker.is_alive():
+                logger.error(f'isw_adapter worker-{index} 异常退出(exitcode={worker.exitcode})，重新启动')
+                self.restart_worker(index)
+
+    def monitor(self):
+        while True:
+            time.sleep(self.report_interval)
+            try:
+                self.check_workers()
+                depths = self.queue_depths()
+                logger.info(
+                    'isw_adapter worker queue depth: ' + ', '.join(f'worker-{i}={d}' for i, d in enumerate(depths))
+                )
+                for index, buffer in enumerate(self.buffers):
+                    logger.info(f'isw_adapter worker-{index} ingest queue: ' + json.dumps(buffer.get_metrics()))
+            except Exception as err:
+                logger.error(f'isw_adapter 工作进程监控失败: {err}')
+                logger.error(traceback.format_exc())
+
+
+class ShardMQTTUpServer(MQTTUpServer):
+    """
+    接收 Isw 设备上行数据后按设备分发给工作进程
+    """
+
+    def __init__(self, *args, supervisor=None, **kwargs):
+        self.supervisor = supervisor
+        super().__init__(*args, **kwargs)
+
+    def on_message(self, client, user_data, msg):
+        try:
+            self.supervisor.put(msg.topic, msg.payload.decode())
+        except Exception as err:
+            logger.error(f'topic <<{msg.topic}>> 消息分发失败: {err}')
+            logger.error(traceback.format_exc())
+
+
+class ShardIswUpServe(IswUpServe):
+    """
+    isw网关上行数据处理(多进程分片模式)
+    """
+
+    @staticmethod
+    def start_receiver_server():
+        """
+        启动工作进程及 mqtt server
+        :return:
+        """
+        # 主进程正常退出时终止工作进程，工作进程退出前推送告警合并通知
+        exit_on_sigterm()
+        supervisor = ShardSupervisor()
+        supervisor.start()
+        client = ShardMQTTUpServer(
+            client_id=f'isw_adapter_{int(time.time() * 1000)}',
+            logger=logger,
+            supervisor=supervisor,
+            **ISW_MQTT_DATA
+        )
+        client.loop_forever()
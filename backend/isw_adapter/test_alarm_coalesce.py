@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+告警通知合并 测试
+"""
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from backend.isw_adapter.alarm_coalesce import AlarmCoalescer
+
+
+def alarm_msg(alarm_status, rule_id=1):
+    return {'alarm_rule_id': rule_id, 'alarm_status': alarm_status}
+
+
+class AlarmCoalescerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.sender = mock.Mock()
+        self.coalescer = AlarmCoalescer(window=60, sender=self.sender)
+        patcher = mock.patch.object(self.coalescer, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add(self, alarm_status, now, rule_id=1, alarm_time=None):
+        self.coalescer.add(1, 'dev_0', alarm_msg(alarm_status, rule_id), alarm_status, alarm_time or now, now=now)
+
+    def sent(self):
+        return [(call.args[2]['alarm_status'], call.args[2].get('alarm_count')) for call in self.sender.call_args_list]
+
+    def test_first_alarm_sent_immediately(self):
+        self.add('alerting', now=0)
+        self.assertEqual(self.sent(), [('alerting', None)])
+
+    def test_repeats_coalesced_until_window_end(self):
+        for now in range(3):
+            self.add('alerting', now=now)
+        self.assertEqual(self.sent(), [('alerting', None)])
+        self.assertEqual(self.coalescer.flush(now=30), 0)
+        self.assertEqual(self.coalescer.flush(now=60), 1)
+        msg = self.sender.call_args.args[2]
+        self.assertEqual((msg['alarm_count'], msg['first_alarm_time'], msg['last_alarm_time']), (3, 0, 2))
+
+    def test_window_without_repeats_not_resent(self):
+        self.add('alerting', now=0)
+        self.assertEqual(self.coalescer.flush(now=60), 0)
+        self.assertEqual(self.sender.call_count, 1)
+
+    def test_restore_within_window_sent(self):
+        self.add('alerting', now=0)
+        self.add('normal', now=1)
+        self.assertEqual(self.sent(), [('alerting', None), ('normal', None)])
+
+    def test_repeats_summarised_before_transition(self):
+        self.add('alerting', now=0)
+        self.add('alerting', now=1)
+        self.add('normal', now=2)
+        self.assertEqual(self.sent(), [('alerting', None), ('alerting', 2), ('normal', None)])
+
+    def test_rules_coalesced_separately(self):
+        self.add('alerting', now=0, rule_id=1)
+        self.add('alerting', now=0, rule_id=2)
+        self.assertEqual(self.sender.call_count, 2)
+
+    def test_stop_flushes_pending_windows(self):
+        self.add('alerting', now=0)
+        self.add('alerting', now=1)
+        self.coalescer.stop()
+        self.assertEqual(self.sent(), [('alerting', None), ('alerting', 2)])
+
+    def test_sender_error_logged(self):
+        self.sender.side_effect = RuntimeError('mq')
+        self.add('alerting', now=0)
+        self.assertEqual(self.sender.call_count, 1)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+isw 上行数据 asyncio 处理模式 测试
+"""
+import asyncio
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import SimpleTestCase
+
+from backend.isw_adapter import async_server
+from backend.isw_adapter.batch_ingest import UpMsgBatch
+
+FLUSH_METHODS = ('flush_device_data', 'flush_alarm_logs', 'flush_latest_values', 'flush_tsdb_points')
+
+
+class AsyncUpServerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.server = async_server.AsyncUpServer(lanes=2, executor_workers=2, tsdb_write=False)
+        self.addCleanup(self.server.executor.shutdown)
+        self.messages = [('open/PR_x/dev_0/attributes', '{"temp": 21.5}')]
+
+    def process(self, messages):
+        async def run():
+            self.server.loop = asyncio.get_running_loop()
+            await self.server.process_batch(messages)
+        asyncio.run(run())
+
+    def test_process_batch_flushes_every_target(self):
+        batch = mock.create_autospec(UpMsgBatch, instance=True)
+        with mock.patch.object(async_server, 'UpMsgBatch', return_value=batch), \
+                mock.patch.object(async_server, 'close_old_connections'):
+            self.process(self.messages)
+        batch.parse.assert_called_once_with()
+        for name in FLUSH_METHODS:
+            getattr(batch, name).assert_called_once_with()
+
+    def test_connection_error_resumes_batch(self):
+        batch = mock.create_autospec(UpMsgBatch, instance=True)
+        batch.flush_latest_values.side_effect = [OperationalError('connection refused'), None]
+        with mock.patch.object(async_server, 'UpMsgBatch', return_value=batch) as batch_class, \
+                mock.patch.object(async_server, 'close_old_connections'), \
+                mock.patch.object(async_server.asyncio, 'sleep', new=mock.AsyncMock()) as sleep:
+            self.process(self.messages)
+        batch_class.assert_called_once()
+        sleep.assert_awaited_once_with(1)
+        self.assertEqual(batch.flush_latest_values.call_count, 2)
+        self.assertEqual(self.server._failures, 0)
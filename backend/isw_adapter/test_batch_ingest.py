@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+isw 上行数据微批处理 测试
+"""
+import queue
+import shutil
+import tempfile
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import SimpleTestCase
+
+from backend.apps.equipments.biz.latest_value_store import is_ingest_write
+from backend.isw_adapter import batch_ingest
+from backend.isw_adapter.batch_ingest import BatchParseUpMsg, UpMsgBatch, UpMsgBatcher
+from backend.isw_adapter.ingest_queue import BoundedIngestQueue
+
+
+def messages(count):
+    return [(f'open/PR_x/dev_{index}/attributes', '{"temp": 21.5}') for index in range(count)]
+
+
+class UpMsgBatchRetryTestCase(SimpleTestCase):
+    """
+    连接故障后批次从失败处继续处理，已完成的解析及写入不重复执行
+    """
+
+    def test_parse_resumes_after_failed_message(self):
+        batch = UpMsgBatch(messages(3))
+        batch.prefetched = True
+        parsed = []
+
+        def parse_msg(msg):
+            parsed.append(msg.topic)
+            if len(parsed) == 2:
+                raise OperationalError('connection refused')
+
+        with mock.patch.object(BatchParseUpMsg, 'parse_msg', autospec=True, side_effect=parse_msg):
+            with self.assertRaises(OperationalError):
+                batch.parse()
+            batch.parse()
+        topics = [topic for topic, _ in batch.messages]
+        self.assertEqual(parsed, [topics[0], topics[1], topics[1], topics[2]])
+
+    def test_parse_marks_ingest_writes(self):
+        batch = UpMsgBatch(messages(1))
+        batch.prefetched = True
+        flags = []
+        with mock.patch.object(BatchParseUpMsg, 'parse_msg', autospec=True,
+                               side_effect=lambda msg: flags.append(is_ingest_write())):
+            batch.parse()
+        self.assertEqual((flags, is_ingest_write()), ([True], False))
+
+    def test_failed_flush_keeps_pending_writes(self):
+        tsdb_client = mock.Mock()
+        tsdb_client.write_multiple_data.side_effect = [None, OperationalError('connection refused'), None]
+        batch = UpMsgBatch([], tsdb_client=tsdb_client)
+        batch.tsdb_points = {'PR_a': [{'key': 'a'}], 'PR_b': [{'key': 'b'}]}
+        with self.assertRaises(OperationalError):
+            batch.flush_tsdb_points()
+        batch.flush_tsdb_points()
+        self.assertEqual([call.args[0] for call in tsdb_client.write_multiple_data.call_args_list],
+                         ['PR_a', 'PR_b', 'PR_b'])
+        self.assertEqual(batch.tsdb_points, {})
+
+    def test_failed_latest_values_kept(self):
+        batch = UpMsgBatch([])
+        batch.latest_values = {'dev_0': {'temp': 21.5}}
+        with mock.patch.object(batch_ingest, 'update_many_latest_values',
+                               side_effect=OperationalError('connection refused')):
+            with self.assertRaises(OperationalError):
+                batch.flush_latest_values()
+        self.assertEqual(batch.latest_values, {'dev_0': {'temp': 21.5}})
+
+    def test_batcher_retries_same_batch(self):
+        batch = mock.create_autospec(UpMsgBatch, instance=True)
+        batch.execute.side_effect = [OperationalError('connection refused'), None]
+        batcher = UpMsgBatcher(tsdb_write=False)
+        with mock.patch.object(batch_ingest, 'UpMsgBatch', return_value=batch) as batch_class, \
+                mock.patch.object(batch_ingest, 'close_old_connections'), \
+                mock.patch.object(batch_ingest, 'connections'), \
+                mock.patch.object(batch_ingest.time, 'sleep') as sleep:
+            batcher.process_batch(messages(2))
+        batch_class.assert_called_once()
+        self.assertEqual(batch.execute.call_count, 2)
+        sleep.assert_called_once_with(1)
+        self.assertEqual(batcher._failures, 0)
+
+    def test_task_done_after_batch(self):
+        spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spill_dir, ignore_errors=True)
+        msg_queue = BoundedIngestQueue(spill_dir=spill_dir)
+        self.addCleanup(msg_queue.stop)
+        with mock.patch.object(msg_queue, 'task_done') as task_done:
+            UpMsgBatcher(tsdb_write=False, msg_queue=msg_queue).task_done(3)
+        task_done.assert_called_once_with(3)
+        # queue.Queue 不需要通知
+        UpMsgBatcher(tsdb_write=False, msg_queue=queue.Queue()).task_done(3)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+设备模型处理类扩展 测试
+"""
+from decimal import Decimal
+from unittest import mock
+
+import fakeredis
+from django.test import TestCase
+
+from backend.apps.air_servers.biz import auto_off_scheduler, occupancy
+from backend.apps.air_servers.models import AirCondGroup, AirPersonnelSensor, CentralAirConditioner
+from backend.apps.device_models.models import AirConditioner, EnvironmentMonitor, PersonnelSensor, \
+    PrepaidElectricMeter
+from backend.apps.el_prepayment_servers.biz import billing
+from backend.apps.el_prepayment_servers.models import PrepaidElMeter
+from backend.apps.equipments.models import Device, DeviceCategory, EZtProjects
+from backend.apps.projects.models import OrgTree, Projects
+from backend.isw_adapter import category_overrides
+from backend.isw_adapter.category_cfg import CATEGORY_CLASS_MAP
+
+
+def create_device(project, username, device_type):
+    category, _ = DeviceCategory.objects.get_or_create(
+        key=f'overrides_{device_type}', project=project, defaults=dict(
+            ezt_project=EZtProjects.objects.get_or_create(project_key='PR_overrides')[0],
+            category_id=f'overrides_{device_type}', category_name=device_type,
+        )
+    )
+    return Device.objects.create(username=username, project=project, category=category)
+
+
+def use_fake_redis(test_case, *modules):
+    """
+    各模块的 device_data redis 替换为 fakeredis，测试库 id 与线上数据重叠
+    """
+    redis_conn = fakeredis.FakeRedis()
+    for module in modules:
+        patcher = mock.patch.object(module, 'get_redis_conn', return_value=redis_conn)
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+    return redis_conn
+
+
+def device_data(device):
+    return {'id': device.id, 'username': device.username, 'category': device.category_id,
+            'category_info': {'id': device.category_id}}
+
+
+class PersonnelSensorManageTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = Projects.objects.create(name='overrides')
+        cls.group = AirCondGroup.objects.create(name='g1')
+        cls.sensors = []
+        for index in range(2):
+            sensor = PersonnelSensor.objects.create(
+                device=create_device(cls.project, f'pir_{index}', 'personnel_sensor'), status='0'
+            )
+            AirPersonnelSensor.objects.create(personnel_sensor=sensor, group=cls.group)
+            cls.sensors.append(sensor)
+        air_cond = AirConditioner.objects.create(device=create_device(cls.project, 'air_0', 'air_conditioner'))
+        cls.air = CentralAirConditioner.objects.create(
+            air_cond=air_cond, group=cls.group, is_auto_off=True, off_delay_minutes=5
+        )
+
+    def setUp(self):
+        self.redis_conn = use_fake_redis(self, occupancy, auto_off_scheduler)
+
+    def manage(self, sensor, status):
+        return CATEGORY_CLASS_MAP['personnel_sensor']('t', {'status': status}, device_data(sensor.device))
+
+    def report(self, sensor, status):
+        self.manage(sensor, status).parse_data_report()
+
+    def test_registered(self):
+        self.assertIs(CATEGORY_CLASS_MAP['personnel_sensor'], category_overrides.PersonnelSensorManage)
+
+    def test_group_state_transitions(self):
+        manage_class = category_overrides.PersonnelSensorManage
+        with mock.patch.object(manage_class, 'open_auto_off_task') as open_task, \
+                mock.patch.object(manage_class, 'close_auto_off_task') as close_task:
+            self.report(self.sensors[0], '1')
+            self.report(self.sensors[1], '1')
+            self.report(self.sensors[0], '0')
+            self.assertEqual((open_task.call_count, close_task.call_count), (0, 1))
+            self.report(self.sensors[1], '0')
+            self.assertEqual((open_task.call_count, close_task.call_count), (1, 1))
+        self.assertEqual(list(open_task.call_args.args[0]), [self.air])
+        self.assertEqual(occupancy.get_many_group_occupancy([self.group.id]), {self.group.id: (0, 2)})
+
+    def test_scheduler_enabled(self):
+        member = auto_off_scheduler.schedule_member(self.air.id, 'air_0')
+        with mock.patch.object(category_overrides, 'AIR_AUTO_OFF_SCHEDULER_ENABLED', True):
+            self.report(self.sensors[0], '1')
+            self.report(self.sensors[0], '0')
+            self.assertIsNotNone(self.redis_conn.zscore(auto_off_scheduler.AUTO_OFF_SCHEDULE_KEY, member))
+            self.report(self.sensors[1], '1')
+            self.assertIsNone(self.redis_conn.zscore(auto_off_scheduler.AUTO_OFF_SCHEDULE_KEY, member))
+
+    def test_scheduler_disabled_uses_legacy_tasks(self):
+        manage_class = category_overrides.BasePersonnelSensorManage
+        with mock.patch.object(manage_class, 'open_auto_off_task') as open_task, \
+                mock.patch.object(manage_class, 'close_auto_off_task') as close_task, \
+                mock.patch.object(category_overrides, 'AIR_AUTO_OFF_SCHEDULER_ENABLED', False):
+            manage = self.manage(self.sensors[0], '0')
+            manage.open_auto_off_task(CentralAirConditioner.objects.all())
+            manage.close_auto_off_task(CentralAirConditioner.objects.all())
+        self.assertEqual((open_task.call_count, close_task.call_count), (1, 1))
+        self.assertEqual(self.redis_conn.zcard(auto_off_scheduler.AUTO_OFF_SCHEDULE_KEY), 0)
+
+
+class PrepaidElectricMeterManageTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        project = Projects.objects.create(name='overrides')
+        cls.device = create_device(project, 'meter_0', 'prepaid_electric_meter')
+        cls.device_meter = PrepaidElectricMeter.objects.create(device=cls.device, epi=100.0, state=1)
+        cls.el_meter = PrepaidElMeter.objects.create(
+            org=OrgTree.objects.create(project=project, name='org'), prepaid_el_meter=cls.device_meter,
+            price=Decimal('1'), waring_amount=Decimal('10'), surplus=Decimal('15'),
+        )
+
+    def setUp(self):
+        use_fake_redis(self, billing)
+
+    def report(self, epi):
+        CATEGORY_CLASS_MAP['prepaid_electric_meter']('t', {'epi': epi}, device_data(self.device)).parse_data_report()
+
+    def test_registered(self):
+        self.assertIs(CATEGORY_CLASS_MAP['prepaid_electric_meter'], category_overrides.PrepaidElectricMeterManage)
+
+    def test_billing_window(self):
+        with mock.patch.object(category_overrides, 'PREPAID_BILLING_WINDOW', 300):
+            self.report(101.0)
+            self.report(102.0)
+        self.assertEqual(PrepaidElMeter.objects.get(id=self.el_meter.id).surplus, Decimal('15'))
+        self.assertEqual(PrepaidElectricMeter.objects.get(id=self.device_meter.id).epi, 102.0)
+        self.assertEqual(billing.settle_due_windows(window=0), 1)
+        self.assertEqual(PrepaidElMeter.objects.get(id=self.el_meter.id).surplus, Decimal('13'))
+
+    def test_invalid_reading_falls_back(self):
+        with mock.patch.object(category_overrides, 'PREPAID_BILLING_WINDOW', 300), \
+                mock.patch.object(category_overrides.BasePrepaidElectricMeterManage, 'parse_el_meter_data') as base:
+            self.report('n/a')
+        base.assert_called_once()
+
+    def test_window_disabled(self):
+        with mock.patch.object(category_overrides, 'PREPAID_BILLING_WINDOW', 0), \
+                mock.patch.object(category_overrides, 'bill_report') as bill_report, \
+                mock.patch.object(category_overrides.BasePrepaidElectricMeterManage, 'parse_el_meter_data') as base:
+            self.report(101.0)
+        bill_report.assert_not_called()
+        base.assert_called_once()
+
+
+class EnvironmentMonitorManageTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.device = create_device(Projects.objects.create(name='overrides'), 'env_0', 'environment_monitor')
+        EnvironmentMonitor.objects.create(device=cls.device, up_attr_data={'temp': 20, 'hum': 50})
+
+    def manage(self, msg):
+        return CATEGORY_CLASS_MAP['environment_monitor']('t', msg, device_data(self.device))
+
+    def test_registered(self):
+        self.assertIs(CATEGORY_CLASS_MAP['environment_monitor'], category_overrides.EnvironmentMonitorManage)
+
+    def test_merge_in_database(self):
+        with mock.patch.object(category_overrides, 'supports_jsonb_merge', return_value=True), \
+                mock.patch.object(category_overrides, 'merge_json_field') as merge, \
+                mock.patch.object(category_overrides.BaseEnvironmentMonitorManage, 'parse_data_report') as base:
+            self.manage({'temp': 21.5}).parse_data_report()
+        base.assert_not_called()
+        queryset, field_name, data = merge.call_args.args
+        self.assertEqual((list(queryset.values_list('device_id', flat=True)), field_name, data),
+                         ([self.device.id], 'up_attr_data', {'temp': 21.5}))
+
+    def test_fallback(self):
+        with mock.patch.object(category_overrides, 'supports_jsonb_merge', return_value=False):
+            self.manage({'temp': 21.5}).parse_data_report()
+        self.assertEqual(EnvironmentMonitor.objects.get(device=self.device).up_attr_data, {'temp': 21.5, 'hum': 50})
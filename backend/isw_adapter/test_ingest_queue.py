@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+isw 上行消息有界队列 测试
+"""
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from backend.isw_adapter.ingest_queue import BoundedIngestQueue, SpillFile, SPILL_FILE_NAME, POLICY_DROP_OLDEST, \
+    POLICY_SPILL
+
+
+def message(index):
+    return 'open/PR_x/dev_0/attributes', f'{{"seq": {index}}}'
+
+
+class BoundedIngestQueueTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spill_dir, ignore_errors=True)
+
+    def create_queue(self, policy=POLICY_SPILL, **kwargs):
+        msg_queue = BoundedIngestQueue(maxsize=2, policy=policy, spill_dir=self.spill_dir, **kwargs)
+        self.addCleanup(msg_queue.stop)
+        return msg_queue
+
+    def drain(self, msg_queue):
+        items = []
+        while True:
+            try:
+                items.append(msg_queue.get(block=False))
+            except queue.Empty:
+                return items
+
+    def test_spill_keeps_arrival_order(self):
+        msg_queue = self.create_queue(replay_chunk_size=2)
+        for index in range(4):
+            msg_queue.put(message(index))
+        self.assertEqual(msg_queue.qsize(), 2)
+        self.assertEqual(msg_queue.get(), message(0))
+        # 溢出文件未回放完之前，新消息即使队列有空位也追加到溢出文件
+        msg_queue.put(message(4))
+        self.assertEqual(msg_queue.qsize(), 1)
+        self.assertEqual(self.drain(msg_queue), [message(index) for index in range(1, 5)])
+        metrics = msg_queue.get_metrics()
+        self.assertEqual((metrics['spilled'], metrics['replayed'], metrics['spilling']), (3, 3, False))
+        # 溢出文件中的消息全部处理后才删除
+        msg_queue.task_done(4)
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+        msg_queue.task_done()
+        self.assertEqual(os.listdir(self.spill_dir), [])
+        # 回放完成后恢复直接入队
+        msg_queue.put(message(5))
+        self.assertEqual((msg_queue.qsize(), msg_queue.get_metrics()['spilled']), (1, 3))
+
+    def test_replay_only_when_queue_is_empty(self):
+        msg_queue = self.create_queue()
+        for index in range(3):
+            msg_queue.put(message(index))
+        self.assertEqual(msg_queue.get(), message(0))
+        self.assertEqual(msg_queue.get_metrics()['replayed'], 0)
+        self.assertEqual(msg_queue.get(), message(1))
+        self.assertEqual(msg_queue.get(), message(2))
+        self.assertEqual(msg_queue.get_metrics()['replayed'], 1)
+
+    def test_orphan_spill_replayed_first(self):
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        orphan = SpillFile(self.spill_dir)
+        orphan.path = os.path.join(self.spill_dir, SPILL_FILE_NAME.format(process.pid))
+        orphan.append([message(0), message(1)])
+        orphan.close()
+        msg_queue = self.create_queue()
+        msg_queue.put(message(2))
+        self.assertEqual(self.drain(msg_queue), [message(0), message(1), message(2)])
+        msg_queue.task_done(3)
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def restart(self):
+        """
+        以当前进程遗留的溢出文件创建新队列
+        """
+        with mock.patch.object(SpillFile, 'is_orphan', return_value=True):
+            return self.create_queue()
+
+    def test_unprocessed_replay_kept_on_restart(self):
+        msg_queue = self.create_queue()
+        for index in range(3):
+            msg_queue.put(message(index))
+        self.assertEqual(self.drain(msg_queue), [message(0), message(1), message(2)])
+        msg_queue.task_done(2)
+        # message(2) 已读回但未处理，溢出文件保留
+        msg_queue.stop()
+        self.assertEqual(self.drain(self.restart()), [message(2)])
+
+    def test_stop_saves_queue_before_spill_file(self):
+        msg_queue = self.create_queue()
+        for index in range(4):
+            msg_queue.put(message(index))
+        msg_queue.stop()
+        self.assertEqual(msg_queue.qsize(), 0)
+        # 退出后的消息写入溢出文件，不再取出
+        msg_queue.put(message(4))
+        with self.assertRaises(queue.Empty):
+            msg_queue.get(block=False)
+        self.assertEqual(self.drain(self.restart()), [message(index) for index in range(5)])
+
+    def test_stop_keeps_replayed_messages_in_file(self):
+        msg_queue = self.create_queue()
+        for index in range(4):
+            msg_queue.put(message(index))
+        self.assertEqual([msg_queue.get() for _ in range(3)], [message(0), message(1), message(2)])
+        msg_queue.task_done(2)
+        # message(3) 从溢出文件读回，message(4) 直接进入内存队列
+        msg_queue.put(message(4))
+        msg_queue.stop()
+        self.assertEqual(self.drain(self.restart()), [message(2), message(3), message(4)])
+
+    def test_spill_file_buffered(self):
+        spill_file = SpillFile(self.spill_dir, flush_size=2)
+        spill_file.append([message(0)])
+        self.assertEqual(os.path.getsize(spill_file.path), 0)
+        spill_file.append([message(1)])
+        spill_file.append([message(2)])
+        self.assertEqual(list(SpillFile.read(spill_file.path)), [message(0), message(1)])
+        spill_file.close()
+        self.assertEqual(list(SpillFile.read(spill_file.path)), [message(0), message(1), message(2)])
+
+    def test_drop_oldest(self):
+        msg_queue = self.create_queue(policy=POLICY_DROP_OLDEST)
+        for index in range(3):
+            msg_queue.put(message(index))
+        self.assertEqual(self.drain(msg_queue), [message(1), message(2)])
+        self.assertEqual(msg_queue.get_metrics()['dropped'], 1)
+
+    def test_get_timeout(self):
+        with self.assertRaises(queue.Empty):
+            self.create_queue().get(timeout=0.01)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            self.create_queue(policy='discard')
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+上报数据解码器 测试
+"""
+import json
+import math
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from backend.apps.device_models.models import AirConditioner
+from backend.isw_adapter import payload_decoder
+from backend.isw_adapter.payload_decoder import PayloadSchema, TSDB_FLOAT_FIELD, TSDB_STRING_FIELD, get_schema, \
+    loads, to_bool, to_int, to_str
+
+
+class CoercerTestCase(SimpleTestCase):
+
+    def test_loads(self):
+        self.assertEqual(loads('{"temp": 21.5}'), {'temp': 21.5})
+        # 格式错误时返回原字符串
+        self.assertEqual(loads('not json'), 'not json')
+
+    def test_loads_non_finite(self):
+        # orjson 不接受 NaN/Infinity，与标准库 json 的解码结果一致
+        msg = loads('{"temp_set": NaN, "temp_room": Infinity}')
+        self.assertTrue(math.isnan(msg['temp_set']))
+        self.assertEqual(msg['temp_room'], float('inf'))
+        with mock.patch.object(payload_decoder, 'json_loads', json.loads):
+            self.assertEqual(loads('{"temp_room": -Infinity}'), {'temp_room': float('-inf')})
+
+    def test_to_int(self):
+        self.assertEqual([to_int(5), to_int('5'), to_int('5.0'), to_int(5.9)], [5, 5, 5, 5])
+        with self.assertRaises(ValueError):
+            to_int('on')
+
+    def test_to_bool(self):
+        self.assertEqual([to_bool(value) for value in ('1', ' True ', 'on', '0', 'off', 1, 0)],
+                         [True, True, True, False, False, True, False])
+
+    def test_to_str(self):
+        self.assertEqual([to_str(True), to_str(3.0), to_str(3.5), to_str('on')], ['1', '3', '3.5', 'on'])
+
+
+class PayloadSchemaTestCase(SimpleTestCase):
+
+    def setUp(self):
+        attr_map = dict(AirConditioner.ATTR_MAP, humidity={'key': 'humidity', 'name': '湿度', 'data_type': 'N'})
+        patcher = mock.patch.object(AirConditioner, 'ATTR_MAP', attr_map)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.schema = PayloadSchema(AirConditioner)
+
+    def test_model_field_type_preferred(self):
+        # capacity 在 ATTR_MAP 中为数值，模型字段为字符串
+        values = self.schema.decode(
+            '{"capacity": 3.0, "t_high_limit": "30", "lock_switch": "on", "temp_set": "26.5", "humidity": "45"}'
+        )
+        self.assertEqual(values, {'capacity': '3', 't_high_limit': 30, 'lock_switch': True, 'temp_set': 26.5,
+                                  'humidity': 45.0})
+
+    def test_unknown_and_invalid_ignored(self):
+        values = self.schema.coerce({'t_high_limit': 'high', 'unknown': 1, 'temp_room': None})
+        self.assertEqual(values, {'temp_room': None})
+
+    def test_non_finite_values_ignored(self):
+        values = self.schema.decode('{"t_high_limit": Infinity, "t_low_limit": 1e400, "temp_set": 26}')
+        self.assertEqual(values, {'temp_set': 26.0})
+
+    def test_decode_invalid_payload(self):
+        self.assertIsNone(self.schema.decode('not json'))
+        self.assertIsNone(self.schema.decode('[1, 2]'))
+
+    def test_model_values(self):
+        values = self.schema.coerce({'temp_set': 26, 'humidity': 45})
+        self.assertEqual(self.schema.model_values(values), {'temp_set': 26.0})
+
+    def test_tsdb_fields(self):
+        values = self.schema.coerce({'lock_switch': 1, 'mode': 'cool', 'temp_room': None, 't_high_limit': 30})
+        self.assertEqual(self.schema.tsdb_fields(values), [
+            ('lock_switch', {TSDB_FLOAT_FIELD: 1.0}),
+            ('mode', {TSDB_STRING_FIELD: 'cool'}),
+            ('t_high_limit', {TSDB_FLOAT_FIELD: 30.0}),
+        ])
+
+
+class GetSchemaTestCase(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(payload_decoder, '_schemas', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached(self):
+        schema = get_schema('air_cond')
+        self.assertIs(schema.model_class, AirConditioner)
+        self.assertIs(get_schema('air_cond'), schema)
+
+    def test_unknown_device_type(self):
+        self.assertIsNone(get_schema('no_such_device_type'))
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+isw 上行数据多进程分片处理 测试
+"""
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from backend.isw_adapter.ingest_queue import POLICY_SPILL
+from backend.isw_adapter.shard_server import ShardSupervisor, get_device_username
+
+
+class ShardSupervisorTestCase(SimpleTestCase):
+
+    def setUp(self):
+        spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spill_dir, ignore_errors=True)
+        self.supervisor = ShardSupervisor(processes=2, spill_dir=spill_dir, maxsize=2, policy=POLICY_SPILL)
+        for buffer in self.supervisor.buffers:
+            self.addCleanup(buffer.stop)
+
+    def test_get_device_username(self):
+        self.assertEqual(get_device_username('open/PR_x/dev_0/attributes'), 'dev_0')
+        self.assertIsNone(get_device_username('open/PR_x/attributes'))
+
+    def test_same_device_same_shard(self):
+        index = self.supervisor.shard_index('dev_0')
+        self.assertEqual({self.supervisor.shard_index('dev_0') for _ in range(3)}, {index})
+        self.assertEqual(self.supervisor.shard_index(None), 0)
+
+    def test_workers_not_forked_from_threads(self):
+        self.assertEqual(self.supervisor.ctx.get_start_method(), 'forkserver')
+
+    def test_queue_bounded_and_forwarded_in_order(self):
+        topic = 'open/PR_x/dev_0/attributes'
+        index = self.supervisor.shard_index('dev_0')
+        messages = [(topic, str(seq)) for seq in range(5)]
+        for message in messages:
+            self.supervisor.put(*message)
+        buffer = self.supervisor.buffers[index]
+        self.assertEqual((buffer.qsize(), buffer.get_metrics()['spilled']), (2, 3))
+        self.assertEqual(self.supervisor.queue_depths()[index], 2)
+        threading.Thread(target=self.supervisor.forward, args=(index,), daemon=True).start()
+        msg_queue = self.supervisor.queues[index]
+        self.assertEqual([tuple(msg_queue.get(timeout=5)) for _ in messages], messages)
+
+    def test_restart_replaces_queue(self):
+        index = self.supervisor.shard_index('dev_0')
+        old_queue = self.supervisor.queues[index]
+        self.supervisor.workers[index] = mock.Mock(**{'is_alive.return_value': False, 'exitcode': -9})
+        with mock.patch.object(self.supervisor, 'start_worker') as start_worker:
+            self.supervisor.check_workers()
+        start_worker.assert_called_once_with(index)
+        msg_queue = self.supervisor.queues[index]
+        self.assertIsNot(msg_queue, old_queue)
+        # 转发线程转发到新的队列
+        threading.Thread(target=self.supervisor.forward, args=(index,), daemon=True).start()
+        self.supervisor.put('open/PR_x/dev_0/attributes', '0')
+        self.assertEqual(tuple(msg_queue.get(timeout=5)), ('open/PR_x/dev_0/attributes', '0'))
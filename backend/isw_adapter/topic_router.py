@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+上行消息 topic 路由及设备类型处理类注册表
+
+TopicRouter: 启动时将 topic 类型预先映射为处理函数，分发时只需一次 split 与一次字典查找
+CategoryHandlerRegistry: 设备类型 id -> BaseCategoryManage 子类元组，
+    DeviceCategory/CategoryModeMapping 变更(设备缓存失效通知)后才重新加载
+"""
+import threading
+
+from django.conf import settings
+
+from backend.apps.equipments.biz.device_cache import device_info_cache, CATEGORY_KEY
+from backend.apps.equipments.models import CategoryModeMapping
+from backend.isw_adapter import category_overrides  # noqa: F401
+from backend.isw_adapter.category_cfg import CATEGORY_CLASS_MAP
+
+logger = settings.ISW_ADAPTER_LOGGER
+
+CATEGORY_KEY_PREFIX = CATEGORY_KEY.format('')
+
+
+class TopicRouter(object):
+    """
+    topic open/<project_key>/<device_username>/<topic_type> 路由
+    """
+
+    def __init__(self, handler_class):
+        """
+        :param handler_class: ParseUpMsg 或其子类，按其 PARSE_FUNC 生成路由
+        """
+        self.routes = {
+            pattern.rsplit('/', 1)[-1]: getattr(handler_class, func_name)
+            for pattern, func_name in handler_class.PARSE_FUNC.items()
+        }
+
+    def route(self, topic):
+        """
+        :param topic:
+        :return: (project_key, device_username, handler) topic 格式错误时返回 None，未知 topic 类型 handler 为 None
+        """
+        parts = topic.split('/')
+        if len(parts) != 4:
+            return None
+        return parts[1], parts[2], self.routes.get(parts[3])
+
+
+class CategoryHandlerRegistry(object):
+    """
+    设备类型处理类注册表
+    """
+
+    def __init__(self, class_map=CATEGORY_CLASS_MAP, loader=None):
+        """
+        :param class_map: 设备模型 -> 处理类
+        :param loader: 返回 [(category_id, device_type), ...] 的函数，默认从 CategoryModeMapping 加载
+        """
+        self.class_map = class_map
+        self.loader = loader or self.load_category_modes
+        self._handlers = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def load_category_modes():
+        return CategoryModeMapping.objects.order_by('id').values_list('category_id', 'device_type')
+
+    def build(self):
+        handlers = {}
+        for category_id, device_type in self.loader():
+            manage_class = self.class_map.get(device_type)
+            if manage_class is not None:
+                handlers.setdefault(category_id, []).append(manage_class)
+        self._handlers = {category_id: tuple(classes) for category_id, classes in handlers.items()}
+        logger.info(f'isw_adapter 设备类型处理类注册表已加载, 设备类型数: {len(self._handlers)}')
+        return self._handlers
+
+    def on_invalidate(self, keys):
+        """
+        设备缓存失效通知回调，设备类型变更时标记注册表需重新加载
+        """
+        if keys is None or any(key.startswith(CATEGORY_KEY_PREFIX) for key in keys):
+            self._handlers = None
+
+    def get_handlers(self, category_info):
+        """
+        获取设备类型的处理类
+        :param category_info: 设备类型缓存数据
+        :return: (manage_class, ...)
+        """
+        handlers = self._handlers
+        if handlers is None:
+            with self._lock:
+                handlers = self._handlers if self._handlers is not None else self.build()
+        classes = handlers.get(category_info['id'])
+        if classes is None:
+            # 注册表尚未包含新增的设备类型时，按缓存中的设备模型查找
+            classes = tuple(
+                self.class_map[device_type] for device_type in category_info.get('device_types', [])
+                if device_type in self.class_map
+            )
+        return classes
+
+
+category_handler_registry = CategoryHandlerRegistry()
+device_info_cache.add_invalidate_callback(category_handler_registry.on_invalidate)
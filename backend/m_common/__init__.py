@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+# 时序数据库客户端工厂按配置选择 InfluxDB 写入方式、TDengine 连接池，在任何调用方取得 DatabaseFactory 之前安装
+from backend.m_common.tsdb.factory import install as _install_tsdb_factory
+
+_install_tsdb_factory()
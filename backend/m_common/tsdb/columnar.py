@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+时序数据库查询结果列式格式
+
+query 默认返回逐行的 dict 列表，统计代码汇总数月的小时数据时要创建并遍历上百万个 dict。
+DatabaseFactory.get_client 返回的客户端 query 增加参数 result_format:
+    rows      默认，与原来相同
+    columnar  ColumnarResult，{列名: numpy 数组}，_time 列为 datetime64[ms](UTC)，同时作为 index
+    arrow     pyarrow.Table，列与 columnar 相同
+InfluxDB 由查询返回的 series(列名 + 值列表)直接生成列，TDengine 取游标的原始结果行按列转置，均不创建逐行 dict。
+数值列为 float64(空值为 NaN)，其它列为 object。numpy、pyarrow 只在使用对应格式时导入。
+"""
+import threading
+from datetime import datetime
+
+from backend.m_common.tsdb.conf import TIME_ZONE_OFFSET
+from backend.m_common.tsdb.influxdb_wrapper import InfluxDBWrapper
+from backend.m_common.tsdb.tdengine_wrapper import TDengineWrapper
+
+RESULT_FORMAT_ROWS = 'rows'
+RESULT_FORMAT_COLUMNAR = 'columnar'
+RESULT_FORMAT_ARROW = 'arrow'
+RESULT_FORMATS = (RESULT_FORMAT_ROWS, RESULT_FORMAT_COLUMNAR, RESULT_FORMAT_ARROW)
+
+# 与逐行结果相同的时间列名
+TIME_COLUMN = '_time'
+INFLUXDB_TIME_COLUMN = 'time'
+TDENGINE_TIME_COLUMN = '_ts'
+
+# 当前线程的列式查询状态
+_local = threading.local()
+
+
+class ColumnarResult(dict):
+    """
+    列式查询结果 {列名: numpy 数组}
+    """
+
+    @property
+    def index(self):
+        return self.get(TIME_COLUMN)
+
+    @property
+    def row_count(self):
+        return len(self[TIME_COLUMN]) if TIME_COLUMN in self else 0
+
+    def to_arrow(self):
+        import pyarrow
+        return pyarrow.table({name: pyarrow.array(values) for name, values in self.items()})
+
+
+def column_array(values):
+    import numpy
+    sample = next((value for value in values if value is not None), None)
+    if isinstance(sample, (int, float)) and not isinstance(sample, bool):
+        try:
+            return numpy.array(values, dtype=numpy.float64)
+        except (TypeError, ValueError):
+            pass
+    return numpy.array(values, dtype=object)
+
+
+def time_array(values):
+    """
+    毫秒时间戳、datetime(无时区时按 TIME_ZONE_OFFSET)或 UTC 时间字符串(InfluxDB)转换为 datetime64[ms]
+    """
+    import numpy
+    if values and isinstance(values[0], datetime):
+        values = [to_epoch_ms(value) for value in values]
+    elif values and isinstance(values[0], str):
+        # datetime64 不支持时区标记
+        values = [value[:-1] if value.endswith('Z') else value for value in values]
+    return numpy.array(values, dtype='datetime64[ms]')
+
+
+def to_epoch_ms(value):
+    if value.tzinfo is None:
+        value = datetime.fromisoformat(value.isoformat() + TIME_ZONE_OFFSET)
+    return int(value.timestamp() * 1000)
+
+
+def build_columns(names, columns, time_name):
+    """
+    :param names: 列名
+    :param columns: 与列名对应的值列表
+    :param time_name: 时间列名，转换为 _time
+    """
+    result = ColumnarResult()
+    for name, values in zip(names, columns):
+        if name == time_name:
+            result[TIME_COLUMN] = time_array(values)
+        else:
+            result[name] = column_array(values)
+    return result
+
+
+def format_result(result, result_format):
+    return result.to_arrow() if result_format == RESULT_FORMAT_ARROW else result
+
+
+def check_result_format(result_format):
+    if result_format not in RESULT_FORMATS:
+        raise ValueError(f'Unknown result format: {result_format}')
+
+
+class ColumnarInfluxDBWrapper(InfluxDBWrapper):
+    """
+    query 支持 result_format 的 InfluxDBWrapper
+    """
+
+    def query(self, store=None, selects=None, measurement=None, where=None, group_by=None, order_by=None, limit=None,
+              offset=None, slimit=None, soffset=None, interval=None, aggregate=None, is_standard=True,
+              result_format=RESULT_FORMAT_ROWS):
+        check_result_format(result_format)
+        _local.columnar = result_format != RESULT_FORMAT_ROWS
+        try:
+            result = super().query(store, selects, measurement, where, group_by, order_by, limit, offset, slimit,
+                                   soffset, interval, aggregate, is_standard)
+        finally:
+            _local.columnar = False
+        if result_format == RESULT_FORMAT_ROWS or result is None:
+            return result
+        return format_result(result, result_format)
+
+    @staticmethod
+    def _arrange_query_results(results):
+        if not getattr(_local, 'columnar', False):
+            return InfluxDBWrapper._arrange_query_results(results)
+        return ColumnarInfluxDBWrapper._series_to_columns(results)
+
+    @staticmethod
+    def _series_to_columns(results):
+        """
+        查询返回的 series 合并为列，分组(tags)的值按行展开
+        """
+        names, columns = [], {}
+        row_count = 0
+        for statement in results or ():
+            for series in statement.get('series') or ():
+                values = series.get('values') or []
+                tags = series.get('tags') or {}
+                for name in [*series['columns'], *tags]:
+                    if name not in columns:
+                        names.append(name)
+                        columns[name] = [None] * row_count
+                for index, name in enumerate(series['columns']):
+                    columns[name].extend(row[index] for row in values)
+                for name, value in tags.items():
+                    columns[name].extend([value] * len(values))
+                row_count += len(values)
+                # 本 series 没有的列补空值
+                for name in names:
+                    if len(columns[name]) < row_count:
+                        columns[name].extend([None] * (row_count - len(columns[name])))
+        return build_columns(names, [columns[name] for name in names], INFLUXDB_TIME_COLUMN)
+
+
+class _ColumnarCursor(object):
+    """
+    记录当前线程最后一次查询的列名及原始结果行，原 query 取到空结果，不创建逐行 dict
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, *args, **kwargs):
+        result = self._cursor.execute(*args, **kwargs)
+        _local.description = self._cursor.description
+        return result
+
+    def fetchall(self):
+        _local.rows = self._cursor.fetchall()
+        return []
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _ColumnarConnection(object):
+    """
+    只有正在执行列式查询的线程取得 _ColumnarCursor，其它线程使用原连接的游标
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._conn.cursor(*args, **kwargs)
+        # 多个线程同时列式查询时连接可能被包装多层，游标只包装一次
+        if getattr(_local, 'columnar', False) and not isinstance(cursor, _ColumnarCursor):
+            return _ColumnarCursor(cursor)
+        return cursor
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class ColumnarTDengineWrapper(TDengineWrapper):
+    """
+    query 支持 result_format 的 TDengineWrapper
+    查询语句仍由原 query 生成(is_standard 时包含 _ts/_wstart AS _ts 时间列)，结果行由游标直接取出后按列转置
+    """
+
+    def query(self, store=None, selects=None, measurement=None, where=None, group_by=None, order_by=None, limit=None,
+              offset=None, slimit=None, soffset=None, interval=None, aggregate=None, is_standard=True,
+              result_format=RESULT_FORMAT_ROWS):
+        check_result_format(result_format)
+        if result_format == RESULT_FORMAT_ROWS:
+            return super().query(store, selects, measurement, where, group_by, order_by, limit, offset, slimit,
+                                 soffset, interval, aggregate, is_standard)
+        if not self.conn:
+            self.connect()
+        conn = self.conn
+        # 包装后的连接只对当前线程生效，列名及结果行按线程记录
+        proxy = self.conn = _ColumnarConnection(conn)
+        _local.columnar, _local.description, _local.rows = True, None, None
+        try:
+            super().query(store, selects, measurement, where, group_by, order_by, limit, offset, slimit, soffset,
+                          interval, aggregate, is_standard)
+        finally:
+            _local.columnar = False
+            # 其它线程已换上自己的包装时不还原，留下的包装对其它线程透明
+            if self.conn is proxy:
+                self.conn = conn
+        rows, description = _local.rows, _local.description
+        _local.description, _local.rows = None, None
+        if not rows or not description:
+            return format_result(ColumnarResult(), result_format)
+        names = [column[0] for column in description]
+        return format_result(build_columns(names, list(zip(*rows)), TDENGINE_TIME_COLUMN), result_format)
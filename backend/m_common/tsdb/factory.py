@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+时序数据库客户端工厂扩展
+
+DatabaseFactory.get_client 按配置返回扩展的客户端，query 均支持 result_format(columnar)，并提供 query_iter(streaming):
+    influxdb  StreamingInfluxDBWrapper，INFLUXDB_WRITE_MODE=batching 时为 BatchingInfluxDBWrapper(influxdb_batching)
+    tdengine  StreamingTDengineWrapper，TDENGINE_POOL_ENABLED=True 时为 PooledTDengineWrapper(tdengine_pool)
+    sqlite    SQLiteWrapper(sqlite_wrapper)，嵌入式，数据保存在本地文件，用于测试、性能基准与单机部署
+    TSDB_FANOUT_ENABLED=True 时以上客户端的多设备查询按设备分片并发(fanout)
+    TSDB_QUERY_CACHE_ENABLED=True 时以上客户端再增加查询结果缓存(query_cache)，缓存合并后的结果
+install() 由 backend.m_common 导入时执行，isw_adapter 以外通过工厂获取客户端的调用方同样生效。
+"""
+from functools import lru_cache
+
+from backend.m_common.tsdb.fanout import FanOutMixin, TSDB_FANOUT_ENABLED
+from backend.m_common.tsdb.influxdb_batching import BatchingInfluxDBWrapper, INFLUXDB_WRITE_MODE, \
+    WRITE_MODE_BATCHING
+from backend.m_common.tsdb.interface import DatabaseFactory, Logger
+from backend.m_common.tsdb.query_cache import QueryCacheMixin, TSDB_QUERY_CACHE_ENABLED
+from backend.m_common.tsdb.sqlite_wrapper import SQLiteWrapper
+from backend.m_common.tsdb.streaming import StreamingInfluxDBWrapper, StreamingTDengineWrapper
+from backend.m_common.tsdb.tdengine_pool import PooledTDengineWrapper, TDENGINE_POOL_ENABLED
+
+_factory_get_client = DatabaseFactory.get_client
+
+
+@lru_cache(maxsize=None)
+def with_fanout(wrapper_class):
+    return type(f'FanOut{wrapper_class.__name__}', (FanOutMixin, wrapper_class), {'__module__': __name__})
+
+
+@lru_cache(maxsize=None)
+def with_query_cache(wrapper_class):
+    return type(f'Cached{wrapper_class.__name__}', (QueryCacheMixin, wrapper_class), {'__module__': __name__})
+
+
+def get_wrapper_class(db_type):
+    """
+    :return: 客户端类，未知类型返回 None
+    """
+    if db_type == 'influxdb':
+        batching = INFLUXDB_WRITE_MODE == WRITE_MODE_BATCHING
+        wrapper_class = BatchingInfluxDBWrapper if batching else StreamingInfluxDBWrapper
+    elif db_type == 'tdengine':
+        wrapper_class = PooledTDengineWrapper if TDENGINE_POOL_ENABLED else StreamingTDengineWrapper
+    elif db_type == 'sqlite':
+        wrapper_class = SQLiteWrapper
+    else:
+        return None
+    if TSDB_FANOUT_ENABLED:
+        wrapper_class = with_fanout(wrapper_class)
+    return with_query_cache(wrapper_class) if TSDB_QUERY_CACHE_ENABLED else wrapper_class
+
+
+def get_client(db_type, logger=None):
+    """
+    DatabaseFactory.get_client
+    """
+    wrapper_class = get_wrapper_class(db_type)
+    if wrapper_class is None:
+        return _factory_get_client(db_type, logger=logger)
+    return wrapper_class(logger=logger or Logger)
+
+
+def install():
+    """
+    替换 DatabaseFactory.get_client
+    """
+    if DatabaseFactory.get_client is not get_client:
+        DatabaseFactory.get_client = staticmethod(get_client)
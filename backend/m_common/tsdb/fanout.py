@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+多设备查询分片并发
+
+DeviceElPowerManage.get_devices_el_during_data、get_devices_el_sort_data、waste_stat_manage.get_devices_el_during_data
+把项目的全部设备放入一个 device_username 条件(InfluxDB 为 OR 连接的等式，TDengine 为 IN 列表)，
+大项目的查询语句很长，查询慢甚至超过语句长度限制。
+    fan_out_query  按设备列表分片查询，供新代码直接调用
+    FanOutMixin    TSDB_FANOUT_ENABLED=True 时 DatabaseFactory.get_client 返回的客户端 query 识别条件中的设备列表，
+                   设备数超过分片大小时自动分片，上述已有调用方不需要修改
+分片在有界线程池中并发查询(每次查询最多 TSDB_FANOUT_MAX_WORKERS 个线程)，结果合并后按 order_by 重新排序。
+第 i 个分片须在 (i // 线程数 + 1) * TSDB_FANOUT_TIMEOUT 秒内完成，超时或出错的分片记录在结果的 errors 中，
+其余分片的结果照常返回(部分失败)，全部分片失败时与 query 出错相同返回 None。
+结果按设备分开时才能分片合并: 按 device_username 分组，或不含聚合、不分页的原始数据查询。
+TDengineWrapper 只有一个连接，不能多线程共用，未启用连接池时分片依次查询；SQLiteWrapper 每个线程使用单独的连接。
+"""
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from backend.m_common.tsdb.abstract import env
+from backend.m_common.tsdb.columnar import RESULT_FORMAT_ROWS
+from backend.m_common.tsdb.sqlite_wrapper import SQLiteWrapper
+from backend.m_common.tsdb.tdengine_pool import PooledTDengineWrapper
+from backend.m_common.tsdb.tdengine_wrapper import TDengineWrapper
+
+TSDB_FANOUT_ENABLED = env.bool('TSDB_FANOUT_ENABLED', default=False)
+# 每个分片的设备数，InfluxDB 的设备条件为 OR 连接的等式，分片较小
+TSDB_FANOUT_INFLUXDB_CHUNK_SIZE = env.int('TSDB_FANOUT_INFLUXDB_CHUNK_SIZE', default=100)
+TSDB_FANOUT_TDENGINE_CHUNK_SIZE = env.int('TSDB_FANOUT_TDENGINE_CHUNK_SIZE', default=500)
+# 每次查询的最大并发线程数
+TSDB_FANOUT_MAX_WORKERS = env.int('TSDB_FANOUT_MAX_WORKERS', default=4)
+# 每个分片的超时时间(秒)
+TSDB_FANOUT_TIMEOUT = env.int('TSDB_FANOUT_TIMEOUT', default=30)
+
+DEVICE_FIELD = 'device_username'
+# 渲染后条件中的设备列表: ("device_username" = 'a' OR "device_username" = 'b')、`device_username` in ('a','b')
+INFLUXDB_DEVICES_PATTERN = re.compile(r'''\("device_username" = '[^']*'(?: OR "device_username" = '[^']*')*\)''')
+TDENGINE_DEVICES_PATTERN = re.compile(r"`device_username` in \('[^']*'(?:,'[^']*')*\)")
+DEVICE_VALUE_PATTERN = re.compile(r"'([^']*)'")
+AGGREGATE_SELECT_PATTERN = re.compile(r'\w+\s*\(')
+
+
+class FanOutRows(list):
+    """
+    分片查询合并后的逐行结果
+    errors: 失败的分片 [(设备列表, 异常), ...]
+    """
+
+    def __init__(self, rows=(), errors=None):
+        super().__init__(rows)
+        self.errors = errors or []
+
+    @property
+    def partial(self):
+        return bool(self.errors)
+
+    @property
+    def failed_devices(self):
+        return [device for devices, _ in self.errors for device in devices]
+
+
+def chunked(items, size):
+    items = list(items)
+    return [items[index:index + size] for index in range(0, len(items), size)]
+
+
+def default_chunk_size(client):
+    if isinstance(client, TDengineWrapper):
+        return TSDB_FANOUT_TDENGINE_CHUNK_SIZE
+    return TSDB_FANOUT_INFLUXDB_CHUNK_SIZE
+
+
+def is_thread_safe(client):
+    """
+    客户端能否在多个线程中同时查询
+    """
+    return not isinstance(client, TDengineWrapper) or isinstance(client, (PooledTDengineWrapper, SQLiteWrapper))
+
+
+def sort_rows(rows, order_by):
+    """
+    按 order_by 排序(原地，稳定)
+    :param order_by: ['time', '-f_value', 'f_value desc', ...]，time 对应 _time，空值排在最前
+    """
+    for item in reversed(order_by or []):
+        name, _, direction = str(item).strip().partition(' ')
+        reverse = name.startswith('-') or direction.strip().lower() == 'desc'
+        name = name.lstrip('-').strip('`"')
+        if name == 'time':
+            name = '_time'
+        rows.sort(key=lambda row: (row.get(name) is not None, row.get(name)), reverse=reverse)
+    return rows
+
+
+def run_chunks(func, chunks, max_workers=TSDB_FANOUT_MAX_WORKERS, timeout=TSDB_FANOUT_TIMEOUT):
+    """
+    在有界线程池中对每个分片执行 func
+    :return: (与分片对应的结果列表，失败的分片结果为 None, [(分片, 异常), ...])
+    """
+    results, errors = [None] * len(chunks), []
+    if max_workers <= 1 or len(chunks) <= 1:
+        # 依次执行时无法中断，不限制超时
+        for index, chunk in enumerate(chunks):
+            try:
+                results[index] = func(chunk)
+            except Exception as err:
+                errors.append((chunk, err))
+        return results, errors
+    workers = min(max_workers, len(chunks))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tsdb_fanout')
+    try:
+        start = time.monotonic()
+        futures = [executor.submit(func, chunk) for chunk in chunks]
+        for index, (chunk, future) in enumerate(zip(chunks, futures)):
+            # 第 index 个分片最早在第 index // workers 轮开始执行
+            remaining = start + timeout * (index // workers + 1) - time.monotonic()
+            try:
+                results[index] = future.result(timeout=max(0, remaining))
+            except FutureTimeoutError:
+                future.cancel()
+                errors.append((chunk, TimeoutError(f'tsdb 分片查询超时({timeout}s)')))
+            except Exception as err:
+                errors.append((chunk, err))
+    finally:
+        # 超时的分片仍在执行，不等待
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results, errors
+
+
+def merge_chunks(results, errors, order_by=None):
+    """
+    :return: FanOutRows，全部分片失败时为 None
+    """
+    if errors and not any(result is not None for result in results):
+        return None
+    rows = FanOutRows((row for result in results if result for row in result), errors)
+    return sort_rows(rows, order_by)
+
+
+def log_errors(logger, errors):
+    for devices, err in errors:
+        logger.error(f'tsdb 分片查询失败 设备<<{devices[0]}>>等{len(devices)}个: {err}')
+
+
+def fan_out_query(client, device_usernames, store=None, selects=None, measurement=None, where=None, group_by=None,
+                  order_by=None, interval=None, aggregate=None, chunk_size=None, max_workers=TSDB_FANOUT_MAX_WORKERS,
+                  timeout=TSDB_FANOUT_TIMEOUT):
+    """
+    按设备分片查询后合并
+    :param client: DatabaseFactory.get_client 返回的客户端
+    :param device_usernames: 设备列表，每个分片的条件为 where AND device_username in (分片)
+    :param chunk_size: 每个分片的设备数，默认按数据库类型
+    :return: FanOutRows(部分分片失败时 errors 不为空)，全部失败时为 None
+    """
+    q = client.q
+
+    def query_chunk(devices):
+        chunk_where = q(DEVICE_FIELD, devices, 'in')
+        if where is not None:
+            chunk_where = chunk_where & where
+        # TDengineWrapper 会修改传入的 selects、group_by
+        rows = client.query(store=store, selects=list(selects or []), measurement=measurement, where=chunk_where,
+                            group_by=list(group_by) if group_by else group_by, order_by=order_by,
+                            interval=interval, aggregate=aggregate)
+        if rows is None:
+            raise RuntimeError('query 返回 None')
+        return rows
+
+    chunks = chunked(device_usernames, chunk_size or default_chunk_size(client))
+    if not is_thread_safe(client):
+        max_workers = 1
+    results, errors = run_chunks(query_chunk, chunks, max_workers, timeout)
+    log_errors(client._logger, errors)
+    return merge_chunks(results, errors, order_by)
+
+
+class FanOutMixin(object):
+    """
+    query 条件中的设备列表超过分片大小时分片并发查询，与 StreamingInfluxDBWrapper、StreamingTDengineWrapper 及其子类组合使用
+    """
+
+    def query(self, store=None, selects=None, measurement=None, where=None, group_by=None, order_by=None, limit=None,
+              offset=None, slimit=None, soffset=None, interval=None, aggregate=None, is_standard=True,
+              result_format=RESULT_FORMAT_ROWS):
+        kwargs = dict(
+            store=store, selects=selects, measurement=measurement, where=where, group_by=group_by,
+            order_by=order_by, limit=limit, offset=offset, slimit=slimit, soffset=soffset, interval=interval,
+            aggregate=aggregate, is_standard=is_standard, result_format=result_format,
+        )
+        if not self._can_fan_out(kwargs):
+            return super().query(**kwargs)
+        where_str = str(where)
+        pattern = TDENGINE_DEVICES_PATTERN if isinstance(self, TDengineWrapper) else INFLUXDB_DEVICES_PATTERN
+        matches = list(pattern.finditer(where_str))
+        chunk_size = default_chunk_size(self)
+        # 多个设备条件(如 OR 组合)无法确定如何拆分
+        if len(matches) != 1:
+            return super().query(**kwargs)
+        match = matches[0]
+        devices = DEVICE_VALUE_PATTERN.findall(match.group(0))
+        if len(devices) <= chunk_size:
+            return super().query(**kwargs)
+        prefix, suffix = where_str[:match.start()], where_str[match.end():]
+
+        def query_chunk(chunk):
+            chunk_kwargs = dict(
+                kwargs, where=self.q(condition=f'{prefix}{self.q(DEVICE_FIELD, chunk, "in")}{suffix}'),
+                selects=list(selects or []), group_by=list(group_by) if group_by else group_by,
+            )
+            rows = super(FanOutMixin, self).query(**chunk_kwargs)
+            if rows is None:
+                raise RuntimeError('query 返回 None')
+            return rows
+
+        max_workers = TSDB_FANOUT_MAX_WORKERS if is_thread_safe(self) else 1
+        results, errors = run_chunks(query_chunk, chunked(devices, chunk_size), max_workers, TSDB_FANOUT_TIMEOUT)
+        log_errors(self._logger, errors)
+        return merge_chunks(results, errors, order_by)
+
+    @staticmethod
+    def _can_fan_out(kwargs):
+        """
+        分片结果直接合并与原查询相同: 逐行结果、不分页，并且按设备分组或不含聚合
+        """
+        if kwargs['where'] is None or kwargs['result_format'] != RESULT_FORMAT_ROWS or not kwargs['is_standard']:
+            return False
+        if any(kwargs[name] is not None for name in ('limit', 'offset', 'slimit', 'soffset')):
+            return False
+        if DEVICE_FIELD in (kwargs['group_by'] or []):
+            return True
+        selects = kwargs['selects'] or []
+        if isinstance(selects, str):
+            selects = [selects]
+        return (kwargs['interval'] is None and kwargs['aggregate'] is None
+                and not any(AGGREGATE_SELECT_PATTERN.search(str(select)) for select in selects))
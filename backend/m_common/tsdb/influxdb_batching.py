@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+InfluxDB 批量异步写入
+
+InfluxDBWrapper 每次写入都创建 SYNCHRONOUS 模式的 write_api，write_data 会阻塞到 HTTP 请求返回。
+INFLUXDB_WRITE_MODE=batching 时 DatabaseFactory.get_client('influxdb') 返回 BatchingInfluxDBWrapper(见 factory):
+    写入只放入缓冲区，由 influxdb_client 的后台线程按批(INFLUXDB_BATCH_SIZE)或按间隔(INFLUXDB_FLUSH_INTERVAL)提交，
+    失败时按 INFLUXDB_RETRY_INTERVAL、INFLUXDB_EXPONENTIAL_BASE 指数退避重试
+close() 及进程退出时提交缓冲区中剩余的数据。
+写入失败不会抛给调用方，通过 error_callback/retry_callback 通知(默认记录日志)。
+"""
+import atexit
+import threading
+import weakref
+
+from influxdb_client.client.write_api import WriteOptions, WriteType
+
+from backend.m_common.tsdb.abstract import env
+from backend.m_common.tsdb.streaming import StreamingInfluxDBWrapper
+
+WRITE_MODE_SYNCHRONOUS = 'synchronous'
+WRITE_MODE_BATCHING = 'batching'
+
+# 写入模式 synchronous/batching
+INFLUXDB_WRITE_MODE = env.str('INFLUXDB_WRITE_MODE', default=WRITE_MODE_SYNCHRONOUS)
+# 每批写入的点数
+INFLUXDB_BATCH_SIZE = env.int('INFLUXDB_BATCH_SIZE', default=1000)
+# 缓冲区提交间隔(毫秒)
+INFLUXDB_FLUSH_INTERVAL = env.int('INFLUXDB_FLUSH_INTERVAL', default=1000)
+# 提交时间随机抖动上限(毫秒)，避免多个进程同时提交
+INFLUXDB_JITTER_INTERVAL = env.int('INFLUXDB_JITTER_INTERVAL', default=0)
+# 首次重试等待(毫秒)
+INFLUXDB_RETRY_INTERVAL = env.int('INFLUXDB_RETRY_INTERVAL', default=5000)
+# 最大重试次数，0 表示不重试
+INFLUXDB_MAX_RETRIES = env.int('INFLUXDB_MAX_RETRIES', default=5)
+# 重试等待上限(毫秒)
+INFLUXDB_MAX_RETRY_DELAY = env.int('INFLUXDB_MAX_RETRY_DELAY', default=125000)
+# 一批数据的重试总时长上限(毫秒)
+INFLUXDB_MAX_RETRY_TIME = env.int('INFLUXDB_MAX_RETRY_TIME', default=180000)
+# 重试等待的指数退避底数
+INFLUXDB_EXPONENTIAL_BASE = env.int('INFLUXDB_EXPONENTIAL_BASE', default=2)
+# 关闭时等待缓冲区提交完成的上限(毫秒)
+INFLUXDB_MAX_CLOSE_WAIT = env.int('INFLUXDB_MAX_CLOSE_WAIT', default=300000)
+
+
+def batching_write_options():
+    return WriteOptions(
+        write_type=WriteType.batching,
+        batch_size=INFLUXDB_BATCH_SIZE,
+        flush_interval=INFLUXDB_FLUSH_INTERVAL,
+        jitter_interval=INFLUXDB_JITTER_INTERVAL,
+        retry_interval=INFLUXDB_RETRY_INTERVAL,
+        max_retries=INFLUXDB_MAX_RETRIES,
+        max_retry_delay=INFLUXDB_MAX_RETRY_DELAY,
+        max_retry_time=INFLUXDB_MAX_RETRY_TIME,
+        exponential_base=INFLUXDB_EXPONENTIAL_BASE,
+        max_close_wait=INFLUXDB_MAX_CLOSE_WAIT,
+    )
+
+
+# 尚未关闭的批量写入客户端，进程退出时提交其缓冲区
+_open_wrappers = weakref.WeakSet()
+
+
+class BatchingInfluxDBWrapper(StreamingInfluxDBWrapper):
+    """
+    批量异步写入的 InfluxDBWrapper，查询等其它操作与 InfluxDBWrapper 相同
+    """
+
+    def __init__(self, logger=None, write_options=None, error_callback=None, retry_callback=None,
+                 success_callback=None):
+        """
+        :param write_options: WriteOptions，默认按 INFLUXDB_* 配置
+        :param error_callback: 一批数据最终写入失败 error_callback(conf, data, exception)
+            conf 为 (bucket, org, precision)，data 为该批数据的 line protocol
+        :param retry_callback: 一批数据写入失败、即将重试 retry_callback(conf, data, exception)
+        :param success_callback: 一批数据写入成功 success_callback(conf, data)
+        """
+        super().__init__(logger=logger)
+        self.write_options = write_options or batching_write_options()
+        self.error_callback = error_callback
+        self.retry_callback = retry_callback
+        self.success_callback = success_callback
+        self._write_api = None
+        self._write_api_lock = threading.Lock()
+
+    def on_write_error(self, conf, data, exception):
+        if self.error_callback is not None:
+            return self.error_callback(conf, data, exception)
+        self._logger.error(f'influxdb 批量写入失败 bucket<<{conf[0]}>>: {exception}')
+
+    def on_write_retry(self, conf, data, exception):
+        if self.retry_callback is not None:
+            return self.retry_callback(conf, data, exception)
+        self._logger.warning(f'influxdb 批量写入重试 bucket<<{conf[0]}>>: {exception}')
+
+    def on_write_success(self, conf, data):
+        if self.success_callback is not None:
+            return self.success_callback(conf, data)
+
+    def _prepare_write_api(self):
+        """
+        所有写入共用一个批量 write_api，写入只放入缓冲区，不等待 InfluxDB 响应
+        """
+        if self._write_api is not None:
+            return self._write_api
+        with self._write_api_lock:
+            if self._write_api is None:
+                if not self.client:
+                    self.connect()
+                self._write_api = self.client.write_api(
+                    write_options=self.write_options,
+                    success_callback=self.on_write_success,
+                    error_callback=self.on_write_error,
+                    retry_callback=self.on_write_retry,
+                )
+                _open_wrappers.add(self)
+        return self._write_api
+
+    def flush(self):
+        """
+        提交缓冲区中的数据并等待完成，之后的写入使用新的 write_api
+        """
+        with self._write_api_lock:
+            write_api, self._write_api = self._write_api, None
+        if write_api is not None:
+            write_api.close()
+        _open_wrappers.discard(self)
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+@atexit.register
+def _flush_on_exit():
+    for wrapper in list(_open_wrappers):
+        try:
+            wrapper.flush()
+        except Exception as err:
+            wrapper._logger.error(f'influxdb 退出时提交缓冲区失败: {err}')
+
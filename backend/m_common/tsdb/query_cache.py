@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+时序数据库查询结果缓存
+
+看板接口反复以相同参数调用 DatabaseInterface.query，TSDB_QUERY_CACHE_ENABLED=True 时 DatabaseFactory.get_client
+返回的客户端(InfluxDB、TDengine 相同)在 query 外增加一层缓存(django cache TSDB_QUERY_CACHE_ALIAS):
+    缓存键为 query 各参数的规范形式，where 取渲染后的条件字符串
+    时间范围的结束时间早于 当前时间 - TSDB_QUERY_CACHE_SETTLE 秒 的查询结果不再变化，缓存 TSDB_QUERY_CACHE_SETTLED_TTL 秒
+    时间范围没有结束时间或结束时间接近当前时间的查询，缓存 TSDB_QUERY_CACHE_LIVE_TTL 秒
+    相同查询同时未命中时只有一个线程/进程查询数据库，其它调用等待其结果
+写入早于 TSDB_QUERY_CACHE_SETTLE 的数据(补录)或删除数据时，该存储桶的缓存版本号加一，原有缓存不再使用，
+到期后由缓存自行删除(other_data 未设置 maxmemory，缓存不能不过期)。
+"""
+import copy
+import hashlib
+import json
+import re
+import threading
+import time
+from datetime import datetime
+
+from backend.m_common.tsdb.abstract import env
+from backend.m_common.tsdb.columnar import RESULT_FORMAT_ROWS
+from backend.m_common.tsdb.conf import TIME_ZONE_OFFSET
+
+TSDB_QUERY_CACHE_ENABLED = env.bool('TSDB_QUERY_CACHE_ENABLED', default=False)
+# 缓存使用的 django cache
+TSDB_QUERY_CACHE_ALIAS = env.str('TSDB_QUERY_CACHE_ALIAS', default='other_data')
+# 结束时间在该时间(秒)以内的时间范围视为仍在变化(数据上报延迟)
+TSDB_QUERY_CACHE_SETTLE = env.int('TSDB_QUERY_CACHE_SETTLE', default=300)
+# 仍在变化的时间范围的缓存时间(秒)
+TSDB_QUERY_CACHE_LIVE_TTL = env.int('TSDB_QUERY_CACHE_LIVE_TTL', default=10)
+# 不再变化的历史时间范围的缓存时间(秒)
+TSDB_QUERY_CACHE_SETTLED_TTL = env.int('TSDB_QUERY_CACHE_SETTLED_TTL', default=3 * 24 * 3600)
+# 等待其它进程查询结果的最长时间(秒)，超过后自行查询
+TSDB_QUERY_CACHE_LOCK_TIMEOUT = env.int('TSDB_QUERY_CACHE_LOCK_TIMEOUT', default=30)
+
+CACHE_KEY_PREFIX = 'tsdb_query'
+# 等待其它进程查询结果的轮询间隔(秒)
+LOCK_POLL_INTERVAL = 0.05
+
+# 渲染后条件中的时间比较: time >= '2024-01-01T00:00:00+08:00'、`_ts` < 1700000000000
+TIME_CONDITION_PATTERN = re.compile(
+    r'''[`"]?\b(?:time|_ts|_time)\b[`"]?\s*(<=|<|>=|>|=)\s*(?:'([^']*)'|(\d+))'''
+)
+NOW_PATTERN = re.compile(r'\bnow\s*\(', re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def to_timestamp(text, number):
+    """
+    条件中的时间值转换为秒级时间戳，无法识别时返回 None
+    :param text: 时间字符串
+    :param number: 整数时间戳，按数量级识别秒/毫秒/微秒/纳秒
+    """
+    if number:
+        value = int(number)
+        for scale in (1e18, 1e15, 1e12):
+            if value >= scale:
+                return value / (scale / 1e9)
+        return value
+    try:
+        dt = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = datetime.fromisoformat(dt.isoformat() + TIME_ZONE_OFFSET)
+    return dt.timestamp()
+
+
+def range_end(where_str):
+    """
+    条件中时间范围的结束时间戳(秒)
+    :return: 没有结束时间(或无法识别、包含 now())时为 None
+    """
+    if not where_str or NOW_PATTERN.search(where_str):
+        return None
+    ends, start_count, end_count = [], 0, 0
+    for operator, text, number in TIME_CONDITION_PATTERN.findall(where_str):
+        timestamp = to_timestamp(text, number)
+        if timestamp is None:
+            return None
+        if operator in ('>', '>='):
+            start_count += 1
+            continue
+        end_count += 1
+        ends.append(timestamp)
+    # OR 组合的多个时间范围中任一个没有结束时间
+    if not ends or start_count > end_count:
+        return None
+    return max(ends)
+
+
+def normalize_where(where):
+    if where is None:
+        return ''
+    return WHITESPACE_PATTERN.sub(' ', str(where)).strip()
+
+
+def get_cache():
+    from django.core.cache import caches
+    return caches[TSDB_QUERY_CACHE_ALIAS]
+
+
+class _Flight(object):
+    """
+    进行中的查询，同一进程内相同的未命中等待其结果
+    """
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class QueryCacheMixin(object):
+    """
+    DatabaseInterface.query 结果缓存，与 StreamingInfluxDBWrapper、StreamingTDengineWrapper 及其子类组合使用
+    """
+    # {缓存键: _Flight}
+    _flights = {}
+    _flights_lock = threading.Lock()
+
+    def query(self, store=None, selects=None, measurement=None, where=None, group_by=None, order_by=None, limit=None,
+              offset=None, slimit=None, soffset=None, interval=None, aggregate=None, is_standard=True,
+              result_format=RESULT_FORMAT_ROWS, cache=True):
+        """
+        :param cache: 为 False 时不使用缓存
+        """
+        kwargs = dict(
+            store=store, selects=selects, measurement=measurement, where=where, group_by=group_by,
+            order_by=order_by, limit=limit, offset=offset, slimit=slimit, soffset=soffset, interval=interval,
+            aggregate=aggregate, is_standard=is_standard, result_format=result_format,
+        )
+        if not cache:
+            return super().query(**kwargs)
+        try:
+            query_cache = get_cache()
+            where_str = normalize_where(where)
+            key = self.query_cache_key(query_cache, where_str, kwargs)
+            result = query_cache.get(key)
+        except Exception as err:
+            self._logger.warning(f'tsdb 查询缓存不可用: {err}')
+            return super().query(**kwargs)
+        if result is not None:
+            return result
+        return self._single_flight(query_cache, key, where_str, kwargs)
+
+    def query_cache_key(self, query_cache, where_str, kwargs):
+        params = dict(kwargs, where=where_str, version=query_cache.get(self.store_version_key(kwargs['store']), 0))
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+        return f'{CACHE_KEY_PREFIX}:{kwargs["store"]}:{digest}'
+
+    @staticmethod
+    def store_version_key(store):
+        return f'{CACHE_KEY_PREFIX}_version:{store}'
+
+    @staticmethod
+    def cache_timeout(where_str, result):
+        """
+        :return: 缓存时间(秒)
+        """
+        # 部分分片失败的结果(fanout.FanOutRows)不长期保存
+        if getattr(result, 'partial', False):
+            return TSDB_QUERY_CACHE_LIVE_TTL
+        end = range_end(where_str)
+        if end is None or end > time.time() - TSDB_QUERY_CACHE_SETTLE:
+            return TSDB_QUERY_CACHE_LIVE_TTL
+        # 历史范围查询结果为空可能是查询出错，不长期保存
+        return TSDB_QUERY_CACHE_SETTLED_TTL if len(result) else TSDB_QUERY_CACHE_LIVE_TTL
+
+    def _single_flight(self, query_cache, key, where_str, kwargs):
+        flights, lock = QueryCacheMixin._flights, QueryCacheMixin._flights_lock
+        with lock:
+            flight = flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = flights[key] = _Flight()
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            # 结果对象由发起查询的调用方持有，可能被修改
+            return copy.deepcopy(flight.result)
+        try:
+            flight.result = self._query_with_lock(query_cache, key, where_str, kwargs)
+            return flight.result
+        except Exception as err:
+            flight.error = err
+            raise
+        finally:
+            with lock:
+                flights.pop(key, None)
+            flight.event.set()
+
+    def _query_with_lock(self, query_cache, key, where_str, kwargs):
+        """
+        多进程间的同一查询只由取得锁的进程执行，其它进程轮询缓存
+        """
+        lock_key = f'{key}:lock'
+        deadline = time.monotonic() + TSDB_QUERY_CACHE_LOCK_TIMEOUT
+        while not query_cache.add(lock_key, 1, TSDB_QUERY_CACHE_LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                return super().query(**kwargs)
+            time.sleep(LOCK_POLL_INTERVAL)
+            result = query_cache.get(key)
+            if result is not None:
+                return result
+        try:
+            result = super().query(**kwargs)
+            if result is not None:
+                query_cache.set(key, result, self.cache_timeout(where_str, result))
+            return result
+        finally:
+            query_cache.delete(lock_key)
+
+    def invalidate_store(self, store):
+        """
+        存储桶数据变化，之前的查询缓存不再使用
+        """
+        try:
+            query_cache = get_cache()
+            version_key = self.store_version_key(store)
+            # 版本号不过期: 过期后从 1 重新计数会命中版本号相同的旧缓存
+            if not query_cache.add(version_key, 1, None):
+                query_cache.incr(version_key)
+        except Exception as err:
+            self._logger.warning(f'tsdb 查询缓存清理失败 store<<{store}>>: {err}')
+
+    @staticmethod
+    def _is_late(timestamp):
+        """
+        写入的数据早于 TSDB_QUERY_CACHE_SETTLE，可能落在已缓存的历史范围内
+        """
+        if isinstance(timestamp, datetime):
+            seconds = timestamp.timestamp()
+        elif isinstance(timestamp, int):
+            seconds = to_timestamp(None, timestamp)
+        else:
+            return False
+        return seconds < time.time() - TSDB_QUERY_CACHE_SETTLE
+
+    def write_data(self, store=None, measurement=None, fields=None, tags=None, timestamp=None):
+        result = super().write_data(store=store, measurement=measurement, fields=fields, tags=tags,
+                                    timestamp=timestamp)
+        if self._is_late(timestamp):
+            self.invalidate_store(store)
+        return result
+
+    def write_multiple_data(self, store, data_points):
+        result = super().write_multiple_data(store, data_points)
+        if any(self._is_late(point.get('timestamp')) for point in data_points):
+            self.invalidate_store(store)
+        return result
+
+    def delete(self, store=None, measurement=None, where=None):
+        result = super().delete(store=store, measurement=measurement, where=where)
+        self.invalidate_store(store)
+        return result
+
+    def delete_old_data(self, store_name, start):
+        result = super().delete_old_data(store_name, start)
+        self.invalidate_store(store_name)
+        return result
+
+    def delete_store(self, name):
+        result = super().delete_store(name)
+        self.invalidate_store(name)
+        return result
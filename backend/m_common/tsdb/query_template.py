@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+查询条件模板
+
+每次查询都要构造 Q 树，& / | 组合时逐层调用 __str__、_value_to_str 渲染。
+看板查询的条件结构相同，只有时间范围、设备列表等取值不同:
+    @query_template 装饰的函数描述条件结构，参数为占位值
+    第一次以某种结构(Q 类、各参数的类型: 字符串/数值/时间/列表/None)调用时，以占位值构造一次 Q 树并渲染，
+    渲染结果按占位拆分为模板缓存，之后的调用只把参数值渲染后拼接，返回 Q(condition=条件字符串)
+参数值由该 Q 类的 _value_to_str 渲染，列表参数按该 Q 类渲染 in 条件的格式拼接，结果与直接构造 Q 树相同。
+
+    @query_template
+    def device_range(q, key, devices, start, end):
+        return q('key', key) & q('device_username', devices, 'in') & q('time', start, '>=') & q('time', end, '<')
+
+    client.query(store, selects, 'data', where=device_range(client.q, 'f_epi', usernames, start, end))
+
+TDengine 的参数绑定(taosws.TaosStmt)只支持写入，不能读取查询结果，两种数据库均使用渲染后的条件字符串。
+"""
+import functools
+import inspect
+import re
+import threading
+from datetime import datetime, timezone
+
+PLACEHOLDER = '__tsdb_param_{}__'
+# 占位时间、数值，与参数值类型相同(Q 按值类型渲染字段，如 time 字段的时间值)
+PLACEHOLDER_DATETIME = datetime(1999, 12, 31, 23, 59, 59, 990000)
+PLACEHOLDER_NUMBER = 7 * 10 ** 15
+
+KIND_NONE = 'none'
+KIND_LIST = 'list'
+KIND_CONST = 'const'
+
+
+def param_kind(value):
+    """
+    参数在条件结构中的类型，布尔值等无法占位的参数以值本身作为结构的一部分
+    """
+    if value is None:
+        return KIND_NONE
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return KIND_LIST
+    if isinstance(value, datetime):
+        return 'datetime', value.tzinfo is not None
+    if isinstance(value, (str, float)) or (isinstance(value, int) and not isinstance(value, bool)):
+        return type(value).__name__
+    return KIND_CONST, value
+
+
+def placeholder(kind, index, value):
+    """
+    :return: 占位值，列表参数为两个占位组成的列表
+    """
+    if kind == KIND_NONE:
+        return None
+    if kind == KIND_LIST:
+        return [PLACEHOLDER.format(f'{index}_0'), PLACEHOLDER.format(f'{index}_1')]
+    if kind == 'str':
+        return PLACEHOLDER.format(index)
+    if kind == 'int':
+        return PLACEHOLDER_NUMBER + index
+    if kind == 'float':
+        return PLACEHOLDER_NUMBER + index + 0.5
+    if isinstance(kind, tuple) and kind[0] == 'datetime':
+        dt = PLACEHOLDER_DATETIME.replace(microsecond=PLACEHOLDER_DATETIME.microsecond + index)
+        return dt.replace(tzinfo=timezone.utc) if kind[1] else dt
+    return value
+
+
+class CompiledTemplate(object):
+    """
+    渲染后的条件，按占位拆分为 [文本, 参数序号, 文本, ...]
+    """
+
+    def __init__(self, q_class, names, kinds, condition, tokens):
+        """
+        :param condition: 以占位值渲染的条件
+        :param tokens: {占位值渲染后的文本: 参数序号}
+        """
+        self.q_class = q_class
+        self.names = names
+        self.kinds = kinds
+        self.condition = condition
+        self.parts = []
+        # 列表参数以两个占位渲染，两个占位之间的文本为值之间的分隔:
+        # ("device_username" = 'a' OR "device_username" = 'b')、`device_username` in ('a','b')
+        # {参数序号: 分隔文本}
+        self.separators = {}
+        position = 0
+        pattern = re.compile('|'.join(re.escape(token) for token in sorted(tokens, key=len, reverse=True)))
+        matches = iter(pattern.finditer(condition)) if tokens else iter(())
+        for match in matches:
+            param = tokens[match.group(0)]
+            self.parts.append(condition[position:match.start()])
+            self.parts.append(param)
+            position = match.end()
+            if kinds[param] == KIND_LIST:
+                second = next(matches)
+                self.separators[param] = condition[match.end():second.start()]
+                position = second.end()
+        self.parts.append(condition[position:])
+
+    def render(self, values):
+        to_str = self.q_class._value_to_str
+        chunks = []
+        for part in self.parts:
+            if isinstance(part, str):
+                chunks.append(part)
+                continue
+            value = values[part]
+            if part in self.separators:
+                if not value:
+                    raise ValueError(f'查询条件参数 {self.names[part]} 不能为空列表')
+                separator = self.separators[part]
+                if all(type(item) is str for item in value):
+                    # 字符串值渲染为 '值'(不转义)，直接拼接
+                    chunks.append("'" + f"'{separator}'".join(value) + "'")
+                else:
+                    chunks.append(separator.join(str(to_str(item)) for item in value))
+            else:
+                chunks.append(str(to_str(value)))
+        return ''.join(chunks)
+
+
+class QueryTemplate(object):
+    """
+    由 query_template 装饰器创建，调用时返回 Q(condition=渲染后的条件)
+    """
+
+    def __init__(self, func):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.signature = inspect.signature(func)
+        self.names = list(self.signature.parameters)[1:]
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, q_class, *args, **kwargs):
+        names = self.names
+        if kwargs or len(args) != len(names):
+            bound = self.signature.bind(q_class, *args, **kwargs)
+            bound.apply_defaults()
+            values = [bound.arguments[name] for name in names]
+        else:
+            values = args
+        kinds = tuple(param_kind(value) for value in values)
+        template = self.compile(q_class, names, kinds, values)
+        return q_class(condition=template.render(values))
+
+    def compile(self, q_class, names, kinds, values):
+        """
+        :return: 该结构的 CompiledTemplate，已编译时从缓存取出
+        """
+        key = (q_class, kinds)
+        template = self._templates.get(key)
+        if template is None:
+            with self._lock:
+                template = self._templates.get(key)
+                if template is None:
+                    template = self._templates[key] = self._compile(q_class, names, kinds, values)
+        return template
+
+    def _compile(self, q_class, names, kinds, values):
+        placeholders, tokens = [], {}
+        for index, (kind, value) in enumerate(zip(kinds, values)):
+            value = placeholder(kind, index, value)
+            placeholders.append(value)
+            if kind == KIND_LIST:
+                tokens.update({str(q_class._value_to_str(item)): index for item in value})
+            elif value is not None and not (isinstance(kind, tuple) and kind[0] == KIND_CONST):
+                tokens[str(q_class._value_to_str(value))] = index
+        condition = str(self.func(q_class, **dict(zip(names, placeholders))))
+        return CompiledTemplate(q_class, names, kinds, condition, tokens)
+
+    def cache_size(self):
+        return len(self._templates)
+
+
+def query_template(func):
+    """
+    装饰描述查询条件结构的函数 func(q, *params)，返回 Q 树
+    """
+    return QueryTemplate(func)
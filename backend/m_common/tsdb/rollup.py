@@ -0,0 +1,558 @@
+# -*- coding: utf-8 -*-
+"""
+时序数据库汇总(rollup)
+
+统计代码读取 f_epi_point_hour、f_epi_during_hour 等汇总数据，日、月、年视图不再扫描原始数据点。
+汇总数据与原始数据相同: 测量 data，标签 device_username 与 key(为汇总名称)，字段 f_value，时间为窗口开始时间。
+每个汇总由 Rollup 声明: 名称、来源 key、聚合方式、时间粒度(hour/day/month)、保留天数，
+日、月汇总由上一级汇总计算(级联)，按声明顺序执行。聚合方式:
+    last/first/max/min/sum/mean/spread  窗口内来源数据的聚合值
+    increase                            窗口内最后一个值与之前最后一个值的差(累计量的用量)，负值(表计清零)丢弃
+维护方式 TSDB_ROLLUP_MODE:
+    celery  celery beat 每 TSDB_ROLLUP_INTERVAL 秒执行 RollupEngine.run，计算上次之后已结束的窗口，
+            窗口结束 TSDB_ROLLUP_SETTLE 秒后才计算(等待延迟上报的数据)，进度保存在 state 中
+    native  InfluxDB 为每个存储桶、每个汇总创建 task；TDengine 为小时汇总创建 stream(需要 3.x)，
+            其它汇总(stream 不支持的聚合方式与粒度)仍由 celery 计算
+RollupEngine.backfill 重新计算指定时间范围，lag 返回汇总数据的滞后时间。
+"""
+from datetime import datetime, timedelta
+
+from backend.m_common.tsdb.abstract import env
+from backend.m_common.tsdb.conf import TIME_ZONE_OFFSET
+from backend.m_common.tsdb.query_cache import QueryCacheMixin
+from backend.m_common.tsdb.sqlite_wrapper import SQLiteWrapper
+from backend.m_common.tsdb.tdengine_wrapper import TDengineWrapper
+
+TSDB_ROLLUP_ENABLED = env.bool('TSDB_ROLLUP_ENABLED', default=False)
+TSDB_ROLLUP_MODE = env.str('TSDB_ROLLUP_MODE', default='celery')
+# celery 汇总任务的执行间隔(秒)
+TSDB_ROLLUP_INTERVAL = env.int('TSDB_ROLLUP_INTERVAL', default=300)
+# 窗口结束后等待延迟数据的时间(秒)
+TSDB_ROLLUP_SETTLE = env.int('TSDB_ROLLUP_SETTLE', default=300)
+# 没有进度记录时计算最近的窗口数
+TSDB_ROLLUP_LOOKBACK = env.int('TSDB_ROLLUP_LOOKBACK', default=2)
+# 每次查询的最大窗口数(补算长时间范围时分段)
+TSDB_ROLLUP_CHUNK = env.int('TSDB_ROLLUP_CHUNK', default=168)
+# 汇总滞后超过该时间(秒)时告警
+TSDB_ROLLUP_LAG_ALERT = env.int('TSDB_ROLLUP_LAG_ALERT', default=7200)
+TSDB_ROLLUP_LAG_CHECK_INTERVAL = env.int('TSDB_ROLLUP_LAG_CHECK_INTERVAL', default=600)
+# 保存计算进度的 django cache
+TSDB_ROLLUP_STATE_ALIAS = env.str('TSDB_ROLLUP_STATE_ALIAS', default='other_data')
+
+MODE_CELERY = 'celery'
+MODE_NATIVE = 'native'
+
+RESOLUTION_HOUR = 'hour'
+RESOLUTION_DAY = 'day'
+RESOLUTION_MONTH = 'month'
+# {粒度: (query interval, flux duration)}，月窗口长度不固定，逐月查询
+RESOLUTIONS = {
+    RESOLUTION_HOUR: ('1h', '1h'),
+    RESOLUTION_DAY: ('1d', '1d'),
+    RESOLUTION_MONTH: (None, '1mo'),
+}
+
+AGGREGATE_INCREASE = 'increase'
+# {聚合方式: (InfluxQL/Flux 函数, TDengine 函数)}
+AGGREGATES = {
+    'last': ('last', 'last'),
+    'first': ('first', 'first'),
+    'max': ('max', 'max'),
+    'min': ('min', 'min'),
+    'sum': ('sum', 'sum'),
+    'mean': ('mean', 'avg'),
+    'spread': ('spread', 'spread'),
+    AGGREGATE_INCREASE: ('last', 'last'),
+}
+
+MEASUREMENT = 'data'
+VALUE_FIELD = 'f_value'
+VALUE_ALIAS = 'rollup_value'
+STATE_KEY_PREFIX = 'tsdb_rollup'
+# InfluxDB 查询语句中的 TZ 与 task 的 location
+FLUX_LOCATION = 'Asia/Shanghai'
+
+LOCAL_TZ = datetime.strptime(TIME_ZONE_OFFSET, '%z').tzinfo
+
+
+class Rollup(object):
+    """
+    汇总声明
+    """
+
+    def __init__(self, name, source, aggregate, resolution, retention=None):
+        """
+        :param name: 汇总数据的 key
+        :param source: 来源数据的 key(原始数据或上一级汇总)
+        :param aggregate: 聚合方式，AGGREGATES 之一
+        :param resolution: 时间粒度 hour/day/month
+        :param retention: 保留天数，None 为永久保留
+        """
+        if aggregate not in AGGREGATES:
+            raise ValueError(f'Unknown rollup aggregate: {aggregate}')
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f'Unknown rollup resolution: {resolution}')
+        self.name = name
+        self.source = source
+        self.aggregate = aggregate
+        self.resolution = resolution
+        self.retention = retention
+
+    @property
+    def interval(self):
+        return RESOLUTIONS[self.resolution][0]
+
+    def __repr__(self):
+        return f'Rollup({self.name} = {self.aggregate}({self.source}) per {self.resolution})'
+
+
+# 按依赖顺序声明，上一级汇总在前
+ROLLUPS = [
+    Rollup('f_epi_point_hour', 'f_epi', 'last', RESOLUTION_HOUR),
+    Rollup('f_epi_during_hour', 'f_epi', AGGREGATE_INCREASE, RESOLUTION_HOUR),
+    Rollup('f_epi_point_day', 'f_epi_point_hour', 'last', RESOLUTION_DAY),
+    Rollup('f_epi_during_day', 'f_epi_during_hour', 'sum', RESOLUTION_DAY),
+    Rollup('f_epi_point_month', 'f_epi_point_day', 'last', RESOLUTION_MONTH),
+    Rollup('f_epi_during_month', 'f_epi_during_day', 'sum', RESOLUTION_MONTH),
+]
+
+
+def register(rollup):
+    """
+    增加汇总声明，同名声明被替换；来源为其它汇总时须在来源之后注册
+    """
+    ROLLUPS[:] = [item for item in ROLLUPS if item.name != rollup.name]
+    ROLLUPS.append(rollup)
+    return rollup
+
+
+def get_rollups(names=None):
+    if not names:
+        return list(ROLLUPS)
+    unknown = set(names) - {rollup.name for rollup in ROLLUPS}
+    if unknown:
+        raise ValueError(f'Unknown rollups: {sorted(unknown)}')
+    return [rollup for rollup in ROLLUPS if rollup.name in names]
+
+
+def to_local(dt):
+    """
+    datetime(无时区时按 TIME_ZONE_OFFSET)转换为本地时区
+    """
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=LOCAL_TZ)
+    return dt.astimezone(LOCAL_TZ)
+
+
+def window_start(dt, resolution):
+    """
+    dt 所在窗口的开始时间(本地时区对齐)
+    """
+    dt = to_local(dt).replace(minute=0, second=0, microsecond=0)
+    if resolution == RESOLUTION_HOUR:
+        return dt
+    dt = dt.replace(hour=0)
+    if resolution == RESOLUTION_DAY:
+        return dt
+    return dt.replace(day=1)
+
+
+def next_window(dt, resolution, count=1):
+    """
+    count 个窗口之后的开始时间，count 为负数时为之前
+    """
+    if resolution == RESOLUTION_HOUR:
+        return dt + timedelta(hours=count)
+    if resolution == RESOLUTION_DAY:
+        return dt + timedelta(days=count)
+    months = dt.year * 12 + dt.month - 1 + count
+    return dt.replace(year=months // 12, month=months % 12 + 1)
+
+
+def iter_windows(start, end, resolution):
+    """
+    [start, end) 内各窗口的开始时间
+    """
+    current = window_start(start, resolution)
+    while current < end:
+        yield current
+        current = next_window(current, resolution)
+
+
+def to_ms(dt):
+    return int(dt.timestamp() * 1000)
+
+
+def from_ms(value):
+    return datetime.fromtimestamp(value / 1000, LOCAL_TZ)
+
+
+def get_state():
+    from django.core.cache import caches
+    return caches[TSDB_ROLLUP_STATE_ALIAS]
+
+
+def supports_native(client, rollup):
+    """
+    汇总能否由数据库原生维护: InfluxDB task 支持全部汇总，
+    TDengine stream 不支持跨窗口的 increase，天、月窗口按 UTC 对齐，只用于小时汇总，SQLite 不支持
+    """
+    if isinstance(client, SQLiteWrapper):
+        return False
+    if isinstance(client, TDengineWrapper):
+        return rollup.resolution == RESOLUTION_HOUR and rollup.aggregate != AGGREGATE_INCREASE
+    return True
+
+
+class RollupEngine(object):
+    """
+    通过 DatabaseInterface 查询、写入计算汇总，InfluxDB、TDengine 相同
+    """
+
+    def __init__(self, client, rollups=None, state=None, mode=TSDB_ROLLUP_MODE, settle=TSDB_ROLLUP_SETTLE,
+                 lookback=TSDB_ROLLUP_LOOKBACK, chunk=TSDB_ROLLUP_CHUNK, logger=None):
+        """
+        :param client: DatabaseFactory.get_client 返回的客户端
+        :param rollups: 汇总声明，默认为 ROLLUPS
+        :param state: 保存计算进度，需要 get/set(如 django cache)，None 时每次计算最近 lookback 个窗口
+        :param mode: celery 时 run 计算全部汇总，native 时只计算数据库不能原生维护的汇总
+        """
+        if mode not in (MODE_CELERY, MODE_NATIVE):
+            raise ValueError(f'Unknown rollup mode: {mode}')
+        self.client = client
+        self.rollups = list(ROLLUPS if rollups is None else rollups)
+        self.state = state
+        self.mode = mode
+        self.settle = settle
+        self.lookback = lookback
+        self.chunk = chunk
+        self.logger = logger or client._logger
+
+    @property
+    def is_tdengine(self):
+        return isinstance(self.client, TDengineWrapper)
+
+    def managed_rollups(self):
+        """
+        由本引擎计算的汇总
+        """
+        if self.mode == MODE_CELERY:
+            return list(self.rollups)
+        return [rollup for rollup in self.rollups if not supports_native(self.client, rollup)]
+
+    def native_rollups(self):
+        if self.mode == MODE_CELERY:
+            return []
+        return [rollup for rollup in self.rollups if supports_native(self.client, rollup)]
+
+    def closed_until(self, rollup, now=None):
+        """
+        已结束(且超过 settle)的窗口的结束时间
+        """
+        now = to_local(now or datetime.now(LOCAL_TZ))
+        return window_start(now - timedelta(seconds=self.settle), rollup.resolution)
+
+    @staticmethod
+    def state_key(store, rollup):
+        return f'{STATE_KEY_PREFIX}:{store}:{rollup.name}'
+
+    def get_watermark(self, store, rollup):
+        """
+        :return: 已计算到的时间(下一个待计算窗口的开始时间)，没有记录时为 None
+        """
+        if self.state is None:
+            return None
+        value = self.state.get(self.state_key(store, rollup))
+        return from_ms(value) if value else None
+
+    def set_watermark(self, store, rollup, dt):
+        if self.state is not None:
+            self.state.set(self.state_key(store, rollup), to_ms(dt), None)
+
+    def run(self, store, now=None):
+        """
+        增量计算上次之后已结束的窗口
+        :return: 写入的数据点数
+        """
+        count = 0
+        for rollup in self.managed_rollups():
+            end = self.closed_until(rollup, now)
+            start = self.get_watermark(store, rollup) or next_window(end, rollup.resolution, -self.lookback)
+            if start >= end:
+                continue
+            count += self.process(store, rollup, start, end)
+            self.set_watermark(store, rollup, end)
+        return count
+
+    def _flush(self):
+        # 批量写入模式下先提交，级联的下一级汇总才能查询到
+        flush = getattr(self.client, 'flush', None)
+        if flush is not None:
+            flush()
+
+    def backfill(self, store, start, end=None, rollups=None):
+        """
+        重新计算 [start, end) 内的窗口，end 默认为已结束窗口，按声明顺序计算(先计算来源汇总)
+        :return: {汇总名称: 写入的数据点数}
+        """
+        counts = {}
+        for rollup in rollups or self.rollups:
+            closed = self.closed_until(rollup)
+            rollup_end = min(window_start(end, rollup.resolution), closed) if end else closed
+            counts[rollup.name] = self.process(store, rollup, start, rollup_end)
+            watermark = self.get_watermark(store, rollup)
+            if watermark is None or watermark < rollup_end:
+                self.set_watermark(store, rollup, rollup_end)
+        return counts
+
+    def process(self, store, rollup, start, end):
+        """
+        计算 [start, end) 内的窗口并写入
+        :return: 写入的数据点数
+        """
+        count = 0
+        windows = list(iter_windows(start, end, rollup.resolution))
+        for index in range(0, len(windows), self.chunk):
+            chunk = windows[index:index + self.chunk]
+            chunk_end = next_window(chunk[-1], rollup.resolution)
+            data_points = [
+                {
+                    'measurement': MEASUREMENT,
+                    'fields': {VALUE_FIELD: float(value)},
+                    'tags': {'device_username': device_username, 'key': rollup.name},
+                    'timestamp': timestamp,
+                }
+                for device_username, timestamp, value in self.aggregate(store, rollup, chunk[0], chunk_end)
+            ]
+            if data_points:
+                self.client.write_multiple_data(store, data_points)
+            count += len(data_points)
+        if count:
+            self._flush()
+        return count
+
+    def aggregate(self, store, rollup, start, end):
+        """
+        :return: [(device_username, 窗口开始毫秒时间戳, 值), ...]
+        """
+        if rollup.aggregate != AGGREGATE_INCREASE:
+            return self._window_values(store, rollup, start, end)
+        # 用量为窗口最后一个值与之前最后一个值的差，第一个窗口与 start 之前的最后一个值比较(可能相隔多个窗口)
+        previous = self._previous_values(store, rollup, start)
+        result = []
+        for device_username, timestamp, value in self._window_values(store, rollup, start, end):
+            last = previous.get(device_username)
+            previous[device_username] = value
+            if last is not None and value >= last:
+                result.append((device_username, timestamp, value - last))
+        return result
+
+    def _previous_values(self, store, rollup, start):
+        """
+        各设备 start 之前的最后一个来源值
+        :return: {device_username: value}
+        """
+        values = {}
+        for row in self._query(store, rollup, None, start):
+            device_username, value = row.get('device_username'), self._row_value(rollup, row)
+            if device_username is not None and value is not None:
+                values[device_username] = value
+        return values
+
+    def _window_values(self, store, rollup, start, end):
+        """
+        各窗口的聚合值，按设备、时间排序，没有数据的窗口不返回
+        """
+        if rollup.interval:
+            rows = self._query(store, rollup, start, end, rollup.interval)
+            values = [
+                (row.get('device_username'), row['_time'], self._row_value(rollup, row)) for row in rows
+            ]
+        else:
+            values = []
+            for window in iter_windows(start, end, rollup.resolution):
+                timestamp = to_ms(window)
+                rows = self._query(store, rollup, window, next_window(window, rollup.resolution))
+                values.extend(
+                    (row.get('device_username'), timestamp, self._row_value(rollup, row)) for row in rows
+                )
+        values = [item for item in values if item[0] is not None and item[2] is not None]
+        values.sort(key=lambda item: (item[0], item[1]))
+        return values
+
+    def _select(self, rollup):
+        function = AGGREGATES[rollup.aggregate][1 if self.is_tdengine else 0]
+        return f'{function}({VALUE_FIELD}) as {VALUE_ALIAS}'
+
+    def _row_value(self, rollup, row):
+        # TDengineWrapper 以 select 表达式为列名
+        return row.get(VALUE_ALIAS, row.get(self._select(rollup)))
+
+    def _query(self, store, rollup, start, end, interval=None):
+        """
+        :param start: 为 None 时不限制开始时间
+        """
+        q = self.client.q
+        selects = [self._select(rollup)]
+        if self.is_tdengine:
+            # TDengine 的分组列需要在 select 中才会返回
+            selects.append('device_username')
+        where = q('key', rollup.source)
+        if start is not None:
+            where = where & q('time', start, '>=')
+        kwargs = dict(
+            store=store, selects=selects, measurement=MEASUREMENT, where=where & q('time', end, '<'),
+            group_by=['device_username'], interval=interval,
+        )
+        if isinstance(self.client, QueryCacheMixin):
+            kwargs['cache'] = False
+        rows = self.client.query(**kwargs)
+        if rows is None:
+            raise RuntimeError(f'tsdb 汇总查询失败 store<<{store}>> rollup<<{rollup.name}>>')
+        return rows
+
+    def latest(self, store, rollup):
+        """
+        :return: 最新一个汇总窗口的开始时间，没有数据时为 None
+        """
+        q = self.client.q
+        kwargs = dict(store=store, selects=[f'last({VALUE_FIELD})'], measurement=MEASUREMENT,
+                      where=q('key', rollup.name))
+        if isinstance(self.client, QueryCacheMixin):
+            kwargs['cache'] = False
+        rows = self.client.query(**kwargs)
+        if not rows:
+            return None
+        return from_ms(rows[0]['_time'])
+
+    def lag(self, store, rollup, now=None):
+        """
+        汇总数据的滞后时间(秒): 当前时间与最新汇总窗口结束时间之差，没有汇总数据时为 None
+        """
+        latest = self.latest(store, rollup)
+        if latest is None:
+            return None
+        now = to_local(now or datetime.now(LOCAL_TZ))
+        return max(0, (now - next_window(latest, rollup.resolution)).total_seconds())
+
+    def apply_retention(self, store, now=None):
+        """
+        删除超过保留天数的汇总数据
+        """
+        q = self.client.q
+        now = to_local(now or datetime.now(LOCAL_TZ))
+        for rollup in self.rollups:
+            if rollup.retention is None:
+                continue
+            cutoff = now - timedelta(days=rollup.retention)
+            self.client.delete(store=store, measurement=MEASUREMENT,
+                               where=q('key', rollup.name) & q('time', cutoff, '<'))
+
+    def install_native(self, store):
+        """
+        为存储桶创建(或更新)原生汇总: InfluxDB task / TDengine stream
+        :return: 已创建的汇总名称
+        """
+        rollups = self.native_rollups()
+        if not rollups:
+            return []
+        if self.is_tdengine:
+            self._execute_tdengine(store, [tdengine_stream_sql(store, rollup, self.settle) for rollup in rollups])
+        else:
+            tasks_api = self._influxdb_tasks_api()
+            for rollup in rollups:
+                self._upsert_influxdb_task(tasks_api, store, rollup)
+        return [rollup.name for rollup in rollups]
+
+    def uninstall_native(self, store):
+        """
+        删除存储桶的原生汇总
+        """
+        if isinstance(self.client, SQLiteWrapper):
+            return
+        if self.is_tdengine:
+            self._execute_tdengine(
+                store, [f'DROP STREAM IF EXISTS `{native_name(store, rollup)}`' for rollup in self.rollups]
+            )
+            return
+        tasks_api = self._influxdb_tasks_api()
+        for rollup in self.rollups:
+            for task in tasks_api.find_tasks(name=native_name(store, rollup)):
+                tasks_api.delete_task(task.id)
+
+    def _execute_tdengine(self, store, sql_list):
+        # 创建 stream 的频率很低，使用单独的连接，不占用连接池
+        wrapper = TDengineWrapper(logger=self.logger)
+        try:
+            wrapper.connect()
+            wrapper._prepare_connection(store)
+            for sql in sql_list:
+                wrapper.conn.execute(sql)
+        finally:
+            wrapper.close()
+
+    def _influxdb_tasks_api(self):
+        if not self.client.client:
+            self.client.connect()
+        return self.client.client.tasks_api()
+
+    def _upsert_influxdb_task(self, tasks_api, store, rollup):
+        from influxdb_client import TaskCreateRequest, TaskUpdateRequest
+
+        name = native_name(store, rollup)
+        flux = influxdb_task_flux(store, rollup, self.settle)
+        tasks = tasks_api.find_tasks(name=name)
+        if tasks:
+            tasks_api.update_task_request(tasks[0].id, TaskUpdateRequest(flux=flux, status='active'))
+        else:
+            tasks_api.create_task(task_create_request=TaskCreateRequest(
+                org=self.client.org, flux=flux, status='active', description=repr(rollup)
+            ))
+
+
+def native_name(store, rollup):
+    return f'rollup_{store}_{rollup.name}'
+
+
+def influxdb_task_flux(store, rollup, settle=TSDB_ROLLUP_SETTLE):
+    """
+    InfluxDB task: 每个窗口结束 settle 秒后计算该窗口，increase 多读取一个窗口后求差
+    """
+    every = RESOLUTIONS[rollup.resolution][1]
+    function = AGGREGATES[rollup.aggregate][0]
+    start = f'date.sub(d: {every}, from: stop)'
+    difference = ''
+    if rollup.aggregate == AGGREGATE_INCREASE:
+        start = f'date.sub(d: {every}, from: {start})'
+        difference = '\n    |> difference(nonNegative: true)'
+    return f'''import "date"
+import "timezone"
+
+option location = timezone.location(name: "{FLUX_LOCATION}")
+option task = {{name: "{native_name(store, rollup)}", every: {every}, offset: {settle}s}}
+
+stop = date.truncate(t: now(), unit: {every})
+start = {start}
+
+from(bucket: "{store}")
+    |> range(start: start, stop: stop)
+    |> filter(fn: (r) => r._measurement == "{MEASUREMENT}" and r._field == "{VALUE_FIELD}" and r.key == "{rollup.source}")
+    |> aggregateWindow(every: {every}, fn: {function}, createEmpty: false, timeSrc: "_start"){difference}
+    |> set(key: "key", value: "{rollup.name}")
+    |> to(bucket: "{store}")
+'''
+
+
+def tdengine_stream_sql(store, rollup, settle=TSDB_ROLLUP_SETTLE):
+    """
+    TDengine stream: 窗口关闭(watermark settle 秒)后计算，结果写回 data 超级表，key 标签为汇总名称
+    """
+    function = AGGREGATES[rollup.aggregate][1]
+    return (
+        f'CREATE STREAM IF NOT EXISTS `{native_name(store, rollup)}` '
+        f'TRIGGER WINDOW_CLOSE WATERMARK {settle}s IGNORE EXPIRED 0 '
+        f'INTO `{MEASUREMENT}` SUBTABLE(CONCAT(\'{rollup.name}_\', device_username)) '
+        f'AS SELECT _wstart AS _ts, {function}({VALUE_FIELD}) AS {VALUE_FIELD} FROM `{MEASUREMENT}` '
+        f'WHERE `key` = \'{rollup.source}\' '
+        f'PARTITION BY device_username, \'{rollup.name}\' AS `key` INTERVAL({rollup.interval})'
+    )
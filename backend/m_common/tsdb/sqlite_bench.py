@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+嵌入式时序数据库(SQLite)性能基准
+
+不需要 InfluxDB / TDengine 服务，在临时目录中生成与生产相同结构的数据(测量 data，标签 device_username、key，字段 f_value)，
+输出写入吞吐量与看板常用查询耗时的平均值与 P50/P95/P99(毫秒):
+    range    单个设备一天的原始数据
+    hourly   全部设备一天的小时 last，按设备分组
+    daily    全部设备整个时间范围的按天 spread
+    latest   device_latest_data
+修改查询、写入相关代码前后各运行一次，作为离线对比的基线。
+
+用法:
+    python -m backend.m_common.tsdb.sqlite_bench --devices 100 --days 7 --interval 15 --repeat 20
+"""
+import argparse
+import logging
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from backend.m_common.tsdb.sqlite_wrapper import SQLiteWrapper
+from backend.m_common.tsdb.tdengine_pool_bench import summary
+
+BENCH_STORE = 'sqlite_bench'
+BENCH_MEASUREMENT = 'data'
+BENCH_KEY = 'f_epi'
+
+logger = logging.getLogger('sqlite_bench')
+
+
+def generate_points(devices, start, days, interval):
+    """
+    每个设备每 interval 分钟一个累计值
+    """
+    count = days * 24 * 60 // interval
+    for device in devices:
+        value = random.uniform(0, 1000)
+        for index in range(count):
+            value += random.uniform(0, 2)
+            yield {
+                'measurement': BENCH_MEASUREMENT, 'fields': {'f_value': round(value, 2)},
+                'tags': {'device_username': device, 'key': BENCH_KEY},
+                'timestamp': start + timedelta(minutes=interval * index),
+            }
+
+
+def write(client, points, batch_size):
+    batch, written = [], 0
+    start = time.perf_counter()
+    for point in points:
+        batch.append(point)
+        if len(batch) >= batch_size:
+            client.write_multiple_data(BENCH_STORE, batch)
+            written, batch = written + len(batch), []
+    if batch:
+        client.write_multiple_data(BENCH_STORE, batch)
+        written += len(batch)
+    return written, time.perf_counter() - start
+
+
+def timed(func, repeat):
+    costs, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        costs.append(time.perf_counter() - start)
+    return costs, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='嵌入式时序数据库(SQLite)性能基准')
+    parser.add_argument('--devices', type=int, default=100, help='设备数')
+    parser.add_argument('--days', type=int, default=7, help='数据天数')
+    parser.add_argument('--interval', type=int, default=15, help='数据间隔(分钟)')
+    parser.add_argument('--batch-size', type=int, default=5000, help='每次 write_multiple_data 的数据点数')
+    parser.add_argument('--repeat', type=int, default=20, help='每个查询的执行次数')
+    parser.add_argument('--dir', help='数据库文件目录，默认为临时目录(结束后删除)')
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix='sqlite_bench_')
+    client = SQLiteWrapper(logger=logger, directory=directory)
+    if client.is_strore_exists(BENCH_STORE):
+        client.delete_store(BENCH_STORE)
+    client.create_store(BENCH_STORE)
+    try:
+        random.seed(0)
+        devices = [f'bench_{index}' for index in range(args.devices)]
+        start = datetime(2025, 1, 1)
+        end = start + timedelta(days=args.days)
+        written, elapsed = write(client, generate_points(devices, start, args.days, args.interval), args.batch_size)
+        print(f'[write] points {written} elapsed {elapsed:.2f}s ({written / elapsed:.0f} points/s) '
+              f'size {client.get_store_disk_usage(BENCH_STORE) / 1024 / 1024:.1f}MB')
+
+        q = client.q
+        day_where = q('time', start, '>=') & q('time', start + timedelta(days=1), '<') & q('key', BENCH_KEY)
+        queries = [
+            ('range', lambda: client.query(
+                BENCH_STORE, ['f_value'], BENCH_MEASUREMENT, day_where & q('device_username', devices[0]))),
+            ('hourly', lambda: client.query(
+                BENCH_STORE, ['last(f_value) AS f_value', 'device_username'], BENCH_MEASUREMENT,
+                day_where & q('device_username', devices, 'in'), group_by=['device_username'], interval='1h')),
+            ('daily', lambda: client.query(
+                BENCH_STORE, ['spread(f_value) AS f_value', 'device_username'], BENCH_MEASUREMENT,
+                q('time', start, '>=') & q('time', end, '<') & q('key', BENCH_KEY),
+                group_by=['device_username'], interval='1d')),
+            ('latest', lambda: client.device_latest_data(BENCH_STORE, devices[-1])),
+        ]
+        for name, func in queries:
+            costs, rows = timed(func, args.repeat)
+            print(f'[{name}] rows {len(rows or [])}')
+            print(summary('  query (ms)', costs))
+    finally:
+        client.delete_store(BENCH_STORE)
+        client.close()
+        if not args.dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
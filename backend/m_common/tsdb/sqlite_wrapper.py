@@ -0,0 +1,1417 @@
+# -*- coding: utf-8 -*-
+"""
+嵌入式时序数据库(SQLite)
+
+测试、性能基准与单机小规模部署不需要另外运行 InfluxDB / TDengine 服务:
+TSDB_TYPE=sqlite 时 DatabaseFactory.get_client 返回 SQLiteWrapper，数据保存在 SQLITE_TSDB_DIR 目录下，
+每个 store(create_store)一个数据库文件 {store}.db。
+
+SQLiteWrapper 继承 StreamingTDengineWrapper，查询语句、写入的行协议、结果转换均与 TDengineWrapper 相同(使用 TDengine 的 Q)，
+只把连接替换为 SQLiteConnection: 在 SQLite 上执行 TDengineWrapper 生成的 TDengine SQL 子集与 schemaless 行协议写入，
+因此 result_format、query_iter、分片并发、查询缓存、汇总等扩展同样可用。
+    measurement  一张表(WITHOUT ROWID)，_ts 为毫秒时间戳，标签、字段各为一列(写入时自动增加)，
+                 主键为(标签组合, _ts)，时间与标签相同的数据点覆盖已有字段(与 TDengine 子表相同)
+    查询         SELECT 列/函数 FROM ... WHERE ... PARTITION BY ... INTERVAL(..., AUTO) FILL(NULL|NONE)
+                 ORDER BY ... SLIMIT/SOFFSET(分组数) LIMIT/OFFSET(有 PARTITION BY 时为每个分组的行数)
+                 聚合函数 count/sum/avg/max/min/first/last/last_row/spread/stddev/percentile/apercentile/median，
+                 _ts 与时间字符串、now() - 1h 比较时按毫秒时间戳比较，time 视为 _ts
+    INTERVAL     AUTO 时窗口从 WHERE 中的开始时间对齐，否则从 UTC 1970-01-01 对齐，
+                 月(n)、年(y)窗口按本地时间(TIME_ZONE_OFFSET)的自然月对齐
+TDengine 的其它语法(stream、子查询、SESSION/STATE_WINDOW 等)与函数不支持，执行时抛出 sqlite3.NotSupportedError
+或 sqlite3.OperationalError，与 TDengine 语句出错时相同由调用方处理。
+ALTER DATABASE 的保留时间(KEEP)不生效，使用 delete_old_data 清理。
+"""
+import atexit
+import glob
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+
+from backend.m_common.tsdb.abstract import env
+from backend.m_common.tsdb.conf import TIME_ZONE_OFFSET
+from backend.m_common.tsdb.streaming import StreamingTDengineWrapper
+
+# 数据库文件目录，默认为 backend/tsdb_data(已在 .gitignore 中忽略)
+SQLITE_TSDB_DIR = env.str('SQLITE_TSDB_DIR', default='') or str(Path(__file__).resolve().parents[2] / 'tsdb_data')
+# 等待其它连接释放写锁的最长时间(秒)
+SQLITE_TSDB_TIMEOUT = env.int('SQLITE_TSDB_TIMEOUT', default=30)
+# PRAGMA synchronous，WAL 下 NORMAL 在断电时可能丢失最近提交的写入，但不会损坏数据库
+SQLITE_TSDB_SYNCHRONOUS = env.str('SQLITE_TSDB_SYNCHRONOUS', default='NORMAL')
+
+STORE_SUFFIX = '.db'
+STORE_NAME_PATTERN = re.compile(r'^\w[\w.-]*$')
+# 列信息表
+COLUMNS_TABLE = '_tsdb_columns'
+TIME_COLUMN = '_ts'
+SERIES_COLUMN = '_series'
+RESERVED_COLUMNS = (TIME_COLUMN, SERIES_COLUMN)
+
+KIND_TAG = 'tag'
+KIND_FIELD = 'field'
+# 行协议字段类型对应的列类型(SQLite 类型亲和性)
+COLUMN_TYPES = {'tag': 'TEXT', 'double': 'REAL', 'bigint': 'INTEGER', 'bool': 'INTEGER', 'varchar': 'TEXT'}
+
+# FILL(NULL) 最多补充的窗口数
+MAX_FILL_WINDOWS = 10 ** 6
+
+LOCAL_TIMEZONE = datetime.strptime(TIME_ZONE_OFFSET, '%z').tzinfo
+# 本地时间的 1970-01-01 00:00:00(无时区)，查询结果的时间与 taosws 相同为无时区的本地时间
+_LOCAL_EPOCH = datetime(1970, 1, 1) + LOCAL_TIMEZONE.utcoffset(None)
+
+DURATION_UNITS = {'a': 1, 's': 1000, 'm': 60 * 1000, 'h': 3600 * 1000, 'd': 86400 * 1000, 'w': 7 * 86400 * 1000}
+CALENDAR_UNITS = {'n': 1, 'y': 12}
+NOW_PATTERN = re.compile(r'^now\(\)\s*(?:([+-])\s*(\d+)([a-z]))?$', re.I)
+DURATION_PATTERN = re.compile(r'^(\d+)([a-z])$', re.I)
+
+_TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.)*")
+  | (?P<ident>`(?:[^`]|``)*`)
+  | (?P<duration>\d+[abusmhdwny](?![\w.]))
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)
+  | (?P<name>[^\W\d]\w*)
+  | (?P<op><=|>=|<>|!=|==|\|\||[-+*/%<>=(),.;])
+""", re.X)
+
+KEYWORDS = {
+    'AND', 'OR', 'NOT', 'IN', 'LIKE', 'IS', 'NULL', 'BETWEEN', 'AS', 'ASC', 'DESC', 'DISTINCT', 'TRUE', 'FALSE',
+    'CASE', 'WHEN', 'THEN', 'ELSE', 'END', 'NULLS', 'CAST', 'ESCAPE', 'MATCH', 'NMATCH',
+}
+CLAUSE_KEYWORDS = ('SELECT', 'FROM', 'WHERE', 'PARTITION', 'GROUP', 'INTERVAL', 'SLIDING', 'FILL', 'ORDER', 'SLIMIT',
+                   'SOFFSET', 'LIMIT', 'OFFSET')
+COMPARISON_OPERATORS = {'=', '==', '!=', '<>', '<', '<=', '>', '>='}
+# 比较运算符交换两侧后的运算符
+FLIPPED_OPERATORS = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '=': '=', '==': '=='}
+# 视为 _ts 的列名
+TIME_NAMES = {'_ts', 'time', '_rowts', '_c0'}
+WINDOW_NAMES = {'_wstart', '_wend', '_wduration'}
+# TDengine 函数 -> (SQLite 函数, 追加的参数)
+FUNCTIONS = {
+    'first': ('_tsdb_first', ', `_ts`'),
+    'last': ('_tsdb_last', ', `_ts`'),
+    'last_row': ('_tsdb_last_row', ', `_ts`'),
+    'spread': ('_tsdb_spread', ''),
+    'stddev': ('_tsdb_stddev', ''),
+    'percentile': ('_tsdb_percentile', ''),
+    'apercentile': ('_tsdb_percentile', ''),
+    'median': ('_tsdb_percentile', ', 50'),
+}
+AGGREGATE_FUNCTIONS = {'count', 'sum', 'avg', 'max', 'min', 'total', 'group_concat', *FUNCTIONS}
+# 结果为时间的表达式: _ts、first(_ts)、last(_ts) 等
+TIME_RESULT_PATTERN = re.compile(r'^(?:(?:first|last|last_row|max|min)\()?`?(?:_ts|time|_rowts|_c0)`?\)?$', re.I)
+
+
+class Token(object):
+    __slots__ = ('kind', 'text')
+
+    def __init__(self, kind, text):
+        self.kind = kind
+        self.text = text
+
+    @property
+    def upper(self):
+        return self.text.upper() if self.kind == 'name' else None
+
+    def __repr__(self):
+        return f'Token({self.kind}, {self.text!r})'
+
+
+def tokenize(sql):
+    tokens, position = [], 0
+    while position < len(sql):
+        match = _TOKEN_PATTERN.match(sql, position)
+        if not match:
+            raise sqlite3.OperationalError(f'syntax error near: {sql[position:position + 20]}')
+        if match.lastgroup != 'space':
+            tokens.append(Token(match.lastgroup, match.group()))
+        position = match.end()
+    return tokens
+
+
+def split_top_level(tokens, separator=','):
+    """
+    按括号外的分隔符拆分
+    """
+    parts, current, depth = [], [], 0
+    for token in tokens:
+        if token.kind == 'op' and token.text == '(':
+            depth += 1
+        elif token.kind == 'op' and token.text == ')':
+            depth -= 1
+        if depth == 0 and token.kind == 'op' and token.text == separator:
+            parts.append(current)
+            current = []
+        else:
+            current.append(token)
+    if current:
+        parts.append(current)
+    return parts
+
+
+def identifier_name(token):
+    return token.text[1:-1].replace('``', '`') if token.kind == 'ident' else token.text
+
+
+def quote(name):
+    return '`' + name.replace('`', '``') + '`'
+
+
+def string_value(token):
+    text = token.text[1:-1]
+    if token.text[0] == "'":
+        return text.replace("''", "'")
+    return text.replace('\\"', '"')
+
+
+def sql_string(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def to_ms(value):
+    """
+    datetime(无时区时按 TIME_ZONE_OFFSET)转换为毫秒时间戳
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=LOCAL_TIMEZONE)
+    return int(value.timestamp() * 1000)
+
+
+def to_local_datetime(ms):
+    """
+    毫秒时间戳转换为无时区的本地时间，与 taosws 返回的时间相同
+    """
+    return _LOCAL_EPOCH + timedelta(milliseconds=ms)
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def parse_duration(text):
+    """
+    :return: (毫秒数, 0) 或 (0, 月数)
+    """
+    match = DURATION_PATTERN.match(text)
+    if not match:
+        raise sqlite3.OperationalError(f'invalid duration: {text}')
+    count, unit = int(match.group(1)), match.group(2).lower()
+    if unit in DURATION_UNITS:
+        return count * DURATION_UNITS[unit], 0
+    if unit in CALENDAR_UNITS:
+        return 0, count * CALENDAR_UNITS[unit]
+    raise sqlite3.NotSupportedError(f'不支持的时间单位: {text}(精度为毫秒)')
+
+
+def parse_time(text, now=None):
+    """
+    时间字符串转换为毫秒时间戳: ISO 8601(无时区时按 TIME_ZONE_OFFSET)、毫秒时间戳、now() [+-] 时长
+    """
+    text = text.strip()
+    if text.isdigit():
+        return int(text)
+    match = NOW_PATTERN.match(text)
+    if match:
+        value = now_ms() if now is None else now
+        if match.group(1):
+            milliseconds, months = parse_duration(match.group(2) + match.group(3))
+            if months:
+                raise sqlite3.NotSupportedError(f'不支持的时间运算: {text}')
+            value += milliseconds if match.group(1) == '+' else -milliseconds
+        return value
+    try:
+        return to_ms(datetime.fromisoformat(text.replace('Z', '+00:00')))
+    except ValueError:
+        raise sqlite3.OperationalError(f'invalid timestamp: {text}')
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    year, month = value.year + month // 12, month % 12 + 1
+    if month == 12:
+        days = 31
+    else:
+        days = (datetime(year, month + 1, 1) - datetime(year, month, 1)).days
+    return value.replace(year=year, month=month, day=min(value.day, days))
+
+
+def calendar_window(ts, months, origin):
+    """
+    ts 所在的按月窗口的开始时间(毫秒)，窗口从 origin 开始每 months 个月一个，按本地时间计算
+    """
+    start, moment = to_local_datetime(origin), to_local_datetime(ts)
+    index = ((moment.year - start.year) * 12 + moment.month - start.month) // months
+    window = add_months(start, index * months)
+    if window > moment:
+        window = add_months(start, (index - 1) * months)
+    return to_ms(window)
+
+
+# 聚合函数
+
+
+class _First(object):
+
+    def __init__(self):
+        self.ts = self.value = None
+
+    def step(self, value, ts):
+        if value is not None and (self.ts is None or ts < self.ts):
+            self.ts, self.value = ts, value
+
+    def finalize(self):
+        return self.value
+
+
+class _Last(_First):
+
+    def step(self, value, ts):
+        if value is not None and (self.ts is None or ts >= self.ts):
+            self.ts, self.value = ts, value
+
+
+class _LastRow(_First):
+
+    def step(self, value, ts):
+        if self.ts is None or ts >= self.ts:
+            self.ts, self.value = ts, value
+
+
+class _Spread(object):
+
+    def __init__(self):
+        self.low = self.high = None
+
+    def step(self, value):
+        if value is None:
+            return
+        if self.low is None:
+            self.low = self.high = value
+        else:
+            self.low, self.high = min(self.low, value), max(self.high, value)
+
+    def finalize(self):
+        return None if self.low is None else float(self.high - self.low)
+
+
+class _Stddev(object):
+    """
+    总体标准差，与 TDengine stddev 相同
+    """
+
+    def __init__(self):
+        self.count, self.mean, self.m2 = 0, 0.0, 0.0
+
+    def step(self, value):
+        if value is None:
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def finalize(self):
+        return math.sqrt(self.m2 / self.count) if self.count else None
+
+
+class _Percentile(object):
+    """
+    percentile(x, p)，线性插值，apercentile 的估算算法参数被忽略
+    """
+
+    def __init__(self):
+        self.values, self.percent = [], None
+
+    def step(self, value, percent, *args):
+        if value is not None:
+            self.values.append(value)
+        self.percent = percent
+
+    def finalize(self):
+        if not self.values:
+            return None
+        values = sorted(self.values)
+        position = (len(values) - 1) * self.percent / 100
+        low = int(math.floor(position))
+        high = min(low + 1, len(values) - 1)
+        return float(values[low] + (values[high] - values[low]) * (position - low))
+
+
+@lru_cache(maxsize=256)
+def _compile_regexp(pattern):
+    return re.compile(pattern)
+
+
+def _regexp(pattern, value):
+    return value is not None and _compile_regexp(pattern).search(str(value)) is not None
+
+
+def _register_functions(db):
+    db.create_aggregate('_tsdb_first', 2, _First)
+    db.create_aggregate('_tsdb_last', 2, _Last)
+    db.create_aggregate('_tsdb_last_row', 2, _LastRow)
+    db.create_aggregate('_tsdb_spread', 1, _Spread)
+    db.create_aggregate('_tsdb_stddev', 1, _Stddev)
+    db.create_aggregate('_tsdb_percentile', -1, _Percentile)
+    db.create_function('_tsdb_calendar_window', 3, calendar_window, deterministic=True)
+    db.create_function('regexp', 2, _regexp, deterministic=True)
+    db.create_function('server_status', 0, lambda: 1)
+
+
+class SQLiteStores(object):
+    """
+    目录下的数据库文件，每个线程对每个 store 使用单独的 sqlite3 连接，线程安全
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 关闭次数、{store: 删除次数}，关闭或删除后各线程已打开的连接失效
+        self._closed = 0
+        self._generations = {}
+        # {store: [各线程的连接]}
+        self._connections = {}
+
+    def path(self, store):
+        if not STORE_NAME_PATTERN.match(store or ''):
+            raise sqlite3.OperationalError(f'invalid database name: {store}')
+        return os.path.join(self.directory, store + STORE_SUFFIX)
+
+    def exists(self, store):
+        return os.path.exists(self.path(store))
+
+    def names(self):
+        return sorted(os.path.basename(path)[:-len(STORE_SUFFIX)]
+                      for path in glob.glob(os.path.join(glob.escape(self.directory), '*' + STORE_SUFFIX)))
+
+    def create(self, store):
+        os.makedirs(self.directory, exist_ok=True)
+        self._open(store)
+
+    def connection(self, store):
+        """
+        :return: 当前线程的连接，数据库不存在时抛出 OperationalError
+        """
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        generation = (self._closed, self._generations.get(store, 0))
+        cached = connections.get(store)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        if not self.exists(store):
+            raise sqlite3.OperationalError(f'Database not exist: {store}')
+        db = self._open(store)
+        connections[store] = (generation, db)
+        return db
+
+    def _open(self, store):
+        db = sqlite3.connect(self.path(store), timeout=SQLITE_TSDB_TIMEOUT, isolation_level=None,
+                             check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute(f'PRAGMA synchronous={SQLITE_TSDB_SYNCHRONOUS}')
+        db.execute(f'CREATE TABLE IF NOT EXISTS {COLUMNS_TABLE} ('
+                   'measurement TEXT NOT NULL, name TEXT NOT NULL, kind TEXT NOT NULL, type TEXT NOT NULL, '
+                   'position INTEGER NOT NULL, PRIMARY KEY (measurement, name)) WITHOUT ROWID')
+        _register_functions(db)
+        with self._lock:
+            self._connections.setdefault(store, []).append(db)
+        return db
+
+    def drop(self, store):
+        path = self.path(store)
+        with self._lock:
+            self._generations[store] = self._generations.get(store, 0) + 1
+            for db in self._connections.pop(store, []):
+                db.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    def disk_usage(self, store):
+        path = self.path(store)
+        return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix))
+
+    def close(self):
+        with self._lock:
+            for connections in self._connections.values():
+                for db in connections:
+                    db.close()
+            self._connections.clear()
+            self._closed += 1
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_stores(directory=None):
+    """
+    进程内按目录共享的 SQLiteStores
+    """
+    directory = os.path.abspath(directory or SQLITE_TSDB_DIR)
+    with _stores_lock:
+        stores = _stores.get(directory)
+        if stores is None:
+            stores = _stores[directory] = SQLiteStores(directory)
+        return stores
+
+
+@atexit.register
+def _close_stores():
+    for stores in list(_stores.values()):
+        stores.close()
+
+
+# 表结构
+
+
+def load_columns(db, measurement):
+    """
+    :return: {列名: (kind, type)}，按增加顺序
+    """
+    rows = db.execute(f'SELECT name, kind, type FROM {COLUMNS_TABLE} WHERE measurement = ? ORDER BY position',
+                      (measurement,)).fetchall()
+    existing = {row[1] for row in db.execute(f'PRAGMA table_info({quote(measurement)})')}
+    return {name: (kind, column_type) for name, kind, column_type in rows if name in existing}
+
+
+def ensure_columns(db, measurement, columns, known):
+    """
+    创建表、增加缺少的列
+    :param columns: {列名: (kind, type)}
+    :param known: load_columns 的结果，原地更新
+    """
+    table = quote(measurement)
+    if not known and not db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                    (measurement,)).fetchone():
+        db.execute(f'CREATE TABLE IF NOT EXISTS {table} ({quote(SERIES_COLUMN)} TEXT NOT NULL, '
+                   f'{quote(TIME_COLUMN)} INTEGER NOT NULL, '
+                   f'PRIMARY KEY ({quote(SERIES_COLUMN)}, {quote(TIME_COLUMN)})) WITHOUT ROWID')
+        db.execute(f'CREATE INDEX IF NOT EXISTS {quote(measurement + "__ts")} ON {table} ({quote(TIME_COLUMN)})')
+    for name, (kind, column_type) in columns.items():
+        if name in known:
+            continue
+        if name in RESERVED_COLUMNS:
+            raise sqlite3.OperationalError(f'invalid column name: {name}')
+        try:
+            db.execute(f'ALTER TABLE {table} ADD COLUMN {quote(name)} {COLUMN_TYPES[column_type]}')
+        except sqlite3.OperationalError as err:
+            # 其它连接已增加
+            if 'duplicate column' not in str(err):
+                raise
+        if kind == KIND_TAG:
+            # 按标签与时间查询(device_username、key)
+            db.execute(f'CREATE INDEX IF NOT EXISTS {quote(f"{measurement}_{name}")} '
+                       f'ON {table} ({quote(name)}, {quote(TIME_COLUMN)})')
+        db.execute(f'INSERT OR IGNORE INTO {COLUMNS_TABLE} (measurement, name, kind, type, position) '
+                   f'SELECT ?, ?, ?, ?, count(*) FROM {COLUMNS_TABLE} WHERE measurement = ?',
+                   (measurement, name, kind, column_type, measurement))
+        known[name] = (kind, column_type)
+
+
+# 行协议
+
+
+def _split_unescaped(text, separator, quoted=False):
+    """
+    按未转义(且不在双引号内)的分隔符拆分
+    """
+    parts, current, escaped, in_quote = [], [], False, False
+    for char in text:
+        if escaped:
+            current.append('\\' + char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif quoted and char == '"':
+            in_quote = not in_quote
+            current.append(char)
+        elif char == separator and not in_quote:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    if escaped:
+        current.append('\\')
+    parts.append(''.join(current))
+    return parts
+
+
+def _unescape(text):
+    return re.sub(r'\\([,= \\"])', r'\1', text)
+
+
+def _field_value(text):
+    """
+    :return: (值, 列类型)
+    """
+    if len(text) >= 2 and text[0] == '"' and text[-1] == '"':
+        return text[1:-1].replace('\\"', '"').replace('\\\\', '\\'), 'varchar'
+    lowered = text.lower()
+    if lowered in ('t', 'true'):
+        return True, 'bool'
+    if lowered in ('f', 'false'):
+        return False, 'bool'
+    match = re.match(r'^([-+]?\d+)[iu](?:8|16|32|64)?$', text)
+    if match:
+        return int(match.group(1)), 'bigint'
+    try:
+        return float(re.sub(r'f(?:32|64)$', '', text)), 'double'
+    except ValueError:
+        raise sqlite3.OperationalError(f'invalid field value: {text}')
+
+
+def parse_line(line, default_timestamp):
+    """
+    解析一行行协议(时间精度为毫秒)
+    :return: (measurement, {标签: 值}, {字段: (值, 列类型)}, 毫秒时间戳)
+    """
+    sections = [section for section in _split_unescaped(line.strip(), ' ', quoted=True) if section != '']
+    if len(sections) < 2:
+        raise sqlite3.OperationalError(f'invalid line protocol: {line}')
+    series = _split_unescaped(sections[0], ',')
+    measurement = _unescape(series[0])
+    tags = {}
+    for item in series[1:]:
+        key, _, value = item.partition('=')
+        tags[_unescape(key)] = _unescape(value)
+    fields = {}
+    for item in _split_unescaped(' '.join(sections[1:2]), ',', quoted=True):
+        key, _, value = item.partition('=')
+        fields[_unescape(key)] = _field_value(value)
+    timestamp = int(sections[2]) if len(sections) > 2 else default_timestamp
+    return measurement, tags, fields, timestamp
+
+
+def series_key(tags):
+    return ','.join(f'{key}={tags[key]}' for key in sorted(tags))
+
+
+# SELECT
+
+
+class Expression(object):
+    """
+    TDengine 表达式转换为 SQLite 表达式
+    """
+
+    def __init__(self, tokens, window_sql=None, window_size=None, now=None, columns=None):
+        """
+        :param window_sql: _wstart 对应的表达式
+        :param window_size: 窗口毫秒数，_wend、_wduration 使用
+        :param columns: 表中已有的列名，其它列名视为没有写入过的字段，值为 NULL；None 时不检查
+        """
+        self.tokens = tokens
+        self.columns = columns
+        self.window_sql = window_sql
+        self.window_size = window_size
+        self.now = now_ms() if now is None else now
+        self.functions = set()
+        # [(运算符, 毫秒时间戳)]，_ts 与常量的比较
+        self.time_comparisons = []
+        self.has_or = False
+        self.sql = self._translate()
+
+    def _items(self):
+        """
+        :return: [(kind, sql, value)]，kind 为 time/keyword/op/string/number/other
+        """
+        items, closings, tokens = [], [], self.tokens
+        index = 0
+        while index < len(tokens):
+            token = tokens[index]
+            following = tokens[index + 1] if index + 1 < len(tokens) else None
+            is_call = following is not None and following.kind == 'op' and following.text == '('
+            if token.kind == 'name' and is_call and token.upper not in KEYWORDS:
+                function = token.text.lower()
+                if function == 'now':
+                    if index + 2 >= len(tokens) or tokens[index + 2].text != ')':
+                        raise sqlite3.OperationalError('now() 不接受参数')
+                    index += 3
+                    value = self.now
+                    # now() +/- 时长合并为一个常量
+                    if (index + 1 < len(tokens) and tokens[index].text in ('+', '-')
+                            and tokens[index + 1].kind == 'duration'):
+                        milliseconds, months = parse_duration(tokens[index + 1].text)
+                        if months:
+                            raise sqlite3.NotSupportedError('不支持按月的时间运算')
+                        value += milliseconds if tokens[index].text == '+' else -milliseconds
+                        index += 2
+                    items.append(('number', str(value), value))
+                    continue
+                self.functions.add(function)
+                name, extra = FUNCTIONS.get(function, (token.text, ''))
+                items.append(('other', name + '(', None))
+                closings.append(extra)
+                index += 2
+                continue
+            if token.kind == 'op' and token.text == '(':
+                closings.append('')
+                items.append(('op', '(', None))
+            elif token.kind == 'op' and token.text == ')':
+                if not closings:
+                    raise sqlite3.OperationalError('syntax error: unbalanced parentheses')
+                items.append(('op', closings.pop() + ')', None))
+            elif token.kind == 'op':
+                items.append(('op', token.text, None))
+            elif token.kind == 'string':
+                value = string_value(token)
+                items.append(('string', sql_string(value), value))
+            elif token.kind == 'number':
+                items.append(('number', token.text, float(token.text) if '.' in token.text else int(token.text)))
+            elif token.kind == 'duration':
+                milliseconds, months = parse_duration(token.text)
+                if months:
+                    raise sqlite3.NotSupportedError(f'不支持的时长: {token.text}')
+                items.append(('number', str(milliseconds), milliseconds))
+            elif token.kind == 'name' and token.upper in KEYWORDS:
+                keyword = token.upper
+                if keyword in ('OR', 'NOT'):
+                    self.has_or = True
+                sql = {'MATCH': 'REGEXP', 'NMATCH': 'NOT REGEXP'}.get(keyword, keyword)
+                items.append(('keyword', sql, keyword))
+            else:
+                name = identifier_name(token)
+                lowered = name.lower()
+                if token.kind == 'name' and lowered in WINDOW_NAMES:
+                    items.append(('window', self._window(lowered), lowered))
+                elif lowered in TIME_NAMES:
+                    items.append(('time', quote(TIME_COLUMN), None))
+                elif token.kind == 'name' and lowered == 'tbname':
+                    items.append(('other', quote(SERIES_COLUMN), None))
+                elif self.columns is not None and name not in self.columns:
+                    items.append(('other', 'NULL', None))
+                else:
+                    items.append(('other', quote(name), None))
+            index += 1
+        if closings:
+            raise sqlite3.OperationalError('syntax error: unbalanced parentheses')
+        return items
+
+    def _window(self, name):
+        if self.window_sql is None:
+            raise sqlite3.OperationalError(f'{name} 只能用于 INTERVAL 查询')
+        if name == '_wstart':
+            return self.window_sql
+        if not self.window_size:
+            raise sqlite3.NotSupportedError(f'按月的窗口不支持 {name}')
+        if name == '_wend':
+            return f'({self.window_sql} + {self.window_size})'
+        return str(self.window_size)
+
+    def _translate(self):
+        items = self._items()
+        self._convert_time_strings(items)
+        if not self.has_or:
+            self._collect_time_comparisons(items)
+        return ' '.join(item[1] for item in items)
+
+    @staticmethod
+    def _is_time(items, index):
+        return 0 <= index < len(items) and items[index][0] == 'time'
+
+    def _convert_time_strings(self, items):
+        """
+        与 _ts 比较的时间字符串转换为毫秒时间戳
+        """
+        in_time_list, depth = False, 0
+        for index, (kind, sql, value) in enumerate(items):
+            if in_time_list:
+                if sql == '(':
+                    depth += 1
+                elif sql == ')':
+                    depth -= 1
+                    in_time_list = depth > 0
+            if kind != 'string':
+                if kind == 'keyword' and value == 'IN' and (self._is_time(items, index - 1) or (
+                        index >= 2 and items[index - 1][2] == 'NOT' and self._is_time(items, index - 2))):
+                    in_time_list, depth = True, 0
+                continue
+            previous = items[index - 1] if index >= 1 else (None, None, None)
+            following = items[index + 1] if index + 1 < len(items) else (None, None, None)
+            convert = in_time_list and depth == 1
+            if previous[0] == 'op' and previous[1] in COMPARISON_OPERATORS and self._is_time(items, index - 2):
+                convert = True
+            elif following[0] == 'op' and following[1] in COMPARISON_OPERATORS and self._is_time(items, index + 2):
+                convert = True
+            elif previous[2] == 'BETWEEN' and self._is_time(items, index - 2):
+                convert = True
+            elif (previous[2] == 'AND' and index >= 3 and items[index - 3][2] == 'BETWEEN'
+                  and self._is_time(items, index - 4)):
+                convert = True
+            if convert:
+                milliseconds = parse_time(value, self.now)
+                items[index] = ('number', str(milliseconds), milliseconds)
+
+    def _collect_time_comparisons(self, items):
+        """
+        只有 AND 连接时，_ts 与常量的比较即为查询的时间范围
+        """
+        def constant(index):
+            if not (0 <= index < len(items)) or items[index][0] != 'number':
+                return None
+            # 常量两侧不是算术运算
+            for neighbour in (index - 1, index + 1):
+                if 0 <= neighbour < len(items) and items[neighbour][0] == 'op' and items[neighbour][1] in '+-*/%':
+                    return None
+            return items[index][2]
+
+        for index, (kind, sql, value) in enumerate(items):
+            if kind == 'op' and sql in COMPARISON_OPERATORS:
+                if self._is_time(items, index - 1) and constant(index + 1) is not None:
+                    self.time_comparisons.append((sql, constant(index + 1)))
+                elif self._is_time(items, index + 1) and constant(index - 1) is not None:
+                    self.time_comparisons.append((FLIPPED_OPERATORS.get(sql, sql), constant(index - 1)))
+            elif kind == 'keyword' and value == 'BETWEEN' and self._is_time(items, index - 1):
+                low, high = constant(index + 1), constant(index + 3)
+                if low is not None and high is not None:
+                    self.time_comparisons += [('>=', low), ('<=', high)]
+
+    def time_range(self):
+        """
+        :return: (开始, 结束)毫秒时间戳，均包含，未限制时为 None
+        """
+        start = end = None
+        for operator, value in self.time_comparisons:
+            if operator in ('>', '>='):
+                value = value + 1 if operator == '>' else value
+                start = value if start is None else max(start, value)
+            if operator in ('<', '<='):
+                value = value - 1 if operator == '<' else value
+                end = value if end is None else min(end, value)
+            if operator in ('=', '=='):
+                start = value if start is None else max(start, value)
+                end = value if end is None else min(end, value)
+        return start, end
+
+
+def split_clauses(tokens):
+    """
+    :return: {子句关键字: tokens}
+    """
+    clauses, current, depth = {}, None, 0
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if token.kind == 'op' and token.text == '(':
+            depth += 1
+        elif token.kind == 'op' and token.text == ')':
+            depth -= 1
+        if depth == 0 and token.upper in CLAUSE_KEYWORDS:
+            current = token.upper
+            if current in ('PARTITION', 'GROUP', 'ORDER'):
+                if index + 1 >= len(tokens) or tokens[index + 1].upper != 'BY':
+                    raise sqlite3.OperationalError(f'syntax error near {token.text}')
+                index += 1
+            if current in clauses:
+                raise sqlite3.OperationalError(f'syntax error: duplicate {current}')
+            clauses[current] = []
+        elif current is None:
+            raise sqlite3.OperationalError(f'syntax error near {token.text}')
+        else:
+            clauses[current].append(token)
+        index += 1
+    return clauses
+
+
+def single_int(tokens, clause):
+    if len(tokens) != 1 or tokens[0].kind != 'number':
+        raise sqlite3.OperationalError(f'syntax error: {clause}')
+    return int(tokens[0].text)
+
+
+class SelectItem(object):
+    """
+    select 列表中的一项
+    """
+
+    def __init__(self, tokens):
+        alias = None
+        if len(tokens) >= 3 and tokens[-2].upper == 'AS':
+            alias, tokens = identifier_name(tokens[-1]), tokens[:-2]
+        self.tokens = tokens
+        self.alias = alias
+        if len(tokens) == 1 and tokens[0].kind in ('ident', 'name'):
+            self.identifier = identifier_name(tokens[0])
+        else:
+            self.identifier = None
+        self.text = ''.join(token.text for token in tokens)
+        self.name = alias or self.identifier or self.text
+        self.is_star = len(tokens) == 1 and tokens[0].text == '*'
+        self.is_time = (self.name.lower() in TIME_NAMES | WINDOW_NAMES - {'_wduration'}
+                        or bool(TIME_RESULT_PATTERN.match(self.text)))
+        self.is_window = any(token.kind == 'name' and token.text.lower() in WINDOW_NAMES for token in tokens)
+
+
+class SelectStatement(object):
+    """
+    解析 TDengineWrapper 生成的 SELECT
+    """
+
+    def __init__(self, tokens):
+        clauses = split_clauses(tokens)
+        if 'SELECT' not in clauses:
+            raise sqlite3.OperationalError('syntax error')
+        self.items = [SelectItem(item) for item in split_top_level(clauses['SELECT'])]
+        table = clauses.get('FROM')
+        if table is not None and (len(table) != 1 or table[0].kind not in ('ident', 'name')):
+            raise sqlite3.NotSupportedError('只支持从一个 measurement 查询')
+        self.table = identifier_name(table[0]) if table else None
+        self.where = clauses.get('WHERE')
+        self.partition = [identifier_name(part[0]) if len(part) == 1 and part[0].kind in ('ident', 'name')
+                          else None for part in split_top_level(clauses.get('PARTITION', []))]
+        if None in self.partition:
+            raise sqlite3.NotSupportedError('PARTITION BY 只支持列名')
+        self.group_by = clauses.get('GROUP')
+        self.interval, self.interval_offset = self._parse_interval(clauses.get('INTERVAL'))
+        if 'SLIDING' in clauses:
+            sliding = ''.join(token.text for token in clauses['SLIDING']).strip('()')
+            if self.interval is None or sliding != self.interval:
+                raise sqlite3.NotSupportedError('不支持 SLIDING')
+        fill = ''.join(token.text for token in clauses.get('FILL', [])).strip('()').upper()
+        if fill not in ('', 'NULL', 'NULL_F', 'NONE'):
+            raise sqlite3.NotSupportedError(f'不支持 FILL({fill})')
+        self.fill = fill in ('NULL', 'NULL_F')
+        self.order_by = [self._parse_order(part) for part in split_top_level(clauses.get('ORDER', []))]
+        self.slimit = single_int(clauses['SLIMIT'], 'SLIMIT') if 'SLIMIT' in clauses else None
+        self.soffset = single_int(clauses['SOFFSET'], 'SOFFSET') if 'SOFFSET' in clauses else None
+        self.limit, self.offset = None, None
+        if 'LIMIT' in clauses:
+            parts = split_top_level(clauses['LIMIT'])
+            if len(parts) == 2:
+                # LIMIT offset, count
+                self.offset, self.limit = single_int(parts[0], 'LIMIT'), single_int(parts[1], 'LIMIT')
+            else:
+                self.limit = single_int(clauses['LIMIT'], 'LIMIT')
+        if 'OFFSET' in clauses:
+            self.offset = single_int(clauses['OFFSET'], 'OFFSET')
+
+    @staticmethod
+    def _parse_interval(tokens):
+        if tokens is None:
+            return None, None
+        values = [''.join(token.text for token in part) for part in split_top_level(tokens[1:-1])]
+        if not tokens or tokens[0].text != '(' or tokens[-1].text != ')' or not 1 <= len(values) <= 2:
+            raise sqlite3.OperationalError('syntax error: INTERVAL')
+        return values[0], values[1] if len(values) == 2 else None
+
+    @staticmethod
+    def _parse_order(tokens):
+        descending = False
+        if tokens and tokens[-1].upper in ('ASC', 'DESC'):
+            descending, tokens = tokens[-1].upper == 'DESC', tokens[:-1]
+        # '-time'(InfluxDB 写法)视为倒序
+        if len(tokens) == 2 and tokens[0].text == '-':
+            descending, tokens = True, tokens[1:]
+        if not tokens:
+            raise sqlite3.OperationalError('syntax error: ORDER BY')
+        return tokens, descending
+
+
+class SelectQuery(object):
+    """
+    在一个 store 上执行 SELECT
+    :return: rows 迭代器，description
+    """
+
+    def __init__(self, db, statement, now=None):
+        self.db = db
+        self.statement = statement
+        self.now = now_ms() if now is None else now
+        self.columns = load_columns(db, statement.table) if statement.table else {}
+        self.items = self._expand_items()
+        self.names = [item.name for item in self.items]
+        self.converters = [self._converter(item) for item in self.items]
+
+    def _expand_items(self):
+        items = []
+        for item in self.statement.items:
+            if not item.is_star:
+                items.append(item)
+                continue
+            # * 展开为 _ts、字段、标签
+            names = [TIME_COLUMN] + [name for name, (kind, _) in self.columns.items() if kind == KIND_FIELD] + \
+                    [name for name, (kind, _) in self.columns.items() if kind == KIND_TAG]
+            items += [SelectItem([Token('ident', quote(name))]) for name in names]
+        return items
+
+    def _converter(self, item):
+        if item.is_time:
+            return to_local_datetime
+        column = self.columns.get(item.identifier) if item.identifier else None
+        if column is not None and column[1] == 'bool':
+            return bool
+        return None
+
+    def _window(self):
+        """
+        :return: (窗口开始表达式, 窗口毫秒数或 None, 窗口月数或 None, 时间范围)
+        """
+        statement = self.statement
+        where = Expression(statement.where, now=self.now) if statement.where else None
+        time_range = where.time_range() if where is not None else (None, None)
+        if statement.interval is None:
+            return None, None, None, time_range
+        milliseconds, months = parse_duration(statement.interval)
+        offset = statement.interval_offset
+        if offset is not None and offset.upper() == 'AUTO':
+            origin = time_range[0]
+            if origin is None:
+                origin = 0 if milliseconds else to_ms(datetime(1970, 1, 1))
+        elif offset is not None:
+            origin = parse_duration(offset)[0]
+        else:
+            # 按月的窗口从本地时间 1970-01 开始
+            origin = 0 if milliseconds else to_ms(datetime(1970, 1, 1))
+        ts = quote(TIME_COLUMN)
+        if milliseconds:
+            window_sql = f'({ts} - ((({ts} - {origin}) % {milliseconds}) + {milliseconds}) % {milliseconds})'
+        else:
+            window_sql = f'_tsdb_calendar_window({ts}, {months}, {origin})'
+        self.origin = origin
+        return window_sql, milliseconds or None, months or None, time_range
+
+    def execute(self):
+        statement = self.statement
+        window_sql, window_size, window_months, time_range = self._window()
+
+        def expression(tokens, columns=None):
+            return Expression(tokens, window_sql, window_size, self.now, columns)
+
+        # 与 InfluxDB 相同，没有写入过的字段查询结果为空值，而不是出错
+        known = set(self.columns) | set(RESERVED_COLUMNS) if statement.table else None
+        selects = [expression(item.tokens, known) for item in self.items]
+        aggregate = any(select.functions & AGGREGATE_FUNCTIONS for select in selects)
+        columns = [select.sql for select in selects]
+        partition = [quote(name) for name in statement.partition]
+        hidden = []
+        if window_sql is not None:
+            hidden.append(window_sql)
+        hidden += partition
+        sql = 'SELECT ' + ', '.join(columns + hidden)
+        if statement.table:
+            sql += f' FROM {quote(statement.table)}'
+        if statement.where:
+            sql += f' WHERE {expression(statement.where, known).sql}'
+        group = list(hidden) if aggregate or window_sql is not None else []
+        if statement.group_by:
+            group += [expression(part).sql for part in split_top_level(statement.group_by)]
+        if group:
+            sql += ' GROUP BY ' + ', '.join(group)
+        python_path = window_sql is not None or bool(partition)
+        if not python_path:
+            if statement.order_by:
+                sql += ' ORDER BY ' + ', '.join(
+                    expression(self._order_tokens(tokens)).sql + (' DESC' if descending else '')
+                    for tokens, descending in statement.order_by
+                )
+            if statement.limit is not None or statement.offset is not None:
+                sql += f' LIMIT {statement.limit if statement.limit is not None else -1}'
+                if statement.offset is not None:
+                    sql += f' OFFSET {statement.offset}'
+            cursor = self.db.execute(sql)
+            time_indexes = [index for index, item in enumerate(self.items) if item.is_time]
+            if aggregate and not group and time_indexes:
+                # 没有数据时 SQLite 仍返回一行空值，TDengine 不返回结果
+                cursor = [row for row in cursor if any(row[index] is not None for index in time_indexes)]
+            return self._convert(cursor)
+        if window_sql is not None:
+            sql += ' ORDER BY ' + ', '.join(partition + [window_sql])
+        elif not aggregate:
+            sql += ' ORDER BY ' + ', '.join(partition + [quote(TIME_COLUMN)])
+        else:
+            sql += ' ORDER BY ' + ', '.join(partition)
+        rows = self.db.execute(sql).fetchall()
+        hidden_start = len(columns)
+        if window_sql is not None and statement.fill:
+            rows = self._fill(rows, hidden_start, window_size, window_months, time_range)
+        rows = self._order(rows, hidden_start, window_sql is not None)
+        rows = self._limit(rows, hidden_start, window_sql is not None)
+        return self._convert(row[:hidden_start] for row in rows)
+
+    def _order_tokens(self, tokens):
+        # ORDER BY 别名(如 _ts)在 SQLite 中同样可用，保留原名
+        if len(tokens) == 1 and tokens[0].kind in ('ident', 'name'):
+            name = identifier_name(tokens[0])
+            if name in self.names and name.lower() not in TIME_NAMES:
+                return [Token('ident', quote(name))]
+        return tokens
+
+    def _fill(self, rows, hidden_start, window_size, window_months, time_range):
+        """
+        FILL(NULL): 每个分组补充时间范围内没有数据的窗口
+        """
+        start, end = time_range
+        windows_of = {}
+        for row in rows:
+            windows_of.setdefault(tuple(row[hidden_start + 1:]), set()).add(row[hidden_start])
+        if not windows_of:
+            return rows
+        all_windows = [window for windows in windows_of.values() for window in windows]
+        first = self._window_of(start, window_size, window_months) if start is not None else min(all_windows)
+        last = self._window_of(end, window_size, window_months) if end is not None else max(all_windows)
+        windows, window = [], first
+        while window <= last:
+            windows.append(window)
+            if len(windows) > MAX_FILL_WINDOWS:
+                raise sqlite3.OperationalError('Too many windows in FILL')
+            window = window + window_size if window_size else to_ms(add_months(to_local_datetime(window),
+                                                                                window_months))
+        partition_names = self.statement.partition
+        filled = list(rows)
+        for key, existing in windows_of.items():
+            partition_values = dict(zip(partition_names, key))
+            for window in windows:
+                if window in existing:
+                    continue
+                values = []
+                for item in self.items:
+                    if item.is_window and item.text.lower() == '_wstart':
+                        values.append(window)
+                    elif item.is_window and item.text.lower() == '_wend' and window_size:
+                        values.append(window + window_size)
+                    elif item.identifier in partition_values:
+                        values.append(partition_values[item.identifier])
+                    else:
+                        values.append(None)
+                filled.append(tuple(values) + (window,) + key)
+        filled.sort(key=lambda row: (_sort_key(row[hidden_start + 1:]), row[hidden_start]))
+        return filled
+
+    def _window_of(self, ts, window_size, window_months):
+        if window_size:
+            return ts - ((ts - self.origin) % window_size + window_size) % window_size
+        return calendar_window(ts, window_months, self.origin)
+
+    def _sort_index(self, tokens, hidden_start, has_window):
+        """
+        :return: ORDER BY 项对应的结果列序号
+        """
+        name = identifier_name(tokens[0]) if len(tokens) == 1 and tokens[0].kind in ('ident', 'name') else \
+            ''.join(token.text for token in tokens)
+        lowered = name.lower()
+        for index, item in enumerate(self.items):
+            if item.name == name or item.text == name:
+                return index
+        if lowered in TIME_NAMES or lowered == '_wstart':
+            for index, item in enumerate(self.items):
+                if item.is_time:
+                    return index
+            if has_window:
+                return hidden_start
+        if name in self.statement.partition:
+            return hidden_start + int(has_window) + self.statement.partition.index(name)
+        raise sqlite3.NotSupportedError(f'ORDER BY {name} 须为查询结果中的列')
+
+    def _order(self, rows, hidden_start, has_window):
+        for tokens, descending in reversed(self.statement.order_by):
+            index = self._sort_index(tokens, hidden_start, has_window)
+            rows.sort(key=lambda row: (row[index] is not None, row[index]), reverse=descending)
+        return rows
+
+    def _limit(self, rows, hidden_start, has_window):
+        """
+        有 PARTITION BY 时 SLIMIT/SOFFSET 限制分组数，LIMIT/OFFSET 限制每个分组的行数
+        """
+        statement = self.statement
+        if not statement.partition:
+            start = statement.offset or 0
+            return rows[start:start + statement.limit if statement.limit is not None else None]
+        if all(value is None for value in (statement.slimit, statement.soffset, statement.limit, statement.offset)):
+            return rows
+        key_start = hidden_start + int(has_window)
+        partitions, counts, result = {}, {}, []
+        soffset, offset = statement.soffset or 0, statement.offset or 0
+        for row in rows:
+            key = row[key_start:]
+            if key not in partitions:
+                partitions[key] = len(partitions)
+            if partitions[key] < soffset or (statement.slimit is not None
+                                             and partitions[key] >= soffset + statement.slimit):
+                continue
+            count = counts[key] = counts.get(key, 0) + 1
+            if count <= offset or (statement.limit is not None and count > offset + statement.limit):
+                continue
+            result.append(row)
+        return result
+
+    def _convert(self, rows):
+        converters = [(index, converter) for index, converter in enumerate(self.converters) if converter]
+        if not converters:
+            return rows
+
+        def convert(row):
+            row = list(row)
+            for index, converter in converters:
+                if row[index] is not None:
+                    row[index] = converter(row[index])
+            return tuple(row)
+
+        return map(convert, rows)
+
+    @property
+    def description(self):
+        return [(name, None, None, None, None, None, None) for name in self.names]
+
+
+def _sort_key(values):
+    return tuple((value is not None, value) for value in values)
+
+
+class SQLiteCursor(object):
+    """
+    与 taosws 游标相同的接口: execute、fetchall、fetchmany、fetchone、description、rowcount
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._rows = iter(())
+        self.description = None
+        self.rowcount = -1
+
+    def execute(self, sql, *args, **kwargs):
+        rows, self.description, self.rowcount = self._conn._execute(sql)
+        self._rows = iter(rows)
+        return self.rowcount
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchmany(self, size=1000):
+        return list(islice(self._rows, size))
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def close(self):
+        self._rows = iter(())
+
+
+class SQLiteConnection(object):
+    """
+    与 taosws 连接相同的接口，在 SQLite 上执行 TDengineWrapper 使用的语句与 schemaless 写入
+    当前数据库(use)按线程保存
+    """
+
+    def __init__(self, stores):
+        self.stores = stores
+        self._local = threading.local()
+
+    @property
+    def store(self):
+        return getattr(self._local, 'store', None)
+
+    def _db(self):
+        if self.store is None:
+            raise sqlite3.OperationalError('Database not specified or available')
+        return self.stores.connection(self.store)
+
+    def cursor(self):
+        return SQLiteCursor(self)
+
+    def execute(self, sql, *args, **kwargs):
+        return self._execute(sql)[2]
+
+    def query(self, sql, *args, **kwargs):
+        cursor = self.cursor()
+        cursor.execute(sql)
+        return cursor
+
+    def commit(self):
+        pass
+
+    def close(self):
+        # 连接由 SQLiteStores 在进程内共享
+        self._local = threading.local()
+
+    def schemaless_insert(self, lines=None, protocol=None, precision=None, ttl=None, req_id=None):
+        """
+        写入行协议(时间精度为毫秒)，没有时间的数据点为当前时间
+        :return: 写入的数据点数
+        """
+        db = self._db()
+        default_timestamp = now_ms()
+        # 按 (measurement, 标签名, 字段名) 分组批量写入
+        groups = {}
+        for line in lines or []:
+            if not line or not line.strip():
+                continue
+            measurement, tags, fields, timestamp = parse_line(line, default_timestamp)
+            key = (measurement, tuple(tags), tuple(fields))
+            group = groups.setdefault(key, ({}, []))
+            for name, (_, column_type) in fields.items():
+                group[0].setdefault(name, column_type)
+            group[1].append([series_key(tags), timestamp, *tags.values(), *(value for value, _ in fields.values())])
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            known_columns = {}
+            for (measurement, tag_names, field_names), (field_types, values) in groups.items():
+                known = known_columns.get(measurement)
+                if known is None:
+                    known = known_columns[measurement] = load_columns(db, measurement)
+                columns = {name: (KIND_TAG, 'tag') for name in tag_names}
+                columns.update({name: (KIND_FIELD, field_types[name]) for name in field_names})
+                ensure_columns(db, measurement, columns, known)
+                names = [SERIES_COLUMN, TIME_COLUMN, *tag_names, *field_names]
+                sql = (f'INSERT INTO {quote(measurement)} ({", ".join(quote(name) for name in names)}) '
+                       f'VALUES ({", ".join("?" * len(names))})')
+                if field_names:
+                    # 时间与标签相同时覆盖本次写入的字段，其它字段不变
+                    sql += (f' ON CONFLICT ({quote(SERIES_COLUMN)}, {quote(TIME_COLUMN)}) DO UPDATE SET '
+                            + ', '.join(f'{quote(name)} = excluded.{quote(name)}' for name in field_names))
+                else:
+                    sql += ' ON CONFLICT DO NOTHING'
+                db.executemany(sql, values)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return sum(len(values) for _, values in groups.values())
+
+    def _execute(self, sql):
+        """
+        :return: (rows, description, rowcount)
+        """
+        tokens = tokenize(sql.strip().rstrip(';'))
+        if not tokens:
+            raise sqlite3.OperationalError('empty statement')
+        command = tokens[0].upper
+        if command == 'SELECT':
+            return self._select(tokens)
+        if command == 'USE':
+            return self._use(tokens)
+        if command == 'SHOW':
+            return self._show(tokens)
+        if command == 'CREATE' and len(tokens) > 1 and tokens[1].upper == 'DATABASE':
+            self.stores.create(self._database_name(tokens[2:]))
+            return [], None, 0
+        if command == 'DROP' and len(tokens) > 1 and tokens[1].upper == 'DATABASE':
+            self._drop_database(self._database_name(tokens[2:]))
+            return [], None, 0
+        if command == 'DROP' and len(tokens) > 1 and tokens[1].upper in ('TABLE', 'STABLE'):
+            return self._drop_table(tokens[2:])
+        if command == 'ALTER' and len(tokens) > 1 and tokens[1].upper == 'DATABASE':
+            # 保留时间(KEEP)等选项不生效
+            self.stores.path(self._database_name(tokens[2:3]))
+            return [], None, 0
+        if command == 'DELETE':
+            return self._delete(tokens)
+        raise sqlite3.NotSupportedError(f'不支持的语句: {sql[:100]}')
+
+    @staticmethod
+    def _database_name(tokens):
+        # [IF [NOT] EXISTS] `name` [选项]
+        while tokens and tokens[0].upper in ('IF', 'NOT', 'EXISTS'):
+            tokens = tokens[1:]
+        if not tokens or tokens[0].kind not in ('ident', 'name'):
+            raise sqlite3.OperationalError('syntax error: database name')
+        return identifier_name(tokens[0])
+
+    def _use(self, tokens):
+        store = self._database_name(tokens[1:])
+        self.stores.connection(store)
+        self._local.store = store
+        return [], None, 0
+
+    def _show(self, tokens):
+        target = ' '.join(token.upper or token.text for token in tokens[1:])
+        if target == 'DATABASES':
+            return [(name,) for name in self.stores.names()], [('name', None, None, None, None, None, None)], 0
+        if target in ('STABLES', 'TABLES'):
+            rows = self._db().execute(f'SELECT DISTINCT measurement FROM {COLUMNS_TABLE} ORDER BY measurement')
+            return rows.fetchall(), [('stable_name', None, None, None, None, None, None)], 0
+        raise sqlite3.NotSupportedError(f'不支持的语句: SHOW {target}')
+
+    def _drop_database(self, store):
+        if self.stores.exists(store):
+            self.stores.drop(store)
+        if self.store == store:
+            self._local.store = None
+
+    def _drop_table(self, tokens):
+        measurement = self._database_name(tokens)
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute(f'DROP TABLE IF EXISTS {quote(measurement)}')
+            db.execute(f'DELETE FROM {COLUMNS_TABLE} WHERE measurement = ?', (measurement,))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return [], None, 0
+
+    def _delete(self, tokens):
+        clauses = split_clauses([Token('name', 'SELECT')] + tokens[1:])
+        table = clauses.get('FROM')
+        if not table or len(table) != 1 or set(clauses) - {'SELECT', 'FROM', 'WHERE'}:
+            raise sqlite3.NotSupportedError('DELETE 只支持 DELETE FROM measurement [WHERE 条件]')
+        sql = f'DELETE FROM {quote(identifier_name(table[0]))}'
+        if clauses.get('WHERE'):
+            sql += f' WHERE {Expression(clauses["WHERE"]).sql}'
+        cursor = self._db().execute(sql)
+        return [], None, cursor.rowcount
+
+    def _select(self, tokens):
+        statement = SelectStatement(tokens)
+        db = self._db() if statement.table else self._any_db()
+        query = SelectQuery(db, statement)
+        rows = query.execute()
+        return rows, query.description, -1
+
+    def _any_db(self):
+        # 没有 FROM 的 SELECT(如 SELECT SERVER_STATUS())
+        if self.store is not None:
+            return self._db()
+        db = sqlite3.connect(':memory:')
+        _register_functions(db)
+        return db
+
+
+class SQLiteWrapper(StreamingTDengineWrapper):
+    """
+    TSDB_TYPE=sqlite 时 DatabaseFactory.get_client 返回的客户端
+    """
+
+    def __init__(self, logger=None, directory=None):
+        """
+        :param directory: 数据库文件目录，默认为 SQLITE_TSDB_DIR
+        """
+        self.stores = get_stores(directory)
+        super().__init__(logger=logger)
+
+    def connect(self):
+        self.conn = SQLiteConnection(self.stores)
+
+    def close(self):
+        self.conn = None
+
+    def delete_old_data(self, store_name, start):
+        """
+        删除 store 中 start 之前的数据
+        :param start: datetime(无时区时按 TIME_ZONE_OFFSET)或毫秒时间戳
+        :return: 删除的数据点数
+        """
+        before = to_ms(start) if isinstance(start, datetime) else int(start)
+        db = self.stores.connection(store_name)
+        count = 0
+        for (measurement,) in db.execute(f'SELECT DISTINCT measurement FROM {COLUMNS_TABLE}').fetchall():
+            count += db.execute(f'DELETE FROM {quote(measurement)} WHERE {quote(TIME_COLUMN)} < ?',
+                                (before,)).rowcount
+        return count
+
+    def get_store_disk_usage(self, store_name):
+        """
+        :return: 数据库文件大小(字节)
+        """
+        if not self.stores.exists(store_name):
+            return None
+        return self.stores.disk_usage(store_name)
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+时序数据库分批查询
+
+query 在返回前把整个结果集读入内存，导出、月/年分析的长时间范围查询会拉取数百万个点。
+DatabaseFactory.get_client 返回的客户端增加 query_iter，参数与 query 相同，按批返回结果(每批的格式同 result_format):
+    InfluxDB  查询语句以 chunked=true&chunk_size=batch_size 发送，逐块读取响应(每个 series 每块最多 batch_size 个点)
+    TDengine  查询语句在游标上执行后 fetchmany(batch_size) 逐批读取
+查询语句仍由原 query 生成，逐行结果也由原 query 的转换逻辑生成，与 query 返回的格式一致。
+内存占用只与 batch_size 有关，与时间范围无关。
+"""
+import json
+import threading
+from contextlib import contextmanager
+
+from backend.m_common.tsdb import influxdb_wrapper
+from backend.m_common.tsdb.columnar import ColumnarInfluxDBWrapper, ColumnarTDengineWrapper, RESULT_FORMAT_ROWS, \
+    TDENGINE_TIME_COLUMN, build_columns, check_result_format, format_result
+from backend.m_common.tsdb.influxdb_wrapper import InfluxDBWrapper
+from backend.m_common.tsdb.tdengine_wrapper import TDengineWrapper
+
+DEFAULT_BATCH_SIZE = 10000
+# 分块响应的读取超时(秒)
+INFLUXDB_STREAM_TIMEOUT = (5, 300)
+
+_local = threading.local()
+
+
+class _CapturedResponse(object):
+    """
+    只记录查询语句时返回的空响应
+    """
+    status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    @staticmethod
+    def json():
+        return {'results': []}
+
+
+class _CapturingRequests(object):
+    """
+    influxdb_wrapper 使用的 requests，当前线程开启记录时只记录查询请求而不发送，其它情况原样转发
+    """
+
+    def __init__(self, requests):
+        self._requests = requests
+
+    def get(self, url, *args, **kwargs):
+        captured = getattr(_local, 'captured', None)
+        if captured is None:
+            return self._requests.get(url, *args, **kwargs)
+        captured.update(url=url, headers=kwargs.get('headers'), params=kwargs.get('params'))
+        return _CapturedResponse()
+
+    def __getattr__(self, name):
+        return getattr(self._requests, name)
+
+
+# influxdb_wrapper.query 经模块中的 requests 发送查询
+if not isinstance(influxdb_wrapper.requests, _CapturingRequests):
+    influxdb_wrapper.requests = _CapturingRequests(influxdb_wrapper.requests)
+
+
+class StreamingInfluxDBWrapper(ColumnarInfluxDBWrapper):
+    """
+    支持 query_iter 的 InfluxDBWrapper
+    """
+
+    def query_iter(self, store=None, selects=None, measurement=None, where=None, group_by=None, order_by=None,
+                   limit=None, offset=None, slimit=None, soffset=None, interval=None, aggregate=None,
+                   is_standard=True, result_format=RESULT_FORMAT_ROWS, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        分批查询
+        :param batch_size: 每批每个 series 的最大点数
+        :return: 生成器，每批结果的格式同 query(result_format)
+        """
+        check_result_format(result_format)
+        captured = _local.captured = {}
+        try:
+            InfluxDBWrapper.query(self, store, selects, measurement, where, group_by, order_by, limit, offset,
+                                  slimit, soffset, interval, aggregate, is_standard)
+        finally:
+            _local.captured = None
+        if not captured:
+            return
+        params = dict(captured['params'], chunked='true', chunk_size=batch_size)
+        requests = influxdb_wrapper.requests._requests
+        with requests.get(captured['url'], headers=captured['headers'], params=params, stream=True,
+                          timeout=INFLUXDB_STREAM_TIMEOUT) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                results = json.loads(line).get('results') or []
+                errors = [result['error'] for result in results if 'error' in result]
+                if errors:
+                    self._logger.error(f'influxdb 分批查询失败: {errors}')
+                    raise RuntimeError(errors[0])
+                if result_format == RESULT_FORMAT_ROWS:
+                    batch = InfluxDBWrapper._arrange_query_results(results)
+                    if batch:
+                        yield batch
+                else:
+                    batch = self._series_to_columns(results)
+                    if batch.row_count:
+                        yield format_result(batch, result_format)
+
+
+class _ThreadCursorConnection(object):
+    """
+    当前线程的 cursor() 返回指定的游标，其它线程使用原连接
+    """
+
+    def __init__(self, conn, cursor_factory):
+        self._conn = conn
+        self._cursor_factory = cursor_factory
+        self._thread_id = threading.get_ident()
+
+    def cursor(self, *args, **kwargs):
+        if threading.get_ident() == self._thread_id:
+            return self._cursor_factory()
+        return self._conn.cursor(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class _CaptureCursor(object):
+    """
+    只记录查询语句，不执行
+    """
+    description = None
+
+    def __init__(self, captured):
+        self._captured = captured
+
+    def execute(self, sql, *args, **kwargs):
+        if not sql.upper().startswith('USE '):
+            self._captured.append(sql)
+        return 0
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class _ReplayCursor(object):
+    """
+    返回已读取的一批结果，由原 query 转换为逐行结果
+    """
+
+    def __init__(self, rows, description):
+        self._rows = rows
+        self.description = description
+
+    def execute(self, *args, **kwargs):
+        return 0
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class StreamingTDengineWrapper(ColumnarTDengineWrapper):
+    """
+    支持 query_iter 的 TDengineWrapper
+    """
+
+    @contextmanager
+    def _iter_connection(self, store):
+        """
+        分批查询期间使用的连接
+        """
+        if not self.conn:
+            self.connect()
+        yield self.conn
+
+    @contextmanager
+    def _cursor_override(self, conn, cursor_factory):
+        """
+        在当前线程内让原 query 使用指定的游标
+        """
+        original = self.conn
+        proxy = self.conn = _ThreadCursorConnection(conn, cursor_factory)
+        try:
+            yield
+        finally:
+            if self.conn is proxy:
+                self.conn = original
+
+    def query_iter(self, store=None, selects=None, measurement=None, where=None, group_by=None, order_by=None,
+                   limit=None, offset=None, slimit=None, soffset=None, interval=None, aggregate=None,
+                   is_standard=True, result_format=RESULT_FORMAT_ROWS, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        分批查询
+        :param batch_size: 每批最大行数
+        :return: 生成器，每批结果的格式同 query(result_format)
+        """
+        check_result_format(result_format)
+        args = (store, selects, measurement, where, group_by, order_by, limit, offset, slimit, soffset, interval,
+                aggregate, is_standard)
+        with self._iter_connection(store) as conn:
+            captured = []
+            with self._cursor_override(conn, lambda: _CaptureCursor(captured)):
+                TDengineWrapper.query(self, *args)
+            if not captured:
+                return
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f'USE `{store}`')
+                cursor.execute(captured[-1])
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield self._convert_batch(conn, args, rows, cursor.description, result_format)
+            finally:
+                cursor.close()
+
+    def _convert_batch(self, conn, args, rows, description, result_format):
+        if result_format != RESULT_FORMAT_ROWS:
+            names = [column[0] for column in description]
+            return format_result(build_columns(names, list(zip(*rows)), TDENGINE_TIME_COLUMN), result_format)
+        with self._cursor_override(conn, lambda: _ReplayCursor(rows, description)):
+            return TDengineWrapper.query(self, *args)
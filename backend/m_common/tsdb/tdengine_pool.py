@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+TDengine 连接池
+
+TDengineWrapper 只持有一个连接，每次操作前执行 use `store` 切换数据库:
+    多线程共用同一个客户端时(uwsgi 多线程、isw_adapter 批量写入)连接上的当前数据库会被其它线程切换，
+    每个客户端对象又各自建立一次 websocket(6041 端口 taosAdapter)连接
+TDENGINE_POOL_ENABLED=True 时 DatabaseFactory.get_client('tdengine') 返回 PooledTDengineWrapper:
+    连接按数据库(store)保存在进程内的连接池中，建立时即 use `store`，操作期间由当前线程独占，用完归还
+    连接记录当前数据库，原 query 每次执行的 use `store` 与当前数据库相同时不再发送
+    嵌套调用(如 query 中调用的方法)的数据库与外层不同时另取一个连接，外层连接的当前数据库不变
+    每个数据库最多 TDENGINE_POOL_SIZE 个连接，空闲超过 TDENGINE_POOL_MAX_IDLE 秒的连接被关闭，
+    空闲超过 TDENGINE_POOL_HEALTH_CHECK_INTERVAL 秒的连接取出时先执行一次检查，失败则重新建立
+"""
+import atexit
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import taosws
+
+from backend.m_common.tsdb.abstract import env
+from backend.m_common.tsdb.streaming import StreamingTDengineWrapper
+
+TDENGINE_POOL_ENABLED = env.bool('TDENGINE_POOL_ENABLED', default=False)
+# 每个数据库的最大连接数
+TDENGINE_POOL_SIZE = env.int('TDENGINE_POOL_SIZE', default=8)
+# 空闲连接最长保留时间(秒)
+TDENGINE_POOL_MAX_IDLE = env.int('TDENGINE_POOL_MAX_IDLE', default=300)
+# 空闲超过该时间(秒)的连接取出时先检查是否可用
+TDENGINE_POOL_HEALTH_CHECK_INTERVAL = env.int('TDENGINE_POOL_HEALTH_CHECK_INTERVAL', default=30)
+# 连接数已满时等待归还的最长时间(秒)
+TDENGINE_POOL_TIMEOUT = env.int('TDENGINE_POOL_TIMEOUT', default=10)
+
+HEALTH_CHECK_SQL = 'SELECT SERVER_STATUS()'
+USE_SQL_PATTERN = re.compile(r'^\s*use\s+`?([^`\s;]+)`?\s*;?\s*$', re.IGNORECASE)
+
+
+class StoreConnection(object):
+    """
+    记录当前数据库的连接，切换到当前数据库的 use 语句不发送
+    """
+
+    def __init__(self, conn, store):
+        self._conn = conn
+        self.current_store = store
+
+    def use_skipped(self, sql):
+        """
+        :return: sql 是切换到当前数据库的 use 语句(不需执行)
+        """
+        match = USE_SQL_PATTERN.match(sql) if isinstance(sql, str) else None
+        if match is None:
+            return False
+        if match.group(1) == self.current_store:
+            return True
+        # 切换到其它数据库，执行成功后记录
+        self.current_store = None
+        return False
+
+    def after_execute(self, sql):
+        match = USE_SQL_PATTERN.match(sql) if isinstance(sql, str) else None
+        if match is not None:
+            self.current_store = match.group(1)
+
+    def execute(self, sql, *args, **kwargs):
+        if self.use_skipped(sql):
+            return 0
+        result = self._conn.execute(sql, *args, **kwargs)
+        self.after_execute(sql)
+        return result
+
+    def cursor(self, *args, **kwargs):
+        return StoreCursor(self._conn.cursor(*args, **kwargs), self)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class StoreCursor(object):
+
+    def __init__(self, cursor, conn):
+        self._cursor = cursor
+        self._store_conn = conn
+
+    def execute(self, sql, *args, **kwargs):
+        if self._store_conn.use_skipped(sql):
+            return 0
+        result = self._cursor.execute(sql, *args, **kwargs)
+        self._store_conn.after_execute(sql)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class PooledConnection(object):
+    __slots__ = ('conn', 'store', 'last_used', 'last_checked')
+
+    def __init__(self, conn, store, now):
+        self.conn = conn
+        self.store = store
+        self.last_used = now
+        self.last_checked = now
+
+
+class TDengineConnectionPool(object):
+    """
+    按数据库保存的连接池，线程安全
+    """
+
+    def __init__(self, dsn, size=TDENGINE_POOL_SIZE, max_idle=TDENGINE_POOL_MAX_IDLE,
+                 health_check_interval=TDENGINE_POOL_HEALTH_CHECK_INTERVAL, timeout=TDENGINE_POOL_TIMEOUT,
+                 logger=None):
+        """
+        :param dsn: taosws 连接串
+        :param size: 每个数据库的最大连接数
+        :param max_idle: 空闲连接最长保留时间(秒)
+        :param health_check_interval: 空闲超过该时间(秒)的连接取出时先检查
+        :param timeout: 连接数已满时等待归还的最长时间(秒)
+        """
+        self.dsn = dsn
+        self.size = size
+        self.max_idle = max_idle
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self.logger = logger
+        self._lock = threading.Lock()
+        # {store: deque([PooledConnection, ...])}，右端为最近归还的连接
+        self._idle = {}
+        # {store: BoundedSemaphore}，限制每个数据库同时使用的连接数
+        self._slots = {}
+
+    def _get_slots(self, store):
+        with self._lock:
+            slots = self._slots.get(store)
+            if slots is None:
+                slots = self._slots[store] = threading.BoundedSemaphore(self.size)
+            return slots
+
+    def _connect(self, store, now):
+        conn = taosws.connect(self.dsn)
+        if store is not None:
+            conn.execute(f'use `{store}`')
+        return PooledConnection(StoreConnection(conn, store), store, now)
+
+    def _close(self, pooled):
+        try:
+            pooled.conn.close()
+        except Exception as err:
+            if self.logger:
+                self.logger.warning(f'tdengine 关闭连接失败 store<<{pooled.store}>>: {err}')
+
+    def _is_healthy(self, pooled, now):
+        if now - pooled.last_checked < self.health_check_interval:
+            return True
+        try:
+            pooled.conn.execute(HEALTH_CHECK_SQL)
+        except Exception as err:
+            if self.logger:
+                self.logger.warning(f'tdengine 连接检查失败 store<<{pooled.store}>>: {err}')
+            return False
+        pooled.last_checked = now
+        return True
+
+    def evict_idle(self, now=None):
+        """
+        关闭空闲超时的连接
+        :return: 关闭的连接数
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self._lock:
+            for idle in self._idle.values():
+                # 左端为最早归还的连接
+                while idle and now - idle[0].last_used >= self.max_idle:
+                    expired.append(idle.popleft())
+        for pooled in expired:
+            self._close(pooled)
+        return len(expired)
+
+    def _take_idle(self, store):
+        with self._lock:
+            idle = self._idle.get(store)
+            return idle.pop() if idle else None
+
+    def acquire(self, store):
+        """
+        取出一个连接，使用后须调用 release
+        :param store: 数据库名，None 表示不指定数据库
+        :return: PooledConnection
+        """
+        if not self._get_slots(store).acquire(timeout=self.timeout):
+            raise TimeoutError(f'tdengine 连接池已满 store<<{store}>> size<<{self.size}>>')
+        try:
+            now = time.monotonic()
+            self.evict_idle(now)
+            while True:
+                pooled = self._take_idle(store)
+                if pooled is None:
+                    return self._connect(store, now)
+                if self._is_healthy(pooled, now):
+                    return pooled
+                self._close(pooled)
+        except Exception:
+            self._slots[store].release()
+            raise
+
+    def release(self, pooled, discard=False):
+        """
+        归还连接
+        :param discard: 为 True 时关闭连接而不放回连接池(操作出错，连接状态未知)
+        """
+        if discard:
+            self._close(pooled)
+        else:
+            pooled.last_used = time.monotonic()
+            with self._lock:
+                self._idle.setdefault(pooled.store, deque()).append(pooled)
+        self._slots[pooled.store].release()
+
+    @contextmanager
+    def connection(self, store):
+        pooled = self.acquire(store)
+        try:
+            yield pooled.conn
+        except Exception:
+            self.release(pooled, discard=True)
+            raise
+        self.release(pooled)
+
+    def clear(self, store):
+        """
+        关闭数据库的空闲连接，删除数据库后调用
+        """
+        with self._lock:
+            idle = self._idle.pop(store, None) or ()
+        for pooled in idle:
+            self._close(pooled)
+
+    def close(self):
+        with self._lock:
+            stores = list(self._idle)
+        for store in stores:
+            self.clear(store)
+
+
+# {dsn: TDengineConnectionPool}
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dsn, logger=None):
+    with _pools_lock:
+        pool = _pools.get(dsn)
+        if pool is None:
+            pool = _pools[dsn] = TDengineConnectionPool(dsn, logger=logger)
+        return pool
+
+
+@atexit.register
+def _close_pools():
+    for pool in list(_pools.values()):
+        pool.close()
+
+
+class PooledTDengineWrapper(StreamingTDengineWrapper):
+    """
+    使用连接池的 TDengineWrapper
+
+    TDengineWrapper 的操作都通过 self.conn 执行，这里 conn 为当前线程从连接池取出的连接:
+    操作开始时按 store 取出连接，结束后归还，同一对象可以在多个线程中同时使用。
+    """
+
+    def __init__(self, logger=None, pool=None):
+        self._local = threading.local()
+        super().__init__(logger=logger)
+        config = self.db_config
+        self.pool = pool or get_pool(
+            f"taosws://{config['username']}:{config['password']}@{config['host']}:{config['port']}", logger=logger
+        )
+
+    @property
+    def conn(self):
+        return getattr(self._local, 'conn', None)
+
+    @conn.setter
+    def conn(self, value):
+        self._local.conn = value
+
+    @contextmanager
+    def _pooled(self, store=None):
+        # 嵌套调用的数据库与外层相同时沿用外层已取出的连接，不同时另取连接，结束后恢复外层连接
+        outer = self.conn, getattr(self._local, 'store', None)
+        if outer[0] is not None and outer[1] == store:
+            yield
+            return
+        with self.pool.connection(store) as conn:
+            self.conn, self._local.store = conn, store
+            try:
+                yield
+            finally:
+                self.conn, self._local.store = outer
+
+    @contextmanager
+    def _iter_connection(self, store):
+        # 分批查询期间独占一个连接，不占用当前线程的 conn
+        with self.pool.connection(store) as conn:
+            yield conn
+
+    def _prepare_connection(self, store):
+        # 连接池中的连接建立时已 use `store`
+        if getattr(self.conn, 'current_store', None) == store and store is not None:
+            return
+        return super()._prepare_connection(store)
+
+    def close(self):
+        # 连接由连接池管理，空闲超时后关闭
+        pass
+
+    def query(self, store=None, *args, **kwargs):
+        with self._pooled(store):
+            return super().query(store, *args, **kwargs)
+
+    def write_data(self, store=None, *args, **kwargs):
+        with self._pooled(store):
+            return super().write_data(store, *args, **kwargs)
+
+    def write_multiple_data(self, store, data_points):
+        with self._pooled(store):
+            return super().write_multiple_data(store, data_points)
+
+    def delete(self, store=None, *args, **kwargs):
+        with self._pooled(store):
+            return super().delete(store, *args, **kwargs)
+
+    def delete_old_data(self, store_name, start):
+        with self._pooled(store_name):
+            return super().delete_old_data(store_name, start)
+
+    def measurement_count(self, store_name, measurement):
+        with self._pooled(store_name):
+            return super().measurement_count(store_name, measurement)
+
+    def device_latest_data(self, store_name, device_username):
+        with self._pooled(store_name):
+            return super().device_latest_data(store_name, device_username)
+
+    def get_store_disk_usage(self, store_name):
+        with self._pooled():
+            return super().get_store_disk_usage(store_name)
+
+    def is_strore_exists(self, name):
+        with self._pooled():
+            return super().is_strore_exists(name)
+
+    def create_store(self, name):
+        with self._pooled():
+            return super().create_store(name)
+
+    def delete_store(self, name):
+        self.pool.clear(name)
+        with self._pooled():
+            return super().delete_store(name)
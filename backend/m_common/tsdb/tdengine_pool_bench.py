@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+TDengine 连接池性能对比
+
+模拟 uwsgi 多线程下每个请求获取一个客户端、执行一次写入和一次查询后关闭:
+    direct  每个请求 TDengineWrapper()，即每个请求建立一次连接
+    pooled  每个请求 PooledTDengineWrapper()，连接从进程内连接池取出
+输出两种方式写入、查询耗时的平均值与 P50/P95/P99(毫秒)。
+
+用法(需要可连接的 TDengine，配置同 TDENGINE_*):
+    python -m backend.m_common.tsdb.tdengine_pool_bench --threads 16 --requests 200
+"""
+import argparse
+import logging
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.m_common.tsdb.tdengine_pool import PooledTDengineWrapper
+from backend.m_common.tsdb.tdengine_wrapper import TDengineWrapper
+
+BENCH_STORE = 'tdengine_pool_bench'
+BENCH_MEASUREMENT = 'data'
+
+logger = logging.getLogger('tdengine_pool_bench')
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def summary(name, values):
+    values = [value * 1000 for value in values]
+    return (f'{name:<14} mean {statistics.mean(values):8.2f}  p50 {percentile(values, 50):8.2f}  '
+            f'p95 {percentile(values, 95):8.2f}  p99 {percentile(values, 99):8.2f}')
+
+
+def one_request(client_class, index):
+    client = client_class(logger=logger)
+    try:
+        start = time.perf_counter()
+        client.write_data(
+            store=BENCH_STORE, measurement=BENCH_MEASUREMENT, fields={'f': float(index)},
+            tags={'device_username': f'bench_{index % 100}'}, timestamp=int(time.time() * 1000) + index
+        )
+        write_cost = time.perf_counter() - start
+        start = time.perf_counter()
+        client.query(store=BENCH_STORE, selects=['*'], measurement=BENCH_MEASUREMENT, limit=10)
+        query_cost = time.perf_counter() - start
+    finally:
+        client.close()
+    return write_cost, query_cost
+
+
+def run(client_class, threads, requests):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        costs = list(executor.map(lambda index: one_request(client_class, index), range(requests)))
+    elapsed = time.perf_counter() - start
+    return [cost[0] for cost in costs], [cost[1] for cost in costs], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TDengine 连接池性能对比')
+    parser.add_argument('--threads', type=int, default=16, help='并发线程数(uwsgi threads)')
+    parser.add_argument('--requests', type=int, default=200, help='每种方式的请求数')
+    args = parser.parse_args()
+
+    admin = TDengineWrapper(logger=logger)
+    if not admin.is_strore_exists(BENCH_STORE):
+        admin.create_store(BENCH_STORE)
+    try:
+        for name, client_class in (('direct', TDengineWrapper), ('pooled', PooledTDengineWrapper)):
+            # 预热，连接池方式建立连接不计入
+            run(client_class, args.threads, args.threads)
+            write_costs, query_costs, elapsed = run(client_class, args.threads, args.requests)
+            print(f'[{name}] threads {args.threads} requests {args.requests} '
+                  f'elapsed {elapsed:.2f}s ({args.requests / elapsed:.1f} req/s)')
+            print(summary('  write (ms)', write_costs))
+            print(summary('  query (ms)', query_costs))
+    finally:
+        admin.delete_store(BENCH_STORE)
+        admin.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+时序数据库查询结果列式格式 测试
+"""
+import logging
+import threading
+import unittest
+from datetime import datetime, timezone
+
+import numpy
+
+from backend.m_common.tsdb.columnar import ColumnarInfluxDBWrapper, ColumnarTDengineWrapper, TIME_COLUMN, \
+    time_array
+
+logger = logging.getLogger(__name__)
+
+# 2025-01-01 00:00:00+08:00、01:00:00+08:00
+TIMESTAMPS = [1735660800000, 1735664400000]
+
+
+class FakeCursor(object):
+    """
+    记录查询语句，SELECT 返回指定的结果行
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = None
+
+    def execute(self, sql, *args, **kwargs):
+        self.conn.statements.append(sql)
+        if sql.upper().startswith('SELECT'):
+            self.description = [(name,) for name in self.conn.names]
+        return 0
+
+    def fetchall(self):
+        return list(self.conn.rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, names, rows):
+        self.names = names
+        self.rows = rows
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def execute(self, sql):
+        self.statements.append(sql)
+
+    def close(self):
+        pass
+
+
+class ColumnarTDengineWrapperTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.client = ColumnarTDengineWrapper(logger=logger)
+        self.conn = self.client.conn = FakeConnection(
+            ['_ts', 'f_value', 'device_username'],
+            [(datetime(2025, 1, 1, 0), 1.5, 'dev_0'), (datetime(2025, 1, 1, 1), None, 'dev_0')],
+        )
+        self.where = self.client.q('key', 'f_epi')
+
+    def select_sql(self):
+        return next(sql for sql in self.conn.statements if sql.upper().startswith('SELECT'))
+
+    def test_raw_query_has_time_index(self):
+        result = self.client.query('PR_x', ['f_value', 'device_username'], 'data', self.where,
+                                   result_format='columnar')
+        self.assertTrue(self.select_sql().startswith('SELECT _ts,'))
+        self.assertEqual(result.index.dtype, numpy.dtype('datetime64[ms]'))
+        self.assertEqual(result.index.astype('int64').tolist(), TIMESTAMPS)
+        self.assertEqual(result.row_count, 2)
+        numpy.testing.assert_array_equal(result['f_value'], [1.5, numpy.nan])
+        self.assertEqual(result['device_username'].tolist(), ['dev_0', 'dev_0'])
+        self.assertIs(self.client.conn, self.conn)
+
+    def test_interval_query_has_window_start(self):
+        result = self.client.query('PR_x', ['last(f_value) AS f_value'], 'data', self.where, interval='1h',
+                                   result_format='columnar')
+        self.assertIn('_wstart AS _ts', self.select_sql())
+        self.assertEqual(result.index.astype('int64').tolist(), TIMESTAMPS)
+
+    def test_arrow(self):
+        table = self.client.query('PR_x', ['f_value', 'device_username'], 'data', self.where,
+                                  result_format='arrow')
+        self.assertEqual(table.column_names, [TIME_COLUMN, 'f_value', 'device_username'])
+        self.assertEqual(table.num_rows, 2)
+
+    def test_empty_result(self):
+        self.conn.rows = []
+        result = self.client.query('PR_x', ['f_value'], 'data', self.where, result_format='columnar')
+        self.assertEqual((result.row_count, result.index), (0, None))
+
+    def test_rows_format_unchanged(self):
+        rows = self.client.query('PR_x', ['f_value', 'device_username'], 'data', self.where)
+        self.assertEqual([row['_time'] for row in rows], TIMESTAMPS)
+        self.assertEqual(rows[0]['f_value'], 1.5)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            self.client.query('PR_x', ['f_value'], 'data', self.where, result_format='csv')
+
+    def test_other_threads_not_affected(self):
+        rows, started = [], []
+
+        class ThreadCursor(FakeCursor):
+            """
+            列式查询取结果时，其它线程在同一客户端上执行普通查询
+            """
+
+            def fetchall(cursor):
+                if not started:
+                    started.append(True)
+                    thread = threading.Thread(target=lambda: rows.extend(
+                        self.client.query('PR_x', ['f_value', 'device_username'], 'data', self.where)
+                    ))
+                    thread.start()
+                    thread.join()
+                return super().fetchall()
+
+        self.conn.cursor = lambda: ThreadCursor(self.conn)
+        result = self.client.query('PR_x', ['f_value', 'device_username'], 'data', self.where,
+                                   result_format='columnar')
+        self.assertEqual(result.row_count, 2)
+        self.assertEqual([row['_time'] for row in rows], TIMESTAMPS)
+
+
+class ColumnarInfluxDBWrapperTestCase(unittest.TestCase):
+
+    def test_series_to_columns(self):
+        result = ColumnarInfluxDBWrapper._series_to_columns([{'series': [
+            {'columns': ['time', 'f_value'], 'tags': {'device_username': 'dev_0'},
+             'values': [['2025-01-01T00:00:00Z', 1.0], ['2025-01-01T01:00:00Z', 2.0]]},
+            {'columns': ['time', 'f_value', 's_value'], 'tags': {'device_username': 'dev_1'},
+             'values': [['2025-01-01T00:00:00Z', 3.0, 'on']]},
+        ]}])
+        self.assertEqual(list(result), [TIME_COLUMN, 'f_value', 'device_username', 's_value'])
+        self.assertEqual(result['f_value'].tolist(), [1.0, 2.0, 3.0])
+        self.assertEqual(result['device_username'].tolist(), ['dev_0', 'dev_0', 'dev_1'])
+        self.assertEqual(result['s_value'].tolist(), [None, None, 'on'])
+        self.assertEqual(result.index[0], numpy.datetime64('2025-01-01T00:00:00', 'ms'))
+
+
+class TimeArrayTestCase(unittest.TestCase):
+
+    def test_naive_datetime_uses_local_offset(self):
+        values = time_array([datetime(2025, 1, 1, 0), datetime(2025, 1, 1, 0, tzinfo=timezone.utc)])
+        self.assertEqual(values.astype('int64').tolist(), [TIMESTAMPS[0], TIMESTAMPS[0] + 8 * 3600 * 1000])
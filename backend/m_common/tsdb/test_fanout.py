@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+多设备查询分片并发 测试
+"""
+import logging
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from backend.m_common.tsdb import fanout
+from backend.m_common.tsdb.fanout import FanOutMixin, FanOutRows, chunked, fan_out_query, merge_chunks, run_chunks, \
+    sort_rows
+from backend.m_common.tsdb.sqlite_wrapper import SQLiteWrapper
+
+logger = logging.getLogger(__name__)
+
+STORE = 'PR_fanout'
+# 2024-01-01 00:00:00+08:00
+START = 1704038400000
+
+
+class FanOutSQLiteWrapper(FanOutMixin, SQLiteWrapper):
+    pass
+
+
+class HelperTestCase(unittest.TestCase):
+
+    def test_chunked(self):
+        self.assertEqual(chunked(range(5), 2), [[0, 1], [2, 3], [4]])
+
+    def test_sort_rows(self):
+        rows = [{'_time': 2, 'f_value': 1}, {'_time': 1, 'f_value': None}, {'_time': 3, 'f_value': 1}]
+        self.assertEqual([row['_time'] for row in sort_rows(list(rows), ['time'])], [1, 2, 3])
+        self.assertEqual([row['_time'] for row in sort_rows(list(rows), ['-f_value', 'time desc'])], [3, 2, 1])
+
+    def test_run_chunks_collects_errors(self):
+        def func(chunk):
+            if chunk == [2]:
+                raise RuntimeError('down')
+            return chunk
+
+        results, errors = run_chunks(func, [[1], [2], [3]], max_workers=2, timeout=5)
+        self.assertEqual(results, [[1], None, [3]])
+        self.assertEqual([chunk for chunk, _ in errors], [[2]])
+
+    def test_run_chunks_timeout(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def func(chunk):
+            if chunk == [2]:
+                release.wait(5)
+            return chunk
+
+        results, errors = run_chunks(func, [[1], [2]], max_workers=2, timeout=0.1)
+        self.assertEqual(results, [[1], None])
+        self.assertIsInstance(errors[0][1], TimeoutError)
+
+    def test_merge_partial(self):
+        rows = merge_chunks([[{'_time': 2}], None, [{'_time': 1}]], [(['dev_1'], RuntimeError())], ['time'])
+        self.assertIsInstance(rows, FanOutRows)
+        self.assertEqual(rows, [{'_time': 1}, {'_time': 2}])
+        self.assertTrue(rows.partial)
+        self.assertEqual(rows.failed_devices, ['dev_1'])
+
+    def test_merge_all_failed(self):
+        self.assertIsNone(merge_chunks([None], [(['dev_0'], RuntimeError())]))
+
+
+class FanOutQueryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.client = FanOutSQLiteWrapper(logger=logger, directory=directory)
+        self.addCleanup(self.client.stores.close)
+        self.client.create_store(STORE)
+        self.devices = [f'dev_{index}' for index in range(5)]
+        self.client.write_multiple_data(STORE, [{
+            'measurement': 'data', 'fields': {'f_value': float(index)},
+            'tags': {'device_username': username, 'key': 'f_epi'}, 'timestamp': START + index,
+        } for index, username in enumerate(self.devices)])
+        patcher = mock.patch.object(fanout, 'TSDB_FANOUT_TDENGINE_CHUNK_SIZE', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def where(self):
+        q = self.client.q
+        return q('key', 'f_epi') & q('device_username', self.devices, 'in')
+
+    def test_fan_out_query(self):
+        rows = fan_out_query(self.client, self.devices, STORE, ['f_value', 'device_username'], 'data',
+                             self.client.q('key', 'f_epi'), order_by=['time'])
+        self.assertEqual([row['device_username'] for row in rows], self.devices)
+        self.assertFalse(rows.partial)
+
+    def test_mixin_splits_device_list(self):
+        with mock.patch.object(SQLiteWrapper, 'query', autospec=True, side_effect=SQLiteWrapper.query) as query:
+            rows = self.client.query(STORE, ['f_value', 'device_username'], 'data', self.where(), order_by=['time'])
+        self.assertEqual(query.call_count, 3)
+        self.assertEqual([row['f_value'] for row in rows], [0.0, 1.0, 2.0, 3.0, 4.0])
+
+    def test_mixin_keeps_paged_query(self):
+        with mock.patch.object(SQLiteWrapper, 'query', autospec=True, side_effect=SQLiteWrapper.query) as query:
+            rows = self.client.query(STORE, ['f_value', 'device_username'], 'data', self.where(), limit=10)
+        self.assertEqual(query.call_count, 1)
+        self.assertEqual(len(rows), 5)
+        self.assertNotIsInstance(rows, FanOutRows)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+时序数据库查询结果缓存 测试
+"""
+import logging
+import time
+import unittest
+from unittest import mock
+
+from backend.m_common.tsdb import query_cache
+from backend.m_common.tsdb.query_cache import QueryCacheMixin, range_end, to_timestamp
+
+logger = logging.getLogger(__name__)
+
+# 2024-01-01 00:00:00+08:00
+START = 1704038400
+
+
+class FakeCache(object):
+    """
+    记录缓存时间的 django cache
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.timeouts = {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value, timeout=None):
+        self.data[key] = value
+        self.timeouts[key] = timeout
+
+    def add(self, key, value, timeout=None):
+        if key in self.data:
+            return False
+        self.set(key, value, timeout)
+        return True
+
+    def incr(self, key):
+        self.data[key] += 1
+        return self.data[key]
+
+    def delete(self, key):
+        self.data.pop(key, None)
+        self.timeouts.pop(key, None)
+
+
+class FakeWrapper(object):
+
+    def __init__(self):
+        self._logger = logger
+        self.rows = [{'_time': START * 1000, 'f_value': 1.0}]
+        self.queries = 0
+
+    def query(self, **kwargs):
+        self.queries += 1
+        return list(self.rows)
+
+    def write_multiple_data(self, store, data_points):
+        return True
+
+
+class CachedWrapper(QueryCacheMixin, FakeWrapper):
+    pass
+
+
+class RangeEndTestCase(unittest.TestCase):
+
+    def test_string_range(self):
+        where = "time >= '2024-01-01T00:00:00+08:00' AND time < '2024-01-02T00:00:00+08:00'"
+        self.assertEqual(range_end(where), START + 86400)
+
+    def test_naive_time_uses_local_offset(self):
+        self.assertEqual(range_end("`_ts` < '2024-01-01 00:00:00'"), START)
+
+    def test_integer_timestamps(self):
+        self.assertEqual(range_end(f'_ts >= {START}000 AND _ts <= {START + 60}000'), START + 60)
+        self.assertEqual(to_timestamp(None, str(START * 10 ** 9)), START)
+
+    def test_open_range(self):
+        self.assertIsNone(range_end(f'_ts >= {START}000'))
+        self.assertIsNone(range_end('time > now() - 1h'))
+        self.assertIsNone(range_end(''))
+        self.assertIsNone(range_end("time < 'yesterday'"))
+
+    def test_or_range_without_end(self):
+        where = f'(_ts >= 1 AND _ts < {START}) OR _ts >= {START}'
+        self.assertIsNone(range_end(where))
+
+
+class QueryCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = FakeCache()
+        patcher = mock.patch.object(query_cache, 'get_cache', return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = CachedWrapper()
+        self.history = f'_ts >= {START}000 AND _ts < {START + 3600}000'
+
+    def query(self, where):
+        return self.client.query('PR_x', ['f_value'], 'data', where)
+
+    def result_timeouts(self):
+        return [timeout for key, timeout in self.cache.timeouts.items() if '_version' not in key]
+
+    def test_history_cached_with_finite_ttl(self):
+        self.assertEqual(self.query(self.history), self.client.rows)
+        self.assertEqual(self.query(self.history), self.client.rows)
+        self.assertEqual(self.client.queries, 1)
+        self.assertEqual(self.result_timeouts(), [query_cache.TSDB_QUERY_CACHE_SETTLED_TTL])
+
+    def test_live_range(self):
+        self.query(f'_ts >= {int(time.time()) - 60}000')
+        self.assertEqual(self.result_timeouts(), [query_cache.TSDB_QUERY_CACHE_LIVE_TTL])
+
+    def test_empty_history_not_kept(self):
+        self.client.rows = []
+        self.query(self.history)
+        self.assertEqual(self.result_timeouts(), [query_cache.TSDB_QUERY_CACHE_LIVE_TTL])
+
+    def test_partial_result_not_kept(self):
+        result = mock.MagicMock(partial=True)
+        self.assertEqual(QueryCacheMixin.cache_timeout(self.history, result), query_cache.TSDB_QUERY_CACHE_LIVE_TTL)
+
+    def test_late_write_invalidates_store(self):
+        self.query(self.history)
+        self.client.write_multiple_data('PR_x', [{'timestamp': START * 1000}])
+        self.query(self.history)
+        self.assertEqual(self.client.queries, 2)
+
+    def test_current_write_keeps_cache(self):
+        self.query(self.history)
+        self.client.write_multiple_data('PR_x', [{'timestamp': int(time.time() * 1000)}])
+        self.query(self.history)
+        self.assertEqual(self.client.queries, 1)
+
+    def test_cache_disabled_per_call(self):
+        self.client.query('PR_x', ['f_value'], 'data', self.history, cache=False)
+        self.assertEqual(self.cache.data, {})
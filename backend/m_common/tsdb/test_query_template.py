@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+查询条件模板 测试
+"""
+import unittest
+from datetime import datetime, timezone
+
+from backend.m_common.tsdb.influxdb_wrapper import Q as InfluxDBQ
+from backend.m_common.tsdb.query_template import KIND_CONST, KIND_LIST, KIND_NONE, param_kind, query_template
+from backend.m_common.tsdb.tdengine_wrapper import Q as TDengineQ
+
+START = datetime(2025, 1, 1)
+END = datetime(2025, 1, 2)
+
+
+@query_template
+def device_range(q, key, devices, start, end=None):
+    condition = q('key', key) & q('device_username', devices, 'in') & q('time', start, '>=')
+    if end is not None:
+        condition = condition & q('time', end, '<')
+    return condition
+
+
+@query_template
+def value_above(q, key, value):
+    return q('key', key) & q('f_value', value, '>')
+
+
+def direct_device_range(q, key, devices, start, end=None):
+    condition = q('key', key) & q('device_username', devices, 'in') & q('time', start, '>=')
+    if end is not None:
+        condition = condition & q('time', end, '<')
+    return condition
+
+
+class ParamKindTestCase(unittest.TestCase):
+
+    def test_kinds(self):
+        self.assertEqual(param_kind(None), KIND_NONE)
+        self.assertEqual(param_kind(('a', 'b')), KIND_LIST)
+        self.assertEqual(param_kind(START), ('datetime', False))
+        self.assertEqual(param_kind(START.replace(tzinfo=timezone.utc)), ('datetime', True))
+        self.assertEqual([param_kind('a'), param_kind(1), param_kind(1.5)], ['str', 'int', 'float'])
+        # 布尔值无法占位，作为结构的一部分
+        self.assertEqual(param_kind(True), (KIND_CONST, True))
+
+
+class QueryTemplateTestCase(unittest.TestCase):
+
+    def assertSameAsDirect(self, q_class, *args, **kwargs):
+        self.assertEqual(str(device_range(q_class, *args, **kwargs)),
+                         str(direct_device_range(q_class, *args, **kwargs)))
+
+    def test_same_as_direct_query(self):
+        for q_class in (TDengineQ, InfluxDBQ):
+            with self.subTest(q_class=q_class.__module__):
+                self.assertSameAsDirect(q_class, 'f_epi', ['dev_0', 'dev_1', 'dev_2'], START, END)
+                self.assertSameAsDirect(q_class, 'f_ua', ['dev_0'], START, end=END)
+                self.assertSameAsDirect(q_class, 'f_ua', ('dev_0', 'dev_1'), START)
+
+    def test_numeric_values(self):
+        for q_class in (TDengineQ, InfluxDBQ):
+            with self.subTest(q_class=q_class.__module__):
+                for value in (10, 10.5):
+                    self.assertEqual(str(value_above(q_class, 'f_epi', value)),
+                                     str(q_class('key', 'f_epi') & q_class('f_value', value, '>')))
+
+    def test_template_cached_per_structure(self):
+        template = query_template(direct_device_range)
+        template(TDengineQ, 'f_epi', ['dev_0'], START, END)
+        template(TDengineQ, 'f_ua', ['dev_1', 'dev_2'], END, START)
+        self.assertEqual(template.cache_size(), 1)
+        # end 为 None 及不同 Q 类为不同结构
+        template(TDengineQ, 'f_epi', ['dev_0'], START)
+        template(InfluxDBQ, 'f_epi', ['dev_0'], START, END)
+        self.assertEqual(template.cache_size(), 3)
+
+    def test_empty_list(self):
+        with self.assertRaises(ValueError):
+            device_range(TDengineQ, 'f_epi', [], START, END)
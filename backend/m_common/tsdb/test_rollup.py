@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+时序数据库汇总 测试
+"""
+import logging
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from backend.m_common.tsdb.rollup import AGGREGATE_INCREASE, LOCAL_TZ, RESOLUTION_DAY, RESOLUTION_HOUR, \
+    RESOLUTION_MONTH, Rollup, RollupEngine, iter_windows, next_window, to_ms, window_start
+from backend.m_common.tsdb.sqlite_wrapper import SQLiteWrapper
+
+logger = logging.getLogger(__name__)
+
+STORE = 'PR_rollup'
+
+
+def local(*args):
+    return datetime(*args, tzinfo=LOCAL_TZ)
+
+
+class WindowTestCase(unittest.TestCase):
+
+    def test_window_start(self):
+        dt = local(2024, 3, 15, 10, 25, 30)
+        self.assertEqual(window_start(dt, RESOLUTION_HOUR), local(2024, 3, 15, 10))
+        self.assertEqual(window_start(dt, RESOLUTION_DAY), local(2024, 3, 15))
+        self.assertEqual(window_start(dt, RESOLUTION_MONTH), local(2024, 3, 1))
+
+    def test_next_window(self):
+        self.assertEqual(next_window(local(2024, 12, 1), RESOLUTION_MONTH), local(2025, 1, 1))
+        self.assertEqual(next_window(local(2024, 1, 1), RESOLUTION_MONTH, -1), local(2023, 12, 1))
+        self.assertEqual(next_window(local(2024, 1, 1), RESOLUTION_HOUR, -2), local(2023, 12, 31, 22))
+
+    def test_iter_windows(self):
+        windows = list(iter_windows(local(2024, 1, 1, 0, 30), local(2024, 1, 1, 3), RESOLUTION_HOUR))
+        self.assertEqual(windows, [local(2024, 1, 1, hour) for hour in range(3)])
+
+
+class RollupEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.client = SQLiteWrapper(logger=logger, directory=directory)
+        self.addCleanup(self.client.stores.close)
+        self.client.create_store(STORE)
+        self.engine = RollupEngine(self.client, rollups=[], logger=logger)
+        self.increase = Rollup('f_epi_during_hour', 'f_epi', AGGREGATE_INCREASE, RESOLUTION_HOUR)
+        self.last = Rollup('f_epi_point_hour', 'f_epi', 'last', RESOLUTION_HOUR)
+
+    def write(self, device_username, dt, value):
+        self.client.write_multiple_data(STORE, [{
+            'measurement': 'data', 'fields': {'f_value': value},
+            'tags': {'device_username': device_username, 'key': 'f_epi'}, 'timestamp': to_ms(dt),
+        }])
+
+    def aggregate(self, rollup, start, end):
+        return self.engine.aggregate(STORE, rollup, start, end)
+
+    def test_last(self):
+        self.write('meter_0', local(2024, 1, 1, 0, 10), 10.0)
+        self.write('meter_0', local(2024, 1, 1, 0, 50), 12.0)
+        self.assertEqual(self.aggregate(self.last, local(2024, 1, 1), local(2024, 1, 1, 1)),
+                         [('meter_0', to_ms(local(2024, 1, 1)), 12.0)])
+
+    def test_increase_seeded_from_earlier_value(self):
+        # 来源数据间隔多个窗口时，第一个窗口与 start 之前的最后一个值比较
+        self.write('meter_0', local(2024, 1, 1, 0, 10), 10.0)
+        self.write('meter_0', local(2024, 1, 1, 3, 30), 15.0)
+        self.write('meter_0', local(2024, 1, 1, 4, 30), 16.5)
+        self.assertEqual(self.aggregate(self.increase, local(2024, 1, 1, 3), local(2024, 1, 1, 5)), [
+            ('meter_0', to_ms(local(2024, 1, 1, 3)), 5.0),
+            ('meter_0', to_ms(local(2024, 1, 1, 4)), 1.5),
+        ])
+
+    def test_increase_without_previous_value(self):
+        self.write('meter_0', local(2024, 1, 1, 3, 30), 15.0)
+        self.write('meter_0', local(2024, 1, 1, 4, 30), 16.0)
+        self.assertEqual(self.aggregate(self.increase, local(2024, 1, 1, 3), local(2024, 1, 1, 5)),
+                         [('meter_0', to_ms(local(2024, 1, 1, 4)), 1.0)])
+
+    def test_increase_drops_reset(self):
+        self.write('meter_0', local(2024, 1, 1, 0, 30), 100.0)
+        self.write('meter_0', local(2024, 1, 1, 1, 30), 2.0)
+        self.write('meter_0', local(2024, 1, 1, 2, 30), 3.0)
+        self.assertEqual(self.aggregate(self.increase, local(2024, 1, 1, 1), local(2024, 1, 1, 3)),
+                         [('meter_0', to_ms(local(2024, 1, 1, 2)), 1.0)])
+
+    def test_process_writes_rollup(self):
+        self.write('meter_0', local(2024, 1, 1, 0, 10), 10.0)
+        self.write('meter_0', local(2024, 1, 1, 2, 10), 12.0)
+        self.assertEqual(self.engine.process(STORE, self.increase, local(2024, 1, 1, 1), local(2024, 1, 1, 3)), 1)
+        rows = self.client.query(STORE, ['f_value', 'device_username'], 'data',
+                                 self.client.q('key', 'f_epi_during_hour'))
+        self.assertEqual([(row['device_username'], row['f_value']) for row in rows], [('meter_0', 2.0)])
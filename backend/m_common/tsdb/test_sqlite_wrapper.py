@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+嵌入式时序数据库(SQLite) 测试
+"""
+import logging
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+
+from backend.m_common.tsdb.sqlite_wrapper import SQLiteWrapper, parse_line
+
+logger = logging.getLogger(__name__)
+
+STORE = 'PR_sqlite'
+# 2024-01-01 00:00:00+08:00
+START = 1704038400000
+HOUR = 3600 * 1000
+
+
+class SQLiteWrapperTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.client = SQLiteWrapper(logger=logger, directory=self.directory)
+        self.addCleanup(self.client.stores.close)
+        self.client.create_store(STORE)
+        self.q = self.client.q
+
+    def write(self, device_username, timestamp, value, key='f_epi'):
+        self.client.write_multiple_data(STORE, [{
+            'measurement': 'data', 'fields': {'f_value': value},
+            'tags': {'device_username': device_username, 'key': key}, 'timestamp': timestamp,
+        }])
+
+    def test_write_and_query(self):
+        self.write('meter_0', START, 1.0)
+        self.write('meter_0', START + HOUR, 2.0)
+        rows = self.client.query(STORE, ['f_value', 'device_username'], 'data', self.q('key', 'f_epi'))
+        self.assertEqual([(row['_time'], row['f_value']) for row in rows], [(START, 1.0), (START + HOUR, 2.0)])
+
+    def test_same_time_and_tags_overwrites(self):
+        self.write('meter_0', START, 1.0)
+        self.write('meter_0', START, 3.0)
+        rows = self.client.query(STORE, ['f_value'], 'data', self.q('key', 'f_epi'))
+        self.assertEqual([row['f_value'] for row in rows], [3.0])
+
+    def test_interval_partition(self):
+        for device_username, value in (('meter_0', 1.0), ('meter_1', 5.0)):
+            self.write(device_username, START + 60 * 1000, value)
+            self.write(device_username, START + 120 * 1000, value + 1)
+        where = self.q('key', 'f_epi') & self.q('time', datetime.fromtimestamp(START / 1000), '>=')
+        rows = self.client.query(STORE, ['last(f_value)', 'device_username'], 'data', where,
+                                 group_by=['device_username'], interval='1h')
+        self.assertEqual(sorted((row['device_username'], row['_time'], row['last(f_value)']) for row in rows),
+                         [('meter_0', START, 2.0), ('meter_1', START, 6.0)])
+
+    def test_delete_old_data(self):
+        self.write('meter_0', START, 1.0)
+        self.write('meter_0', START + HOUR, 2.0)
+        self.assertEqual(self.client.delete_old_data(STORE, START + HOUR), 1)
+        rows = self.client.query(STORE, ['f_value'], 'data', self.q('key', 'f_epi'))
+        self.assertEqual([row['f_value'] for row in rows], [2.0])
+
+    def test_unsupported_syntax(self):
+        self.client.connect()
+        self.client.conn.execute(f'USE `{STORE}`')
+        with self.assertRaises((sqlite3.NotSupportedError, sqlite3.OperationalError)):
+            self.client.conn.execute('CREATE STREAM s INTO t AS SELECT _wstart FROM data INTERVAL(1h)')
+
+    def test_disk_usage(self):
+        self.assertGreater(self.client.get_store_disk_usage(STORE), 0)
+        self.assertIsNone(self.client.get_store_disk_usage('PR_missing'))
+
+
+class ParseLineTestCase(unittest.TestCase):
+
+    def test_line_protocol(self):
+        measurement, tags, fields, timestamp = parse_line(
+            'data,device_username=meter\\ 0,key=f_epi f_value=1.5,s_value="on" 1704038400000', 0
+        )
+        self.assertEqual((measurement, timestamp), ('data', 1704038400000))
+        self.assertEqual(tags, {'device_username': 'meter 0', 'key': 'f_epi'})
+        self.assertEqual(fields, {'f_value': (1.5, 'double'), 's_value': ('on', 'varchar')})
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+TDengine 连接池 测试
+"""
+import logging
+import unittest
+from unittest import mock
+
+from backend.m_common.tsdb import tdengine_pool
+from backend.m_common.tsdb.tdengine_pool import PooledTDengineWrapper, StoreConnection, TDengineConnectionPool
+from backend.m_common.tsdb.test_columnar import FakeConnection
+
+logger = logging.getLogger(__name__)
+
+
+def use_statements(conn):
+    return [sql for sql in conn.statements if sql.upper().startswith('USE')]
+
+
+class StoreConnectionTestCase(unittest.TestCase):
+
+    def test_use_current_store_skipped(self):
+        raw = FakeConnection([], [])
+        conn = StoreConnection(raw, 'PR_a')
+        conn.cursor().execute('USE `PR_a`')
+        conn.execute('use PR_a;')
+        self.assertEqual(raw.statements, [])
+        # 切换到其它数据库后再切换回来需要执行
+        conn.cursor().execute('USE `PR_b`')
+        conn.execute('USE `PR_a`')
+        self.assertEqual(raw.statements, ['USE `PR_b`', 'USE `PR_a`'])
+        self.assertEqual(conn.current_store, 'PR_a')
+
+
+class PooledTDengineWrapperTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.conns = []
+        patcher = mock.patch.object(tdengine_pool.taosws, 'connect', side_effect=self.connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = TDengineConnectionPool('taosws://test', logger=logger)
+        self.client = PooledTDengineWrapper(logger=logger, pool=self.pool)
+
+    def connect(self, dsn):
+        conn = FakeConnection(['_ts', 'f_value'], [])
+        self.conns.append(conn)
+        return conn
+
+    def query(self, store):
+        return self.client.query(store, ['f_value'], 'data', self.client.q('key', 'f_epi'))
+
+    def test_use_sent_once(self):
+        self.query('PR_a')
+        self.query('PR_a')
+        self.assertEqual(len(self.conns), 1)
+        self.assertEqual(use_statements(self.conns[0]), ['use `PR_a`'])
+
+    def test_nested_call_for_other_store(self):
+        # 外层操作取出连接期间查询另一个数据库
+        with self.client._pooled('PR_a'):
+            outer_conn = self.client.conn
+            self.query('PR_b')
+            self.assertIs(self.client.conn, outer_conn)
+            self.query('PR_a')
+        self.assertEqual(len(self.conns), 2)
+        self.assertEqual(use_statements(self.conns[0]), ['use `PR_a`'])
+        self.assertEqual(use_statements(self.conns[1]), ['use `PR_b`'])
+        # 连接归还到各自数据库的空闲连接中
+        self.assertEqual([pooled.conn.current_store for pooled in self.pool._idle['PR_a']], ['PR_a'])
+        self.assertEqual([pooled.conn.current_store for pooled in self.pool._idle['PR_b']], ['PR_b'])
+        self.assertIsNone(self.client.conn)
+
+
+if __name__ == '__main__':
+    unittest.main()